@@ -0,0 +1,166 @@
+import collections
+import random
+
+import numpy
+
+__author__ = 'fpena'
+
+
+class RecordView(collections.MutableMapping):
+    """
+    Copy-on-write view of a record. The fields are read from the original
+    record, but the fields that are set or deleted are stored in an overlay
+    that belongs to the view, so the original record is never modified and
+    can be shared by all the folds of a cross-validation.
+
+    Only the top level of the record is copied on write, values such as lists
+    and dictionaries are shared with the original record and must not be
+    modified in place
+    """
+
+    __slots__ = ('_record', '_overlay', '_deleted')
+
+    def __init__(self, record):
+        self._record = record
+        self._overlay = {}
+        self._deleted = None
+
+    def __getitem__(self, field):
+        if field in self._overlay:
+            return self._overlay[field]
+        if self._deleted is not None and field in self._deleted:
+            raise KeyError(field)
+        return self._record[field]
+
+    def __setitem__(self, field, value):
+        self._overlay[field] = value
+        if self._deleted is not None:
+            self._deleted.discard(field)
+
+    def __delitem__(self, field):
+        if field not in self:
+            raise KeyError(field)
+        self._overlay.pop(field, None)
+        if field in self._record:
+            if self._deleted is None:
+                self._deleted = set()
+            self._deleted.add(field)
+
+    def __contains__(self, field):
+        if field in self._overlay:
+            return True
+        if self._deleted is not None and field in self._deleted:
+            return False
+        return field in self._record
+
+    def __iter__(self):
+        for field in self._record:
+            if field in self._overlay:
+                continue
+            if self._deleted is not None and field in self._deleted:
+                continue
+            yield field
+        for field in self._overlay:
+            yield field
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class FoldView(object):
+    """
+    Cross-validation splits represented as arrays of indices over a single
+    list of records, instead of deep copies of the records. The train and test
+    records of a fold are returned as RecordView objects, so the fields that
+    are modified during a fold (like the context topics) don't leak to the
+    original records or to the other folds, and the memory used stays close to
+    a single copy of the dataset regardless of the number of folds and cycles
+    """
+
+    def __init__(self, records, order=None):
+        """
+        :param records: the list of records, which is never modified
+        :param order: the order in which the records are split. By default the
+        records are split in their original order
+        """
+        self.records = records
+        if order is None:
+            order = numpy.arange(len(records))
+        self.order = numpy.asarray(order, dtype=numpy.int64)
+
+    def shuffle(self):
+        """
+        Shuffles the order of the records. The random module is used in the
+        same way as when shuffling the list of records, so the same seed
+        produces the same permutation
+        """
+        order = range(len(self.records))
+        random.shuffle(order)
+        self.order = numpy.array(order, dtype=numpy.int64)
+
+    def get_records(self):
+        """
+        Returns the records in the order they are split, without copying them
+
+        :return: a list with the records
+        """
+        return [self.records[index] for index in self.order]
+
+    def get_views(self, indices):
+        """
+        Returns a copy-on-write view of each of the given records
+
+        :param indices: the indices of the records in the original list
+        :return: a list of RecordView
+        """
+        return [RecordView(self.records[index]) for index in indices]
+
+    def split_train_test_indices(self, split=0.8, start=0.):
+        """
+        Splits the indices of the records in two disjunct sets: train and
+        test, in the same way as ETLUtils.split_train_test splits the list of
+        records
+
+        :param split: % of training set to be used (test set size = 100-percent)
+        :param start: the position in which the split should start. This value
+        must be in the range [0,1]
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        :return: a tuple with the train and the test indices
+        """
+        order = self.order
+        length = len(order)
+        split_start = split + start
+        start_index = int(round(start * length))
+
+        if start == 0:
+            split_index = int(round(split * length))
+            train = order[:split_index]
+            test = order[split_index:]
+        elif split_start > 1:
+            end_index = int(round((split_start - 1) * length))
+            train = numpy.concatenate(
+                [order[start_index:], order[:end_index]])
+            test = order[end_index:start_index]
+        else:
+            end_index = int(round(split_start * length))
+            train = order[start_index:end_index]
+            test = numpy.concatenate([order[end_index:], order[:start_index]])
+
+        return train, test
+
+    def split_train_test(self, split=0.8, start=0.):
+        """
+        Splits the records in two disjunct datasets: train and test. The
+        records of both datasets are copy-on-write views of the original
+        records
+
+        :param split: % of training set to be used (test set size = 100-percent)
+        :param start: the position in which the split should start. This value
+        must be in the range [0,1]
+        :return: a tuple with the train and the test lists of RecordView
+        """
+        train, test = self.split_train_test_indices(split, start)
+        return self.get_views(train), self.get_views(test)
@@ -1,4 +1,3 @@
-
 import csv
 
 import numpy
@@ -9,9 +8,13 @@ from utils.constants import Constants
 __author__ = 'fpena'
 
 
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
 def csv_to_libfm(
         input_files, target_column, one_hot_columns,
-        delete_columns=None, delimiter=',', has_header=False, suffix='.libfm'):
+        delete_columns=None, delimiter=',', has_header=False, suffix='.libfm',
+        vector_map=None):
     """
     Converts a CSV file to the libFM format.
 
@@ -27,78 +30,262 @@ def csv_to_libfm(
     :param delimiter: the separator used in the CSV file
     :type has_header: bool
     :param has_header: a boolean indicating if the CSV file has a header or not
+    :type vector_map: dict
+    :param vector_map: the feature map returned by a previous conversion. If
+    given, the one-hot values that are already in the map keep their IDs
+
+    :rtype (int, dict)
+    :return the number of variables in the model and the feature map, which
+    maps every one-hot value to its variable ID
+    """
+
+    def build_row_source(input_file):
+        def read_rows():
+            with open(input_file, 'r') as csv_file:
+                csv_reader = csv.reader(csv_file, delimiter=delimiter)
+                if has_header:
+                    next(csv_reader, None)
+                for row in csv_reader:
+                    yield row
+        return read_rows
+
+    row_sources = [build_row_source(input_file) for input_file in input_files]
+    output_files = [input_file + suffix for input_file in input_files]
+
+    return rows_to_libfm(
+        row_sources, output_files, target_column, one_hot_columns,
+        delete_columns, vector_map)
 
-    :rtype int
-    :return the number of variables in the model
+
+def rows_to_libfm(
+        row_sources, output_files, target_column, one_hot_columns,
+        delete_columns=None, vector_map=None):
+    """
+    Writes the given rows in the libFM format. The rows are read twice, the
+    first time to build the one-hot vocabulary and the second time to write
+    the libFM lines one by one, so the memory used doesn't depend on the
+    number of rows. This way the records that are already in memory can be
+    exported without writing them to an intermediate CSV file.
+
+    The static columns take the IDs from 0 to the number of static columns,
+    and the one-hot values take the following IDs in the order in which they
+    appear, first by source, then by column and then by row, which is the
+    same order used by csv_to_libfm
+
+    :type row_sources: list
+    :param row_sources: a list with one element per output file. Each element
+    is either a list of rows or a function with no arguments that returns an
+    iterator over the rows, since the rows have to be read twice. A row is a
+    list with the values of each column
+    :type output_files: list[str]
+    :param output_files: the paths of the libFM files, one per row source
+    :type target_column: int
+    :param target_column: the index of the column that contains the target
+    :type one_hot_columns: list[int]
+    :param one_hot_columns: the indices of the columns that are one-hot
+    encoded
+    :type delete_columns: list[int]
+    :param delete_columns: the indices of the columns that are to be excluded
+    :type vector_map: dict
+    :param vector_map: the feature map returned by a previous conversion. If
+    given, the one-hot values that are already in the map keep their IDs
+
+    :rtype (int, dict)
+    :return the number of variables in the model and the feature map
     """
 
     if delete_columns is None:
         delete_columns = []
 
-    csv_reader_list = [
-        csv.reader(open(input_file, 'r'), delimiter=delimiter)
-        for input_file in input_files
-        ]
+    static_columns, vector_map, id_counter = build_libfm_vocabulary(
+        row_sources, target_column, one_hot_columns, delete_columns,
+        vector_map)
+
+    for row_source, output_file in zip(row_sources, output_files):
+        with open(output_file, 'w', WRITE_BUFFER_SIZE) as write_file:
+            for row in _iterate_rows(row_source):
+                write_file.write(format_libfm_row(
+                    row, target_column, static_columns, one_hot_columns,
+                    vector_map))
+
+    print('Number of variables in the model: %d' % id_counter)
+
+    return id_counter, vector_map
+
+
+def rows_to_csr_matrices(
+        row_sources, target_column, one_hot_columns, delete_columns=None,
+        vector_map=None):
+    """
+    Builds the sparse design matrix and the target vector of each of the given
+    row sources, using the same variable IDs that rows_to_libfm would write in
+    the libFM files, so the data can be given to an in-process factorization
+    machine without writing it to disk
+
+    :param row_sources: a list with the row sources, see rows_to_libfm
+    :param target_column: the index of the column that contains the target
+    :param one_hot_columns: the indices of the columns that are one-hot
+    encoded
+    :param delete_columns: the indices of the columns that are to be excluded
+    :param vector_map: the feature map returned by a previous conversion. If
+    given, the one-hot values that are already in the map keep their IDs
+    :rtype (list[(scipy.sparse.csr_matrix, numpy.ndarray)], int, dict)
+    :return: a list with a tuple (design matrix, target vector) for each row
+    source, the number of variables in the model and the feature map
+    """
+
+    static_columns, vector_map, id_counter = build_libfm_vocabulary(
+        row_sources, target_column, one_hot_columns, delete_columns,
+        vector_map)
+
+    matrices = []
+
+    for row_source in row_sources:
+        targets = []
+        data = []
+        indices = []
+        indptr = [0]
+
+        for row in _iterate_rows(row_source):
+            targets.append(float(_get_target(row, target_column)))
+            for variable_id, column_index in enumerate(static_columns):
+                if row[column_index] is not None:
+                    data.append(float(row[column_index]))
+                    indices.append(variable_id)
+            for column_index in one_hot_columns:
+                data.append(1.)
+                indices.append(vector_map[
+                    _build_vector_key(column_index, row[column_index])])
+            indptr.append(len(indices))
+
+        num_rows = len(targets)
+        x = sparse.csr_matrix(
+            (numpy.array(data, dtype=numpy.float64),
+             numpy.array(indices, dtype=numpy.int32),
+             numpy.array(indptr, dtype=numpy.int64)),
+            shape=(num_rows, id_counter))
+        matrices.append((x, numpy.array(targets)))
+
+    return matrices, id_counter, vector_map
+
+
+def build_libfm_vocabulary(
+        row_sources, target_column, one_hot_columns, delete_columns=None,
+        vector_map=None):
+    """
+    Reads the given rows and assigns an ID to every static column and to
+    every value of the one-hot columns
+
+    :param row_sources: a list with the row sources, see rows_to_libfm
+    :param target_column: the index of the column that contains the target
+    :param one_hot_columns: the indices of the columns that are one-hot
+    encoded
+    :param delete_columns: the indices of the columns that are to be excluded
+    :param vector_map: an optional feature map to extend
+    :return: a tuple with the list of static columns, the feature map and the
+    number of variables in the model
+    """
+
+    if delete_columns is None:
+        delete_columns = []
 
-    data_matrix_list = []
+    vector_map = {} if vector_map is None else dict(vector_map)
+    static_columns = None
+    id_counter = None
+
+    for row_source in row_sources:
+        new_keys_list = [[] for _ in one_hot_columns]
+
+        for row in _iterate_rows(row_source):
+            if static_columns is None:
+                # The static columns are that ones that are not going to be
+                # deleted, don't belong to the one-hot columns or the target
+                # column
+                static_columns = sorted(set(range(len(row))).difference(
+                    [target_column], one_hot_columns, delete_columns))
+                id_counter = max(
+                    [len(static_columns)] +
+                    [vector_id + 1 for vector_id in vector_map.values()])
+
+            for new_keys, column_index in zip(new_keys_list, one_hot_columns):
+                vector_key = _build_vector_key(column_index, row[column_index])
+                if vector_key not in vector_map:
+                    # The keys of different columns never collide, so the IDs
+                    # can be assigned column by column once the source is read
+                    vector_map[vector_key] = None
+                    new_keys.append(vector_key)
 
-    for csv_reader in csv_reader_list:
-        if has_header:
-            next(csv_reader)
-        data_matrix_list.append(list(csv_reader))
+        for new_keys in new_keys_list:
+            for vector_key in new_keys:
+                vector_map[vector_key] = id_counter
+                id_counter += 1
 
-    # The static columns are that ones that are not going to be deleted, don't
-    # belong to the one-hot columns or the target column
-    all_columns = range(len(data_matrix_list[0][0]))
-    static_columns = set(all_columns).difference(
-        [target_column], one_hot_columns, delete_columns)
+    if static_columns is None:
+        static_columns = []
+        id_counter = max(
+            [0] + [vector_id + 1 for vector_id in vector_map.values()])
 
-    id_counter = 0
-    output_row_list = []
+    return static_columns, vector_map, id_counter
 
-    # Do the target column
-    for data_matrix in data_matrix_list:
-        output_rows = []
-        for row_index in range(len(data_matrix)):
-            output_rows.append(str(data_matrix[row_index][target_column]))
-        output_row_list.append(output_rows)
 
-    # Do the static columns
-    for column_index in static_columns:
+def format_libfm_row(
+        row, target_column, static_columns, one_hot_columns, vector_map):
+    """
+    Builds the libFM line of the given row
+
+    :param row: a list with the values of each column
+    :param target_column: the index of the column that contains the target
+    :param static_columns: the indices of the static columns, as returned by
+    build_libfm_vocabulary
+    :param one_hot_columns: the indices of the columns that are one-hot
+    encoded
+    :param vector_map: the feature map
+    :return: the libFM line, including the line break. The static columns
+    whose value is None are left out of the line
+    """
+    entries = [_format_value(_get_target(row, target_column))]
 
-        for data_matrix, output_rows in zip(data_matrix_list, output_row_list):
-            column = get_column(data_matrix, column_index)
+    # A missing value is the same as a 0 for libFM, so it is not written
+    for variable_id, column_index in enumerate(static_columns):
+        if row[column_index] is None:
+            continue
+        entries.append(
+            str(variable_id) + ':' + _format_value(row[column_index]))
 
-            for row_index in range(len(data_matrix)):
-                output_rows[row_index] +=\
-                    " " + str(id_counter) + ":" + str(column[row_index])
+    for column_index in one_hot_columns:
+        vector_key = _build_vector_key(column_index, row[column_index])
+        entries.append(str(vector_map[vector_key]) + ':1')
 
-        id_counter += 1
+    return ' '.join(entries) + '\n'
 
-    vector_map = {}
 
-    # Do the one-hot columns
-    for data_matrix, output_rows in zip(data_matrix_list, output_row_list):
-        for column_index in one_hot_columns:
-            column = get_column(data_matrix, column_index)
+def _iterate_rows(row_source):
+    if callable(row_source):
+        return row_source()
+    return iter(row_source)
 
-            for row_index in range(len(data_matrix)):
-                vector_key = str(column_index) + " : " + str(column[row_index])
 
-                if vector_key not in vector_map:
-                    vector_map[vector_key] = id_counter
-                    id_counter += 1
+def _get_target(row, target_column):
+    target = row[target_column]
+    if target is None:
+        raise ValueError('The row %s does not have a target value' % row)
+    return target
 
-                output_rows[row_index] += " " + str(vector_map[vector_key]) + ":1"
 
-    for input_file, output_rows in zip(input_files, output_row_list):
-        with open(input_file + suffix, 'w') as write_file:
-            for row in output_rows:
-                write_file.write("%s\n" % row)
+def _build_vector_key(column_index, value):
+    return str(column_index) + ' : ' + _format_value(value)
 
-    print('Number of variables in the model: %d' % id_counter)
 
-    return id_counter
+def _format_value(value):
+    # Format the values the same way the csv module does, so writing the
+    # records directly gives the same files as going through a CSV file.
+    # None only reaches this point as a value of a one-hot column, where it is
+    # one more category
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
 
 
 def get_column(matrix, i):
@@ -0,0 +1,573 @@
+import json
+import numbers
+import os
+import shutil
+
+import numpy
+
+from etl import ETLUtils
+
+__author__ = 'fpena'
+
+
+STORE_SUFFIX = '.columns'
+METADATA_FILE = 'metadata.json'
+DEFAULT_CHUNK_SIZE = 10000
+
+SCALAR = 'scalar'
+STRING = 'string'
+STRING_LIST = 'string_list'
+PAIR_LIST = 'pair_list'
+FLOAT_DICT = 'float_dict'
+JSON = 'json'
+
+# The suffix of the arrays that indicate which values of a numeric array that
+# mixes integers and floats are integers
+INTEGERS_SUFFIX = '_integers'
+
+
+class RecordColumn(object):
+    """
+    Read-only sequence with the values of one field of the records of a
+    ColumnarRecordStore. The values are decoded from the memory-mapped arrays
+    when they are accessed, so only the fields that are used are read from
+    disk
+    """
+
+    def __init__(self, kind, arrays, present):
+        self.kind = kind
+        self.arrays = arrays
+        self.present = present
+        self._values = None
+        self._keys = {}
+
+    def __len__(self):
+        if self.kind == SCALAR:
+            return len(self.arrays['values'])
+        return len(self.arrays['offsets']) - 1
+
+    def __getitem__(self, index):
+        return self.to_list()[index]
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def to_list(self):
+        """
+        Decodes all the values of this column. The result is cached
+
+        :return: a list with the value of the field in each record
+        """
+        if self._values is None:
+            self._values = self.get_range(0, len(self))
+        return self._values
+
+    def get_range(self, start, end):
+        """
+        Decodes the values of the records in the range [start, end) without
+        caching them, so a column can be read in chunks that don't have to
+        fit in memory all at once
+
+        :param start: the index of the first record
+        :param end: the index after the last record
+        :return: a list with the value of the field in each of the records
+        """
+        return getattr(self, '_decode_' + self.kind)(start, end)
+
+    def _get_offsets(self, start, end):
+        offsets = numpy.asarray(self.arrays['offsets'][start:end + 1])
+        return offsets[0], offsets[-1], offsets - offsets[0]
+
+    def _get_keys(self, data_name, offsets_name):
+        # The vocabularies are small, so they are decoded only once
+        keys = self._keys.get(data_name)
+        if keys is None:
+            keys = _decode_strings(
+                self.arrays[data_name], self.arrays[offsets_name])
+            self._keys[data_name] = keys
+        return keys
+
+    def _get_numbers(self, array_name, start, end):
+        values = self.arrays[array_name][start:end].tolist()
+        integers = self.arrays.get(array_name + INTEGERS_SUFFIX)
+        if integers is None:
+            return values
+        # The integers of the arrays that also contain floats are restored
+        return [
+            int(value) if is_integer else value
+            for value, is_integer in zip(values, integers[start:end].tolist())
+        ]
+
+    def _decode_scalar(self, start, end):
+        return self._get_numbers('values', start, end)
+
+    def _decode_string(self, start, end):
+        first, last, offsets = self._get_offsets(start, end)
+        return _decode_strings(self.arrays['data'][first:last], offsets)
+
+    def _decode_string_list(self, start, end):
+        first, last, offsets = self._get_offsets(start, end)
+        vocabulary = self._get_keys('vocabulary_data', 'vocabulary_offsets')
+        tokens = [
+            vocabulary[token]
+            for token in self.arrays['tokens'][first:last].tolist()]
+        return _split(tokens, offsets)
+
+    def _decode_pair_list(self, start, end):
+        first, last, offsets = self._get_offsets(start, end)
+        pairs = [
+            [first_value, second_value]
+            for first_value, second_value in zip(
+                self._get_numbers('first', first, last),
+                self._get_numbers('second', first, last))
+        ]
+        return _split(pairs, offsets)
+
+    def _decode_float_dict(self, start, end):
+        first, last, offsets = self._get_offsets(start, end)
+        keys = self._get_keys('key_data', 'key_offsets')
+        key_list = [keys[key] for key in self.arrays['keys'][first:last]]
+        value_list = self._get_numbers('values', first, last)
+        offsets = offsets.tolist()
+        return [
+            dict(zip(key_list[key_start:key_end],
+                     value_list[key_start:key_end]))
+            for key_start, key_end in zip(offsets[:-1], offsets[1:])
+        ]
+
+    def _decode_json(self, start, end):
+        return [
+            json.loads(value) for value in self._decode_string(start, end)
+        ]
+
+
+class ColumnarRecordStore(object):
+    """
+    On-disk columnar representation of a list of records, in which every field
+    is stored in its own NumPy arrays. The scalar fields are stored as a
+    single array, while the variable length fields (strings, bags of words,
+    corpora and dictionaries of floats) are stored as a flat array of values
+    plus an array of offsets that indicates where the values of each record
+    start. The fields that don't fit any of these layouts are stored as JSON
+    strings.
+
+    The arrays are memory-mapped and loaded only when their field is
+    accessed
+    """
+
+    def __init__(self, directory, mmap_mode='r'):
+        self.directory = directory
+        self.mmap_mode = mmap_mode
+
+        with open(os.path.join(directory, METADATA_FILE)) as read_file:
+            metadata = json.load(read_file)
+
+        self.num_records = metadata['num_records']
+        self.field_kinds = {}
+        self.field_files = {}
+        self.fields = []
+        for field_metadata in metadata['fields']:
+            field = field_metadata['name']
+            self.fields.append(field)
+            self.field_kinds[field] = field_metadata['kind']
+            self.field_files[field] = field_metadata['arrays']
+        self._columns = {}
+
+    def __len__(self):
+        return self.num_records
+
+    def get_column(self, field):
+        """
+        Returns the values of the given field
+
+        :param field: the name of the field
+        :rtype: RecordColumn
+        :return: a RecordColumn with the values of the field in each record
+        """
+        column = self._columns.get(field)
+        if column is None:
+            arrays = {
+                array_name: self._load_array(file_name)
+                for array_name, file_name in self.field_files[field].items()
+            }
+            present = arrays.pop('present', None)
+            column = RecordColumn(self.field_kinds[field], arrays, present)
+            self._columns[field] = column
+        return column
+
+    def load_records(self, fields=None):
+        """
+        Builds the list of records, containing only the given fields
+
+        :param fields: a list with the names of the fields to load. If None,
+        all the fields are loaded. The fields that are not in the store are
+        ignored
+        :return: a list of dictionaries
+        """
+        fields = self._get_fields(fields)
+        records = [{} for _ in xrange(self.num_records)]
+        for field in fields:
+            column = self.get_column(field)
+            _fill_field(records, field, column.to_list(), column.present)
+
+        return records
+
+    def iterate_records(self, fields=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Reads the records in chunks, decoding only the records of one chunk
+        at a time, so the records can be processed within a fixed memory
+        budget regardless of the size of the store
+
+        :param fields: a list with the names of the fields to load. If None,
+        all the fields are loaded. The fields that are not in the store are
+        ignored
+        :param chunk_size: the number of records of each chunk
+        :return: a generator of lists of dictionaries
+        """
+        fields = self._get_fields(fields)
+        for start in xrange(0, self.num_records, chunk_size):
+            end = min(start + chunk_size, self.num_records)
+            records = [{} for _ in xrange(end - start)]
+            for field in fields:
+                column = self.get_column(field)
+                present = column.present
+                if present is not None:
+                    present = present[start:end]
+                _fill_field(
+                    records, field, column.get_range(start, end), present)
+            yield records
+
+    def _get_fields(self, fields):
+        if fields is None:
+            fields = self.fields
+        return [field for field in fields if field in self.field_kinds]
+
+    def _load_array(self, file_name):
+        return numpy.load(
+            os.path.join(self.directory, file_name), mmap_mode=self.mmap_mode)
+
+    @staticmethod
+    def save(directory, records):
+        """
+        Saves the given records in the given directory, replacing its content
+
+        :param directory: the path of the directory
+        :param records: a list of dictionaries
+        """
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory)
+
+        fields = []
+        seen_fields = set()
+        for record in records:
+            for field in record:
+                if field not in seen_fields:
+                    seen_fields.add(field)
+                    fields.append(field)
+
+        fields_metadata = []
+        for field_index, field in enumerate(fields):
+            present = numpy.array(
+                [field in record for record in records], dtype=bool)
+            values = [record.get(field) for record in records]
+            kind = _infer_kind(
+                [value for value, is_present in zip(values, present)
+                 if is_present])
+            arrays = _ENCODERS[kind](values, present)
+            if not present.all():
+                arrays['present'] = present
+
+            array_files = {}
+            for array_name, array in arrays.items():
+                file_name = '%d_%s.npy' % (field_index, array_name)
+                numpy.save(os.path.join(directory, file_name), array)
+                array_files[array_name] = file_name
+
+            fields_metadata.append({
+                'name': field,
+                'kind': kind,
+                'arrays': array_files
+            })
+
+        # The metadata is written at the end, so an interrupted save doesn't
+        # leave a store that looks complete
+        metadata = {'num_records': len(records), 'fields': fields_metadata}
+        with open(os.path.join(directory, METADATA_FILE), 'w') as write_file:
+            json.dump(metadata, write_file)
+
+
+def get_store_path(file_path):
+    return file_path + STORE_SUFFIX
+
+
+def is_store_valid(file_path):
+    """
+    Indicates if the columnar store of the given records file exists and is
+    at least as recent as the JSON file
+
+    :param file_path: the path of the JSON records file
+    """
+    metadata_file = os.path.join(get_store_path(file_path), METADATA_FILE)
+    if not os.path.exists(metadata_file):
+        return False
+    if not os.path.exists(file_path):
+        return True
+    return os.path.getmtime(metadata_file) >= os.path.getmtime(file_path)
+
+
+def records_exist(file_path):
+    """
+    Indicates if the records of the given file have been saved, either as a
+    JSON file or as a columnar store
+
+    :param file_path: the path of the JSON records file
+    """
+    return os.path.exists(file_path) or is_store_valid(file_path)
+
+
+def save_records(file_path, records, export_json=True):
+    """
+    Saves the given records in a columnar store next to the given file path
+    and, optionally, in the JSON file, for the tools that read it
+
+    :param file_path: the path of the JSON records file
+    :param records: a list of dictionaries
+    :param export_json: a boolean that indicates if the JSON file also has to
+    be written
+    """
+    if export_json:
+        ETLUtils.save_json_file(file_path, records)
+    elif os.path.exists(file_path):
+        # A stale JSON file would be newer than the store
+        os.remove(file_path)
+    ColumnarRecordStore.save(get_store_path(file_path), records)
+
+
+def load_records(file_path, fields=None):
+    """
+    Loads the records of the given file, reading only the given fields from
+    its columnar store. If the store doesn't exist or is older than the JSON
+    file, the JSON file is parsed and the store is created, so the next loads
+    are faster
+
+    :param file_path: the path of the JSON records file
+    :param fields: a list with the names of the fields to load. If None, all
+    the fields are loaded
+    :return: a list of dictionaries
+    """
+    if not is_store_valid(file_path):
+        records = ETLUtils.load_json_file(file_path)
+        ColumnarRecordStore.save(get_store_path(file_path), records)
+        if fields is not None:
+            records = [
+                {field: record[field] for field in fields if field in record}
+                for record in records
+            ]
+        return records
+
+    return ColumnarRecordStore(get_store_path(file_path)).load_records(fields)
+
+
+def iterate_records(file_path, fields=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Reads the records of the given file in chunks from its columnar store. If
+    the store doesn't exist or is older than the JSON file, it is created
+    first, which requires parsing the whole JSON file once
+
+    :param file_path: the path of the JSON records file
+    :param fields: a list with the names of the fields to load. If None, all
+    the fields are loaded
+    :param chunk_size: the number of records of each chunk
+    :return: a generator of lists of dictionaries
+    """
+    if not is_store_valid(file_path):
+        ColumnarRecordStore.save(
+            get_store_path(file_path), ETLUtils.load_json_file(file_path))
+
+    store = ColumnarRecordStore(get_store_path(file_path))
+    for records in store.iterate_records(fields, chunk_size):
+        yield records
+
+
+def _fill_field(records, field, values, present):
+    if present is None:
+        for record, value in zip(records, values):
+            record[field] = value
+    else:
+        for record, value, is_present in zip(records, values, present):
+            if is_present:
+                record[field] = value
+
+
+def _infer_kind(values):
+    if all(isinstance(value, bool) for value in values) or \
+            all(_is_number(value) for value in values):
+        return SCALAR
+    if all(isinstance(value, basestring) for value in values):
+        return STRING
+    if all(isinstance(value, (list, tuple)) for value in values):
+        if all(isinstance(token, basestring)
+               for value in values for token in value):
+            return STRING_LIST
+        if all(isinstance(pair, (list, tuple)) and len(pair) == 2 and
+               _is_number(pair[0]) and _is_number(pair[1])
+               for value in values for pair in value):
+            return PAIR_LIST
+    if all(isinstance(value, dict) for value in values) and \
+            all(isinstance(key, basestring) and _is_number(dict_value)
+                for value in values for key, dict_value in value.items()):
+        return FLOAT_DICT
+    return JSON
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+
+def _numeric_array(values):
+    if all(isinstance(value, bool) for value in values) and values:
+        return numpy.array(values, dtype=bool)
+    if all(isinstance(value, (int, long)) and not isinstance(value, bool)
+           for value in values):
+        return numpy.array(values, dtype=numpy.int64)
+    return numpy.array(values, dtype=numpy.float64)
+
+
+def _numeric_arrays(array_name, values):
+    """
+    Builds the array with the given numbers. If the numbers mix integers and
+    floats, they are stored as floats and an additional array indicates which
+    of them are integers, so they are loaded with the same type they had
+
+    :param array_name: the name of the array
+    :param values: a list of numbers
+    :return: a dictionary with the arrays
+    """
+    array = _numeric_array(values)
+    arrays = {array_name: array}
+    if array.dtype == numpy.float64:
+        integers = numpy.array(
+            [isinstance(value, (int, long)) for value in values], dtype=bool)
+        if integers.any():
+            arrays[array_name + INTEGERS_SUFFIX] = integers
+    return arrays
+
+
+def _build_offsets(lengths):
+    offsets = numpy.zeros(len(lengths) + 1, dtype=numpy.int64)
+    numpy.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def _encode_strings(strings):
+    encoded = [
+        value.encode('utf-8') if isinstance(value, unicode) else value
+        for value in strings
+    ]
+    data = numpy.frombuffer(''.join(encoded), dtype=numpy.uint8) \
+        if encoded else numpy.zeros(0, dtype=numpy.uint8)
+    return data, _build_offsets([len(value) for value in encoded])
+
+
+def _decode_strings(data, offsets):
+    text = numpy.asarray(data).tostring()
+    offsets = offsets.tolist()
+    return [
+        text[start:end].decode('utf-8')
+        for start, end in zip(offsets[:-1], offsets[1:])
+    ]
+
+
+def _split(values, offsets):
+    offsets = offsets.tolist()
+    return [
+        values[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def _encode_scalar(values, present):
+    # The missing values take the type of the first value that is present,
+    # so they don't turn a column of integers into floats or the opposite
+    default = next(
+        (type(value)() for value, is_present in zip(values, present)
+         if is_present), 0)
+    return _numeric_arrays('values', [
+        value if is_present else default
+        for value, is_present in zip(values, present)])
+
+
+def _encode_string(values, present):
+    data, offsets = _encode_strings([
+        value if is_present else '' for value, is_present in
+        zip(values, present)])
+    return {'data': data, 'offsets': offsets}
+
+
+def _encode_string_list(values, present):
+    values = [
+        value if is_present else [] for value, is_present in
+        zip(values, present)]
+    vocabulary = {}
+    tokens = []
+    for value in values:
+        for token in value:
+            tokens.append(vocabulary.setdefault(token, len(vocabulary)))
+    words = sorted(vocabulary, key=vocabulary.get)
+    vocabulary_data, vocabulary_offsets = _encode_strings(words)
+    return {
+        'tokens': numpy.array(tokens, dtype=numpy.int32),
+        'offsets': _build_offsets([len(value) for value in values]),
+        'vocabulary_data': vocabulary_data,
+        'vocabulary_offsets': vocabulary_offsets
+    }
+
+
+def _encode_pair_list(values, present):
+    values = [
+        value if is_present else [] for value, is_present in
+        zip(values, present)]
+    pairs = [pair for value in values for pair in value]
+    arrays = {'offsets': _build_offsets([len(value) for value in values])}
+    arrays.update(_numeric_arrays('first', [pair[0] for pair in pairs]))
+    arrays.update(_numeric_arrays('second', [pair[1] for pair in pairs]))
+    return arrays
+
+
+def _encode_float_dict(values, present):
+    values = [
+        value if is_present else {} for value, is_present in
+        zip(values, present)]
+    key_ids = {}
+    keys = []
+    dict_values = []
+    for value in values:
+        for key, dict_value in value.items():
+            keys.append(key_ids.setdefault(key, len(key_ids)))
+            dict_values.append(dict_value)
+    key_data, key_offsets = \
+        _encode_strings(sorted(key_ids, key=key_ids.get))
+    arrays = {
+        'keys': numpy.array(keys, dtype=numpy.int32),
+        'offsets': _build_offsets([len(value) for value in values]),
+        'key_data': key_data,
+        'key_offsets': key_offsets
+    }
+    arrays.update(_numeric_arrays('values', dict_values))
+    return arrays
+
+
+def _encode_json(values, present):
+    data, offsets = _encode_strings([
+        json.dumps(value) if is_present else 'null' for value, is_present in
+        zip(values, present)])
+    return {'data': data, 'offsets': offsets}
+
+
+_ENCODERS = {
+    SCALAR: _encode_scalar,
+    STRING: _encode_string,
+    STRING_LIST: _encode_string_list,
+    PAIR_LIST: _encode_pair_list,
+    FLOAT_DICT: _encode_float_dict,
+    JSON: _encode_json
+}
@@ -8,13 +8,13 @@ from langdetect import DetectorFactory
 from langdetect.lang_detect_exception import LangDetectException
 import numpy
 from gensim import corpora
-from nltk import PerceptronTagger
-from nltk.corpus import stopwords
 
 from etl import ETLUtils
+from etl import record_store
 from etl.reviews_dataset_analyzer import ReviewsDatasetAnalyzer
 from evaluation import classifier_evaluator
-from nlp import nlp_utils
+from nlp import nlp_pipeline
+from nlp import nlp_resources
 from topicmodeling.context import lda_context_utils
 from topicmodeling.context import topic_model_creator
 from topicmodeling.context.context_extractor import ContextExtractor
@@ -22,11 +22,28 @@ from topicmodeling.context.context_transformer import ContextTransformer
 from topicmodeling.context.reviews_classifier import ReviewsClassifier
 from topicmodeling.nmf_topic_extractor import NmfTopicExtractor
 from tripadvisor.fourcity import extractor
+from utils import artifact_cache
 from utils import utilities
 from utils.constants import Constants
 from utils.utilities import all_context_words
 
 
+# The properties that affect the bags of words of the records and the
+# dictionary built from them
+DICTIONARY_PROPERTIES = [
+    'business_type',
+    'bow_type',
+    'document_level',
+    'language',
+    'lemmatize',
+    'max_dictionary_word_count',
+    'min_dictionary_word_count',
+    'min_reviews_per_item',
+    'min_reviews_per_user',
+    'topic_model_target_type',
+]
+
+
 class ReviewsPreprocessor:
 
     def __init__(self, use_cache=False):
@@ -274,55 +291,49 @@ class ReviewsPreprocessor:
         ETLUtils.save_json_file(item_frequency_file, [item_frequency_map])
 
     @staticmethod
-    def pos_tag_reviews(records):
+    def pos_tag_reviews(records, use_cache=False):
         print('%s: tag reviews' % time.strftime("%Y/%m/%d-%H:%M:%S"))
-        tagger = PerceptronTagger()
 
-        for record in records:
-            tagged_words =\
-                nlp_utils.tag_words(record[Constants.TEXT_FIELD], tagger)
+        tagged_texts = ReviewsPreprocessor.process_reviews_text(
+            records, nlp_pipeline.POS_TAG, use_cache)
+        for record, tagged_words in zip(records, tagged_texts):
             record[Constants.POS_TAGS_FIELD] = tagged_words
 
     @staticmethod
-    def lemmatize_reviews(records):
+    def lemmatize_reviews(records, use_cache=False):
         """
         Performs a POS tagging on the text contained in the reviews and
         additionally finds the lemma of each word in the review
 
         :type records: list[dict]
         :param records: a list of dictionaries with the reviews
+        :param use_cache: if True, the reviews that were already lemmatized
+        are read from the NLP cache
         """
         print('%s: lemmatize reviews' % time.strftime("%Y/%m/%d-%H:%M:%S"))
 
-        record_index = 0
-        for record in records:
-            #
-
-            tagged_words =\
-                nlp_utils.lemmatize_text(record[Constants.TEXT_FIELD])
-
+        lemmatized_texts = ReviewsPreprocessor.process_reviews_text(
+            records, nlp_pipeline.LEMMATIZE, use_cache)
+        for record, tagged_words in zip(records, lemmatized_texts):
             record[Constants.POS_TAGS_FIELD] = tagged_words
-            record_index += 1
 
         return records
         # print('')
 
     @staticmethod
-    def lemmatize_sentences(records):
+    def lemmatize_sentences(records, use_cache=False):
         print('%s: lemmatize sentences' % time.strftime("%Y/%m/%d-%H:%M:%S"))
 
         sentence_records = []
-        record_index = 0
         document_level = Constants.DOCUMENT_LEVEL
-        for record in records:
-            sentences = \
-                nlp_utils.get_sentences(record[Constants.TEXT_FIELD])
+        lemmatized_texts = ReviewsPreprocessor.process_reviews_text(
+            records, nlp_pipeline.LEMMATIZE_SENTENCES, use_cache)
+        for record, lemmatized_sentences in zip(records, lemmatized_texts):
             sentence_index = 0
-            for sentence in sentences:
+            for sentence, tagged_words in lemmatized_sentences:
                 if isinstance(document_level, (int, float)) and\
                         sentence_index >= document_level:
                     break
-                tagged_words = nlp_utils.lemmatize_sentence(sentence)
                 sentence_record = {}
                 sentence_record.update(record)
                 sentence_record[Constants.TEXT_FIELD] = sentence
@@ -330,11 +341,24 @@ class ReviewsPreprocessor:
                 sentence_record[Constants.POS_TAGS_FIELD] = tagged_words
                 sentence_records.append(sentence_record)
                 sentence_index += 1
-                # print(sentence_record)
-            record_index += 1
-            # print('\rrecord index: %d/%d' % (record_index, len(records))),
         return sentence_records
 
+    @staticmethod
+    def process_reviews_text(records, operation, use_cache):
+        """
+        Applies an NLP operation to the text of each review in parallel
+
+        :param records: a list of dictionaries with the reviews
+        :param operation: the name of the operation (see nlp_pipeline)
+        :param use_cache: if True, the results are read from and written to
+        the NLP cache
+        :return: a list with the result of the operation for each review
+        """
+        cache = nlp_pipeline.get_cache(operation) if use_cache else None
+        return nlp_pipeline.process_texts(
+            [record[Constants.TEXT_FIELD] for record in records], operation,
+            cache)
+
     def lemmatize_records(self):
 
         if os.path.exists(Constants.LEMMATIZED_RECORDS_FILE):
@@ -344,10 +368,11 @@ class ReviewsPreprocessor:
             return
 
         if Constants.DOCUMENT_LEVEL == 'review':
-            self.records = self.lemmatize_reviews(self.records)
+            self.records = self.lemmatize_reviews(self.records, self.use_cache)
         elif Constants.DOCUMENT_LEVEL == 'sentence' or\
                 isinstance(Constants.DOCUMENT_LEVEL, (int, long)):
-            self.records = self.lemmatize_sentences(self.records)
+            self.records = self.lemmatize_sentences(
+                self.records, self.use_cache)
 
         ETLUtils.save_json_file(Constants.LEMMATIZED_RECORDS_FILE, self.records)
 
@@ -373,7 +398,8 @@ class ReviewsPreprocessor:
                     'yes' if record['sentence_type'] == 'specific' else 'no'
             print('num training records', len(training_records))
 
-        training_records = self.lemmatize_reviews(training_records)
+        training_records = self.lemmatize_reviews(
+            training_records, self.use_cache)
 
         classifier = ReviewsClassifier(classifier_evaluator.load_pipeline())
         classifier.train(training_records)
@@ -383,11 +409,7 @@ class ReviewsPreprocessor:
         print('%s: build bag of words' % time.strftime("%Y/%m/%d-%H:%M:%S"))
 
         bow_type = Constants.BOW_TYPE
-        cached_stop_words = set(stopwords.words("english"))
-        cached_stop_words |= {
-            't', 'didn', 'doesn', 'haven', 'don', 'aren', 'isn', 've', 'll',
-            'couldn', 'm', 'hasn', 'hadn', 'won', 'shouldn', 's', 'wasn',
-            'wouldn'}
+        cached_stop_words = nlp_resources.get_stop_words()
 
         if Constants.LEMMATIZE:
             tagged_word_index = 2
@@ -411,10 +433,20 @@ class ReviewsPreprocessor:
     def build_dictionary(self):
         print('%s: build dictionary' % time.strftime("%Y/%m/%d-%H:%M:%S"))
 
-        if self.use_cache and os.path.exists(Constants.DICTIONARY_FILE):
-            print('Dictionary already exists')
-            self.dictionary = corpora.Dictionary.load(Constants.DICTIONARY_FILE)
-            return
+        # The dictionary is cached by the records and the properties used to
+        # build their bags of words
+        cache = artifact_cache.get_cache()
+        dictionary_key = artifact_cache.build_key(
+            'dictionary', DICTIONARY_PROPERTIES,
+            artifact_cache.hash_records(self.records))
+
+        if self.use_cache:
+            self.dictionary = cache.load_with(
+                dictionary_key, corpora.Dictionary.load)
+            if self.dictionary is not None:
+                print('Dictionary already exists')
+                cache.export(dictionary_key, Constants.DICTIONARY_FILE)
+                return
 
         all_words = []
 
@@ -428,6 +460,7 @@ class ReviewsPreprocessor:
             Constants.MAX_DICTIONARY_WORD_COUNT)
 
         self.dictionary.save(Constants.DICTIONARY_FILE)
+        cache.store_file(dictionary_key, Constants.DICTIONARY_FILE)
 
     def tag_contextual_reviews(self):
         """
@@ -464,10 +497,11 @@ class ReviewsPreprocessor:
 
     def export_records(self):
         print('%s: export records' % time.strftime("%Y/%m/%d-%H:%M:%S"))
-        ETLUtils.save_json_file(
+        record_store.save_records(
             Constants.FULL_PROCESSED_RECORDS_FILE, self.records)
         self.drop_unnecessary_fields()
-        ETLUtils.save_json_file(Constants.PROCESSED_RECORDS_FILE, self.records)
+        record_store.save_records(
+            Constants.PROCESSED_RECORDS_FILE, self.records)
 
     def label_review_targets(self):
 
@@ -560,29 +594,31 @@ class ReviewsPreprocessor:
             for record in recsys_records:
                 record[Constants.CONTEXT_TOPICS_FIELD] = {'na': 1.0}
 
-            ETLUtils.save_json_file(file_name, recsys_records)
+            record_store.save_records(file_name, recsys_records)
             return
 
         topic_model_creator.train_topic_model(topic_model_records)
 
-        if os.path.exists(Constants.RECSYS_TOPICS_PROCESSED_RECORDS_FILE):
+        if record_store.records_exist(
+                Constants.RECSYS_TOPICS_PROCESSED_RECORDS_FILE):
             print('Recsys topic records have already been generated')
-            recsys_records = ETLUtils.load_json_file(
+            recsys_records = record_store.load_records(
                 Constants.RECSYS_TOPICS_PROCESSED_RECORDS_FILE)
         else:
             recsys_records = self.records[num_records / 2:]
             self.find_topic_distribution(recsys_records)
-            ETLUtils.save_json_file(
+            record_store.save_records(
                 Constants.RECSYS_TOPICS_PROCESSED_RECORDS_FILE, recsys_records)
 
-        if os.path.exists(Constants.RECSYS_CONTEXTUAL_PROCESSED_RECORDS_FILE):
+        if record_store.records_exist(
+                Constants.RECSYS_CONTEXTUAL_PROCESSED_RECORDS_FILE):
             print('Recsys contextual records have already been generated')
             print(Constants.RECSYS_CONTEXTUAL_PROCESSED_RECORDS_FILE)
-            recsys_records = ETLUtils.load_json_file(
+            recsys_records = record_store.load_records(
                 Constants.RECSYS_CONTEXTUAL_PROCESSED_RECORDS_FILE)
         else:
             self.update_context_topics(recsys_records)
-            ETLUtils.save_json_file(
+            record_store.save_records(
                 Constants.RECSYS_CONTEXTUAL_PROCESSED_RECORDS_FILE,
                 recsys_records
             )
@@ -606,7 +642,7 @@ class ReviewsPreprocessor:
 
     def load_full_records(self):
         records_file = Constants.FULL_PROCESSED_RECORDS_FILE
-        self.records = ETLUtils.load_json_file(records_file)
+        self.records = record_store.load_records(records_file)
 
     def count_specific_generic_ratio(self):
         """
@@ -699,10 +735,10 @@ class ReviewsPreprocessor:
         utilities.plant_seeds()
 
         if self.use_cache and \
-                os.path.exists(Constants.PROCESSED_RECORDS_FILE):
+                record_store.records_exist(Constants.PROCESSED_RECORDS_FILE):
             print('Records have already been processed')
             self.records = \
-                ETLUtils.load_json_file(Constants.PROCESSED_RECORDS_FILE)
+                record_store.load_records(Constants.PROCESSED_RECORDS_FILE)
         else:
             self.preprocess()
 
@@ -0,0 +1,77 @@
+import random
+from unittest import TestCase
+
+from etl import ETLUtils
+from etl.fold_view import FoldView
+from etl.fold_view import RecordView
+
+__author__ = 'fpena'
+
+
+records = [
+    {'review_id': 'r%d' % index, 'stars': index % 5 + 1}
+    for index in range(13)
+]
+
+
+class TestRecordView(TestCase):
+
+    def test_copy_on_write(self):
+        record = {'review_id': 'r1', 'stars': 4.0}
+        view = RecordView(record)
+
+        view['context_topics'] = {'topic0': 1.0}
+        view['stars'] = 5.0
+        del view['review_id']
+
+        self.assertEqual({'review_id': 'r1', 'stars': 4.0}, record)
+        self.assertEqual(
+            {'stars': 5.0, 'context_topics': {'topic0': 1.0}}, dict(view))
+        self.assertEqual(2, len(view))
+        self.assertFalse('review_id' in view)
+        self.assertRaises(KeyError, view.__getitem__, 'review_id')
+        self.assertIsNone(view.get('review_id'))
+
+        view['review_id'] = 'r2'
+        self.assertEqual('r2', view['review_id'])
+        self.assertEqual('r1', record['review_id'])
+
+
+class TestFoldView(TestCase):
+
+    def test_split_train_test(self):
+        fold_view = FoldView(records)
+
+        for start in [0., 0.2, 0.4, 0.6, 0.8]:
+            expected_train, expected_test = \
+                ETLUtils.split_train_test(records, 0.8, start)
+            train, test = fold_view.split_train_test(0.8, start)
+            self.assertEqual(expected_train, [dict(view) for view in train])
+            self.assertEqual(expected_test, [dict(view) for view in test])
+
+    def test_shuffle(self):
+        random.seed(0)
+        shuffled_records = list(records)
+        random.shuffle(shuffled_records)
+
+        random.seed(0)
+        fold_view = FoldView(records)
+        fold_view.shuffle()
+
+        self.assertEqual(shuffled_records, fold_view.get_records())
+        train, test = fold_view.split_train_test(0.8, 0.4)
+        self.assertEqual(
+            ETLUtils.split_train_test(shuffled_records, 0.8, 0.4)[1],
+            [dict(view) for view in test])
+
+    def test_folds_are_isolated(self):
+        fold_view = FoldView(records)
+
+        train, _ = fold_view.split_train_test(0.8, 0.)
+        for view in train:
+            view['context_topics'] = {'topic0': 1.0}
+
+        train, _ = fold_view.split_train_test(0.8, 0.)
+        self.assertTrue(all('context_topics' not in view for view in train))
+        self.assertTrue(
+            all('context_topics' not in record for record in records))
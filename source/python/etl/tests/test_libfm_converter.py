@@ -1,6 +1,10 @@
 import filecmp
 import os
+import shutil
+import tempfile
 from etl.libfm_converter import csv_to_libfm
+from etl.libfm_converter import rows_to_csr_matrices
+from etl.libfm_converter import rows_to_libfm
 from unittest import TestCase
 
 __author__ = 'fpena'
@@ -11,6 +15,11 @@ folder = '/Users/fpena/UCC/Thesis/projects/yelp/source/python/etl/tests/'
 
 class TestLibfmConverter(TestCase):
 
+    def make_temp_folder(self):
+        temp_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_folder)
+        return temp_folder
+
     def test_csv_to_libfm(self):
 
         input_file = folder + 'yelp.csv_train_0'
@@ -29,3 +38,70 @@ class TestLibfmConverter(TestCase):
 
         if os.path.isfile(output_file):
             os.remove(output_file)
+
+    def test_rows_to_libfm(self):
+
+        train_rows = [
+            [4, 'U1', 'I1', 0.5],
+            [2, 'U2', 'I1', 0.0],
+            [5, 'U1', 'I2', 0.25],
+        ]
+        test_rows = [
+            [3, 'U3', 'I2', 1.0],
+        ]
+        temp_folder = self.make_temp_folder()
+        output_files = [
+            os.path.join(temp_folder, 'train.libfm'),
+            os.path.join(temp_folder, 'test.libfm')
+        ]
+
+        num_variables, vector_map = rows_to_libfm(
+            [train_rows, lambda: iter(test_rows)], output_files, 0, [1, 2])
+
+        expected_map = {
+            '1 : U1': 1, '1 : U2': 2, '2 : I1': 3, '2 : I2': 4, '1 : U3': 5}
+        self.assertEqual(6, num_variables)
+        self.assertEqual(expected_map, vector_map)
+
+        with open(output_files[0]) as read_file:
+            self.assertEqual(
+                ['4 0:0.5 1:1 3:1\n', '2 0:0.0 2:1 3:1\n',
+                 '5 0:0.25 1:1 4:1\n'],
+                read_file.readlines())
+        with open(output_files[1]) as read_file:
+            self.assertEqual(['3 0:1.0 5:1 4:1\n'], read_file.readlines())
+
+        # Reusing the feature map keeps the IDs of the known values
+        num_variables, new_vector_map = rows_to_libfm(
+            [[[1, 'U4', 'I1', 0.5]]], output_files[:1], 0, [1, 2],
+            vector_map=vector_map)
+
+        self.assertEqual(7, num_variables)
+        self.assertEqual(6, new_vector_map['1 : U4'])
+        with open(output_files[0]) as read_file:
+            self.assertEqual(['1 0:0.5 6:1 3:1\n'], read_file.readlines())
+
+    def test_rows_to_libfm_missing_values(self):
+
+        rows = [
+            [4, 'U1', None, 0.5],
+            [2, 'U2', 1.0, None],
+        ]
+        output_file = os.path.join(self.make_temp_folder(), 'rows.libfm')
+
+        rows_to_libfm([rows], [output_file], 0, [1])
+
+        # The missing static values are left out instead of written empty
+        with open(output_file) as read_file:
+            self.assertEqual(
+                ['4 1:0.5 2:1\n', '2 0:1.0 3:1\n'], read_file.readlines())
+
+        matrices, num_variables, _ = rows_to_csr_matrices([rows], 0, [1])
+        self.assertEqual(4, num_variables)
+        self.assertEqual(
+            [[0., 0.5, 1., 0.], [1., 0., 0., 1.]],
+            matrices[0][0].toarray().tolist())
+
+        self.assertRaises(
+            ValueError, rows_to_libfm, [[[None, 'U1', 1.0, 0.5]]],
+            [output_file], 0, [1])
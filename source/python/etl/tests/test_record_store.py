@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from etl import ETLUtils
+from etl import record_store
+from etl.record_store import ColumnarRecordStore
+
+__author__ = 'fpena'
+
+
+records = [
+    {
+        'review_id': 'r1',
+        'stars': 4.0,
+        'has_context': True,
+        'bow': ['good', 'food'],
+        'corpus': [[0, 1.0], [3, 2.0]],
+        'context_topics': {'topic0': 0.25, 'topic1': 0.75},
+        'extra': {'nested': [1, 2]}
+    },
+    {
+        'review_id': u'r2',
+        'stars': 2.5,
+        'has_context': False,
+        'bow': [],
+        'corpus': [],
+        'context_topics': {}
+    },
+    {
+        'review_id': 'r3',
+        'stars': 5.0,
+        'has_context': True,
+        'bow': ['nice'],
+        'corpus': [[7, 1.0]],
+        'context_topics': {'topic0': 1.0},
+        'extra': None
+    },
+]
+
+
+class TestRecordStore(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.directory, 'records.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save(self):
+        store_path = record_store.get_store_path(self.file_path)
+        ColumnarRecordStore.save(store_path, records)
+        store = ColumnarRecordStore(store_path)
+
+        self.assertEqual(3, len(store))
+        self.assertEqual(records, store.load_records())
+        self.assertEqual(
+            ['r1', 'r2', 'r3'], list(store.get_column('review_id')))
+        self.assertEqual(
+            [{'review_id': record['review_id'], 'corpus': record['corpus']}
+             for record in records],
+            store.load_records(['review_id', 'corpus', 'missing_field']))
+
+    def test_save_records(self):
+        record_store.save_records(self.file_path, records, export_json=False)
+        self.assertFalse(os.path.exists(self.file_path))
+        self.assertTrue(record_store.records_exist(self.file_path))
+        self.assertEqual(records, record_store.load_records(self.file_path))
+
+    def test_load_records(self):
+        # A JSON file without a store is converted the first time it is read
+        ETLUtils.save_json_file(self.file_path, records)
+        self.assertFalse(record_store.is_store_valid(self.file_path))
+        self.assertEqual(
+            [{'stars': record['stars']} for record in records],
+            record_store.load_records(self.file_path, ['stars']))
+        self.assertTrue(record_store.is_store_valid(self.file_path))
+        self.assertEqual(records, record_store.load_records(self.file_path))
+
+    def test_iterate_records(self):
+        record_store.save_records(self.file_path, records, export_json=False)
+
+        chunks = list(record_store.iterate_records(self.file_path, None, 2))
+        self.assertEqual([2, 1], [len(chunk) for chunk in chunks])
+        self.assertEqual(records, chunks[0] + chunks[1])
+
+        chunks = list(record_store.iterate_records(
+            self.file_path, ['bow', 'extra'], 1))
+        self.assertEqual(
+            [[{'bow': record['bow'], 'extra': record['extra']}]
+             if 'extra' in record else [{'bow': record['bow']}]
+             for record in records],
+            chunks)
+
+    def test_integer_values(self):
+        # The integers are loaded as integers, even if their field also
+        # contains floats
+        mixed_records = [
+            {'count': 3, 'corpus': [[0, 1], [3, 0.5]], 'weights': {'a': 2}},
+            {'count': 2.5, 'corpus': [[7, 2]], 'weights': {'a': 0.5}},
+            {'flag': True},
+        ]
+        record_store.save_records(
+            self.file_path, mixed_records, export_json=False)
+        loaded_records = record_store.load_records(self.file_path)
+
+        self.assertEqual(mixed_records, loaded_records)
+        self.assertIsInstance(loaded_records[0]['count'], int)
+        self.assertIsInstance(loaded_records[1]['count'], float)
+        self.assertIsInstance(loaded_records[0]['corpus'][0][1], int)
+        self.assertIsInstance(loaded_records[0]['corpus'][1][1], float)
+        self.assertIsInstance(loaded_records[0]['weights']['a'], int)
+        self.assertIsInstance(loaded_records[2]['flag'], bool)
@@ -221,13 +221,7 @@ def transform(records):
     :return:
     """
 
-    num_features =\
-        len(review_metrics_extractor.get_review_metrics(records[0]))
-    x_matrix = numpy.zeros((len(records), num_features))
-
-    for index in range(len(records)):
-        x_matrix[index] =\
-            review_metrics_extractor.get_review_metrics(records[index])
+    x_matrix = review_metrics_extractor.get_reviews_metrics(records)
 
     min_values = x_matrix.min(axis=0)
     max_values = x_matrix.max(axis=0)
@@ -1,6 +1,6 @@
-import copy
 import csv
 import json
+import multiprocessing
 import os
 import random
 from subprocess import call
@@ -16,12 +16,16 @@ from gensim import corpora
 
 from etl import ETLUtils
 from etl import libfm_converter
+from etl import record_store
+from etl.fold_view import FoldView
 from evaluation import rmse_calculator
 from evaluation.top_n_evaluator import TopNEvaluator
 from evaluation import parameter_combinator
+from recommenders.factorization_machine import FactorizationMachine
 # from recommenders import fastfm_recommender
 from topicmodeling.context import topic_model_creator
 from tripadvisor.fourcity import extractor
+from utils import artifact_cache
 from utils import utilities
 from utils.constants import Constants
 
@@ -34,6 +38,42 @@ basic_headers = [
     Constants.ITEM_ID_FIELD
 ]
 
+# The fields of the records that are used to train and evaluate the
+# recommender
+recsys_fields = [
+    Constants.REVIEW_ID_FIELD,
+    Constants.USER_ID_FIELD,
+    Constants.ITEM_ID_FIELD,
+    Constants.RATING_FIELD,
+    Constants.PREDICTED_CLASS_FIELD,
+    Constants.HAS_CONTEXT_FIELD
+]
+
+# The fields of the records that are read by print_context_topics
+print_context_topics_fields = [
+    Constants.TEXT_FIELD,
+    Constants.TOPICS_FIELD,
+    Constants.BOW_FIELD,
+    Constants.CORPUS_FIELD
+]
+
+# The properties that affect the predictions of the factorization machines,
+# besides the content of the train and test data
+FM_PROPERTIES = [
+    'fm_init_stdev',
+    'fm_iterations',
+    'fm_method',
+    'fm_num_factors',
+    'fm_regularization0',
+    'fm_regularization1',
+    'fm_regularization2',
+    'fm_sdg_learn_rate',
+    'fm_use_1way_interactions',
+    'fm_use_bias',
+    'libfm_seed',
+    'solver',
+]
+
 
 def build_headers(context_rich_topics):
     headers = basic_headers[:]
@@ -133,6 +173,12 @@ class ContextTopNRunner(object):
         self.context_log_file = None
         self.libfm_model_file = None
         self.num_variables_in_model = None
+        self.libfm_vector_map = None
+        self.fm_matrices = None
+        self.topic_model_key = None
+        # Prints the context topics of the important records of each fold,
+        # which requires loading their texts
+        self.show_context_topics = False
 
     def clear(self):
         print('clear: %s' % time.strftime("%Y/%m/%d-%H:%M:%S"))
@@ -146,15 +192,16 @@ class ContextTopNRunner(object):
         self.important_records = None
         self.context_rich_topics = None
         self.context_topics_map = None
+        self.fm_matrices = None
 
-        if Constants.SOLVER == Constants.LIBFM:
-            os.remove(self.csv_train_file)
-            os.remove(self.csv_test_file)
-            os.remove(self.context_predictions_file)
-            os.remove(self.context_train_file)
-            os.remove(self.context_test_file)
-            os.remove(self.context_log_file)
-            os.remove(self.libfm_model_file)
+        # The libFM files only exist if the libFM design matrix was built, and
+        # libFM is not run when the predictions are cached
+        for file_path in [
+                self.context_predictions_file, self.context_train_file,
+                self.context_test_file, self.context_log_file,
+                self.libfm_model_file]:
+            if file_path is not None and os.path.exists(file_path):
+                os.remove(file_path)
 
         self.csv_train_file = None
         self.csv_test_file = None
@@ -197,13 +244,16 @@ class ContextTopNRunner(object):
     def load(self):
         print('load: %s' % time.strftime("%Y/%m/%d-%H:%M:%S"))
 
+        # Only the fields that are used are read from the records store
         if Constants.SEPARATE_TOPIC_MODEL_RECSYS_REVIEWS:
-            self.original_records =\
-                ETLUtils.load_json_file(
-                    Constants.RECSYS_CONTEXTUAL_PROCESSED_RECORDS_FILE)
+            records_file = Constants.RECSYS_CONTEXTUAL_PROCESSED_RECORDS_FILE
+            fields = recsys_fields + [Constants.CONTEXT_TOPICS_FIELD]
         else:
-            self.original_records =\
-                ETLUtils.load_json_file(Constants.PROCESSED_RECORDS_FILE)
+            records_file = Constants.PROCESSED_RECORDS_FILE
+            fields = recsys_fields + topic_model_creator.TOPIC_MODEL_FIELDS
+        if self.show_context_topics:
+            fields += print_context_topics_fields
+        self.original_records = record_store.load_records(records_file, fields)
 
         print('num_records: %d' % len(self.original_records))
         user_ids = extractor.get_groupby_list(
@@ -213,9 +263,9 @@ class ContextTopNRunner(object):
         print('total users', len(user_ids))
         print('total items', len(item_ids))
 
-    def shuffle(self, records):
+    def shuffle(self, fold_view):
         print('shuffle: %s' % time.strftime("%Y/%m/%d-%H:%M:%S"))
-        random.shuffle(records)
+        fold_view.shuffle()
 
     def get_records_to_predict_topn(self):
         print('get_records_to_predict_topn: %s'
@@ -280,6 +330,8 @@ class ContextTopNRunner(object):
 
         context_extractor = topic_model_creator.create_topic_model(
             self.train_records, cycle_index, fold_index)
+        self.topic_model_key = \
+            topic_model_creator.get_topic_model_key(self.train_records)
         self.context_rich_topics = context_extractor.context_rich_topics
 
         topics_file_path = Constants.generate_file_name(
@@ -301,9 +353,10 @@ class ContextTopNRunner(object):
             'context_important_records', 'json', Constants.CACHE_FOLDER,
             cycle_index, fold_index, True)
 
-        self.train_records = ETLUtils.load_json_file(train_records_file_path)
+        self.train_records = \
+            record_store.load_records(train_records_file_path)
         self.important_records = \
-            ETLUtils.load_json_file(important_records_file_path)
+            record_store.load_records(important_records_file_path)
         self.load_cache_context_topics(cycle_index, fold_index)
 
         self.context_topics_map = {}
@@ -312,7 +365,8 @@ class ContextTopNRunner(object):
                 record[Constants.CONTEXT_TOPICS_FIELD]
 
         # self.train_records = self.filter_context_words(self.train_records)
-        # self.print_context_topics(self.important_records)
+        if self.show_context_topics:
+            self.print_context_topics(self.important_records)
 
         self.important_records = None
         gc.collect()
@@ -337,23 +391,41 @@ class ContextTopNRunner(object):
     def find_reviews_topics(self, context_extractor, cycle_index, fold_index):
         print('find topics: %s' % time.strftime("%Y/%m/%d-%H:%M:%S"))
 
-        train_records_file_path = Constants.generate_file_name(
-            'context_train_records', 'json', Constants.CACHE_FOLDER,
-            cycle_index, fold_index, Constants.USE_CONTEXT)
-
-        if os.path.exists(train_records_file_path):
-            self.train_records = \
-                ETLUtils.load_json_file(train_records_file_path)
-        else:
+        # The context topics of the train and the important records are
+        # cached by the topic model that was used to find them and the records
+        cache = artifact_cache.get_cache()
+        train_topics_key = artifact_cache.build_key(
+            'train_context_topics', [], self.topic_model_key)
+        important_topics_key = artifact_cache.build_key(
+            'important_context_topics', ['text_sampling_proportion'],
+            self.topic_model_key,
+            artifact_cache.hash_records(self.important_records))
+
+        train_context_topics = cache.load(train_topics_key)
+        if train_context_topics is None:
             context_extractor.find_contextual_topics(self.train_records)
-            ETLUtils.save_json_file(train_records_file_path, self.train_records)
-        context_extractor.find_contextual_topics(
-            self.important_records, Constants.TEXT_SAMPLING_PROPORTION)
-
-        self.context_topics_map = {}
-        for record in self.important_records:
-            self.context_topics_map[record[Constants.REVIEW_ID_FIELD]] = \
-                record[Constants.CONTEXT_TOPICS_FIELD]
+            train_context_topics = [
+                record.get(Constants.CONTEXT_TOPICS_FIELD)
+                for record in self.train_records
+            ]
+            cache.store(train_topics_key, train_context_topics)
+        else:
+            for record, context_topics in zip(
+                    self.train_records, train_context_topics):
+                if context_topics is not None:
+                    record[Constants.CONTEXT_TOPICS_FIELD] = context_topics
+
+        self.context_topics_map = cache.load(important_topics_key)
+        if self.context_topics_map is None:
+            context_extractor.find_contextual_topics(
+                self.important_records, Constants.TEXT_SAMPLING_PROPORTION)
+
+            self.context_topics_map = {}
+            for record in self.important_records:
+                self.context_topics_map[record[Constants.REVIEW_ID_FIELD]] = \
+                    record[Constants.CONTEXT_TOPICS_FIELD]
+            cache.store(important_topics_key, self.context_topics_map)
+        cache.print_statistics()
 
         self.important_records = None
         gc.collect()
@@ -395,10 +467,15 @@ class ContextTopNRunner(object):
         # print('all used context words count: %d' % len(all_context_words))
         print('all used context topics: %d' % len(all_context_topics))
 
-    def prepare_records_for_libfm(self):
-        print('prepare_records_for_libfm: %s' %
-              time.strftime("%Y/%m/%d-%H:%M:%S"))
+    def build_libfm_row_sources(self):
+        """
+        Builds the row sources of the train records and the records to
+        predict, in which every row contains the rating, the user ID, the item
+        ID and the context topics of a record
 
+        :return: a list with a function that generates the train rows and a
+        function that generates the rows to predict
+        """
         self.headers = build_headers(self.context_rich_topics)
 
         if Constants.FM_REVIEW_TYPE == Constants.SPECIFIC or \
@@ -407,75 +484,108 @@ class ContextTopNRunner(object):
                 self.train_records, Constants.PREDICTED_CLASS_FIELD,
                 [Constants.FM_REVIEW_TYPE])
 
-        with open(self.csv_train_file, 'w') as out_file:
-            writer = csv.writer(out_file)
-
-            # Write header
-            writer.writerow(self.headers)
-
-            for record in self.train_records:
-                row = []
-                for header in basic_headers:
-                    row.append(record[header])
-
-                if Constants.USE_CONTEXT is True:
-                    context_topics = record[Constants.CONTEXT_TOPICS_FIELD]
-                    for topic in self.context_rich_topics:
-                        # print('context_topics', context_topics)
-                        row.append(context_topics['topic' + str(topic[0])])
-
-                    if Constants.USE_NO_CONTEXT_TOPICS_SUM:
-                        row.append(context_topics['nocontexttopics'])
+        train_records = self.train_records
+        records_to_predict = self.records_to_predict
+        context_rich_topics = self.context_rich_topics
+        context_topics_map = self.context_topics_map
 
-                writer.writerow(row)
+        def build_row(record, context_topics):
+            row = [record[header] for header in basic_headers]
 
-        self.train_records = None
-        gc.collect()
+            if Constants.USE_CONTEXT is True:
+                for topic in context_rich_topics:
+                    row.append(context_topics['topic' + str(topic[0])])
 
-        with open(self.csv_test_file, 'w') as out_file:
-            writer = csv.writer(out_file)
+                if Constants.USE_NO_CONTEXT_TOPICS_SUM:
+                    row.append(context_topics['nocontexttopics'])
 
-            # Write header
-            writer.writerow(self.headers)
+            return row
 
-            for record in self.records_to_predict:
-                row = []
-                for header in basic_headers:
-                    row.append(record[header])
+        def generate_train_rows():
+            for record in train_records:
+                yield build_row(
+                    record, record.get(Constants.CONTEXT_TOPICS_FIELD))
 
+        def generate_test_rows():
+            for record in records_to_predict:
+                context_topics = None
                 if Constants.USE_CONTEXT is True:
-                    important_record = record[Constants.REVIEW_ID_FIELD]
                     context_topics = \
-                        self.context_topics_map[important_record]
-                    for topic in self.context_rich_topics:
-                        row.append(context_topics['topic' + str(topic[0])])
+                        context_topics_map[record[Constants.REVIEW_ID_FIELD]]
+                yield build_row(record, context_topics)
 
-                    if Constants.USE_NO_CONTEXT_TOPICS_SUM:
-                        row.append(context_topics['nocontexttopics'])
+        print('num_cols', len(self.headers))
 
-                writer.writerow(row)
+        return [generate_train_rows, generate_test_rows]
 
+    def release_libfm_records(self):
+        self.train_records = None
         # self.records_to_predict = None
         self.context_topics_map = None
         self.context_rich_topics = None
         gc.collect()
 
-        print('Exported CSV and JSON files: %s'
-              % time.strftime("%Y/%m/%d-%H:%M:%S"))
-
-        csv_files = [
-            self.csv_train_file,
-            self.csv_test_file
-        ]
+    def prepare_records_for_libfm(self):
+        print('prepare_records_for_libfm: %s' %
+              time.strftime("%Y/%m/%d-%H:%M:%S"))
 
-        print('num_cols', len(self.headers))
+        row_sources = self.build_libfm_row_sources()
 
-        self.num_variables_in_model = libfm_converter.csv_to_libfm(
-            csv_files, 0, [1, 2], [], ',', has_header=True,
-            suffix='.libfm')
+        # The records are written straight into the libFM files, without
+        # going through the intermediate CSV files
+        self.num_variables_in_model, self.libfm_vector_map = \
+            libfm_converter.rows_to_libfm(
+                row_sources,
+                [self.context_train_file, self.context_test_file], 0, [1, 2])
 
         print('Exported LibFM files: %s' % time.strftime("%Y/%m/%d-%H:%M:%S"))
 
+    def prepare_records_for_numpyfm(self):
+        print('prepare_records_for_numpyfm: %s' %
+              time.strftime("%Y/%m/%d-%H:%M:%S"))
+
+        row_sources = self.build_libfm_row_sources()
+        self.fm_matrices, self.num_variables_in_model, \
+            self.libfm_vector_map = libfm_converter.rows_to_csr_matrices(
+                row_sources, 0, [1, 2])
+
+    def build_design_matrices(self, solvers):
+        """
+        Builds the design matrix of the factorization machines of each of the
+        given solvers, and then releases the records they are built from. The
+        design matrices are kept until the fold is cleared, so several
+        factorization machines can be trained on them
+
+        :param solvers: the solvers that are going to be used in this fold
+        """
+        for solver in solvers:
+            if solver == Constants.LIBFM:
+                self.prepare_records_for_libfm()
+            elif solver == Constants.NUMPYFM:
+                self.prepare_records_for_numpyfm()
+
+        self.release_libfm_records()
+
+    def predict_numpyfm(self):
+        print('predict_numpyfm: %s' % time.strftime("%Y/%m/%d-%H:%M:%S"))
+
+        (x_train, y_train), (x_test, _) = self.fm_matrices
+
+        cache = artifact_cache.get_cache()
+        predictions_key = artifact_cache.build_key(
+            'numpyfm_predictions', FM_PROPERTIES,
+            list(x_train.shape), list(x_test.shape),
+            artifact_cache.hash_arrays(
+                x_train.data, x_train.indices, x_train.indptr, y_train,
+                x_test.data, x_test.indices, x_test.indptr))
+
+        self.predictions = cache.load(predictions_key)
+        if self.predictions is None:
+            factorization_machine = FactorizationMachine()
+            self.predictions = factorization_machine.fit_predict(
+                x_train, y_train, x_test)
+            cache.store(predictions_key, self.predictions)
+
     # def predict_fastfm(self):
     #
     #     if Constants.USE_CONTEXT:
@@ -511,21 +621,43 @@ class ContextTopNRunner(object):
     def predict_libfm(self):
         print('predict: %s' % time.strftime("%Y/%m/%d-%H:%M:%S"))
 
-        run_libfm(
-            self.context_train_file, self.context_test_file,
-            self.context_predictions_file, self.context_log_file,
-            self.libfm_model_file
-        )
-        self.predictions = rmse_calculator.read_targets_from_txt(
-            self.context_predictions_file)
-
-    def predict(self):
+        # The predictions are cached by the content of the libFM files
+        cache = artifact_cache.get_cache()
+        predictions_key = artifact_cache.build_key(
+            'libfm_predictions', FM_PROPERTIES,
+            artifact_cache.hash_file(self.context_train_file),
+            artifact_cache.hash_file(self.context_test_file))
+
+        self.predictions = cache.load_with(
+            predictions_key, rmse_calculator.read_targets_from_txt, '.txt')
+        if self.predictions is None:
+            run_libfm(
+                self.context_train_file, self.context_test_file,
+                self.context_predictions_file, self.context_log_file,
+                self.libfm_model_file
+            )
+            cache.store_file(
+                predictions_key, self.context_predictions_file, '.txt')
+            self.predictions = rmse_calculator.read_targets_from_txt(
+                self.context_predictions_file)
+
+    def fit_predict(self):
+        """
+        Trains the factorization machine of Constants.SOLVER on the design
+        matrix that was built for it, and predicts the ratings of the records
+        to predict
+        """
         if Constants.SOLVER == Constants.LIBFM:
-            self.prepare_records_for_libfm()
             self.predict_libfm()
+        elif Constants.SOLVER == Constants.NUMPYFM:
+            self.predict_numpyfm()
         # elif Constants.SOLVER == Constants.FASTFM:
         #     self.predict_fastfm()
 
+    def predict(self):
+        self.build_design_matrices([Constants.SOLVER])
+        self.fit_predict()
+
     def evaluate_topn(self):
         print('evaluate_topn: %s' % time.strftime("%Y/%m/%d-%H:%M:%S"))
 
@@ -639,67 +771,199 @@ class ContextTopNRunner(object):
         else:
             raise ValueError('Unrecognized evaluation metric')
 
-    def perform_cross_validation(self, records):
+    def prepare_fold(self, fold_view, cycle_index, fold_index):
+        """
+        Runs the stages of a fold of the cross-validation that come before the
+        factorization machines: splits the records, selects the records to
+        predict, and trains the topic model and finds the context topics of
+        the records when the context is used
+
+        :type fold_view: FoldView
+        :param fold_view: the records of the cycle, in the order in which they
+        are split
+        :param cycle_index: the index of the cross-validation cycle
+        :param fold_index: the index of the fold
+        """
+        num_folds = Constants.CROSS_VALIDATION_NUM_FOLDS
+        split = 1 - (1/float(num_folds))
+        cv_start = float(fold_index) / num_folds
 
-        Constants.print_properties()
+        self.create_tmp_file_names(cycle_index, fold_index)
+        self.records = fold_view.get_records()
+        self.train_records, self.test_records = \
+            fold_view.split_train_test(split=split, start=cv_start)
+        # subsample_size = int(len(self.train_records)*0.5)
+        # self.train_records = self.train_records[:subsample_size]
+        self.get_records_to_predict(True)
+        if Constants.USE_CONTEXT:
+            if Constants.SEPARATE_TOPIC_MODEL_RECSYS_REVIEWS:
+                self.load_cache_context_topics(None, None)
+            else:
+                context_extractor = self.train_topic_model(
+                    cycle_index, fold_index)
+                self.find_reviews_topics(
+                    context_extractor, cycle_index, fold_index)
+        else:
+            self.context_rich_topics = []
 
-        # self.plant_seeds()
+    def run_fold(self, fold_view, cycle_index, fold_index):
+        """
+        Trains and evaluates the recommender in a single fold of the
+        cross-validation
+
+        :type fold_view: FoldView
+        :param fold_view: the records of the cycle, in the order in which they
+        are split
+        :param cycle_index: the index of the cross-validation cycle
+        :param fold_index: the index of the fold
+        :return: a tuple with the metrics of the fold and the time it took
+        """
+        num_folds = Constants.CROSS_VALIDATION_NUM_FOLDS
+
+        fold_start = time.time()
+        print('\nFold: %d/%d' % ((fold_index+1), num_folds))
+
+        self.prepare_fold(fold_view, cycle_index, fold_index)
+        self.predict()
+        metrics = self.evaluate()
+
+        fold_end = time.time()
+        fold_time = fold_end - fold_start
+        self.clear()
+        print("Total fold %d time = %f seconds" % ((fold_index+1), fold_time))
+
+        return metrics, fold_time
+
+    def run_fold_tests(self, fold_view, cycle_index, fold_index,
+                       tests_properties):
+        """
+        Trains and evaluates the recommender of several tests in a single fold
+        of the cross-validation. The tests must only differ in the properties
+        of the factorization machines (see FM_PROPERTIES), so the records, the
+        topic model, the context topics and the design matrices of the fold
+        are built once and shared by all of them
+
+        :type fold_view: FoldView
+        :param fold_view: the records of the cycle, in the order in which they
+        are split
+        :param cycle_index: the index of the cross-validation cycle
+        :param fold_index: the index of the fold
+        :param tests_properties: the full set of properties of each test
+        :return: a list with a tuple with the metrics of the fold and the time
+        it took for each test. The time of the shared stages is added to the
+        time of every test, so it can be compared with the one of run_fold
+        """
+        Constants.update_properties(tests_properties[0])
+        num_folds = Constants.CROSS_VALIDATION_NUM_FOLDS
+
+        fold_start = time.time()
+        print('\nFold: %d/%d' % ((fold_index+1), num_folds))
+
+        self.prepare_fold(fold_view, cycle_index, fold_index)
+        solvers = sorted(set(
+            properties['solver'] for properties in tests_properties))
+        self.build_design_matrices(solvers)
+        shared_time = time.time() - fold_start
+
+        fold_results = []
+        for properties in tests_properties:
+            Constants.update_properties(properties)
+            test_start = time.time()
+            self.fit_predict()
+            metrics = self.evaluate()
+            fold_time = shared_time + time.time() - test_start
+            fold_results.append((metrics, fold_time))
+
+        self.clear()
+        print('Total fold %d time = %f seconds' %
+              ((fold_index+1), time.time() - fold_start))
+
+        return fold_results
+
+    def create_fold_views(self, records):
+        """
+        Creates the fold view of each cycle of the cross-validation, shuffling
+        the records of each cycle when Constants.SHUFFLE_DATA is set
+
+        :param records: the records used in the cross-validation
+        :return: a list with a FoldView per cycle
+        """
+        fold_views = []
+        for i in range(Constants.NUM_CYCLES):
+            fold_view = FoldView(records)
+            if Constants.SHUFFLE_DATA:
+                self.shuffle(fold_view)
+            fold_views.append(fold_view)
+
+        return fold_views
+
+    def cross_validate(self, records, fold_callback=None):
+        """
+        Runs all the folds of all the cycles of the cross-validation. The
+        records are shuffled once per cycle before any fold is run, and then
+        the folds are run in a pool of Constants.NUM_CORES processes, or one
+        after another if there is only one core or if this is already a worker
+        process. The workers are forked, so they share the records with this
+        process instead of receiving a copy of them
+
+        :param records: the records used in the cross-validation
+        :param fold_callback: a function that is called with the list of the
+        metrics of the folds run so far after each fold, and returns True if
+        the rest of the folds should not be run. It is only called when the
+        folds are run one after another, as they are in a worker process
+        :return: a tuple with the list of the metrics of each fold, in the
+        same order as in a serial run, and the sum of the time of the folds
+        """
+        global _fold_views
 
-        metrics_list = []
-        total_cycle_time = 0.0
         num_cycles = Constants.NUM_CYCLES
         num_folds = Constants.CROSS_VALIDATION_NUM_FOLDS
-        total_iterations = num_cycles * num_folds
-        split = 1 - (1/float(num_folds))
         metric_name = Constants.EVALUATION_METRIC
 
-        # self.load()
+        fold_views = self.create_fold_views(records)
+        folds = [(i, j) for i in range(num_cycles) for j in range(num_folds)]
+        num_processes = utilities.get_num_processes(len(folds))
+
+        if num_processes > 1:
+            _fold_views = fold_views
+            pool = multiprocessing.Pool(num_processes)
+            fold_results = pool.map(run_fold_wrapper, folds)
+            pool.close()
+            pool.join()
+            _fold_views = None
+        else:
+            fold_results = []
+            for i, j in folds:
+                if j == 0:
+                    print('\n\nCycle: %d/%d' % ((i+1), num_cycles))
+                fold_results.append(self.run_fold(fold_views[i], i, j))
+                print('Accumulated %s: %f' % (metric_name, numpy.mean(
+                    [metrics[metric_name] for metrics, _ in fold_results])))
+                if fold_callback is not None and fold_callback(
+                        [metrics for metrics, _ in fold_results]):
+                    break
+
+        metrics_list = [metrics for metrics, _ in fold_results]
+        total_cycle_time = sum(fold_time for _, fold_time in fold_results)
+
+        return metrics_list, total_cycle_time
+
+    def perform_cross_validation(self, records):
+
+        Constants.print_properties()
 
-        for i in range(num_cycles):
+        # self.plant_seeds()
 
-            print('\n\nCycle: %d/%d' % ((i+1), num_cycles))
+        metrics_list, total_cycle_time = self.cross_validate(records)
 
-            self.records = copy.deepcopy(records)
-            if Constants.SHUFFLE_DATA:
-                self.shuffle(self.records)
-
-            for j in range(num_folds):
-
-                fold_start = time.time()
-                cv_start = float(j) / num_folds
-                print('\nFold: %d/%d' % ((j+1), num_folds))
-
-                self.create_tmp_file_names(i, j)
-                self.train_records, self.test_records = \
-                    ETLUtils.split_train_test_copy(
-                        self.records, split=split, start=cv_start)
-                # subsample_size = int(len(self.train_records)*0.5)
-                # self.train_records = self.train_records[:subsample_size]
-                self.get_records_to_predict(True)
-                if Constants.USE_CONTEXT:
-                    if Constants.SEPARATE_TOPIC_MODEL_RECSYS_REVIEWS:
-                        self.load_cache_context_topics(None, None)
-                    else:
-                        context_extractor = self.train_topic_model(i, j)
-                        self.find_reviews_topics(context_extractor, i, j)
-                else:
-                    self.context_rich_topics = []
-                self.predict()
-                metrics = self.evaluate()
-
-                metrics_list.append(metrics)
-                print('Accumulated %s: %f' % (metric_name,
-                    numpy.mean([k[metric_name] for k in metrics_list])))
-
-                fold_end = time.time()
-                fold_time = fold_end - fold_start
-                total_cycle_time += fold_time
-                self.clear()
-                print("Total fold %d time = %f seconds" % ((j+1), fold_time))
-
-        results = self.summarize_results(metrics_list)
-
-        average_cycle_time = total_cycle_time / total_iterations
+        return self.summarize_cross_validation(metrics_list, total_cycle_time)
+
+    @staticmethod
+    def summarize_cross_validation(metrics_list, total_cycle_time):
+
+        results = ContextTopNRunner.summarize_results(metrics_list)
+
+        average_cycle_time = total_cycle_time / len(metrics_list)
         results['cycle_time'] = average_cycle_time
         print('average cycle time: %f' % average_cycle_time)
 
@@ -767,47 +1031,15 @@ class ContextTopNRunner(object):
         utilities.plant_seeds()
         self.load()
 
-        records = self.original_records
-
-        # self.plant_seeds()
-        total_cycle_time = 0.0
-        num_folds = Constants.CROSS_VALIDATION_NUM_FOLDS
-        split = 1 - (1 / float(num_folds))
-        self.records = copy.deepcopy(records)
+        fold_view = FoldView(self.original_records)
         if Constants.SHUFFLE_DATA:
-            self.shuffle(self.records)
-
-        fold_start = time.time()
-        cv_start = float(fold) / num_folds
-        print('\nFold: %d/%d' % ((fold + 1), num_folds))
+            self.shuffle(fold_view)
 
-        self.create_tmp_file_names(0, fold)
-        self.train_records, self.test_records = \
-            ETLUtils.split_train_test_copy(
-                self.records, split=split, start=cv_start)
-        # subsample_size = int(len(self.train_records)*0.5)
-        # self.train_records = self.train_records[:subsample_size]
-        self.get_records_to_predict(True)
-        if Constants.USE_CONTEXT:
-            if Constants.SEPARATE_TOPIC_MODEL_RECSYS_REVIEWS:
-                self.load_cache_context_topics(None, None)
-            else:
-                context_extractor = self.train_topic_model(0, fold)
-                self.find_reviews_topics(context_extractor, 0, fold)
-        else:
-            self.context_rich_topics = []
-        self.predict()
-        metrics = self.evaluate()
-
-        fold_end = time.time()
-        fold_time = fold_end - fold_start
-        total_cycle_time += fold_time
-        self.clear()
-        print("Total fold %d time = %f seconds" % ((fold + 1), fold_time))
+        metrics, _ = self.run_fold(fold_view, 0, fold)
 
         return metrics
 
-    def run(self):
+    def load_cross_validation_records(self):
 
         utilities.plant_seeds()
         self.load()
@@ -822,29 +1054,209 @@ class ContextTopNRunner(object):
             print('cv_start', cv_start)
             records, _ = ETLUtils.split_train_test(
                 self.original_records, split, cv_start)
-            return self.perform_cross_validation(records)
+            return records
         elif Constants.CROSS_VALIDATION_STRATEGY == 'nested_test':
-            return self.perform_cross_validation(records)
+            return records
         else:
             raise ValueError('Unknown cross-validation strategy')
 
+    def run(self):
+
+        records = self.load_cross_validation_records()
+        return self.perform_cross_validation(records)
+
+
+# The records of each cycle, shared with the forked fold workers
+_fold_views = None
+
+
+def run_fold_wrapper(fold):
+    cycle_index, fold_index = fold
+    context_top_n_runner = ContextTopNRunner()
+    return context_top_n_runner.run_fold(
+        _fold_views[cycle_index], cycle_index, fold_index)
+
+
+# The tests of the parameter grid that share all the stages that come before
+# the factorization machines, and the records of each cycle of each group of
+# tests, shared with the forked grid workers
+_grid_groups = None
+_grid_fold_views = None
+
+
+def get_shared_stages_key(properties):
+    """
+    Returns a key that identifies the stages of a test that come before the
+    factorization machines (records, folds, topic model, context topics and
+    design matrices). Two tests with the same key only differ in the
+    properties of their factorization machines
+
+    :param properties: the full set of properties of a test
+    :return: a string with the key
+    """
+    return repr(sorted(
+        (name, value) for name, value in properties.items()
+        if name not in FM_PROPERTIES))
+
+
+def get_fold_views_key():
+    """
+    Returns a key that identifies the records and the folds of the
+    cross-validation of the current properties, which only depend on the
+    records file, the random seeds and on how the records are split
+
+    :return: a tuple with the key
+    """
+    if Constants.SEPARATE_TOPIC_MODEL_RECSYS_REVIEWS:
+        records_file = Constants.RECSYS_CONTEXTUAL_PROCESSED_RECORDS_FILE
+    else:
+        records_file = Constants.PROCESSED_RECORDS_FILE
+
+    return (
+        records_file,
+        Constants.CROSS_VALIDATION_STRATEGY,
+        Constants.NESTED_CROSS_VALIDATION_CYCLE,
+        Constants.CROSS_VALIDATION_NUM_FOLDS,
+        Constants.NUM_CYCLES,
+        Constants.SHUFFLE_DATA,
+        Constants.RANDOM_SEED,
+        Constants.NUMPY_RANDOM_SEED
+    )
+
+
+def run_grid_fold_wrapper(task):
+    group_index, cycle_index, fold_index = task
+    context_top_n_runner = ContextTopNRunner()
+    return context_top_n_runner.run_fold_tests(
+        _grid_fold_views[group_index][cycle_index], cycle_index, fold_index,
+        _grid_groups[group_index])
+
+
+def run_parameter_grid(tests_properties):
+    """
+    Runs the cross-validation of every test of a parameter grid, sharing the
+    stages of the pipeline between the tests that have the same inputs.
+
+    The tests are grouped by all the properties that don't belong to the
+    factorization machines, and every fold of a group builds its records,
+    topic model, context topics and design matrices once, before training and
+    evaluating the factorization machine of each test of the group. The
+    records and folds are loaded once for all the groups that use the same
+    ones. The folds of all the groups are independent, so they are run in a
+    pool of Constants.NUM_CORES processes, or one after another if there is
+    only one core. Every fold sets the properties of its own tests, so the
+    properties of a worker never leak from one fold into another
+
+    :param tests_properties: the full set of properties of each test
+    :return: a list with a tuple with the list of the metrics of each fold
+    and the sum of the time of the folds for each test, in the same order as
+    tests_properties
+    """
+    global _grid_groups
+    global _grid_fold_views
+
+    original_properties = Constants.get_properties_copy()
+
+    groups_map = {}
+    groups = []
+    group_test_indices = []
+    for test_index, properties in enumerate(tests_properties):
+        key = get_shared_stages_key(properties)
+        if key not in groups_map:
+            groups_map[key] = len(groups)
+            groups.append([])
+            group_test_indices.append([])
+        groups[groups_map[key]].append(properties)
+        group_test_indices[groups_map[key]].append(test_index)
+
+    print('Parameter grid: %d tests, %d groups of shared stages' %
+          (len(tests_properties), len(groups)))
+
+    fold_views_map = {}
+    groups_fold_views = []
+    tasks = []
+    for group_index, group in enumerate(groups):
+        Constants.update_properties(group[0])
+        fold_views_key = get_fold_views_key()
+        if fold_views_key not in fold_views_map:
+            context_top_n_runner = ContextTopNRunner()
+            records = context_top_n_runner.load_cross_validation_records()
+            fold_views_map[fold_views_key] = \
+                context_top_n_runner.create_fold_views(records)
+        groups_fold_views.append(fold_views_map[fold_views_key])
+        tasks.extend([
+            (group_index, i, j)
+            for i in range(Constants.NUM_CYCLES)
+            for j in range(Constants.CROSS_VALIDATION_NUM_FOLDS)
+        ])
+
+    Constants.update_properties(original_properties)
+    num_processes = utilities.get_num_processes(len(tasks))
+
+    if num_processes > 1:
+        _grid_groups = groups
+        _grid_fold_views = groups_fold_views
+        pool = multiprocessing.Pool(num_processes)
+        tasks_results = pool.map(run_grid_fold_wrapper, tasks)
+        pool.close()
+        pool.join()
+        _grid_groups = None
+        _grid_fold_views = None
+    else:
+        tasks_results = []
+        for group_index, i, j in tasks:
+            if j == 0:
+                print('\n\nCycle: %d/%d' % ((i+1), len(
+                    groups_fold_views[group_index])))
+            context_top_n_runner = ContextTopNRunner()
+            tasks_results.append(context_top_n_runner.run_fold_tests(
+                groups_fold_views[group_index][i], i, j, groups[group_index]))
+
+    Constants.update_properties(original_properties)
+
+    folds_results = [[] for _ in tests_properties]
+    for (group_index, _, _), fold_results in zip(tasks, tasks_results):
+        for test_index, fold_result in zip(
+                group_test_indices[group_index], fold_results):
+            folds_results[test_index].append(fold_result)
+
+    tests_results = []
+    for test_folds_results in folds_results:
+        metrics_list = [metrics for metrics, _ in test_folds_results]
+        total_cycle_time = sum(
+            fold_time for _, fold_time in test_folds_results)
+        tests_results.append((metrics_list, total_cycle_time))
+
+    return tests_results
+
 
 def run_tests():
 
     combined_parameters = parameter_combinator.get_combined_parameters()
 
-    test_cycle = 1
     num_tests = len(combined_parameters)
-    highest_value = -1
-    best_parameters = None
+
+    # The properties of each test are applied on top of the ones of the
+    # previous test, so the full set of properties of each test is kept
+    tests_properties = []
     for properties in combined_parameters:
         Constants.update_properties(properties)
-        context_top_n_runner = ContextTopNRunner()
+        tests_properties.append(Constants.get_properties_copy())
+
+    tests_results = run_parameter_grid(tests_properties)
+
+    test_cycle = 1
+    highest_value = -1
+    best_parameters = None
+    for test_index, properties in enumerate(combined_parameters):
+        Constants.update_properties(tests_properties[test_index])
 
         print('\n\n******************\nTest %d/%d\n******************\n' %
               (test_cycle, num_tests))
+        Constants.print_properties()
 
-        results = context_top_n_runner.run()
+        results = ContextTopNRunner.summarize_cross_validation(
+            *tests_results[test_index])
         if results[Constants.EVALUATION_METRIC] > highest_value:
             highest_value = results[Constants.EVALUATION_METRIC]
             best_parameters = properties
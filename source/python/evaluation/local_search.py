@@ -0,0 +1,169 @@
+import multiprocessing
+import time
+import traceback
+
+import numpy
+from hyperopt import base
+from hyperopt import space_eval
+from hyperopt import JOB_STATE_DONE
+from hyperopt import JOB_STATE_ERROR
+from hyperopt import STATUS_FAIL
+from hyperopt import Trials
+
+from evaluation import trials_store
+from evaluation.trials_store import Trial
+
+__author__ = 'fpena'
+
+
+# The number of seconds the search waits between checks of the running trials
+POLL_INTERVAL = 1
+
+
+def load_trials(store, domain):
+    """
+    Loads the trials of the store that have finished into a hyperopt Trials
+    object, so a search that was stopped continues where it left off
+
+    :type store: TrialsStore
+    :param store: the store of the trials
+    :type domain: base.Domain
+    :param domain: the domain of the search
+    :return: the hyperopt Trials with the finished trials
+    """
+    trials = Trials()
+    finished_trials = store.get_trials([trials_store.OK, trials_store.PRUNED])
+
+    for finished_trial in finished_trials:
+        tid = trials.new_trial_ids(1)[0]
+        vals = finished_trial['vals']
+        misc = {
+            'tid': tid,
+            'cmd': domain.cmd,
+            'workdir': domain.workdir,
+            'idxs': {
+                label: [tid] if values else []
+                for label, values in vals.items()
+            },
+            'vals': vals
+        }
+        docs = trials.new_trial_docs(
+            [tid], [None], [finished_trial['result']], [misc])
+        docs[0]['state'] = JOB_STATE_DONE
+        trials.insert_trial_docs(docs)
+
+    trials.refresh()
+    print('Loaded %d finished trials' % len(finished_trials))
+
+    return trials
+
+
+def suggest_trial(algo, domain, trials, random_state):
+    """
+    Asks the search algorithm for the next trial and adds it to the trials
+
+    :return: the document of the new trial
+    """
+    new_ids = trials.new_trial_ids(1)
+    trials.refresh()
+    docs = algo(new_ids, domain, trials, random_state.randint(2 ** 31 - 1))
+    trials.insert_trial_docs(docs)
+    trials.refresh()
+
+    # The trials keep a copy of the inserted documents, which is the one that
+    # has to be updated when the trial finishes
+    return [doc for doc in trials.trials if doc['tid'] == new_ids[0]][0]
+
+
+def run_trial_wrapper(fn, store, trial_id, pruner, args):
+    trial = Trial(store, trial_id, pruner)
+    try:
+        result = fn(args, trial)
+    except Exception:
+        traceback.print_exc()
+        result = {'status': STATUS_FAIL}
+        store.finish_trial(trial_id, trials_store.FAIL, result)
+        return result
+
+    state = trials_store.PRUNED if trial.pruned else trials_store.OK
+    store.finish_trial(trial_id, state, result)
+
+    return result
+
+
+def fmin(fn, space, algo, max_evals, store, num_workers=1, pruner=None,
+         seed=None):
+    """
+    Minimizes a function over a hyperopt search space with a pool of local
+    worker processes, without a database server. The trials are kept in the
+    given store, so several searches can share it and a search can be resumed,
+    and the trials that were already finished count towards max_evals.
+
+    The workers are forked when the search starts and are kept until it
+    finishes, so anything the function loads in a worker, or that was loaded
+    before the search started, is reused by all the trials of that worker.
+
+    :param fn: the function that is minimized. It receives the arguments of
+    the trial and a trials_store.Trial, through which it can report the loss
+    of each fold and find out if the trial has to stop. It returns a hyperopt
+    result dictionary, with the loss in result['loss']. It must be defined at
+    the top level of a module so it can be sent to the workers
+    :param space: the hyperopt search space
+    :param algo: the hyperopt search algorithm, such as tpe.suggest
+    :param max_evals: the number of trials of the search
+    :type store: TrialsStore
+    :param store: the store of the trials
+    :param num_workers: the number of worker processes
+    :type pruner: MedianPruner
+    :param pruner: the pruner that stops the trials that are doing worse than
+    the rest, or None if all the trials are run to the end
+    :param seed: the seed of the search algorithm
+    :return: the hyperopt Trials with all the trials of the search
+    """
+    domain = base.Domain(fn, space)
+    trials = load_trials(store, domain)
+    random_state = numpy.random.RandomState(seed)
+
+    num_trials = len(trials.trials)
+    running_trials = []
+    pool = multiprocessing.Pool(num_workers)
+
+    while num_trials < max_evals or running_trials:
+        while len(running_trials) < num_workers and num_trials < max_evals:
+            doc = suggest_trial(algo, domain, trials, random_state)
+            vals = doc['misc']['vals']
+            args = space_eval(space, {
+                label: values[0] for label, values in vals.items() if values
+            })
+            trial_id = store.create_trial(args, vals)
+            async_result = pool.apply_async(
+                run_trial_wrapper, (fn, store, trial_id, pruner, args))
+            running_trials.append((doc, async_result))
+            num_trials += 1
+
+        finished_trials = []
+        unfinished_trials = []
+        for doc, async_result in running_trials:
+            if async_result.ready():
+                finished_trials.append((doc, async_result))
+            else:
+                unfinished_trials.append((doc, async_result))
+        running_trials = unfinished_trials
+
+        if not finished_trials:
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        for doc, async_result in finished_trials:
+            result = async_result.get()
+            doc['result'] = result
+            if result['status'] == STATUS_FAIL:
+                doc['state'] = JOB_STATE_ERROR
+            else:
+                doc['state'] = JOB_STATE_DONE
+        trials.refresh()
+
+    pool.close()
+    pool.join()
+
+    return trials
@@ -2,6 +2,7 @@ import operator
 from random import shuffle
 import time
 from etl import ETLUtils
+from recommenders import batch_prediction
 from topicmodeling.context import reviews_clusterer
 from tripadvisor.fourcity import extractor
 
@@ -51,10 +52,9 @@ def calculate_recommender_precision(
     known_ratings = extractor.get_user_item_ratings(test_data, user_id, True)
     items = known_ratings.keys()
 
-    predicted_ratings = {}
-
-    for item in items:
-        predicted_ratings[item] = recommender.predict_rating(user_id, item)
+    predictions = batch_prediction.to_optional_list(
+        recommender.predict_many([user_id] * len(items), items))
+    predicted_ratings = dict(zip(items, predictions))
 
     return calculate_precision(known_ratings, predicted_ratings, n, min_score)
 
@@ -174,24 +174,20 @@ def calculate_is_a_hit(reviews, recommender, user_id, liked_item, n, text_review
     # unknown_items.append(liked_item)
     # all_items = unknown_items[:]
 
-    if not recommender.has_context:
-        desired_prediction =\
-            recommender.predict_rating(user_id, liked_item)
-    else:
-        desired_prediction =\
-            recommender.predict_rating(user_id, liked_item, text_review)
+    # All the items are predicted in a single batch, so the recommender
+    # computes the neighbours and the baseline of the user only once
+    items = [liked_item] + unknown_items
+    text_reviews = None
+    if recommender.has_context:
+        text_reviews = [text_review] * len(items)
+    predictions = batch_prediction.to_optional_list(recommender.predict_many(
+        [user_id] * len(items), items, text_reviews))
 
-    if desired_prediction is None:
+    if predictions[0] is None:
         return None
 
-    predicted_ratings = {liked_item: desired_prediction}
-
-    for item in unknown_items:
-        if not recommender.has_context:
-            predicted_ratings[item] = recommender.predict_rating(user_id, item)
-        else:
-            predicted_ratings[item] =\
-                recommender.predict_rating(user_id, item, text_review)
+    predicted_ratings = dict(zip(items[1:], predictions[1:]))
+    predicted_ratings[liked_item] = predictions[0]
 
     return is_a_hit(liked_item, predicted_ratings, n)
 
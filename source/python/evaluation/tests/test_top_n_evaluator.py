@@ -1,4 +1,7 @@
 from unittest import TestCase
+
+import numpy
+
 from evaluation.top_n_evaluator import TopNEvaluator
 
 __author__ = 'fpena'
@@ -181,4 +184,70 @@ class TestTopNEvaluator(TestCase):
         item = 'I4'
         top_n_evaluator.update_num_hits(top_n_list, item)
 
-        self.assertEqual(2.0 / 3, top_n_evaluator.calculate_recall())
\ No newline at end of file
+        self.assertEqual(2.0 / 3, top_n_evaluator.calculate_recall())
+
+    def test_sample_irrelevant_items(self):
+        top_n_evaluator = TopNEvaluator(ratings, [], 'hotel')
+        top_n_evaluator.initialize()
+
+        numpy.random.seed(0)
+        user_items = top_n_evaluator.user_item_map['U1']
+        unrated_items = set(top_n_evaluator.item_ids).difference(user_items)
+
+        for num_items in range(1, 9):
+            actual_items = \
+                top_n_evaluator.sample_irrelevant_items('U1', num_items)
+            self.assertEqual(min(num_items, 7), len(actual_items))
+            self.assertEqual(len(actual_items), len(set(actual_items)))
+            self.assertTrue(set(actual_items).issubset(unrated_items))
+
+        # The bitmap is cleared after each sample
+        self.assertFalse(top_n_evaluator.excluded_items.any())
+
+    def test_evaluate(self):
+        num_items = 6
+        evaluator_test_set = [
+            {'review_id': 'R1', 'user_id': 'U1', 'business_id': 'I6',
+             'stars': 5.0, 'predicted_class': 'specific', 'has_context': True},
+            {'review_id': 'R2', 'user_id': 'U2', 'business_id': 'I11',
+             'stars': 5.0, 'predicted_class': 'generic', 'has_context': True},
+            {'review_id': 'R3', 'user_id': 'U3', 'business_id': 'I14',
+             'stars': 5.0, 'predicted_class': 'generic', 'has_context': False},
+        ]
+        top_n_evaluator = TopNEvaluator(
+            ratings, evaluator_test_set, 'hotel', N=2, I=num_items)
+        top_n_evaluator.initialize()
+        top_n_evaluator.get_records_to_predict()
+
+        # The relevant item is the last one of each record, the first record
+        # is a hit, the second one is not and the third one is
+        predictions = [
+            1., 2., 3., 4., 5., 6., 5.5,
+            6., 5., 4., 3., 2., 1., 4.5,
+            1., 1., 1., 1., 1., 1., 2.,
+        ]
+        top_n_evaluator.evaluate(predictions)
+
+        self.assertEqual(2, top_n_evaluator.num_hits)
+        self.assertEqual(1, top_n_evaluator.num_misses)
+        self.assertEqual(2.0 / 3, top_n_evaluator.recall)
+        self.assertEqual(1.0, top_n_evaluator.specific_recall)
+        self.assertEqual(0.5, top_n_evaluator.generic_recall)
+        self.assertEqual(0.5, top_n_evaluator.has_context_recall)
+        self.assertEqual(1.0, top_n_evaluator.has_no_context_recall)
+        self.assertEqual(1.0 / 3, top_n_evaluator.precision)
+
+    def test_find_hits(self):
+        numpy.random.seed(0)
+        predictions_matrix = numpy.random.rand(50, 20)
+
+        for n in [1, 5, 10, 20]:
+            expected_hits = []
+            for row in predictions_matrix:
+                rating_map = dict(enumerate(row))
+                top_n_list = TopNEvaluator.create_top_n_list(rating_map, n)
+                expected_hits.append(19 in top_n_list)
+
+            self.assertSequenceEqual(
+                expected_hits,
+                list(TopNEvaluator.find_hits(predictions_matrix, n)))
@@ -0,0 +1,137 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy
+
+from evaluation import trials_store
+from evaluation.trials_store import MedianPruner
+from evaluation.trials_store import Trial
+from evaluation.trials_store import TrialsStore
+
+__author__ = 'fpena'
+
+
+class TestTrialsStore(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.folder, 'trials.db')
+        self.store = TrialsStore(self.file_path, 'experiment')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_finish_trial(self):
+        trial_id = self.store.create_trial(
+            {'fm_num_factors': numpy.float64(8.0)},
+            {'fm_num_factors': [numpy.float64(8.0)]})
+        trial = self.store.get_trials()[0]
+        self.assertEqual(trial_id, trial['trial_id'])
+        self.assertEqual(trials_store.RUNNING, trial['state'])
+        self.assertEqual({'fm_num_factors': 8.0}, trial['parameters'])
+        self.assertEqual({'fm_num_factors': [8.0]}, trial['vals'])
+        self.assertIsNone(self.store.get_best_trial())
+
+        self.store.finish_trial(
+            trial_id, trials_store.OK, {'loss': -0.25, 'status': 'ok'})
+        trial = self.store.get_best_trial()
+        self.assertEqual(trials_store.OK, trial['state'])
+        self.assertEqual(-0.25, trial['loss'])
+        self.assertEqual({'loss': -0.25, 'status': 'ok'}, trial['result'])
+
+    def test_get_trials(self):
+        first_id = self.store.create_trial({'a': 1})
+        second_id = self.store.create_trial({'a': 2})
+        third_id = self.store.create_trial({'a': 3})
+        self.store.finish_trial(first_id, trials_store.OK, {'loss': 2.0})
+        self.store.finish_trial(second_id, trials_store.PRUNED, {'loss': 1.0})
+        self.store.finish_trial(third_id, trials_store.OK, {'loss': 3.0})
+
+        other_store = TrialsStore(self.file_path, 'other_experiment')
+        other_store.create_trial({'a': 4})
+
+        self.assertEqual(
+            [first_id, second_id, third_id],
+            [trial['trial_id'] for trial in self.store.get_trials()])
+        self.assertEqual(
+            [first_id, third_id],
+            [trial['trial_id']
+             for trial in self.store.get_trials([trials_store.OK])])
+        # Pruned trials are never the best ones
+        self.assertEqual(first_id, self.store.get_best_trial()['trial_id'])
+        self.assertEqual(1, len(other_store.get_trials()))
+
+    def test_get_fold_losses(self):
+        first_id = self.store.create_trial({'a': 1})
+        second_id = self.store.create_trial({'a': 2})
+        failed_id = self.store.create_trial({'a': 3})
+        self.store.report_fold(first_id, 0, 1.0)
+        self.store.report_fold(first_id, 1, 2.0)
+        self.store.report_fold(second_id, 0, 3.0)
+        self.store.report_fold(failed_id, 0, 4.0)
+        self.store.finish_trial(failed_id, trials_store.FAIL, {})
+
+        self.assertEqual(
+            {first_id: [1.0], second_id: [3.0]},
+            self.store.get_fold_losses(1))
+        self.assertEqual(
+            {first_id: [1.0, 2.0]}, self.store.get_fold_losses(2))
+        self.assertEqual({}, self.store.get_fold_losses(3))
+
+
+class TestMedianPruner(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.store = TrialsStore(
+            os.path.join(self.folder, 'trials.db'), 'experiment')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_should_prune(self):
+        pruner = MedianPruner(min_trials=3)
+
+        for loss in [1.0, 2.0, 3.0]:
+            trial_id = self.store.create_trial({})
+            self.store.report_fold(trial_id, 0, loss)
+            self.store.report_fold(trial_id, 1, loss)
+
+        good_trial = Trial(self.store, self.store.create_trial({}), pruner)
+        bad_trial = Trial(self.store, self.store.create_trial({}), pruner)
+        self.assertFalse(good_trial.should_prune(0, 1.5))
+        self.assertTrue(bad_trial.should_prune(0, 2.5))
+        self.assertTrue(bad_trial.pruned)
+
+        # The mean loss of the folds is compared, not the loss of the last one
+        self.assertFalse(good_trial.should_prune(1, 2.4))
+        self.assertFalse(good_trial.pruned)
+
+    def test_min_trials(self):
+        pruner = MedianPruner(min_trials=3)
+
+        for loss in [1.0, 2.0]:
+            trial_id = self.store.create_trial({})
+            self.store.report_fold(trial_id, 0, loss)
+
+        trial = Trial(self.store, self.store.create_trial({}), pruner)
+        self.assertFalse(trial.should_prune(0, 5.0))
+
+    def test_min_folds(self):
+        pruner = MedianPruner(min_trials=1, min_folds=2)
+
+        trial_id = self.store.create_trial({})
+        self.store.report_fold(trial_id, 0, 1.0)
+        self.store.report_fold(trial_id, 1, 1.0)
+
+        trial = Trial(self.store, self.store.create_trial({}), pruner)
+        self.assertFalse(trial.should_prune(0, 5.0))
+        self.assertTrue(trial.should_prune(1, 5.0))
+
+    def test_no_pruner(self):
+        trial_id = self.store.create_trial({})
+        trial = Trial(self.store, trial_id)
+        self.assertFalse(trial.should_prune(0, 5.0))
+        self.assertEqual({trial_id: [5.0]}, self.store.get_fold_losses(1))
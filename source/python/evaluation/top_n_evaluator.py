@@ -58,6 +58,9 @@ class TopNEvaluator:
         self.items_to_predict = None
         self.records_to_predict = None
         self.user_item_map = None
+        self.item_index_map = None
+        self.user_item_indices = None
+        self.excluded_items = None
 
     def initialize(self):
         self.user_ids =\
@@ -67,6 +70,10 @@ class TopNEvaluator:
         print('total users', len(self.user_ids))
         print('total items', len(self.item_ids))
         self.user_item_map = self.create_user_item_map()
+        self.item_index_map = {
+            item_id: index for index, item_id in enumerate(self.item_ids)}
+        self.user_item_indices = {}
+        self.excluded_items = numpy.zeros(len(self.item_ids), dtype=bool)
 
         self.find_important_records()
 
@@ -86,11 +93,64 @@ class TopNEvaluator:
 
         return user_item_map
 
+    def get_user_item_indices(self, user_id):
+        user_item_indices = self.user_item_indices.get(user_id)
+        if user_item_indices is None:
+            user_item_indices = numpy.array(
+                [self.item_index_map[item_id]
+                 for item_id in self.user_item_map[user_id]],
+                dtype=numpy.int64)
+            self.user_item_indices[user_id] = user_item_indices
+        return user_item_indices
+
     def get_irrelevant_items(self, user_id):
         user_items = self.user_item_map[user_id]
-        diff_items = list(set(self.item_ids).difference(user_items))
-        numpy.random.shuffle(diff_items)
-        return diff_items
+        return self.sample_irrelevant_items(
+            user_id, len(self.item_ids) - len(user_items))
+
+    def sample_irrelevant_items(self, user_id, num_items):
+        """
+        Returns a random sample of the items the given user hasn't rated, in
+        random order. The items are drawn uniformly and the ones the user has
+        rated are rejected by checking a bitmap of the user's items, so the
+        cost depends on the size of the sample instead of the total number of
+        items. When the sample is a large part of the unrated items, they are
+        shuffled instead
+
+        :param user_id: the ID of the user
+        :param num_items: the number of items to return. If the user hasn't
+        rated that many items, all the unrated items are returned
+        :return: a list with the IDs of the sampled items
+        """
+        user_item_indices = self.get_user_item_indices(user_id)
+        total_items = len(self.item_ids)
+        num_available = total_items - len(user_item_indices)
+        num_items = min(num_items, num_available)
+
+        self.excluded_items[user_item_indices] = True
+
+        if 2 * num_items > num_available:
+            sample = numpy.flatnonzero(~self.excluded_items)
+            numpy.random.shuffle(sample)
+            sample = sample[:num_items]
+        else:
+            sample = numpy.zeros(0, dtype=numpy.int64)
+            while len(sample) < num_items:
+                candidates = numpy.random.randint(
+                    0, total_items, 2 * (num_items - len(sample)))
+                candidates = candidates[~self.excluded_items[candidates]]
+                # Keep the first occurrence of every item, in order of
+                # appearance, so the sample stays in random order
+                _, first_indices = numpy.unique(
+                    numpy.concatenate([sample, candidates]),
+                    return_index=True)
+                sample = numpy.concatenate(
+                    [sample, candidates])[numpy.sort(first_indices)]
+            sample = sample[:num_items]
+
+        self.excluded_items[user_item_indices] = False
+
+        return [self.item_ids[index] for index in sample]
 
     def find_important_records(self):
         self.important_records = [
@@ -170,7 +230,7 @@ class TopNEvaluator:
             review_id = record[Constants.REVIEW_ID_FIELD]
             rating = record[Constants.RATING_FIELD]
             # return I many of items
-            irrelevant_items = self.get_irrelevant_items(user_id)[:self.I]
+            irrelevant_items = self.sample_irrelevant_items(user_id, self.I)
 
             if len(irrelevant_items) != self.I:
                 print('Irrelevant items size is',
@@ -220,36 +280,32 @@ class TopNEvaluator:
         print('I', self.I)
         assert len(predictions) == len(self.important_records) * (self.I + 1)
 
-        index = 0
-        self.num_hits = 0
-        self.num_misses = 0
-        self.num_specific_hits = 0
-        self.num_specific_misses = 0
-        self.num_generic_hits = 0
-        self.num_generic_misses = 0
-        self.num_has_context_hits = 0
-        self.num_has_context_misses = 0
-        self.num_has_no_context_hits = 0
-        self.num_has_no_context_misses = 0
-
-        for record in self.important_records:
-            user_id = record[Constants.USER_ID_FIELD]
-            item_id = record[Constants.ITEM_ID_FIELD]
-            user_item_key = str(user_id) + '|' + str(item_id)
-
-            item_rating_map = {}
-            irrelevant_items = self.items_to_predict[user_item_key]
-
-            assert len(irrelevant_items) == self.I + 1
-            for irrelevant_item in irrelevant_items:
-                rating = predictions[index]
-                item_rating_map[irrelevant_item] = rating
-
-                index += 1
-
-            top_n_list = self.create_top_n_list(item_rating_map, self.N)
-            # use this inf. for calculating PR
-            self.update_num_hits(top_n_list, record)
+        # Each row contains the predictions of the irrelevant items of a
+        # record, followed by the prediction of its relevant item
+        predictions_matrix = numpy.asarray(
+            predictions, dtype=numpy.float64).reshape(
+            len(self.important_records), self.I + 1)
+        hits = self.find_hits(predictions_matrix, self.N)
+
+        review_types = numpy.array([
+            record[Constants.PREDICTED_CLASS_FIELD]
+            for record in self.important_records])
+        has_context = numpy.array([
+            bool(record[Constants.HAS_CONTEXT_FIELD])
+            for record in self.important_records], dtype=bool)
+        specific = review_types == Constants.SPECIFIC
+        generic = review_types == Constants.GENERIC
+
+        self.num_hits = int(hits.sum())
+        self.num_misses = int((~hits).sum())
+        self.num_specific_hits = int((hits & specific).sum())
+        self.num_specific_misses = int((~hits & specific).sum())
+        self.num_generic_hits = int((hits & generic).sum())
+        self.num_generic_misses = int((~hits & generic).sum())
+        self.num_has_context_hits = int((hits & has_context).sum())
+        self.num_has_context_misses = int((~hits & has_context).sum())
+        self.num_has_no_context_hits = int((hits & ~has_context).sum())
+        self.num_has_no_context_misses = int((~hits & ~has_context).sum())
 
         self.calculate_precision()
         self.calculate_recall()
@@ -257,6 +313,28 @@ class TopNEvaluator:
         # print('precision', self.precision)
         # print('recall', self.recall)
 
+    @staticmethod
+    def find_hits(predictions_matrix, n):
+        """
+        Finds the rows of the given matrix in which the last column, the
+        relevant item, is among the n columns with the highest predictions.
+        As with a full sort, ties are resolved arbitrarily
+
+        :type predictions_matrix: numpy.ndarray
+        :param predictions_matrix: a matrix with the predictions of the items
+        of each record, where the relevant item is the last column
+        :param n: the size of the top-n lists
+        :rtype: numpy.ndarray
+        :return: a boolean array indicating if each row is a hit
+        """
+        num_rows, num_columns = predictions_matrix.shape
+        if n >= num_columns:
+            return numpy.ones(num_rows, dtype=bool)
+
+        top_n = numpy.argpartition(
+            -predictions_matrix, n - 1, axis=1)[:, :n]
+        return (top_n == num_columns - 1).any(axis=1)
+
 
 # start = time.time()
 # # main()
@@ -1,9 +1,18 @@
 import time
 
-from hyperopt import fmin
+import numpy
 from hyperopt import hp
 from hyperopt import tpe
-from hyperopt.mongoexp import MongoTrials
+
+from evaluation import local_search
+from evaluation.trials_store import MedianPruner
+from evaluation.trials_store import TrialsStore
+
+
+# The records of the cross-validation loaded in this process, by the key of
+# the records and folds they are used with, so they are loaded only once for
+# all the trials of a worker
+_records_cache = {}
 
 
 def fibonacci(n):
@@ -25,7 +34,21 @@ def fibonacci(n):
     return sequence
 
 
-def run_recommender(args):
+def get_cross_validation_records(context_top_n_runner):
+    from evaluation import context_top_n_runner as runner_module
+    from utils import utilities
+
+    key = runner_module.get_fold_views_key()
+    if key in _records_cache:
+        utilities.plant_seeds()
+    else:
+        _records_cache[key] = \
+            context_top_n_runner.load_cross_validation_records()
+
+    return _records_cache[key]
+
+
+def run_recommender(args, trial):
     import sys
     # sys.path.append('/Users/fpena/UCC/Thesis/projects/yelp/source/python')
     sys.path.append('/home/fpena/yelp/source/python')
@@ -53,8 +76,30 @@ def run_recommender(args):
     # Finish updating parameters
 
     my_context_top_n_runner = ContextTopNRunner()
-    results = my_context_top_n_runner.run()
-    results['loss'] = -results[Constants.EVALUATION_METRIC]
+    records = get_cross_validation_records(my_context_top_n_runner)
+    Constants.print_properties()
+
+    metric_name = Constants.EVALUATION_METRIC
+
+    def fold_callback(metrics_list):
+        loss = -metrics_list[-1][metric_name]
+        return trial.should_prune(len(metrics_list) - 1, loss)
+
+    metrics_list, total_cycle_time = my_context_top_n_runner.cross_validate(
+        records, fold_callback)
+
+    if trial.pruned:
+        # The results of the trials that were stopped early are not written
+        # to the results files, since they don't come from all the folds
+        results = {
+            metric_name: numpy.mean(
+                [metrics[metric_name] for metrics in metrics_list]),
+            'num_folds': len(metrics_list)
+        }
+    else:
+        results = ContextTopNRunner.summarize_cross_validation(
+            metrics_list, total_cycle_time)
+    results['loss'] = -results[metric_name]
     results['status'] = 'ok'
 
     print('loss', results['loss'])
@@ -64,18 +109,22 @@ def run_recommender(args):
 
 def tune_parameters():
 
-    # trials = Trials()
     from utils.constants import Constants
+    from evaluation.context_top_n_runner import ContextTopNRunner
 
     context_name = '_context' if Constants.USE_CONTEXT else '_nocontext'
     cycle = '_' + str(Constants.NESTED_CROSS_VALIDATION_CYCLE)
 
-    mongo_url =\
-        'mongo://localhost:1234/' +\
-        Constants.ITEM_TYPE + context_name + '_db_nested' + cycle + '/jobs'
-    trials = MongoTrials(mongo_url, exp_key='exp1')
+    experiment =\
+        Constants.ITEM_TYPE + context_name + '_db_nested' + cycle
+    store = TrialsStore(
+        Constants.CACHE_FOLDER + 'hyperopt_trials.db', experiment)
+
+    print('Trials store: %s (%s)' % (store.file_path, experiment))
 
-    print('Connected to %s' % mongo_url)
+    # The records are loaded before the workers are forked, so they are
+    # shared by all of them
+    get_cross_validation_records(ContextTopNRunner())
 
     params = Constants.get_properties_copy()
     params.update({
@@ -130,14 +179,17 @@ def tune_parameters():
             if element[0] in unwanted_args:
                 space.pos_args[1].named_args.remove(element)
 
-    # best = fmin(
-    #     run_recommender, space=space, algo=tpe.suggest,
-    #     max_evals=100, trials=trials)
+    num_workers = Constants.NUM_CORES or 1
+    trials = local_search.fmin(
+        run_recommender, space=space, algo=tpe.suggest, max_evals=100,
+        store=store, num_workers=num_workers, pruner=MedianPruner())
 
+    best_trial = store.get_best_trial()
     print('losses', sorted(trials.losses()))
-    print(
-        'best', trials.best_trial['result']['loss'],
-        trials.best_trial['misc']['vals'])
+    if best_trial is None:
+        print('best: no trial completed all the folds')
+    else:
+        print('best', best_trial['loss'], best_trial['vals'])
     print('num trials: %d' % len(trials.losses()))
 
 
@@ -1,12 +1,13 @@
 import time
 
-from hyperopt import fmin
 from hyperopt import hp
 from hyperopt import tpe
-from hyperopt.mongoexp import MongoTrials
 
+from evaluation import local_search
+from evaluation.trials_store import TrialsStore
 
-def run_recommender(args):
+
+def run_recommender(args, trial):
     import sys
     # sys.path.append('/Users/fpena/UCC/Thesis/projects/yelp/source/python')
     sys.path.append('/home/fpena/yelp/source/python')
@@ -50,12 +51,11 @@ def tune_parameters():
 
     context_name = '_context' if Constants.USE_CONTEXT else '_nocontext'
 
-    mongo_url =\
-        'mongo://localhost:1234/topicmodel_' +\
-        Constants.ITEM_TYPE + context_name + '/jobs'
-    trials = MongoTrials(mongo_url, exp_key='exp1')
+    experiment = 'topicmodel_' + Constants.ITEM_TYPE + context_name
+    store = TrialsStore(
+        Constants.CACHE_FOLDER + 'hyperopt_trials.db', experiment)
 
-    print('Connected to %s' % mongo_url)
+    print('Trials store: %s (%s)' % (store.file_path, experiment))
 
     space =\
         hp.choice(Constants.USE_CONTEXT_FIELD, [
@@ -78,9 +78,11 @@ def tune_parameters():
             },
         ])
 
-    best = fmin(
-        run_recommender, space=space, algo=tpe.suggest,
-        max_evals=1000, trials=trials)
+    # The topic models are scored as a whole, so the trials are not pruned
+    num_workers = Constants.NUM_CORES or 1
+    trials = local_search.fmin(
+        run_recommender, space=space, algo=tpe.suggest, max_evals=1000,
+        store=store, num_workers=num_workers)
 
     print('losses', sorted(trials.losses()))
     print(
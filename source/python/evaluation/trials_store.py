@@ -0,0 +1,275 @@
+from contextlib import contextmanager
+import json
+import sqlite3
+import time
+
+import numpy
+
+__author__ = 'fpena'
+
+
+RUNNING = 'running'
+OK = 'ok'
+PRUNED = 'pruned'
+FAIL = 'fail'
+
+
+def to_json(value):
+    # The values sampled by hyperopt can be numpy scalars
+    return json.dumps(
+        value, default=lambda element: element.item()
+        if isinstance(element, numpy.generic) else str(element))
+
+
+class TrialsStore(object):
+    """
+    Stores the trials of a hyperparameter search in an SQLite database, so the
+    search can run in several local processes without a database server and
+    can be resumed after it is stopped. Every trial keeps its parameters, the
+    values sampled for them, its state and its result, and the loss of each of
+    the folds it has finished, which is used to prune the trials that are
+    doing worse than the rest before all of their folds are run.
+
+    A new connection is opened for every operation, so the store can be
+    shared with forked processes
+    """
+
+    def __init__(self, file_path, experiment):
+        """
+        :param file_path: the path of the SQLite database
+        :param experiment: the name of the experiment the trials belong to,
+        so several experiments can share the same database
+        """
+        self.file_path = file_path
+        self.experiment = experiment
+
+        with self.connect() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS trials ('
+                'trial_id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'experiment TEXT NOT NULL, '
+                'parameters TEXT, '
+                'vals TEXT, '
+                'state TEXT NOT NULL, '
+                'loss REAL, '
+                'result TEXT, '
+                'start_time REAL, '
+                'end_time REAL)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS fold_losses ('
+                'trial_id INTEGER NOT NULL, '
+                'fold_index INTEGER NOT NULL, '
+                'loss REAL NOT NULL, '
+                'PRIMARY KEY (trial_id, fold_index))')
+
+    @contextmanager
+    def connect(self):
+        # The timeout makes the writers wait for each other instead of
+        # failing when the database is locked
+        connection = sqlite3.connect(self.file_path, timeout=600)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def create_trial(self, parameters, vals=None):
+        """
+        Adds a new running trial to the store
+
+        :param parameters: the parameters the trial is run with
+        :param vals: the values sampled by the search algorithm, which are
+        needed to resume the search
+        :return: the ID of the trial
+        """
+        with self.connect() as connection:
+            cursor = connection.execute(
+                'INSERT INTO trials '
+                '(experiment, parameters, vals, state, start_time) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (self.experiment, to_json(parameters), to_json(vals),
+                 RUNNING, time.time()))
+            return cursor.lastrowid
+
+    def finish_trial(self, trial_id, state, result):
+        """
+        Stores the final state and the result of a trial
+
+        :param trial_id: the ID of the trial
+        :param state: the state of the trial (OK, PRUNED or FAIL)
+        :param result: a dictionary with the result of the trial, with its
+        loss in result['loss']
+        """
+        with self.connect() as connection:
+            connection.execute(
+                'UPDATE trials SET state = ?, loss = ?, result = ?, '
+                'end_time = ? WHERE trial_id = ?',
+                (state, result.get('loss'), to_json(result), time.time(),
+                 trial_id))
+
+    def report_fold(self, trial_id, fold_index, loss):
+        """
+        Stores the loss of a trial in one fold of the cross-validation
+
+        :param trial_id: the ID of the trial
+        :param fold_index: the index of the fold, counted from the first fold
+        of the first cycle
+        :param loss: the loss of the trial in the fold
+        """
+        with self.connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO fold_losses '
+                '(trial_id, fold_index, loss) VALUES (?, ?, ?)',
+                (trial_id, fold_index, float(loss)))
+
+    def get_fold_losses(self, num_folds):
+        """
+        Returns the losses of the first folds of every trial of the experiment
+        that has finished at least that number of folds, including the trials
+        that are still running
+
+        :param num_folds: the number of folds
+        :return: a dictionary with the ID of each trial as the key, and a list
+        with the losses of its first num_folds folds as the value
+        """
+        with self.connect() as connection:
+            rows = connection.execute(
+                'SELECT fold_losses.trial_id, fold_index, fold_losses.loss '
+                'FROM fold_losses JOIN trials '
+                'ON fold_losses.trial_id = trials.trial_id '
+                'WHERE experiment = ? AND fold_index < ? AND state != ? '
+                'ORDER BY fold_losses.trial_id, fold_index',
+                (self.experiment, num_folds, FAIL)).fetchall()
+
+        fold_losses = {}
+        for trial_id, fold_index, loss in rows:
+            fold_losses.setdefault(trial_id, []).append(loss)
+
+        return {
+            trial_id: losses for trial_id, losses in fold_losses.items()
+            if len(losses) == num_folds
+        }
+
+    def get_trials(self, states=None):
+        """
+        Returns the trials of the experiment
+
+        :param states: the states of the trials that are returned, or None to
+        return the trials in any state
+        :return: a list with a dictionary per trial, in the order in which the
+        trials were created
+        """
+        with self.connect() as connection:
+            rows = connection.execute(
+                'SELECT trial_id, parameters, vals, state, loss, result '
+                'FROM trials WHERE experiment = ? ORDER BY trial_id',
+                (self.experiment,)).fetchall()
+
+        trials = []
+        for trial_id, parameters, vals, state, loss, result in rows:
+            if states is not None and state not in states:
+                continue
+            trials.append({
+                'trial_id': trial_id,
+                'parameters': json.loads(parameters),
+                'vals': json.loads(vals),
+                'state': state,
+                'loss': loss,
+                'result': None if result is None else json.loads(result)
+            })
+
+        return trials
+
+    def get_best_trial(self):
+        """
+        Returns the finished trial with the lowest loss. Pruned trials are not
+        taken into account, since their loss comes from fewer folds
+
+        :return: a dictionary with the trial, or None if no trial has finished
+        """
+        trials = self.get_trials([OK])
+        if not trials:
+            return None
+        return min(trials, key=lambda trial: trial['loss'])
+
+
+class MedianPruner(object):
+    """
+    Stops a trial when its mean loss over the folds it has finished is worse
+    than the median of the mean loss of the other trials over the same folds
+    """
+
+    def __init__(self, min_trials=5, min_folds=1):
+        """
+        :param min_trials: the number of other trials that must have finished
+        a fold before a trial can be pruned in that fold
+        :param min_folds: the number of folds a trial runs before it can be
+        pruned
+        """
+        self.min_trials = min_trials
+        self.min_folds = min_folds
+
+    def should_prune(self, store, trial_id, fold_index):
+        """
+        :type store: TrialsStore
+        :param store: the store with the losses of the folds of the trials
+        :param trial_id: the ID of the trial
+        :param fold_index: the index of the last fold the trial has finished
+        :return: True if the trial should be stopped, False otherwise
+        """
+        num_folds = fold_index + 1
+        if num_folds < self.min_folds:
+            return False
+
+        fold_losses = store.get_fold_losses(num_folds)
+        if trial_id not in fold_losses:
+            return False
+
+        trial_loss = numpy.mean(fold_losses.pop(trial_id))
+        if len(fold_losses) < self.min_trials:
+            return False
+
+        median_loss = numpy.median(
+            [numpy.mean(losses) for losses in fold_losses.values()])
+
+        return trial_loss > median_loss
+
+
+class Trial(object):
+    """
+    The trial that is being run in a process, through which the objective
+    function reports the loss of each fold and finds out if it has to stop
+    """
+
+    def __init__(self, store, trial_id, pruner=None):
+        """
+        :type store: TrialsStore
+        :param store: the store of the trials
+        :param trial_id: the ID of the trial
+        :type pruner: MedianPruner
+        :param pruner: the pruner of the trials, or None if the trials are
+        never stopped early
+        """
+        self.store = store
+        self.trial_id = trial_id
+        self.pruner = pruner
+        self.pruned = False
+
+    def should_prune(self, fold_index, loss):
+        """
+        Reports the loss of the trial in a fold
+
+        :param fold_index: the index of the fold, counted from the first fold
+        of the first cycle
+        :param loss: the loss of the trial in the fold
+        :return: True if the rest of the folds of the trial should not be run,
+        False otherwise
+        """
+        self.store.report_fold(self.trial_id, fold_index, loss)
+        if self.pruner is not None:
+            self.pruned = self.pruner.should_prune(
+                self.store, self.trial_id, fold_index)
+        if self.pruned:
+            print('Trial %d pruned after %d folds' %
+                  (self.trial_id, fold_index + 1))
+        return self.pruned
@@ -0,0 +1,209 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+
+from nlp import nlp_resources
+from nlp import nlp_utils
+from utils import utilities
+from utils.constants import Constants
+
+__author__ = 'fpena'
+
+
+# The number of texts that are sent to a worker process at once, and that
+# are written to the cache together
+CHUNK_SIZE = 500
+
+LEMMATIZE = 'lemmatize'
+LEMMATIZE_SENTENCES = 'lemmatize_sentences'
+POS_TAG = 'pos_tag'
+
+# Whether the NLP resources have been loaded in the current process
+_initialized = False
+
+
+def initialize_worker():
+    """
+    Loads the punkt sentence tokenizer, the part-of-speech tagger and the
+    pattern lexicon once in the current process, instead of once per text
+    """
+    global _initialized
+    if _initialized:
+        return
+    nlp_resources.preload(
+        nlp_resources.SENTENCE_TOKENIZER, nlp_resources.TAGGER)
+    # pattern loads its lexicon the first time a text is parsed
+    nlp_utils.lemmatize_sentence('start')
+    _initialized = True
+
+
+def lemmatize_sentences(text):
+    """
+    :param text: the text of a review
+    :return: a list with a [sentence, lemmatized words] pair per sentence
+    of the text
+    """
+    return [
+        [sentence, nlp_utils.lemmatize_sentence(sentence)]
+        for sentence in nlp_utils.get_sentences(text)
+    ]
+
+
+OPERATIONS = {
+    LEMMATIZE: nlp_utils.lemmatize_text,
+    LEMMATIZE_SENTENCES: lemmatize_sentences,
+}
+
+# The operations that process all the texts of a chunk at once
+BATCH_OPERATIONS = {
+    POS_TAG: nlp_utils.tag_documents,
+}
+
+
+def process_chunk(task):
+    chunk_index, operation, texts = task
+    if operation in BATCH_OPERATIONS:
+        return chunk_index, BATCH_OPERATIONS[operation](texts)
+    function = OPERATIONS[operation]
+    return chunk_index, [function(text) for text in texts]
+
+
+def hash_text(operation, text):
+    """
+    Returns the key of the result of applying the given operation to the
+    given text, which only depends on their content
+
+    :param operation: the name of the operation
+    :param text: the text
+    :return: the hex digest of the hash
+    """
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return hashlib.sha1(operation + '\0' + text).hexdigest()
+
+
+class TextCache(object):
+    """
+    Append-only cache with the results of an NLP operation for each text,
+    stored in a file with one JSON line per text. The results are appended as
+    soon as they are computed, so a run that is interrupted resumes from the
+    texts that were already processed, and the texts shared by different
+    datasets are processed only once
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def load(self, keys):
+        """
+        Reads the cached results of the given keys
+
+        :param keys: a set with the keys of the texts
+        :return: a dictionary with the cached results of the keys
+        """
+        results = {}
+        if not os.path.exists(self.file_path):
+            return results
+
+        with open(self.file_path) as read_file:
+            for line in read_file:
+                try:
+                    key, result = json.loads(line)
+                except ValueError:
+                    # The last line of a run that was interrupted
+                    continue
+                if key in keys:
+                    results[key] = result
+        return results
+
+    def append(self, keys, results):
+        """
+        Writes the given results at the end of the cache file
+
+        :param keys: the keys of the texts
+        :param results: the result of each text
+        """
+        folder = os.path.dirname(os.path.abspath(self.file_path))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        # A single write per chunk, so the lines of concurrent runs don't get
+        # mixed
+        content = ''.join(
+            json.dumps([key, result]) + '\n'
+            for key, result in zip(keys, results))
+        with open(self.file_path, 'a') as write_file:
+            write_file.write(content)
+
+
+def get_cache(operation):
+    """
+    :param operation: the name of the operation
+    :rtype: TextCache
+    :return: the cache of the given operation, in Constants.NLP_CACHE_FOLDER
+    """
+    return TextCache(os.path.join(
+        Constants.NLP_CACHE_FOLDER, operation + '.jsonl'))
+
+
+def process_texts(texts, operation, cache=None, chunk_size=CHUNK_SIZE):
+    """
+    Applies an NLP operation to each of the given texts. The texts are
+    processed in chunks by a pool of worker processes when Constants.NUM_CORES
+    allows it, and each text is processed only once, even when it appears
+    several times or is already in the cache
+
+    :param texts: a list of texts
+    :param operation: the name of the operation, one of the keys of OPERATIONS
+    or BATCH_OPERATIONS
+    :type cache: TextCache
+    :param cache: the cache of the results of the operation, or None to
+    process all the texts
+    :param chunk_size: the number of texts that are processed at once
+    :return: a list with the result of the operation for each text
+    """
+    keys = [hash_text(operation, text) for text in texts]
+    results = {} if cache is None else cache.load(set(keys))
+
+    pending_texts = {}
+    for key, text in zip(keys, texts):
+        if key not in results:
+            pending_texts[key] = text
+    pending_keys = pending_texts.keys()
+
+    print('%s: %s %d texts (%d cached)' % (
+        time.strftime("%Y/%m/%d-%H:%M:%S"), operation, len(pending_keys),
+        len(set(keys)) - len(pending_keys)))
+
+    chunks = [
+        pending_keys[start:start + chunk_size]
+        for start in range(0, len(pending_keys), chunk_size)
+    ]
+    tasks = [
+        (chunk_index, operation, [pending_texts[key] for key in chunk_keys])
+        for chunk_index, chunk_keys in enumerate(chunks)
+    ]
+
+    def add_results(chunk_index, chunk_results):
+        chunk_keys = chunks[chunk_index]
+        results.update(zip(chunk_keys, chunk_results))
+        if cache is not None:
+            cache.append(chunk_keys, chunk_results)
+
+    num_processes = utilities.get_num_processes(len(tasks))
+    if num_processes > 1:
+        pool = multiprocessing.Pool(num_processes, initialize_worker)
+        try:
+            for chunk_index, chunk_results in pool.imap_unordered(
+                    process_chunk, tasks):
+                add_results(chunk_index, chunk_results)
+        finally:
+            pool.close()
+            pool.join()
+    elif tasks:
+        initialize_worker()
+        for task in tasks:
+            add_results(*process_chunk(task))
+
+    return [results[key] for key in keys]
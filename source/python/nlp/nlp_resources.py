@@ -0,0 +1,94 @@
+import nltk
+from nltk.corpus import stopwords
+from nltk.tokenize import RegexpTokenizer
+
+__author__ = 'fpena'
+
+
+SENTENCE_TOKENIZER = 'sentence_tokenizer'
+WORD_TOKENIZER = 'word_tokenizer'
+TAGGER = 'tagger'
+STOP_WORDS = 'stop_words'
+
+# The fragments that are left by the word tokenizer when it splits the
+# contractions, which are removed along with the english stop words
+CONTRACTION_STOP_WORDS = {
+    't', 'didn', 'doesn', 'haven', 'don', 'aren', 'isn', 've', 'll',
+    'couldn', 'm', 'hasn', 'hadn', 'won', 'shouldn', 's', 'wasn',
+    'wouldn'}
+
+
+def load_stop_words():
+    return frozenset(stopwords.words("english")) | CONTRACTION_STOP_WORDS
+
+
+# The function that loads each resource
+LOADERS = {
+    SENTENCE_TOKENIZER:
+        lambda: nltk.data.load('tokenizers/punkt/english.pickle'),
+    WORD_TOKENIZER: lambda: RegexpTokenizer(r'\w+'),
+    TAGGER: nltk.PerceptronTagger,
+    STOP_WORDS: load_stop_words,
+}
+
+# The resources that have been loaded in the current process. The worker
+# processes inherit the resources that were loaded before they were forked
+_resources = {}
+
+
+def get_resource(name):
+    """
+    Returns an NLP resource, which is loaded only the first time it is
+    requested in each process
+
+    :param name: the name of the resource, one of the keys of LOADERS
+    :return: the resource
+    """
+    if name not in _resources:
+        _resources[name] = LOADERS[name]()
+    return _resources[name]
+
+
+def preload(*names):
+    """
+    Loads the given resources, or all of them if no names are given. It is
+    meant to be called by the initializer of the worker processes
+
+    :param names: the names of the resources
+    """
+    for name in names or LOADERS.keys():
+        get_resource(name)
+
+
+def get_sentence_tokenizer():
+    """
+    :rtype: nltk.tokenize.punkt.PunktSentenceTokenizer
+    :return: the punkt sentence tokenizer for english
+    """
+    return get_resource(SENTENCE_TOKENIZER)
+
+
+def get_word_tokenizer():
+    """
+    :rtype: RegexpTokenizer
+    :return: a tokenizer that splits the text in sequences of alphanumeric
+    characters
+    """
+    return get_resource(WORD_TOKENIZER)
+
+
+def get_tagger():
+    """
+    :rtype: nltk.PerceptronTagger
+    :return: the part-of-speech tagger
+    """
+    return get_resource(TAGGER)
+
+
+def get_stop_words():
+    """
+    :rtype: frozenset
+    :return: the english stop words, including the fragments of the
+    contractions
+    """
+    return get_resource(STOP_WORDS)
@@ -1,8 +1,17 @@
+import itertools
+
 import gensim
 import nltk
 from gensim.utils import lemmatize
 from pattern.text.en import parse
 
+from nlp import nlp_resources
+
+
+# The regular expressions are compiled once, instead of in every call
+NEWLINE_REGEX = nltk.re.compile('\n')
+ALL_TAGS_REGEX = nltk.re.compile('')
+
 
 def get_sentences(text):
     """
@@ -13,17 +22,27 @@ def get_sentences(text):
     :rtype: list[str]
     :return: a list with the sentences there are in the given text
     """
-    sentence_tokenizer = nltk.data.load('tokenizers/punkt/english.pickle')
-    newline_re = nltk.re.compile('\n')
-    paragraphs = newline_re.split(text)
-    sentences = []
-    for paragraph in paragraphs:
-        # sentences.append(paragraph)
-        sentences.extend(sentence_tokenizer.tokenize(paragraph))
+    return sentences_for_many([text])[0]
 
-    return sentences
-    # return sentence_tokenizer.tokenize(text)
 
+def sentences_for_many(texts):
+    """
+    Splits each of the given texts into sentences, with a single lookup of the
+    sentence tokenizer for all of them
+
+    :type texts: list[str]
+    :param texts: a list of texts
+    :rtype: list[list[str]]
+    :return: a list with the sentences of each text
+    """
+    sentence_tokenizer = nlp_resources.get_sentence_tokenizer()
+    return [
+        [
+            sentence for paragraph in NEWLINE_REGEX.split(text)
+            for sentence in sentence_tokenizer.tokenize(paragraph)
+        ]
+        for text in texts
+    ]
 
 
 def get_words(text):
@@ -35,7 +54,7 @@ def get_words(text):
     :rtype: list[str]
     :return: a list with the words there are in the given text
     """
-    sentence_tokenizer = nltk.data.load('tokenizers/punkt/english.pickle')
+    sentence_tokenizer = nlp_resources.get_sentence_tokenizer()
     sentences = sentence_tokenizer.tokenize(text)
 
     words = []
@@ -65,22 +84,43 @@ def tag_words(text, tagger=None):
     text is split into sentences and it returns a list of lists with the tagged
     words. One list for every sentence.
 
-    :param tagger: a part-of-speech tagger. This parameter is useful in order to
-    avoid the initialization of the tagger every time this method is called,
-    since the initialization can take a long time.
+    :param tagger: a part-of-speech tagger. By default the tagger of
+    nlp_resources is used, which is only initialized once per process
     :param text: the text to tag
     :return: a list of lists with pairs, in the form of (word, tag)
     """
-    sentences = get_sentences(text)
-    tokenized_sentences = [
-        get_words_from_sentence(sent.lower()) for sent in sentences]
+    return tag_documents([text], tagger)[0]
+
+
+def tag_documents(texts, tagger=None):
+    """
+    Tags the words of each of the given texts using part-of-speech tags. The
+    sentences of all the texts are tagged together with a single call to
+    tagger.tag_sents, and then the tagged words are grouped back by text
+
+    :type texts: list[str]
+    :param texts: a list of texts
+    :param tagger: a part-of-speech tagger. By default the tagger of
+    nlp_resources is used
+    :return: a list with the (word, tag) pairs of each text
+    """
     if tagger is None:
-        tagger = nltk.PerceptronTagger()
+        tagger = nlp_resources.get_tagger()
+
+    tokenized_sentences = []
+    num_sentences = []
+    for sentences in sentences_for_many(texts):
+        tokenized_sentences.extend(
+            get_words_from_sentence(sentence.lower())
+            for sentence in sentences)
+        num_sentences.append(len(sentences))
 
-    tagged_words = []
-    for sent in tokenized_sentences:
-        tagged_words.extend(tagger.tag(sent))
-    return tagged_words
+    tagged_sentences = iter(tagger.tag_sents(tokenized_sentences))
+    return [
+        list(itertools.chain.from_iterable(
+            itertools.islice(tagged_sentences, text_sentences)))
+        for text_sentences in num_sentences
+    ]
 
 
 def lemmatize_text(text):
@@ -102,12 +142,12 @@ def lemmatize_text(text):
     lemmatized_words = []
     for sentence in sentences:
         lemmatized_words.extend(lemmatize_sentence(
-            sentence, nltk.re.compile(''),
+            sentence, ALL_TAGS_REGEX,
             min_length=1, max_length=100))
     return lemmatized_words
 
 
-def lemmatize_sentence(content, allowed_tags=nltk.re.compile(''),
+def lemmatize_sentence(content, allowed_tags=ALL_TAGS_REGEX,
                stopwords=frozenset(), min_length=1, max_length=100):
 
 
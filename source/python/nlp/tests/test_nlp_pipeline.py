@@ -0,0 +1,85 @@
+import os
+import shutil
+import string
+import tempfile
+from unittest import TestCase
+
+from nlp import nlp_pipeline
+from nlp.nlp_pipeline import TextCache
+from utils.constants import Constants
+
+__author__ = 'fpena'
+
+
+texts = [
+    "We had dinner there last night.",
+    "Small bar, good music, good beer, bad food",
+    "We had dinner there last night.",
+    u"Caf\xe9 con leche"
+]
+
+
+class TestNlpPipeline(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache = TextCache(os.path.join(self.folder, 'upper.jsonl'))
+        nlp_pipeline.OPERATIONS['upper'] = string.upper
+
+    def tearDown(self):
+        del nlp_pipeline.OPERATIONS['upper']
+        shutil.rmtree(self.folder)
+
+    def test_hash_text(self):
+        self.assertEqual(
+            nlp_pipeline.hash_text('upper', texts[0]),
+            nlp_pipeline.hash_text('upper', unicode(texts[0])))
+        self.assertNotEqual(
+            nlp_pipeline.hash_text('upper', texts[0]),
+            nlp_pipeline.hash_text('lemmatize', texts[0]))
+
+    def test_text_cache(self):
+        self.assertEqual({}, self.cache.load({'a'}))
+
+        self.cache.append(['a', 'b'], [[['x', 'NN']], []])
+        with open(self.cache.file_path, 'a') as write_file:
+            write_file.write('["c", [["interrupted')
+
+        self.assertEqual(
+            {'a': [['x', 'NN']]}, self.cache.load({'a', 'c', 'd'}))
+
+    def test_process_texts(self):
+        expected = [text.upper() for text in texts]
+        self.assertEqual(expected, nlp_pipeline.process_texts(
+            texts, 'upper', self.cache, chunk_size=2))
+
+        # The cached texts are not processed again
+        nlp_pipeline.OPERATIONS['upper'] = string.lower
+        self.assertEqual(expected, nlp_pipeline.process_texts(
+            texts, 'upper', self.cache))
+        self.assertEqual(['new text'], nlp_pipeline.process_texts(
+            ['New text'], 'upper', self.cache))
+
+        with open(self.cache.file_path) as read_file:
+            self.assertEqual(4, len(read_file.readlines()))
+
+    def test_process_texts_batch(self):
+        chunks = []
+
+        def upper_texts(chunk_texts):
+            chunks.append(chunk_texts)
+            return [text.upper() for text in chunk_texts]
+
+        num_cores = Constants.NUM_CORES
+        # The chunks are only recorded when they are processed in this process
+        Constants.NUM_CORES = None
+        nlp_pipeline.BATCH_OPERATIONS['upper_batch'] = upper_texts
+        try:
+            self.assertEqual(
+                [text.upper() for text in texts],
+                nlp_pipeline.process_texts(texts, 'upper_batch', chunk_size=2))
+        finally:
+            del nlp_pipeline.BATCH_OPERATIONS['upper_batch']
+            Constants.NUM_CORES = num_cores
+        # The repeated text is processed once, in chunks of two texts
+        self.assertEqual([2, 1], [len(chunk) for chunk in chunks])
@@ -0,0 +1,39 @@
+from unittest import TestCase
+
+from nlp import nlp_resources
+
+__author__ = 'fpena'
+
+
+class TestNlpResources(TestCase):
+
+    def setUp(self):
+        self.num_loads = 0
+
+        def load_resource():
+            self.num_loads += 1
+            return object()
+
+        nlp_resources.LOADERS['test_resource'] = load_resource
+
+    def tearDown(self):
+        del nlp_resources.LOADERS['test_resource']
+        nlp_resources._resources.pop('test_resource', None)
+
+    def test_get_resource(self):
+        resource = nlp_resources.get_resource('test_resource')
+        self.assertIs(resource, nlp_resources.get_resource('test_resource'))
+        self.assertEqual(1, self.num_loads)
+
+    def test_preload(self):
+        nlp_resources.preload('test_resource')
+        self.assertEqual(1, self.num_loads)
+        nlp_resources.get_resource('test_resource')
+        self.assertEqual(1, self.num_loads)
+
+    def test_get_word_tokenizer(self):
+        tokenizer = nlp_resources.get_word_tokenizer()
+        self.assertIs(tokenizer, nlp_resources.get_word_tokenizer())
+        self.assertEqual(
+            ['i', 'didn', 't', 'like', 'it'],
+            tokenizer.tokenize("i didn't like it!"))
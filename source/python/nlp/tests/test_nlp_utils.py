@@ -43,6 +43,12 @@ class TestNlpUtils(TestCase):
         expected_value = 8
         self.assertEqual(actual_value, expected_value)
 
+    def test_sentences_for_many(self):
+        texts = [paragraph1, empty_paragraph, review_text6]
+        self.assertEqual(
+            [nlp_utils.get_sentences(text) for text in texts],
+            nlp_utils.sentences_for_many(texts))
+
     def test_get_words(self):
         actual_value = nlp_utils.get_words(empty_paragraph)
         expected_value = []
@@ -85,6 +91,13 @@ class TestNlpUtils(TestCase):
         ]
         self.assertEqual(actual_value, expected_value)
 
+    def test_tag_documents(self):
+        texts = [paragraph1, empty_paragraph, paragraph2, review_text6]
+        actual_value = nlp_utils.tag_documents(texts)
+        expected_value = [nlp_utils.tag_words(text) for text in texts]
+        self.assertEqual(expected_value, actual_value)
+        self.assertEqual([], nlp_utils.tag_documents([]))
+
     def test_count_verbs(self):
         tagged_words = nlp_utils.tag_words(empty_paragraph)
         counts = Counter(tag for word, tag in tagged_words)
@@ -11,11 +11,15 @@ class AdjustedWeightedSumRecommender(BaseRecommender):
 
     def predict_rating(self, user_id, item_id):
 
-        if user_id not in self.user_ids:
+        if user_id not in self.user_dictionary:
             return None
 
         neighbourhood = self.get_neighbourhood(user_id, item_id)
 
+        return self.calculate_rating(user_id, item_id, neighbourhood)
+
+    def calculate_rating(self, user_id, item_id, neighbourhood):
+
         weighted_sum = 0.
         z_denominator = 0.
         num_users = 0
@@ -13,7 +13,7 @@ class AverageRecommender(BaseRecommender):
     def predict_rating(self, user_id, hotel_id):
         return self._rating
 
-    def load(self, reviews):
+    def load(self, reviews, ratings_store=None):
         data_frame = DataFrame(reviews)
         mean = data_frame.mean()['overall_rating']
         self._rating = mean
@@ -1,6 +1,7 @@
 from abc import ABCMeta, abstractmethod
+from recommenders import batch_prediction
+from recommenders.neighbour_index import NeighbourIndex
 from tripadvisor.fourcity import extractor
-from utils import dictionary_utils
 
 
 __author__ = 'fpena'
@@ -18,51 +19,76 @@ class BaseRecommender(object):
         self.user_ids = None
         self.user_dictionary = None
         self.user_similarity_matrix = None
+        self.neighbour_index = None
 
-    def load(self, reviews):
+    def load(self, reviews, ratings_store=None):
         self.reviews = reviews
         self.user_dictionary =\
             extractor.initialize_users(
                 self.reviews,
-                self._similarity_matrix_builder._is_multi_criteria)
+                self._similarity_matrix_builder._is_multi_criteria,
+                ratings_store)
         self.user_ids = extractor.get_groupby_list(self.reviews, 'user_id')
         if self._similarity_matrix_builder._similarity_metric is not None:
             self.user_similarity_matrix =\
                 self._similarity_matrix_builder.build_similarity_matrix(
                     self.user_dictionary, self.user_ids)
+            self.neighbour_index = NeighbourIndex(
+                self.user_similarity_matrix, self.user_dictionary)
 
     def clear(self):
         self.reviews = None
         self.user_ids = None
         self.user_dictionary = None
         self.user_similarity_matrix = None
+        self.neighbour_index = None
 
     def get_neighbourhood(self, user_id, item_id):
+        """
+        Returns the users who have rated the item sorted by their similarity
+        with the user, at most self._num_neighbors of them
 
-        # if self._num_neighbors is None:
-        #     neighbourhood = list(self.user_ids)
-        #     neighbourhood.remove(user_id)
-        #     return neighbourhood
-
-        similarity_matrix = self.user_similarity_matrix[user_id].copy()
-        similarity_matrix.pop(user_id, None)
-
-        # We remove the users who have not rated the given item
-        similarity_matrix = {
-            k: v for k, v in similarity_matrix.items()
-            if item_id in self.user_dictionary[k].item_ratings}
-
-        # Sort the users by similarity
-        neighbourhood = dictionary_utils.sort_dictionary_keys(
-            similarity_matrix)  # [:self._num_neighbors]
-
-        return neighbourhood
-
+        :param user_id: the ID of the user
+        :param item_id: the ID of the item
+        :return: a tuple with the IDs of the neighbours
+        """
+        return self.neighbour_index.get_neighbourhood(
+            user_id, item_id, self._num_neighbors)
 
     @abstractmethod
     def predict_rating(self, user, item):
         pass
 
+    def predict_user_ratings(self, user_id, item_ids, context=None):
+        """
+        Predicts the ratings that a user would give to several items. The
+        recommenders that have state that only depends on the user override
+        this method to compute it once for all the items
+
+        :param user_id: the ID of the user
+        :param item_ids: the IDs of the items
+        :param context: the context of the ratings, which is ignored by the
+        recommenders that don't use context
+        :return: a list with the predicted rating of each item, with None for
+        the ratings that can't be predicted
+        """
+        return [self.predict_rating(user_id, item_id) for item_id in item_ids]
+
+    def predict_many(self, user_ids, item_ids, contexts=None):
+        """
+        Predicts the ratings of a list of user-item pairs, grouping them by
+        user (see batch_prediction.predict_many)
+
+        :param user_ids: the ID of the user of each pair
+        :param item_ids: the ID of the item of each pair
+        :param contexts: the context of each pair, or None
+        :return: a numpy array with the predicted rating of each pair, with
+        NaN for the ratings that can't be predicted
+        """
+        return batch_prediction.predict_many(
+            self.predict_user_ratings, user_ids, item_ids, contexts)
+
     @property
     def name(self):
         return self._name
+
@@ -0,0 +1,69 @@
+import numpy
+
+__author__ = 'fpena'
+
+
+def group_by_user(user_ids, contexts=None):
+    """
+    Groups the positions of a list of user-item pairs by user and context
+
+    :param user_ids: the ID of the user of each pair
+    :param contexts: the context of each pair, or None if the pairs have no
+    context
+    :return: a dictionary with a (user_id, context) tuple as the key, and the
+    list of the positions of the pairs of that user and context as the value
+    """
+    if contexts is None:
+        contexts = [None] * len(user_ids)
+
+    groups = {}
+    for index, (user_id, context) in enumerate(zip(user_ids, contexts)):
+        groups.setdefault((user_id, context), []).append(index)
+
+    return groups
+
+
+def predict_many(predict_user_ratings, user_ids, item_ids, contexts=None):
+    """
+    Predicts the ratings of a list of user-item pairs by calling
+    predict_user_ratings once for each user and context, so everything that
+    only depends on the user, such as its neighbours or its baseline, is
+    computed once per user instead of once per pair
+
+    :param predict_user_ratings: a function that receives a user ID, a list
+    of item IDs and a context, and returns a list with the predicted rating of
+    each item, with None for the ratings that can't be predicted
+    :param user_ids: the ID of the user of each pair
+    :param item_ids: the ID of the item of each pair
+    :param contexts: the context of each pair (e.g. the text of the review),
+    or None if the pairs have no context
+    :return: a numpy array with the predicted rating of each pair, with NaN
+    for the ratings that can't be predicted
+    """
+    predictions = numpy.full(len(user_ids), numpy.nan)
+
+    for (user_id, context), indices in \
+            group_by_user(user_ids, contexts).items():
+        user_predictions = predict_user_ratings(
+            user_id, [item_ids[index] for index in indices], context)
+        predictions[indices] = [
+            numpy.nan if prediction is None else prediction
+            for prediction in user_predictions
+        ]
+
+    return predictions
+
+
+def to_optional_list(predictions):
+    """
+    Converts an array returned by predict_many into a list in which the
+    ratings that couldn't be predicted are None, as returned by
+    predict_rating
+
+    :param predictions: a numpy array with the predicted ratings
+    :return: a list with the predicted ratings
+    """
+    return [
+        None if numpy.isnan(prediction) else float(prediction)
+        for prediction in predictions
+    ]
@@ -1,4 +1,4 @@
-from utils import dictionary_utils
+from recommenders.neighbour_index import NeighbourIndex
 
 __author__ = 'fpena'
 
@@ -11,6 +11,7 @@ class BasicNeighbourhoodCalculator:
         self.topic_indices = None
         self.num_neighbours = None
         self.user_similarity_matrix = None
+        self.neighbour_index = None
 
     def load(self, user_ids, user_dictionary,
              topic_indices, num_neighbours, user_similarity_matrix):
@@ -19,27 +20,13 @@ class BasicNeighbourhoodCalculator:
         self.topic_indices = topic_indices
         self.num_neighbours = num_neighbours
         self.user_similarity_matrix = user_similarity_matrix
+        self.neighbour_index = NeighbourIndex(
+            self.user_similarity_matrix, self.user_dictionary,
+            skip_dissimilar=True)
 
     def get_neighbourhood(self, user, item, context, threshold):
 
-        sim_users_matrix = self.user_similarity_matrix[user].copy()
-        sim_users_matrix.pop(user, None)
-
-        # We remove the users who have not rated the given item
-        sim_users_matrix = {
-            k: v for k, v in sim_users_matrix.items()
-            if item in self.user_dictionary[k].item_ratings}
-
-        # We remove neighbours that don't have a similarity with user
-        sim_users_matrix = {
-            k: v for k, v in sim_users_matrix.items()
-            if v}
-
-        # Sort the users by similarity
-        neighbourhood = dictionary_utils.sort_dictionary_keys(
-            sim_users_matrix)
-
-        if not self.num_neighbours:
-            return neighbourhood
-
-        return neighbourhood[:self.num_neighbours]
+        # The users who have rated the item and have a similarity with user,
+        # sorted by similarity
+        return self.neighbour_index.get_neighbourhood(
+            user, item, self.num_neighbours)
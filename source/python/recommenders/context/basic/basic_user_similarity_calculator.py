@@ -1,5 +1,8 @@
 import math
 import itertools
+
+import numpy
+
 from tripadvisor.fourcity import extractor
 
 __author__ = 'fpena'
@@ -19,29 +22,21 @@ class BasicUserSimilarityCalculator:
 
     def calculate_pearson_similarity(self, user1, user2):
 
-        common_items =\
-            extractor.get_common_items(self.user_dictionary, user1, user2)
+        user1_ratings, user2_ratings =\
+            extractor.get_common_item_ratings(self.user_dictionary, user1, user2)
 
-        if not common_items:
+        if not len(user1_ratings):
             return None
 
-        numerator = 0
-        denominator1 = 0
-        denominator2 = 0
-
         user1_average = self.user_dictionary[user1].average_overall_rating
         user2_average = self.user_dictionary[user2].average_overall_rating
 
-        for item in common_items:
-            user1_rating = self.user_dictionary[user1].item_ratings[item]
-            user2_rating = self.user_dictionary[user2].item_ratings[item]
+        user1_deviations = user1_ratings - user1_average
+        user2_deviations = user2_ratings - user2_average
 
-            # print('user average', user1_average)
-
-            numerator +=\
-                (user1_rating - user1_average) * (user2_rating - user2_average)
-            denominator1 += (user1_rating - user1_average) ** 2
-            denominator2 += (user2_rating - user2_average) ** 2
+        numerator = numpy.dot(user1_deviations, user2_deviations)
+        denominator1 = numpy.dot(user1_deviations, user1_deviations)
+        denominator2 = numpy.dot(user2_deviations, user2_deviations)
 
         denominator = math.sqrt(denominator1 * denominator2)
 
@@ -52,23 +47,15 @@ class BasicUserSimilarityCalculator:
 
     def calculate_cosine_similarity(self, user1, user2):
 
-        common_items =\
-            extractor.get_common_items(self.user_dictionary, user1, user2)
+        user1_ratings, user2_ratings =\
+            extractor.get_common_item_ratings(self.user_dictionary, user1, user2)
 
-        if not common_items:
+        if not len(user1_ratings):
             return None
 
-        numerator = 0
-        denominator1 = 0
-        denominator2 = 0
-
-        for item in common_items:
-            user1_rating = self.user_dictionary[user1].item_ratings[item]
-            user2_rating = self.user_dictionary[user2].item_ratings[item]
-
-            numerator += user1_rating * user2_rating
-            denominator1 += user1_rating ** 2
-            denominator2 += user2_rating ** 2
+        numerator = numpy.dot(user1_ratings, user2_ratings)
+        denominator1 = numpy.dot(user1_ratings, user1_ratings)
+        denominator2 = numpy.dot(user2_ratings, user2_ratings)
 
         denominator = math.sqrt(denominator1) * math.sqrt(denominator2)
 
@@ -3,6 +3,8 @@ import itertools
 from random import shuffle
 import scipy
 from evaluation import precision_in_top_n
+from recommenders import batch_prediction
+from recommenders.neighbour_index import NeighbourIndex
 from utils import dictionary_utils
 from etl import ETLUtils
 from tripadvisor.fourcity import extractor
@@ -19,14 +21,18 @@ class BasicKNN:
         self.similarity_matrix = None
         self.user_dictionary = None
         self.user_ids = None
+        self.neighbour_index = None
         self.has_context=False
 
-    def load(self, reviews):
+    def load(self, reviews, ratings_store=None):
         self.reviews = reviews
         self.ratings_matrix = create_ratings_matrix(reviews)
-        self.user_dictionary = extractor.initialize_users(self.reviews, False)
+        self.user_dictionary =\
+            extractor.initialize_users(self.reviews, False, ratings_store)
         self.user_ids = extractor.get_groupby_list(self.reviews, 'user_id')
         self.similarity_matrix = self.create_similarity_matrix()
+        self.neighbour_index = NeighbourIndex(
+            self.similarity_matrix, self.user_dictionary, skip_dissimilar=True)
 
     def get_rating(self, user, item):
         return self.ratings_matrix[user][item]
@@ -137,34 +143,15 @@ class BasicKNN:
         :param user1:
         :param user2:
         """
-        items_user1 = self.user_dictionary[user1].item_ratings.keys()
-        items_user2 = self.user_dictionary[user2].item_ratings.keys()
-
-        return list(set(items_user1).intersection(items_user2))
+        return list(
+            extractor.get_common_items(self.user_dictionary, user1, user2))
 
     def get_user_neighbours(self, user, item):
 
-        sim_users_matrix = self.similarity_matrix[user].copy()
-        sim_users_matrix.pop(user, None)
-
-        # We remove the users who have not rated the given item
-        sim_users_matrix = {
-            k: v for k, v in sim_users_matrix.items()
-            if item in self.ratings_matrix[k]}
-
-        # We remove neighbours that don't have a similarity with user
-        sim_users_matrix = {
-            k: v for k, v in sim_users_matrix.items()
-            if v}
-
-        # print(sim_users_matrix)
-
-        # Sort the users by similarity
-        neighbourhood = dictionary_utils.sort_dictionary_keys(
-            sim_users_matrix)  # [:self.num_neighbors]
-
-        if self.num_neighbors:
-            neighbourhood = neighbourhood[:self.num_neighbors]
+        # The users who have rated the item and have a similarity with user,
+        # sorted by similarity
+        neighbourhood = self.neighbour_index.get_neighbourhood(
+            user, item, self.num_neighbors)
 
         # print('neighbourhood', neighbourhood)
         # print('neighbourhood size:', len(neighbourhood))
@@ -202,24 +189,81 @@ class BasicKNN:
 
     def predict_rating(self, user, item):
 
-        if user not in self.user_ids:
+        if user not in self.user_dictionary:
             return None
 
-        ratings_sum = 0
-        similarities_sum = 0
-        num_users = 0
         neighbourhood = self.get_user_neighbours(user, item)
         # print(neighbourhood)
 
+        return self.calculate_rating(user, item, neighbourhood, {})
+
+    def predict_user_ratings(self, user, items, context=None):
+        """
+        Predicts the ratings that a user would give to several items. The
+        similarity between the user and each neighbour is calculated only once
+
+        :param user: the ID of the user
+        :param items: the IDs of the items
+        :param context: ignored, since this recommender doesn't use context
+        :return: a list with the predicted rating of each item, with None for
+        the ratings that can't be predicted
+        """
+        if user not in self.user_dictionary:
+            return [None] * len(items)
+
+        similarities = {}
+
+        return [
+            self.calculate_rating(
+                user, item, self.get_user_neighbours(user, item), similarities)
+            for item in items
+        ]
+
+    def predict_many(self, users, items, contexts=None):
+        """
+        Predicts the ratings of a list of user-item pairs, grouping them by
+        user (see batch_prediction.predict_many)
+
+        :param users: the ID of the user of each pair
+        :param items: the ID of the item of each pair
+        :param contexts: ignored, since this recommender doesn't use context
+        :return: a numpy array with the predicted rating of each pair, with
+        NaN for the ratings that can't be predicted
+        """
+        return batch_prediction.predict_many(
+            self.predict_user_ratings, users, items)
+
+    def calculate_rating(self, user, item, neighbourhood, similarities):
+        """
+        Predicts the rating that the user would give to the item using the
+        given neighbourhood
+
+        :param user: the ID of the user
+        :param item: the ID of the item
+        :param neighbourhood: the neighbours of the user who have rated the
+        item, sorted by similarity
+        :param similarities: a dictionary with the similarities between the
+        user and the neighbours that have already been calculated, which is
+        updated with the ones calculated here
+        :return: the predicted rating, or None if it can't be predicted
+        """
+
         if not neighbourhood:
             return None
 
+        ratings_sum = 0
+        similarities_sum = 0
+        num_users = 0
+
         # print('neighbourhood', len(neighbourhood))
         num_neighbours = 0
 
         for neighbour in neighbourhood:
 
-            similarity = self.calculate_similarity(user, neighbour)
+            if neighbour not in similarities:
+                similarities[neighbour] =\
+                    self.calculate_similarity(user, neighbour)
+            similarity = similarities[neighbour]
             # print('similarity', similarity)
 
             if item in self.user_dictionary[neighbour].item_ratings and similarity is not None:
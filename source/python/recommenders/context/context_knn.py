@@ -3,13 +3,15 @@ import math
 import time
 import cPickle as pickle
 
-from gensim import corpora
 import numpy
 
 from etl import ETLUtils
 from evaluation import precision_in_top_n
 
+from recommenders import batch_prediction
 from recommenders.context import basic_knn
+from recommenders.context.context_similarity_cache import \
+    ContextSimilarityCache
 # from recommenders.context.basic.basic_contextual_knn import BasicContextualKNN
 from recommenders.context.basic.basic_neighbour_contribution_calculator import \
     BasicNeighbourContributionCalculator
@@ -36,6 +38,7 @@ from recommenders.context.similarity.cbc_similarity_calculator import \
     CBCSimilarityCalculator
 from recommenders.context.neighbourhood.simple_neighbourhood_calculator import \
     SimpleNeighbourhoodCalculator
+from recommenders.neighbour_index import NeighbourIndex
 from topicmodeling.context import lda_context_utils
 from topicmodeling.context.lda_based_context import LdaBasedContext
 from topicmodeling.context.review import Review
@@ -54,7 +57,9 @@ class ContextKnn:
         self.ratings_matrix = None
         self.reviews_matrix = None
         self.context_matrix = None
+        self.context_similarity_cache = None
         self.similarity_matrix = None
+        self.neighbour_index = None
         self.user_dictionary = None
         self.user_ids = None
         self.num_topics = num_topics
@@ -64,11 +69,12 @@ class ContextKnn:
         self.context_rich_topics = None
         self.has_context = True
 
-    def load(self, records):
+    def load(self, records, ratings_store=None):
         self.records = records
         self.ratings_matrix = basic_knn.create_ratings_matrix(records)
         self.reviews_matrix = create_reviews_matrix(records)
-        self.user_dictionary = extractor.initialize_users(self.records, False)
+        self.user_dictionary =\
+            extractor.initialize_users(self.records, False, ratings_store)
         self.user_ids = extractor.get_groupby_list(self.records, 'user_id')
 
         lda_based_context = LdaBasedContext(self.records, self.reviews)
@@ -90,7 +96,11 @@ class ContextKnn:
         self.lda_model = lda_based_context.topic_model
         print('building similarity matrix', time.strftime("%H:%M:%S"))
         self.context_matrix = self.create_context_matrix(records)
+        self.context_similarity_cache = ContextSimilarityCache(
+            self.user_dictionary, self.context_rich_topics, self.context_matrix)
         self.similarity_matrix = self.create_similarity_matrix()
+        self.neighbour_index = NeighbourIndex(
+            self.similarity_matrix, self.user_dictionary, skip_dissimilar=True)
         print('finished building similarity matrix', time.strftime("%H:%M:%S"))
 
     def get_rating(self, user, item):
@@ -98,14 +108,8 @@ class ContextKnn:
 
     def get_rating_on_context(self, user, item, context, threshold):
 
-        neighbour_context = self.context_matrix[user][item]
-        context_similarity = get_context_similarity(
-            context, neighbour_context, self.context_rich_topics)
-
-        if context_similarity < threshold:
-            return None
-
-        return self.get_rating(user, item)
+        return self.context_similarity_cache.get_rating_on_context(
+            user, item, context, threshold)
 
     def create_similarity_matrix(self):
 
@@ -127,8 +131,8 @@ class ContextKnn:
         :type review: str
         """
         review_bow = lda_context_utils.create_bag_of_words([review])
-        dictionary = corpora.Dictionary(review_bow)
-        corpus = dictionary.doc2bow(review_bow[0])
+        # The words are mapped with the dictionary of the topic model
+        corpus = self.lda_model.id2word.doc2bow(review_bow[0])
         lda_corpus = self.lda_model.get_document_topics(corpus)
 
         topic_distribution =\
@@ -149,19 +153,12 @@ class ContextKnn:
         return neighbour_rating - neighbor_average
 
     def calculate_user_baseline(self, user_id, context, threshold):
-        user_rated_items = self.user_dictionary[user_id].item_ratings
-        num_rated_items = len(user_rated_items)
-
-        ratings_sum = 0.0
-        num_ratings = 0.0
-        for item_id in user_rated_items.keys():
-            rating = self.get_rating_on_context(
-                user_id, item_id, context, threshold)
-            if rating:
-                ratings_sum += rating
-                num_ratings += 1
-
-        user_baseline = ratings_sum / num_rated_items
+        # The ratings of the user whose context is not similar enough to the
+        # given context are 0
+        ratings = self.context_similarity_cache.get_ratings_on_context(
+            user_id, context, threshold)
+
+        user_baseline = ratings.sum() / len(ratings)
         return user_baseline
 
     def calculate_user_similarity(self, user1, user2, threshold):
@@ -171,42 +168,32 @@ class ContextKnn:
         if not common_items:
             return None
 
-        filtered_items = {}
+        # The similarities between the contexts in which both users rated
+        # each item, calculated at once
+        context_similarities = self.context_similarity_cache.\
+            get_pairwise_context_similarities(user1, user2, common_items)
+        filtered_items = context_similarities > threshold
+        context_similarities = context_similarities[filtered_items]
 
-        for item in common_items:
-            context1 = self.context_matrix[user1][item]
-            context2 = self.context_matrix[user2][item]
-            similarity = get_context_similarity(
-                context1, context2, self.context_rich_topics)
-            if similarity > threshold:
-                filtered_items[item] = similarity
-
-        numerator = 0
-        denominator1 = 0
-        denominator2 = 0
-        denominator3 = 0
         user1_average = self.user_dictionary[user1].average_overall_rating
         user2_average = self.user_dictionary[user2].average_overall_rating
+        user1_deviations = self.context_similarity_cache.get_item_ratings(
+            user1, common_items)[filtered_items] - user1_average
+        user2_deviations = self.context_similarity_cache.get_item_ratings(
+            user2, common_items)[filtered_items] - user2_average
 
-        for item in filtered_items.keys():
-            similarity = filtered_items[item]
-            user1_rating = self.get_rating(user1, item)
-            user2_rating = self.get_rating(user2, item)
-
-            numerator +=\
-                (user1_rating - user1_average) *\
-                (user2_rating - user2_average) *\
-                similarity
-            denominator1 += (user1_rating - user1_average) ** 2
-            denominator2 += (user2_rating - user2_average) ** 2
-            denominator3 += similarity ** 2
+        numerator =\
+            (user1_deviations * user2_deviations * context_similarities).sum()
+        denominator1 = (user1_deviations ** 2).sum()
+        denominator2 = (user2_deviations ** 2).sum()
+        denominator3 = (context_similarities ** 2).sum()
 
         denominator = math.sqrt(denominator1 * denominator2 * denominator3)
 
         if denominator == 0:
             return 0
 
-        return numerator / denominator
+        return float(numerator / denominator)
 
     def get_common_rated_items(self, user1, user2):
         """
@@ -215,10 +202,8 @@ class ContextKnn:
         :param user1:
         :param user2:
         """
-        items_user1 = self.user_dictionary[user1].item_ratings.keys()
-        items_user2 = self.user_dictionary[user2].item_ratings.keys()
-
-        return list(set(items_user1).intersection(items_user2))
+        return list(
+            extractor.get_common_items(self.user_dictionary, user1, user2))
 
     def get_neighbourhood(self, user, item, context, threshold):
 
@@ -233,9 +218,9 @@ class ContextKnn:
 
         neighbour_similarity_map = {}
         for neighbour in neighbours:
-            neighbour_context = self.context_matrix[neighbour][item]
-            context_similarity = get_context_similarity(
-                context, neighbour_context, self.context_rich_topics)
+            context_similarity =\
+                self.context_similarity_cache.get_context_similarity(
+                    neighbour, item, context)
             if context_similarity > threshold:
                 neighbour_similarity_map[neighbour] = context_similarity
 
@@ -247,41 +232,87 @@ class ContextKnn:
 
     def get_neighbourhood2(self, user, item, context, threshold):
 
-        sim_users_matrix = self.similarity_matrix[user].copy()
-        sim_users_matrix.pop(user, None)
+        # The users who have rated the item and have a similarity with user,
+        # sorted by similarity
+        return self.neighbour_index.get_neighbourhood(
+            user, item, self.num_neighbors)
 
-        # We remove the users who have not rated the given item
-        sim_users_matrix = {
-            k: v for k, v in sim_users_matrix.items()
-            if item in self.ratings_matrix[k]}
+    def predict_rating(self, user, item, review):
 
-        # We remove neighbours that don't have a similarity with user
-        sim_users_matrix = {
-            k: v for k, v in sim_users_matrix.items()
-            if v}
+        return self.predict_user_ratings(user, [item], review)[0]
 
-        # Sort the users by similarity
-        neighbourhood = dictionary_utils.sort_dictionary_keys(
-            sim_users_matrix)
-        if self.num_neighbors:
-            return neighbourhood[:self.num_neighbors]
+    def predict_user_ratings(self, user, items, review):
+        """
+        Predicts the ratings that a user would give to several items in the
+        context of the same review. The topic distribution of the review, the
+        baselines of the user and the neighbours in that context and the
+        similarity between the user and each of the neighbours are calculated
+        only once for all the items
+
+        :param user: the ID of the user
+        :param items: the IDs of the items
+        :param review: the text of the review that describes the context
+        :return: a list with the predicted rating of each item, with None for
+        the ratings that can't be predicted
+        """
+        if user not in self.user_dictionary:
+            return [None] * len(items)
 
-        return neighbourhood
+        threshold3 = 0.0
 
-    def predict_rating(self, user, item, review):
+        user_context = self.get_topic_distribution(review)
+        user_average = \
+            self.calculate_user_baseline(user, user_context, threshold3)
+        similarities = {}
+        baselines = {}
 
-        if user not in self.user_ids:
-            return None
+        return [
+            self.calculate_rating(
+                user, item, user_context, user_average, similarities,
+                baselines)
+            for item in items
+        ]
+
+    def predict_many(self, users, items, reviews):
+        """
+        Predicts the ratings of a list of user-item pairs, grouping them by
+        user and review (see batch_prediction.predict_many)
+
+        :param users: the ID of the user of each pair
+        :param items: the ID of the item of each pair
+        :param reviews: the text of the review of each pair
+        :return: a numpy array with the predicted rating of each pair, with
+        NaN for the ratings that can't be predicted
+        """
+        return batch_prediction.predict_many(
+            self.predict_user_ratings, users, items, reviews)
+
+    def calculate_rating(
+            self, user, item, user_context, user_average, similarities,
+            baselines):
+        """
+        Predicts the rating that the user would give to the item
+
+        :param user: the ID of the user
+        :param item: the ID of the item
+        :param user_context: the topic distribution of the review
+        :param user_average: the baseline of the user in the given context
+        :param similarities: a dictionary with the similarities between the
+        user and the neighbours that have already been calculated, which is
+        updated with the ones calculated here
+        :param baselines: a dictionary with the baselines of the neighbours in
+        the given context that have already been calculated, which is updated
+        with the ones calculated here
+        :return: the predicted rating, or None if it can't be predicted
+        """
 
         threshold1 = 0.0
         threshold2 = 0.0
-        threshold3 = 0.0
         threshold4 = 0.0
 
         ratings_sum = 0
         similarities_sum = 0
         num_users = 0
-        user_context = self.get_topic_distribution(review)
         neighbourhood =\
             self.get_neighbourhood2(user, item, user_context, threshold1)
 
@@ -294,16 +325,22 @@ class ContextKnn:
 
         for neighbour in neighbourhood:
 
-            similarity = \
-                self.calculate_user_similarity(user, neighbour, threshold4)
+            if neighbour not in similarities:
+                similarities[neighbour] = \
+                    self.calculate_user_similarity(user, neighbour, threshold4)
+            similarity = similarities[neighbour]
 
             if (item in self.user_dictionary[neighbour].item_ratings and
                         similarity is not None):
 
                 num_neighbours += 1
 
-                neighbour_contribution = self.calculate_neighbour_contribution(
+                if neighbour not in baselines:
+                    baselines[neighbour] = self.calculate_user_baseline(
+                        neighbour, user_context, threshold2)
+                neighbour_rating = self.get_rating_on_context(
                     neighbour, item, user_context, threshold2)
+                neighbour_contribution = neighbour_rating - baselines[neighbour]
                 ratings_sum += similarity * neighbour_contribution
                 similarities_sum += abs(similarity)
                 num_users += 1
@@ -317,8 +354,6 @@ class ContextKnn:
             return None
 
         k = 1 / similarities_sum
-        user_average = \
-            self.calculate_user_baseline(user, user_context, threshold3)
 
         predicted_rating = user_average + k * ratings_sum
 
@@ -0,0 +1,225 @@
+import collections
+
+import numpy
+
+__author__ = 'fpena'
+
+
+# Marks the values that are not in the LRU caches, since None is a valid
+# baseline
+_MISSING = object()
+
+
+class ContextSimilarityCache(object):
+    """
+    Keeps the contexts in which the users have rated the items as one dense
+    (ratings x context-rich topics) array, so the similarity between a query
+    context and the contexts of all the ratings of a user is calculated with a
+    single vectorized call instead of once per rating.
+
+    The similarities between each (user, query context) pair and the
+    baselines of each (user, query context, threshold) are memoized in LRU
+    caches, since the neighbourhood, neighbour contribution and baseline
+    calculators ask for them over and over while the ratings of a review are
+    predicted.
+
+    The similarity between two contexts is 1 / (1 + ||context1 - context2||)
+    over the context-rich topics, as in context_utils.get_context_similarity
+    """
+
+    def __init__(self, user_dictionary, topic_indices, user_item_contexts=None,
+                 cache_size=100000):
+        """
+        :param user_dictionary: a dictionary with the users, by user ID
+        :param topic_indices: the context-rich topics, as a list of tuples
+        whose first element is the index of the topic
+        :param user_item_contexts: a dictionary with the ID of each user as the
+        key, and a dictionary with the topic distribution of the review of
+        each item the user has rated as the value. If None, the item_contexts
+        of the users are used
+        :param cache_size: the number of entries kept in each LRU cache
+        """
+        self.user_dictionary = user_dictionary
+        self.topic_indices = topic_indices
+        self.topic_ids = numpy.array(
+            [topic[0] for topic in topic_indices], dtype=numpy.int64)
+        self.cache_size = cache_size
+        self._similarities = collections.OrderedDict()
+        self._baselines = collections.OrderedDict()
+
+        # The ratings of each user are stored in consecutive rows
+        self.user_rows = {}
+        self.item_positions = {}
+        ratings = []
+        contexts = []
+
+        for user_id, user in user_dictionary.items():
+            if user_item_contexts is None:
+                item_contexts = user.item_contexts
+            else:
+                item_contexts = user_item_contexts[user_id]
+            start = len(ratings)
+            positions = {}
+            for item_id, rating in user.item_ratings.items():
+                positions[item_id] = len(positions)
+                ratings.append(rating)
+                contexts.append(self.filter_context(item_contexts[item_id]))
+            self.user_rows[user_id] = (start, len(ratings))
+            self.item_positions[user_id] = positions
+
+        self.ratings = numpy.array(ratings, dtype=numpy.float64)
+        self.contexts = numpy.array(contexts, dtype=numpy.float64).reshape(
+            len(ratings), len(self.topic_ids))
+
+    def filter_context(self, context):
+        """
+        Selects the context-rich topics of a topic distribution
+        """
+        return numpy.asarray(context, dtype=numpy.float64)[self.topic_ids]
+
+    def _memoize(self, cache, key, calculate):
+        value = cache.pop(key, _MISSING)
+        if value is _MISSING:
+            value = calculate()
+
+        # The most recently used values are at the end of the cache
+        cache[key] = value
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+        return value
+
+    def get_context_similarities(self, user_id, context):
+        """
+        Calculates the similarity between a context and the contexts of all
+        the ratings of a user
+
+        :param user_id: the ID of the user
+        :param context: the topic distribution of the query context
+        :return: an array with the similarity of each rating of the user, in
+        the order of self.item_positions[user_id]
+        """
+        query = self.filter_context(context)
+        start, end = self.user_rows[user_id]
+
+        def calculate():
+            distances = numpy.sqrt(
+                ((self.contexts[start:end] - query) ** 2).sum(axis=1))
+            return 1 / (1 + distances)
+
+        return self._memoize(
+            self._similarities, (user_id, query.tobytes()), calculate)
+
+    def get_context_similarity(self, user_id, item_id, context):
+        """
+        Calculates the similarity between a context and the context in which
+        the user rated the item
+        """
+        position = self.item_positions[user_id][item_id]
+        return self.get_context_similarities(user_id, context)[position]
+
+    def get_ratings_on_context(self, user_id, context, threshold):
+        """
+        Returns the ratings of a user, with a 0 in the ratings whose context
+        has a similarity lower than the threshold with the given context
+
+        :param user_id: the ID of the user
+        :param context: the topic distribution of the query context
+        :param threshold: the minimum context similarity
+        :return: an array with the ratings, in the order of
+        self.item_positions[user_id]
+        """
+        start, end = self.user_rows[user_id]
+        similarities = self.get_context_similarities(user_id, context)
+        return numpy.where(
+            similarities < threshold, 0., self.ratings[start:end])
+
+    def get_rating_on_context(self, user_id, item_id, context, threshold):
+        """
+        Returns the rating the user gave to the item, or None if the context
+        of the rating has a similarity lower than the threshold with the given
+        context
+        """
+        if self.get_context_similarity(user_id, item_id, context) < threshold:
+            return None
+
+        start, _ = self.user_rows[user_id]
+        return float(
+            self.ratings[start + self.item_positions[user_id][item_id]])
+
+    def calculate_user_baseline(self, user_id, context, threshold):
+        """
+        Calculates the average of the ratings of a user whose context is
+        similar to the given context
+
+        :param user_id: the ID of the user
+        :param context: the topic distribution of the query context
+        :param threshold: the minimum context similarity
+        :return: the baseline, or None if no rating is similar enough
+        """
+        query = self.filter_context(context)
+
+        def calculate():
+            ratings = self.get_ratings_on_context(user_id, context, threshold)
+            ratings = ratings[ratings != 0]
+            if not len(ratings):
+                return None
+            return float(ratings.mean())
+
+        return self._memoize(
+            self._baselines, (user_id, query.tobytes(), threshold), calculate)
+
+    def get_pairwise_context_similarities(self, user_id1, user_id2, item_ids):
+        """
+        Calculates the similarity between the contexts in which two users
+        rated each of the given items
+
+        :param user_id1: the ID of the first user
+        :param user_id2: the ID of the second user
+        :param item_ids: the IDs of items both users have rated
+        :return: an array with the context similarity of each item
+        """
+        start1, _ = self.user_rows[user_id1]
+        start2, _ = self.user_rows[user_id2]
+        positions1 = self.item_positions[user_id1]
+        positions2 = self.item_positions[user_id2]
+        rows1 = [start1 + positions1[item_id] for item_id in item_ids]
+        rows2 = [start2 + positions2[item_id] for item_id in item_ids]
+        distances = numpy.sqrt(
+            ((self.contexts[rows1] - self.contexts[rows2]) ** 2).sum(axis=1))
+
+        return 1 / (1 + distances)
+
+    def get_item_ratings(self, user_id, item_ids):
+        """
+        Returns the ratings the user gave to the given items as an array
+        """
+        start, _ = self.user_rows[user_id]
+        positions = self.item_positions[user_id]
+        return self.ratings[
+            [start + positions[item_id] for item_id in item_ids]]
+
+
+# The cache of the users that were loaded last in this process, which is
+# shared by all the calculators that are loaded with the same users
+_shared_cache = None
+
+
+def get_context_similarity_cache(user_dictionary, topic_indices):
+    """
+    Returns the context similarity cache of the given users, which is built
+    only once for all the calculators that are loaded with them
+
+    :param user_dictionary: a dictionary with the users, by user ID, with the
+    contexts of their ratings in item_contexts
+    :param topic_indices: the context-rich topics
+    :rtype: ContextSimilarityCache
+    """
+    global _shared_cache
+
+    if _shared_cache is None or \
+            _shared_cache.user_dictionary is not user_dictionary or \
+            _shared_cache.topic_indices != topic_indices:
+        _shared_cache = ContextSimilarityCache(user_dictionary, topic_indices)
+
+    return _shared_cache
@@ -1,3 +1,4 @@
+from recommenders import batch_prediction
 from topicmodeling.context import lda_context_utils
 from topicmodeling.context.lda_based_context import LdaBasedContext
 from tripadvisor.fourcity import extractor
@@ -30,9 +31,10 @@ class ContextualKNN:
         self.threshold3 = 0.0
         self.threshold4 = 0.0
 
-    def load(self, records):
+    def load(self, records, ratings_store=None):
         # self.records = records
-        self.user_dictionary = extractor.initialize_users(records, False)
+        self.user_dictionary =\
+            extractor.initialize_users(records, False, ratings_store)
         self.user_ids = extractor.get_groupby_list(records, 'user_id')
 
         if self.has_context:
@@ -72,16 +74,73 @@ class ContextualKNN:
 
         # print('predict_rating', user, item)
 
-        if user not in self.user_ids:
-            return None
+        return self.predict_user_ratings(user, [item], review)[0]
+
+    def predict_user_ratings(self, user, items, review=None):
+        """
+        Predicts the ratings that a user would give to several items in the
+        context of the same review. The topic distribution of the review, the
+        baseline of the user and the similarity between the user and each of
+        the neighbours are calculated only once for all the items
+
+        :param user: the ID of the user
+        :param items: the IDs of the items
+        :param review: the text of the review that describes the context
+        :return: a list with the predicted rating of each item, with None for
+        the ratings that can't be predicted
+        """
+        if user not in self.user_dictionary:
+            return [None] * len(items)
 
-        ratings_sum = 0
-        similarities_sum = 0
-        num_neighbours = 0
         user_context = None
         if self.has_context:
             user_context =\
                 lda_context_utils.get_topic_distribution(review, self.lda_model)
+        user_average = self.user_baseline_calculator.calculate_user_baseline(
+            user, user_context, self.threshold3)
+        similarities = {}
+
+        return [
+            self.calculate_rating(
+                user, item, user_context, user_average, similarities)
+            for item in items
+        ]
+
+    def predict_many(self, users, items, reviews=None):
+        """
+        Predicts the ratings of a list of user-item pairs, grouping them by
+        user and review (see batch_prediction.predict_many)
+
+        :param users: the ID of the user of each pair
+        :param items: the ID of the item of each pair
+        :param reviews: the text of the review of each pair, or None if the
+        recommender doesn't use context
+        :return: a numpy array with the predicted rating of each pair, with
+        NaN for the ratings that can't be predicted
+        """
+        if not self.has_context:
+            reviews = None
+        return batch_prediction.predict_many(
+            self.predict_user_ratings, users, items, reviews)
+
+    def calculate_rating(
+            self, user, item, user_context, user_average, similarities):
+        """
+        Predicts the rating that the user would give to the item
+
+        :param user: the ID of the user
+        :param item: the ID of the item
+        :param user_context: the topic distribution of the review
+        :param user_average: the baseline of the user in the given context
+        :param similarities: a dictionary with the similarities between the
+        user and the neighbours that have already been calculated, which is
+        updated with the ones calculated here
+        :return: the predicted rating, or None if it can't be predicted
+        """
+
+        ratings_sum = 0
+        similarities_sum = 0
+        num_neighbours = 0
         neighbourhood = self.neighbourhood_calculator.get_neighbourhood(
             user, item, user_context, self.threshold1)
 
@@ -90,9 +149,10 @@ class ContextualKNN:
 
         for neighbour in neighbourhood:
 
-            similarity =\
-                self.user_similarity_calculator.calculate_user_similarity(
-                    user, neighbour, self.threshold4)
+            if neighbour not in similarities:
+                similarities[neighbour] = self.user_similarity_calculator.\
+                    calculate_user_similarity(user, neighbour, self.threshold4)
+            similarity = similarities[neighbour]
 
             if (item in self.user_dictionary[neighbour].item_ratings and
                     similarity is not None):
@@ -122,8 +182,6 @@ class ContextualKNN:
             return None
 
         k = 1 / similarities_sum
-        user_average = self.user_baseline_calculator.calculate_user_baseline(
-            user, user_context, self.threshold3)
 
         if user_average is None:
             return None
@@ -1,6 +1,6 @@
 from recommenders.context.neighbour_contribution.abstract_neighbour_contribution_calculator import \
     AbstractNeighbourContributionCalculator
-from topicmodeling.context import context_utils
+from recommenders.context import context_similarity_cache
 
 __author__ = 'fpena'
 
@@ -21,10 +21,12 @@ class ContextNCCalculator(AbstractNeighbourContributionCalculator):
         neighbor_average =\
             self.user_baseline_calculator.calculate_user_baseline(
                 neighbour_id, context, threshold)
-        neighbour_context =\
-            self.user_baseline_calculator.user_dictionary[neighbour_id].item_contexts[item_id]
-        context_similarity = context_utils.get_context_similarity(
-            context, neighbour_context, self.user_baseline_calculator.topic_indices)
+        similarity_cache = context_similarity_cache.\
+            get_context_similarity_cache(
+                self.user_baseline_calculator.user_dictionary,
+                self.user_baseline_calculator.topic_indices)
+        context_similarity = similarity_cache.get_context_similarity(
+            neighbour_id, item_id, context)
 
         if not neighbour_rating:
             return None
@@ -1,7 +1,8 @@
 from recommenders.context.neighbourhood.abstract_neighbourhood_calculator import \
     AbstractNeighbourhoodCalculator
+from recommenders.context import context_similarity_cache
+from recommenders.neighbour_index import build_item_user_ids
 from utils import dictionary_utils
-from topicmodeling.context import context_utils
 
 __author__ = 'fpena'
 
@@ -14,6 +15,8 @@ class ContextHybridNeighbourhoodCalculator(AbstractNeighbourhoodCalculator):
         self.user_dictionary = None
         self.topic_indices = None
         self.num_neighbours = None
+        self.item_user_ids = None
+        self.context_similarity_cache = None
         self.weight = weight
         self.similarity_matrix = None
         self.user_similarity_calculator = user_similarity_calculator
@@ -24,6 +27,10 @@ class ContextHybridNeighbourhoodCalculator(AbstractNeighbourhoodCalculator):
         self.user_dictionary = user_dictionary
         self.topic_indices = topic_indices
         self.num_neighbours = num_neighbours
+        self.item_user_ids = build_item_user_ids(self.user_dictionary)
+        self.context_similarity_cache =\
+            context_similarity_cache.get_context_similarity_cache(
+                self.user_dictionary, self.topic_indices)
         self.user_similarity_calculator.load(
             self.user_ids, self.user_dictionary, self.topic_indices)
         self.similarity_matrix =\
@@ -31,21 +38,17 @@ class ContextHybridNeighbourhoodCalculator(AbstractNeighbourhoodCalculator):
 
     def get_neighbourhood(self, user, item, context, threshold):
 
-        all_users = self.user_ids[:]
-        all_users.remove(user)
-        neighbours = []
-
-        # We remove the users who have not rated the given item
-        for neighbour in all_users:
-            if item in self.user_dictionary[neighbour].item_ratings:
-                neighbours.append(neighbour)
+        # Only the users who have rated the given item
+        neighbours = [
+            neighbour for neighbour in self.item_user_ids.get(item, [])
+            if neighbour != user
+        ]
 
         neighbour_similarity_map = {}
         for neighbour in neighbours:
-            neighbour_context =\
-                self.user_dictionary[neighbour].item_contexts[item]
-            context_similarity = context_utils.get_context_similarity(
-                context, neighbour_context, self.topic_indices)
+            context_similarity =\
+                self.context_similarity_cache.get_context_similarity(
+                    neighbour, item, context)
             user_similarity = self.similarity_matrix[user][neighbour]
             if context_similarity > threshold and user_similarity:
                 neighbour_similarity_map[neighbour] =\
@@ -65,5 +68,7 @@ class ContextHybridNeighbourhoodCalculator(AbstractNeighbourhoodCalculator):
         self.user_ids = None
         self.user_dictionary = None
         self.topic_indices = None
+        self.item_user_ids = None
+        self.context_similarity_cache = None
         self.similarity_matrix = None
         self.user_similarity_calculator.clear()
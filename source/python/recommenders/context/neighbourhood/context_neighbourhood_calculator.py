@@ -1,7 +1,8 @@
 from recommenders.context.neighbourhood.abstract_neighbourhood_calculator import \
     AbstractNeighbourhoodCalculator
+from recommenders.context import context_similarity_cache
+from recommenders.neighbour_index import build_item_user_ids
 from utils import dictionary_utils
-from topicmodeling.context import context_utils
 
 __author__ = 'fpena'
 
@@ -14,30 +15,32 @@ class ContextNeighbourhoodCalculator(AbstractNeighbourhoodCalculator):
         self.user_dictionary = None
         self.topic_indices = None
         self.num_neighbours = None
+        self.item_user_ids = None
+        self.context_similarity_cache = None
 
     def load(self, user_ids, user_dictionary, topic_indices, num_neighbours):
         self.user_ids = user_ids
         self.user_dictionary = user_dictionary
         self.topic_indices = topic_indices
         self.num_neighbours = num_neighbours
+        self.item_user_ids = build_item_user_ids(self.user_dictionary)
+        self.context_similarity_cache =\
+            context_similarity_cache.get_context_similarity_cache(
+                self.user_dictionary, self.topic_indices)
 
     def get_neighbourhood(self, user, item, context, threshold):
 
-        all_users = self.user_ids[:]
-        all_users.remove(user)
-        neighbours = []
-
-        # We remove the users who have not rated the given item
-        for neighbour in all_users:
-            if item in self.user_dictionary[neighbour].item_ratings:
-                neighbours.append(neighbour)
+        # Only the users who have rated the given item
+        neighbours = [
+            neighbour for neighbour in self.item_user_ids.get(item, [])
+            if neighbour != user
+        ]
 
         neighbour_similarity_map = {}
         for neighbour in neighbours:
-            neighbour_context =\
-                self.user_dictionary[neighbour].item_contexts[item]
-            context_similarity = context_utils.get_context_similarity(
-                context, neighbour_context, self.topic_indices)
+            context_similarity =\
+                self.context_similarity_cache.get_context_similarity(
+                    neighbour, item, context)
             if context_similarity > threshold:
                 neighbour_similarity_map[neighbour] = context_similarity
 
@@ -54,3 +57,5 @@ class ContextNeighbourhoodCalculator(AbstractNeighbourhoodCalculator):
         self.user_ids = None
         self.user_dictionary = None
         self.topic_indices = None
+        self.item_user_ids = None
+        self.context_similarity_cache = None
@@ -1,6 +1,6 @@
 from recommenders.context.neighbourhood.abstract_neighbourhood_calculator import \
     AbstractNeighbourhoodCalculator
-from utils import dictionary_utils
+from recommenders.neighbour_index import NeighbourIndex
 
 __author__ = 'fpena'
 
@@ -14,6 +14,7 @@ class SimpleNeighbourhoodCalculator(AbstractNeighbourhoodCalculator):
         self.topic_indices = None
         self.num_neighbours = None
         self.similarity_matrix = None
+        self.neighbour_index = None
         self.user_similarity_calculator = user_similarity_calculator
 
     def load(self, user_ids, user_dictionary, topic_indices, num_neighbours):
@@ -25,34 +26,20 @@ class SimpleNeighbourhoodCalculator(AbstractNeighbourhoodCalculator):
             self.user_ids, self.user_dictionary, self.topic_indices)
         self.similarity_matrix =\
             self.user_similarity_calculator.create_similarity_matrix()
+        self.neighbour_index = NeighbourIndex(
+            self.similarity_matrix, self.user_dictionary, skip_dissimilar=True)
 
     def get_neighbourhood(self, user, item, context, threshold):
 
-        sim_users_matrix = self.similarity_matrix[user].copy()
-        sim_users_matrix.pop(user, None)
-
-        # We remove the users who have not rated the given item
-        sim_users_matrix = {
-            k: v for k, v in sim_users_matrix.items()
-            if item in self.user_dictionary[k].item_ratings}
-
-        # We remove neighbours that don't have a similarity with user
-        sim_users_matrix = {
-            k: v for k, v in sim_users_matrix.items()
-            if v}
-
-        # Sort the users by similarity
-        neighbourhood = dictionary_utils.sort_dictionary_keys(
-            sim_users_matrix)
-
-        if self.num_neighbours is None:
-            return neighbourhood
-
-        return neighbourhood[:self.num_neighbours]
+        # The users who have rated the item and have a similarity with user,
+        # sorted by similarity
+        return self.neighbour_index.get_neighbourhood(
+            user, item, self.num_neighbours)
 
     def clear(self):
         self.user_ids = None
         self.user_dictionary = None
         self.topic_indices = None
         self.similarity_matrix = None
+        self.neighbour_index = None
         self.user_similarity_calculator.clear()
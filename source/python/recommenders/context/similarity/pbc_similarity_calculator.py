@@ -1,7 +1,7 @@
 import math
+from recommenders.context import context_similarity_cache
 from recommenders.context.similarity.base_similarity_calculator import \
     BaseSimilarityCalculator
-from topicmodeling.context import context_utils
 from tripadvisor.fourcity import extractor
 
 __author__ = 'fpena'
@@ -10,48 +10,50 @@ __author__ = 'fpena'
 class PBCSimilarityCalculator(BaseSimilarityCalculator):
     def __init__(self):
         super(PBCSimilarityCalculator, self).__init__()
+        self.context_similarity_cache = None
+
+    def load(self, user_ids, user_dictionary, context_rich_topics):
+        super(PBCSimilarityCalculator, self).load(
+            user_ids, user_dictionary, context_rich_topics)
+        self.context_similarity_cache =\
+            context_similarity_cache.get_context_similarity_cache(
+                self.user_dictionary, self.context_rich_topics)
 
     def calculate_user_similarity(self, user1, user2, threshold):
 
-        common_items = extractor.get_common_items(
-            self.user_dictionary, user1, user2)
+        common_items = list(extractor.get_common_items(
+            self.user_dictionary, user1, user2))
 
         if not common_items:
             return None
 
-        filtered_items = {}
-
-        for item in common_items:
-            context1 = self.user_dictionary[user1].item_contexts[item]
-            context2 = self.user_dictionary[user2].item_contexts[item]
-            context_similarity = context_utils.get_context_similarity(
-                context1, context2, self.context_rich_topics)
-            if context_similarity > threshold:
-                filtered_items[item] = context_similarity
+        # The similarities between the contexts in which both users rated
+        # each item, calculated at once
+        context_similarities = self.context_similarity_cache.\
+            get_pairwise_context_similarities(user1, user2, common_items)
+        filtered_items = context_similarities > threshold
+        context_similarities = context_similarities[filtered_items]
 
-        numerator = 0
-        denominator1 = 0
-        denominator2 = 0
-        denominator3 = 0
         user1_average = self.user_dictionary[user1].average_overall_rating
         user2_average = self.user_dictionary[user2].average_overall_rating
+        user1_deviations = self.context_similarity_cache.get_item_ratings(
+            user1, common_items)[filtered_items] - user1_average
+        user2_deviations = self.context_similarity_cache.get_item_ratings(
+            user2, common_items)[filtered_items] - user2_average
 
-        for item in filtered_items.keys():
-            context_similarity = filtered_items[item]
-            user1_rating = self.user_dictionary[user1].item_ratings[item]
-            user2_rating = self.user_dictionary[user2].item_ratings[item]
-
-            numerator +=\
-                (user1_rating - user1_average) *\
-                (user2_rating - user2_average) *\
-                context_similarity
-            denominator1 += (user1_rating - user1_average) ** 2
-            denominator2 += (user2_rating - user2_average) ** 2
-            denominator3 += context_similarity ** 2
+        numerator =\
+            (user1_deviations * user2_deviations * context_similarities).sum()
+        denominator1 = (user1_deviations ** 2).sum()
+        denominator2 = (user2_deviations ** 2).sum()
+        denominator3 = (context_similarities ** 2).sum()
 
         denominator = math.sqrt(denominator1 * denominator2 * denominator3)
 
         if denominator == 0:
             return None
 
-        return numerator / denominator
+        return float(numerator / denominator)
+
+    def clear(self):
+        super(PBCSimilarityCalculator, self).clear()
+        self.context_similarity_cache = None
@@ -0,0 +1,102 @@
+from unittest import TestCase
+
+import numpy
+
+from recommenders.context import context_similarity_cache
+from recommenders.context.context_similarity_cache import \
+    ContextSimilarityCache
+from tripadvisor.fourcity import extractor
+
+__author__ = 'fpena'
+
+
+reviews = [
+    {'user_id': 'U1', 'offering_id': 1, 'overall_rating': 4.0},
+    {'user_id': 'U1', 'offering_id': 2, 'overall_rating': 2.0},
+    {'user_id': 'U1', 'offering_id': 3, 'overall_rating': 5.0},
+    {'user_id': 'U2', 'offering_id': 1, 'overall_rating': 3.0},
+    {'user_id': 'U2', 'offering_id': 3, 'overall_rating': 1.0},
+]
+
+contexts = {
+    'U1': {1: [0.1, 0.5, 0.4], 2: [0.7, 0.1, 0.2], 3: [0.2, 0.2, 0.6]},
+    'U2': {1: [0.3, 0.3, 0.4], 3: [0.2, 0.6, 0.2]},
+}
+
+# The first element of each tuple is the index of a context-rich topic
+topic_indices = [(0, 1.5), (2, 1.2)]
+
+
+def calculate_context_similarity(context1, context2):
+    filtered_context1 = numpy.array([context1[0], context1[2]])
+    filtered_context2 = numpy.array([context2[0], context2[2]])
+    return 1 / (1 + numpy.linalg.norm(filtered_context1 - filtered_context2))
+
+
+class TestContextSimilarityCache(TestCase):
+
+    def setUp(self):
+        self.user_dictionary = extractor.initialize_users(reviews, False)
+        for user_id, user in self.user_dictionary.items():
+            user.item_contexts = contexts[user_id]
+        self.cache = ContextSimilarityCache(
+            self.user_dictionary, topic_indices)
+
+    def test_get_context_similarity(self):
+        query = [0.5, 0.2, 0.3]
+
+        for item_id in [1, 2, 3]:
+            self.assertAlmostEqual(
+                calculate_context_similarity(query, contexts['U1'][item_id]),
+                self.cache.get_context_similarity('U1', item_id, query))
+        self.assertEqual(
+            3, len(self.cache.get_context_similarities('U1', query)))
+        self.assertEqual(
+            2, len(self.cache.get_context_similarities('U2', query)))
+
+    def test_get_rating_on_context(self):
+        query = [0.1, 0.0, 0.4]
+        similarity = calculate_context_similarity(query, contexts['U1'][2])
+
+        self.assertEqual(
+            2.0,
+            self.cache.get_rating_on_context('U1', 2, query, similarity))
+        self.assertIsNone(self.cache.get_rating_on_context(
+            'U1', 2, query, similarity + 0.01))
+
+    def test_calculate_user_baseline(self):
+        query = [0.1, 0.5, 0.4]
+
+        self.assertAlmostEqual(
+            11.0 / 3, self.cache.calculate_user_baseline('U1', query, 0.0))
+        # Only the ratings of the items 1 and 3 have a similar context
+        self.assertAlmostEqual(
+            4.5, self.cache.calculate_user_baseline('U1', query, 0.75))
+        self.assertIsNone(
+            self.cache.calculate_user_baseline('U1', query, 1.1))
+        # The baselines are cached for every context and threshold
+        self.assertEqual(3, len(self.cache._baselines))
+
+    def test_get_pairwise_context_similarities(self):
+        similarities = self.cache.get_pairwise_context_similarities(
+            'U1', 'U2', [3, 1])
+
+        self.assertAlmostEqual(
+            calculate_context_similarity(contexts['U1'][3], contexts['U2'][3]),
+            similarities[0])
+        self.assertAlmostEqual(
+            calculate_context_similarity(contexts['U1'][1], contexts['U2'][1]),
+            similarities[1])
+        self.assertEqual(
+            [1.0, 3.0], list(self.cache.get_item_ratings('U2', [3, 1])))
+
+    def test_get_context_similarity_cache(self):
+        cache = context_similarity_cache.get_context_similarity_cache(
+            self.user_dictionary, topic_indices)
+
+        self.assertIs(
+            cache, context_similarity_cache.get_context_similarity_cache(
+                self.user_dictionary, topic_indices))
+        self.assertIsNot(
+            cache, context_similarity_cache.get_context_similarity_cache(
+                self.user_dictionary, topic_indices[:1]))
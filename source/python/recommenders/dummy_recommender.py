@@ -12,5 +12,5 @@ class DummyRecommender(BaseRecommender):
     def predict_rating(self, user_id, hotel_id):
         return self._rating
 
-    def load(self, reviews):
+    def load(self, reviews, ratings_store=None):
         pass
@@ -0,0 +1,449 @@
+import numpy
+from scipy import sparse
+
+from utils.constants import Constants
+
+__author__ = 'fpena'
+
+
+FM_METHODS = ['sgd', 'als', 'mcmc']
+
+# Hyperpriors used by the MCMC method, the same ones used by libFM
+ALPHA_0 = 1.
+GAMMA_0 = 1.
+BETA_0 = 1.
+MU_0 = 0.
+
+DEFAULT_BATCH_SIZE = 128
+
+
+class FactorizationMachine(object):
+    """
+    Second order factorization machine for regression, trained in-process on
+    a sparse design matrix, so the data doesn't have to be exported to the
+    libFM format and the predictions don't have to be read from disk.
+
+    The model is the same as the one used by libFM,
+
+        y(x) = w0 + sum_i w_i x_i + sum_i sum_j>i <v_i, v_j> x_i x_j
+
+    and it can be learned with the same methods: stochastic gradient descent
+    ('sgd'), alternating least squares ('als') and Markov chain Monte Carlo
+    ('mcmc'). The ALS and MCMC methods update all the variables in a group of
+    consecutive columns that never appear in the same row (like the one-hot
+    encoded users or items) at the same time, which gives the same result as
+    updating them one by one. The SGD method uses mini-batches instead of
+    single samples.
+
+    By default all the hyperparameters are taken from the Constants.FM_*
+    properties.
+    """
+
+    def __init__(
+            self, num_factors=None, method=None, num_iterations=None,
+            init_stdev=None, learn_rate=None, regularization=None,
+            use_bias=None, use_1way_interactions=None, seed=None,
+            batch_size=DEFAULT_BATCH_SIZE):
+        """
+        :param num_factors: the number of latent factors of each variable
+        :param method: the learning method, 'sgd', 'als' or 'mcmc'
+        :param num_iterations: the number of passes over the training data
+        :param init_stdev: the standard deviation used to initialize the
+        latent factors
+        :param learn_rate: the learning rate used by the SGD method
+        :type regularization: (float, float, float)
+        :param regularization: the regularization of the bias, the 1-way
+        interactions and the 2-way interactions. Not used by the MCMC method,
+        which samples them
+        :param use_bias: a boolean that indicates if the global bias is used
+        :param use_1way_interactions: a boolean that indicates if the 1-way
+        interactions are used
+        :param seed: the seed of the random number generator
+        :param batch_size: the number of samples in each mini-batch of the
+        SGD method
+        """
+        if method is None:
+            method = Constants.FM_METHOD
+        if method not in FM_METHODS:
+            raise ValueError('Unrecognized factorization machine method')
+
+        self.num_factors = \
+            Constants.FM_NUM_FACTORS if num_factors is None else num_factors
+        self.method = method
+        self.num_iterations = \
+            Constants.FM_ITERATIONS if num_iterations is None \
+            else num_iterations
+        self.init_stdev = \
+            Constants.FM_INIT_STDEV if init_stdev is None else init_stdev
+        self.learn_rate = \
+            Constants.FM_SDG_LEARN_RATE if learn_rate is None else learn_rate
+        if regularization is None:
+            regularization = (
+                Constants.FM_REGULARIZATION0, Constants.FM_REGULARIZATION1,
+                Constants.FM_REGULARIZATION2)
+        self.regularization = regularization
+        self.use_bias = bool(
+            Constants.FM_USE_BIAS if use_bias is None else use_bias)
+        self.use_1way_interactions = bool(
+            Constants.FM_USE_1WAY_INTERACTIONS if use_1way_interactions is None
+            else use_1way_interactions)
+        self.batch_size = batch_size
+        self.random_state = numpy.random.RandomState(
+            Constants.LIBFM_SEED if seed is None else seed)
+
+        self.w0 = 0.
+        self.w = None
+        self.v = None
+        self.min_target = None
+        self.max_target = None
+
+        # Hyperparameters sampled by the MCMC method
+        self.alpha = 1.
+        self.mu_w = 0.
+        self.lambda_w = 0.
+        self.mu_v = numpy.zeros(self.num_factors)
+        self.lambda_v = numpy.zeros(self.num_factors)
+
+    def fit(self, x, y, warm_start=False):
+        """
+        Trains the model with the given data
+
+        :type x: scipy.sparse.spmatrix
+        :param x: the design matrix, with one row per sample
+        :param y: the target of each sample
+        :param warm_start: a boolean that indicates if the parameters learned
+        in a previous call are used as the starting point, for instance when
+        the model is trained again on the same design matrix with other
+        hyperparameters. The design matrix must have the same variables
+        :return: this model
+        """
+        self.fit_predict(x, y, None, warm_start)
+        return self
+
+    def fit_predict(self, x_train, y_train, x_test, warm_start=False):
+        """
+        Trains the model and predicts the target of the test samples. For the
+        MCMC method the predictions are averaged over all the samples drawn
+        during the training, like libFM does, so this method has to be used
+        instead of fit and predict
+
+        :type x_train: scipy.sparse.spmatrix
+        :param x_train: the design matrix of the training samples
+        :param y_train: the target of each training sample
+        :type x_test: scipy.sparse.spmatrix
+        :param x_test: the design matrix of the test samples, it can be None
+        :param warm_start: a boolean that indicates if the parameters learned
+        in a previous call are used as the starting point. The design matrices
+        must have the same variables
+        :rtype: numpy.ndarray
+        :return: the predictions for the test samples, or None if x_test is
+        None
+        """
+        x_train = sparse.csr_matrix(x_train, dtype=numpy.float64)
+        y_train = numpy.asarray(y_train, dtype=numpy.float64)
+        num_variables = x_train.shape[1]
+        if x_test is not None:
+            x_test = sparse.csr_matrix(x_test, dtype=numpy.float64)
+            num_variables = max(num_variables, x_test.shape[1])
+            x_test = _resize(x_test, num_variables)
+        x_train = _resize(x_train, num_variables)
+
+        self.min_target = y_train.min()
+        self.max_target = y_train.max()
+        self._initialize(num_variables, warm_start)
+
+        if self.method == 'sgd':
+            self._fit_sgd(x_train, y_train)
+        elif self.method == 'als':
+            self._fit_als(x_train, y_train)
+        elif self.method == 'mcmc':
+            return self._fit_mcmc(x_train, y_train, x_test)
+
+        if x_test is None:
+            return None
+        return self.predict(x_test)
+
+    def predict(self, x):
+        """
+        Predicts the target of the given samples with the current parameters.
+        The predictions are clipped to the range of the training targets
+
+        :type x: scipy.sparse.spmatrix
+        :param x: the design matrix of the samples
+        :rtype: numpy.ndarray
+        :return: the predictions
+        """
+        x = _resize(sparse.csr_matrix(x, dtype=numpy.float64), len(self.w))
+        predictions = self._predict(x, x.dot(self.v))
+        return numpy.clip(predictions, self.min_target, self.max_target)
+
+    def _initialize(self, num_variables, warm_start):
+        if warm_start and self.w is not None:
+            if self.v.shape != (num_variables, self.num_factors):
+                raise ValueError(
+                    'The model can\'t be warm started with %d variables and %d '
+                    'factors, it was trained with %d variables and %d factors'
+                    % ((num_variables, self.num_factors) + self.v.shape))
+            return
+
+        self.w0 = 0.
+        self.w = numpy.zeros(num_variables)
+        self.v = self.random_state.normal(
+            0., self.init_stdev, (num_variables, self.num_factors))
+
+    def _predict(self, x, q):
+        """
+        Calculates the predictions without clipping them
+
+        :param x: the design matrix
+        :param q: the product between the design matrix and the latent factors
+        :return: the predictions
+        """
+        squared_sum = x.multiply(x).dot(self.v * self.v).sum(axis=1)
+        predictions = 0.5 * ((q * q).sum(axis=1) - squared_sum)
+        if self.use_bias:
+            predictions += self.w0
+        if self.use_1way_interactions:
+            predictions += x.dot(self.w)
+        return predictions
+
+    def _fit_sgd(self, x, y):
+        reg0, reg1, reg2 = self.regularization
+        num_samples = x.shape[0]
+
+        for _ in xrange(self.num_iterations):
+            permutation = self.random_state.permutation(num_samples)
+
+            for start in xrange(0, num_samples, self.batch_size):
+                batch = permutation[start:start + self.batch_size]
+                x_batch = x[batch]
+                q = x_batch.dot(self.v)
+                error = self._predict(x_batch, q) - y[batch]
+                x_batch_t = x_batch.T.tocsr()
+                # The gradient of each variable is averaged over the samples
+                # of the batch in which it appears, which keeps the step of
+                # the sparse variables close to the one of single sample SGD,
+                # and only the variables that appear in the batch are
+                # regularized
+                counts = numpy.bincount(
+                    x_batch.indices, minlength=x_batch.shape[1])
+                touched = numpy.flatnonzero(counts)
+                counts = counts[touched].astype(numpy.float64)
+
+                if self.use_bias:
+                    self.w0 -= self.learn_rate * (
+                        error.mean() + reg0 * self.w0)
+                if self.use_1way_interactions:
+                    gradient = x_batch_t.dot(error)[touched] / counts
+                    self.w[touched] -= self.learn_rate * (
+                        gradient + reg1 * self.w[touched])
+                gradient = (
+                    x_batch_t.dot(error[:, numpy.newaxis] * q) -
+                    x_batch.multiply(x_batch).T.dot(error)[:, numpy.newaxis] *
+                    self.v)[touched] / counts[:, numpy.newaxis]
+                self.v[touched] -= self.learn_rate * (
+                    gradient + reg2 * self.v[touched])
+
+    def _fit_als(self, x, y):
+        reg0, reg1, reg2 = self.regularization
+        blocks = _ColumnBlocks(x)
+        num_samples = x.shape[0]
+
+        for _ in xrange(self.num_iterations):
+            q = x.dot(self.v)
+            error = self._predict(x, q) - y
+
+            if self.use_bias:
+                new_w0 = (self.w0 * num_samples - error.sum()) / \
+                    (num_samples + reg0)
+                error += new_w0 - self.w0
+                self.w0 = new_w0
+
+            for block in blocks:
+                if self.use_1way_interactions:
+                    self._solve_w(block, error, reg1, 0., None)
+                for factor in xrange(self.num_factors):
+                    self._solve_v(block, factor, q, error, reg2, 0., None)
+
+    def _fit_mcmc(self, x, y, x_test):
+        blocks = _ColumnBlocks(x)
+        num_samples = x.shape[0]
+        prediction_sum = None
+        if x_test is not None:
+            prediction_sum = numpy.zeros(x_test.shape[0])
+
+        for _ in xrange(self.num_iterations):
+            q = x.dot(self.v)
+            error = self._predict(x, q) - y
+
+            self._sample_hyperparameters(error)
+
+            if self.use_bias:
+                precision = self.alpha * num_samples
+                mean = self.alpha * (self.w0 * num_samples - error.sum()) / \
+                    precision
+                new_w0 = mean + \
+                    self.random_state.normal() / numpy.sqrt(precision)
+                error += new_w0 - self.w0
+                self.w0 = new_w0
+
+            for block in blocks:
+                if self.use_1way_interactions:
+                    self._solve_w(
+                        block, error, self.lambda_w, self.mu_w, self.alpha)
+                for factor in xrange(self.num_factors):
+                    self._solve_v(
+                        block, factor, q, error, self.lambda_v[factor],
+                        self.mu_v[factor], self.alpha)
+
+            if x_test is not None:
+                prediction_sum += self.predict(x_test)
+
+        if x_test is None:
+            return None
+        return prediction_sum / self.num_iterations
+
+    def _sample_hyperparameters(self, error):
+        alpha_n = ALPHA_0 + len(error)
+        gamma_n = GAMMA_0 + numpy.dot(error, error)
+        self.alpha = self.random_state.gamma(alpha_n / 2., 2. / gamma_n)
+
+        if self.use_1way_interactions:
+            self.mu_w, self.lambda_w = self._sample_normal_gamma(
+                self.w, self.mu_w, self.lambda_w)
+        for factor in xrange(self.num_factors):
+            self.mu_v[factor], self.lambda_v[factor] = \
+                self._sample_normal_gamma(
+                    self.v[:, factor], self.mu_v[factor],
+                    self.lambda_v[factor])
+
+    def _sample_normal_gamma(self, values, mu, lambda_):
+        """
+        Samples the mean and the precision of the prior of the given
+        parameters from their Normal-Gamma posterior
+
+        :param values: the parameters
+        :param mu: the current mean
+        :param lambda_: the current precision
+        :return: a tuple with the new mean and precision
+        """
+        num_values = len(values)
+        if lambda_ <= 0.:
+            lambda_ = 1.
+        mean = (values.sum() + BETA_0 * MU_0) / (num_values + BETA_0)
+        mu = self.random_state.normal(
+            mean, 1. / numpy.sqrt((num_values + BETA_0) * lambda_))
+        alpha_n = ALPHA_0 + num_values + 1
+        gamma_n = GAMMA_0 + ((values - mu) ** 2).sum() + \
+            BETA_0 * (mu - MU_0) ** 2
+        lambda_ = self.random_state.gamma(alpha_n / 2., 2. / gamma_n)
+        return mu, lambda_
+
+    def _solve_w(self, block, error, lambda_, mu, alpha):
+        """
+        Updates the 1-way interactions of the given block of columns, solving
+        the least squares problem of each one (ALS) or sampling them from
+        their posterior (MCMC, when alpha is not None)
+        """
+        old_w = self.w[block.columns]
+        sum_h2 = block.bincount_columns(block.data * block.data)
+        sum_eh = block.bincount_columns(error[block.rows] * block.data)
+        new_w = self._draw(old_w, sum_h2, sum_eh, lambda_, mu, alpha)
+        delta = new_w - old_w
+        error += block.bincount_rows(block.data * delta[block.local_columns])
+        self.w[block.columns] = new_w
+
+    def _solve_v(self, block, factor, q, error, lambda_, mu, alpha):
+        """
+        Updates the latent factor of the given block of columns, solving the
+        least squares problem of each one (ALS) or sampling them from their
+        posterior (MCMC, when alpha is not None)
+        """
+        old_v = self.v[block.columns, factor]
+        h = block.data * q[block.rows, factor] - \
+            block.squared_data * old_v[block.local_columns]
+        sum_h2 = block.bincount_columns(h * h)
+        sum_eh = block.bincount_columns(error[block.rows] * h)
+        new_v = self._draw(old_v, sum_h2, sum_eh, lambda_, mu, alpha)
+        delta = new_v - old_v
+        error += block.bincount_rows(h * delta[block.local_columns])
+        q[:, factor] += \
+            block.bincount_rows(block.data * delta[block.local_columns])
+        self.v[block.columns, factor] = new_v
+
+    def _draw(self, old_values, sum_h2, sum_eh, lambda_, mu, alpha):
+        if alpha is None:
+            # Variables that don't appear in the training data and aren't
+            # regularized keep their values
+            denominator = sum_h2 + lambda_
+            solvable = denominator > 0
+            new_values = old_values.copy()
+            new_values[solvable] = \
+                (old_values * sum_h2 - sum_eh)[solvable] / \
+                denominator[solvable]
+            return new_values
+
+        precision = alpha * sum_h2 + lambda_
+        mean = (alpha * (old_values * sum_h2 - sum_eh) + mu * lambda_) / \
+            precision
+        return mean + self.random_state.normal(size=len(mean)) / \
+            numpy.sqrt(precision)
+
+
+class _ColumnBlocks(object):
+    """
+    Splits the columns of a design matrix in groups of consecutive columns in
+    which every row has at most one non-zero value. The variables of a group
+    don't interact with each other, so they can all be updated at once
+    """
+
+    def __init__(self, x):
+        x = sparse.csc_matrix(x)
+        x.sort_indices()
+        self.num_rows = x.shape[0]
+        self.blocks = []
+
+        used_rows = numpy.zeros(self.num_rows, dtype=bool)
+        start = 0
+        for column in xrange(x.shape[1]):
+            rows = x.indices[x.indptr[column]:x.indptr[column + 1]]
+            if used_rows[rows].any():
+                self.blocks.append(_ColumnBlock(x, start, column))
+                used_rows[:] = False
+                start = column
+            used_rows[rows] = True
+        if start < x.shape[1]:
+            self.blocks.append(_ColumnBlock(x, start, x.shape[1]))
+
+    def __iter__(self):
+        return iter(self.blocks)
+
+
+class _ColumnBlock(object):
+
+    def __init__(self, x, start, end):
+        begin = x.indptr[start]
+        finish = x.indptr[end]
+        self.num_rows = x.shape[0]
+        self.num_columns = end - start
+        self.columns = numpy.arange(start, end)
+        self.rows = x.indices[begin:finish]
+        self.data = x.data[begin:finish]
+        self.squared_data = self.data * self.data
+        self.local_columns = numpy.repeat(
+            numpy.arange(self.num_columns), numpy.diff(x.indptr[start:end + 1]))
+
+    def bincount_columns(self, values):
+        return numpy.bincount(
+            self.local_columns, values, minlength=self.num_columns)
+
+    def bincount_rows(self, values):
+        return numpy.bincount(self.rows, values, minlength=self.num_rows)
+
+
+def _resize(x, num_columns):
+    if x.shape[1] == num_columns:
+        return x
+    x = x.copy()
+    x.resize((x.shape[0], num_columns))
+    return x
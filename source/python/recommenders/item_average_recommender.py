@@ -11,7 +11,7 @@ class ItemAverageRecommender(BaseRecommender):
         self._rating = None
         self.has_context = False
 
-    def load(self, reviews):
+    def load(self, reviews, ratings_store=None):
         self.reviews = reviews
 
     def predict_rating(self, user_id, item_id):
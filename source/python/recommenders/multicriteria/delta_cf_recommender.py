@@ -13,18 +13,7 @@ class DeltaCFRecommender(MultiCriteriaBaseRecommender):
             similarity_metric=similarity_metric,
             significant_criteria_ranges=significant_criteria_ranges)
 
-    def predict_rating(self, user_id, item_id):
-        """
-        Predicts the rating the user will give to the hotel
-
-        :param user_id: the ID of the user
-        :param item_id: the ID of the hotel
-        :return: a float between 1 and 5 with the predicted rating
-        """
-        if user_id not in self.user_ids:
-            return None
-
-        neighbourhood = self.get_neighbourhood(user_id)
+    def calculate_rating(self, user_id, item_id, neighbourhood):
 
         weighted_sum = 0.
         z_denominator = 0.
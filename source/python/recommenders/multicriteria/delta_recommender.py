@@ -12,18 +12,7 @@ class DeltaRecommender(MultiCriteriaBaseRecommender):
             similarity_metric=None,
             significant_criteria_ranges=significant_criteria_ranges)
 
-    def predict_rating(self, user_id, item_id):
-        """
-        Predicts the rating the user will give to the hotel
-
-        :param user_id: the ID of the user
-        :param item_id: the ID of the hotel
-        :return: a float between 1 and 5 with the predicted rating
-        """
-        if user_id not in self.user_dictionary:
-            return None
-
-        neighbourhood = self.get_neighbourhood(user_id)
+    def calculate_rating(self, user_id, item_id, neighbourhood):
         similarities_ratings_sum = 0.
         num_users = 0
 
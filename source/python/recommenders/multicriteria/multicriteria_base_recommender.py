@@ -1,4 +1,4 @@
-from abc import ABCMeta
+from abc import ABCMeta, abstractmethod
 
 from recommenders.similarity.weights_similarity_matrix_builder import \
     WeightsSimilarityMatrixBuilder
@@ -22,7 +22,7 @@ class MultiCriteriaBaseRecommender(BaseRecommender):
         self._similarity_matrix_builder = WeightsSimilarityMatrixBuilder(similarity_metric)
         self.user_cluster_dictionary = None
 
-    def load(self, reviews):
+    def load(self, reviews, ratings_store=None):
         self.reviews = reviews
         self.user_ids = extractor.get_groupby_list(self.reviews, 'user_id')
         self.user_dictionary =\
@@ -59,6 +59,56 @@ class MultiCriteriaBaseRecommender(BaseRecommender):
 
         return intersection_lst  # [:self._num_neighbors]
 
+    def predict_rating(self, user_id, item_id):
+        """
+        Predicts the rating the user will give to the hotel
+
+        :param user_id: the ID of the user
+        :param item_id: the ID of the hotel
+        :return: a float between 1 and 5 with the predicted rating
+        """
+        if user_id not in self.user_dictionary:
+            return None
+
+        neighbourhood = self.get_neighbourhood(user_id)
+
+        return self.calculate_rating(user_id, item_id, neighbourhood)
+
+    def predict_user_ratings(self, user_id, item_ids, context=None):
+        """
+        Predicts the ratings the user will give to several hotels. The
+        neighbourhood of the user doesn't depend on the hotel, so it is built
+        only once
+
+        :param user_id: the ID of the user
+        :param item_ids: the IDs of the hotels
+        :param context: ignored, since these recommenders don't use context
+        :return: a list with the predicted rating of each hotel, with None for
+        the ratings that can't be predicted
+        """
+        if user_id not in self.user_dictionary:
+            return [None] * len(item_ids)
+
+        neighbourhood = self.get_neighbourhood(user_id)
+
+        return [
+            self.calculate_rating(user_id, item_id, neighbourhood)
+            for item_id in item_ids
+        ]
+
+    @abstractmethod
+    def calculate_rating(self, user_id, item_id, neighbourhood):
+        """
+        Predicts the rating the user will give to the hotel, using the given
+        neighbourhood of the user
+
+        :param user_id: the ID of the user
+        :param item_id: the ID of the hotel
+        :param neighbourhood: the neighbourhood of the user, as returned by
+        get_neighbourhood
+        :return: a float between 1 and 5 with the predicted rating
+        """
+
     @staticmethod
     def build_user_clusters(reviews, significant_criteria_ranges=None):
         """
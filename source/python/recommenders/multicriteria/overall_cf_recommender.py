@@ -13,12 +13,7 @@ class OverallCFRecommender(MultiCriteriaBaseRecommender):
             similarity_metric=similarity_metric,
             significant_criteria_ranges=significant_criteria_ranges)
 
-    def predict_rating(self, user_id, item_id):
-
-        if user_id not in self.user_ids:
-            return None
-
-        neighbourhood = self.get_neighbourhood(user_id)
+    def calculate_rating(self, user_id, item_id, neighbourhood):
 
         weighted_sum = 0.
         z_denominator = 0.
@@ -12,12 +12,7 @@ class OverallRecommender(MultiCriteriaBaseRecommender):
             similarity_metric=None,
             significant_criteria_ranges=significant_criteria_ranges)
 
-    def predict_rating(self, user_id, item_id):
-
-        if user_id not in self.user_dictionary:
-            return None
-
-        neighbourhood = self.get_neighbourhood(user_id)
+    def calculate_rating(self, user_id, item_id, neighbourhood):
         similarities_ratings_sum = 0.
         num_users = 0
 
@@ -1,4 +1,7 @@
 from unittest import TestCase
+
+import numpy
+
 from recommenders.multicriteria.delta_recommender import DeltaRecommender
 
 
@@ -50,3 +53,14 @@ class TestDeltaRecommender(TestCase):
 
         recommender.load(reviews_matrix_5[3:])
         self.assertAlmostEqual(7.8, recommender.predict_rating('U1', 5), places=7)
+
+    def test_predict_many(self):
+        recommender = DeltaRecommender(significant_criteria_ranges=None)
+        recommender.load(reviews_matrix_5)
+
+        predictions = recommender.predict_many(
+            ['U1', 'U4', 'U4', 'U1'], [5, 5, 6, 5])
+        self.assertAlmostEqual(6.8, predictions[0], places=7)
+        self.assertAlmostEqual(7.1333333333333337, predictions[1])
+        self.assertTrue(numpy.isnan(predictions[2]))
+        self.assertAlmostEqual(6.8, predictions[3], places=7)
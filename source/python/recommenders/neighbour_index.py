@@ -0,0 +1,216 @@
+import collections
+
+import numpy
+
+__author__ = 'fpena'
+
+
+class NeighbourIndex(object):
+    """
+    Index with the neighbours of every user sorted by their similarity, which
+    returns the neighbourhood of a user restricted to the users who have rated
+    an item without copying, filtering and sorting the similarity row of the
+    user on every prediction.
+
+    The neighbours of each user are stored sorted by similarity in flat
+    arrays, together with the position (rank) of each neighbour in that order,
+    and there is an inverted index with the users who have rated each item.
+    The neighbourhood of a (user, item) pair is obtained either by looking up
+    the ranks of the raters of the item, or, when the item has many raters and
+    only the top k neighbours are needed, by walking the sorted neighbours of
+    the user until k raters are found. The neighbourhoods are memoized in an
+    LRU cache, so the repeated queries of the top-N evaluations are free.
+
+    The users that don't have a similarity with the user (None or NaN) are
+    never part of its neighbourhood. Ties are broken by the order of the users
+    in the similarity matrix
+    """
+
+    def __init__(self, similarity_matrix, user_dictionary,
+                 skip_dissimilar=False, cache_size=10000):
+        """
+        :param similarity_matrix: a dictionary of dictionaries or a
+        SimilarityMatrix with the similarity between the users
+        :param user_dictionary: a dictionary with the users, by user ID, used
+        to know which users have rated each item
+        :param skip_dissimilar: if True, the users that have a similarity of 0
+        with the user are not part of its neighbourhood
+        :param cache_size: the number of neighbourhoods kept in the LRU cache
+        """
+        self.user_ids = list(similarity_matrix)
+        self.user_index = {
+            user_id: index for index, user_id in enumerate(self.user_ids)}
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+
+        indptr = [0]
+        sorted_neighbours = []
+        sorted_columns = []
+        sorted_ranks = []
+
+        for row, user_id in enumerate(self.user_ids):
+            columns, similarities = self._get_row(similarity_matrix, user_id)
+            mask = (columns != row) & ~numpy.isnan(similarities)
+            if skip_dissimilar:
+                mask &= similarities != 0
+            columns = columns[mask]
+            similarities = similarities[mask]
+
+            # Sorted by similarity in descending order, ties by column
+            neighbours = columns[numpy.lexsort((columns, -similarities))]
+            column_order = numpy.argsort(neighbours, kind='mergesort')
+
+            sorted_neighbours.append(neighbours)
+            sorted_columns.append(neighbours[column_order])
+            sorted_ranks.append(column_order)
+            indptr.append(indptr[-1] + len(neighbours))
+
+        self._indptr = numpy.array(indptr, dtype=numpy.int64)
+        self._neighbours = _concatenate(sorted_neighbours)
+        self._columns = _concatenate(sorted_columns)
+        self._ranks = _concatenate(sorted_ranks)
+
+        self._item_raters = {}
+        for item_id, user_ids in \
+                build_item_user_ids(user_dictionary).iteritems():
+            raters = [
+                self.user_index[user_id] for user_id in user_ids
+                if user_id in self.user_index
+            ]
+            self._item_raters[item_id] =\
+                numpy.unique(numpy.array(raters, dtype=numpy.int64))
+
+    def _get_row(self, similarity_matrix, user_id):
+        """
+        Returns the similarities of a user as a tuple of arrays with the
+        indices of the other users and the similarities with them
+        """
+        csr_matrix = getattr(similarity_matrix, 'csr_matrix', None)
+        if csr_matrix is not None:
+            # A SimilarityMatrix, whose rows and columns are already in the
+            # order of self.user_ids
+            row = self.user_index[user_id]
+            start = csr_matrix.indptr[row]
+            end = csr_matrix.indptr[row + 1]
+            return (
+                numpy.array(csr_matrix.indices[start:end], dtype=numpy.int64),
+                numpy.array(csr_matrix.data[start:end], dtype=numpy.float64))
+
+        row = similarity_matrix[user_id]
+        neighbours = [
+            neighbour for neighbour in row if neighbour in self.user_index]
+        columns = numpy.array(
+            [self.user_index[neighbour] for neighbour in neighbours],
+            dtype=numpy.int64)
+        similarities = numpy.array(
+            [numpy.nan if row[neighbour] is None else row[neighbour]
+             for neighbour in neighbours],
+            dtype=numpy.float64)
+
+        return columns, similarities
+
+    def get_neighbourhood(self, user_id, item_id, num_neighbours=None):
+        """
+        Returns the neighbours of the user who have rated the item, sorted by
+        their similarity with the user
+
+        :param user_id: the ID of the user
+        :param item_id: the ID of the item
+        :param num_neighbours: the maximum number of neighbours that are
+        returned, or None (or 0) to return all of them
+        :return: a tuple with the IDs of the neighbours
+        """
+        key = (user_id, item_id, num_neighbours)
+        neighbourhood = self._cache.pop(key, None)
+
+        if neighbourhood is None:
+            row = self.user_index.get(user_id)
+            raters = self._item_raters.get(item_id)
+            if row is None or raters is None:
+                neighbourhood = ()
+            else:
+                neighbourhood = tuple(
+                    self.user_ids[neighbour] for neighbour in
+                    self._find_neighbours(row, raters, num_neighbours))
+
+        # The most recently used neighbourhoods are at the end of the cache
+        self._cache[key] = neighbourhood
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+        return neighbourhood
+
+    def _find_neighbours(self, row, raters, num_neighbours):
+        start = self._indptr[row]
+        end = self._indptr[row + 1]
+
+        if start == end:
+            return self._neighbours[start:end]
+
+        # Walking the sorted neighbours takes about
+        # num_neighbours * num_user_neighbours / num_raters steps, while
+        # looking up the ranks of the raters takes num_raters steps
+        if num_neighbours and \
+                num_neighbours * (end - start) < len(raters) ** 2:
+            return self._merge_neighbours(start, end, raters, num_neighbours)
+
+        columns = self._columns[start:end]
+        positions = numpy.searchsorted(columns, raters)
+        found = positions < len(columns)
+        positions = positions[found]
+        positions = positions[columns[positions] == raters[found]]
+        ranks = self._ranks[start:end][positions]
+
+        if num_neighbours and len(ranks) > num_neighbours:
+            ranks = numpy.partition(ranks, num_neighbours - 1)[:num_neighbours]
+        ranks.sort()
+
+        return self._neighbours[start + ranks]
+
+    def _merge_neighbours(self, start, end, raters, num_neighbours):
+        """
+        Walks the neighbours of a user in order of similarity, in chunks that
+        double in size, and stops as soon as num_neighbours of them have rated
+        the item
+        """
+        hits = []
+        num_hits = 0
+        chunk_start = start
+        chunk_size = 4 * num_neighbours
+
+        while chunk_start < end and num_hits < num_neighbours:
+            chunk_end = min(chunk_start + chunk_size, end)
+            chunk = self._neighbours[chunk_start:chunk_end]
+            chunk_hits = chunk[numpy.isin(chunk, raters, assume_unique=True)]
+            chunk_hits = chunk_hits[:num_neighbours - num_hits]
+            hits.append(chunk_hits)
+            num_hits += len(chunk_hits)
+            chunk_start += chunk_size
+            chunk_size *= 2
+
+        return numpy.concatenate(hits)
+
+    def clear_cache(self):
+        self._cache.clear()
+
+
+def _concatenate(arrays):
+    if not arrays:
+        return numpy.array([], dtype=numpy.int64)
+    return numpy.concatenate(arrays).astype(numpy.int64)
+
+
+def build_item_user_ids(user_dictionary):
+    """
+    Builds an index with the users who have rated each item
+
+    :param user_dictionary: a dictionary with the users, by user ID
+    :return: a dictionary with the ID of each item as the key, and the list of
+    the IDs of the users who have rated it as the value
+    """
+    item_user_ids = {}
+    for user_id, user in user_dictionary.items():
+        for item_id in user.item_ratings:
+            item_user_ids.setdefault(item_id, []).append(user_id)
+
+    return item_user_ids
@@ -7,11 +7,14 @@ class BaseSimilarityMatrixBuilder:
 
     __metaclass__ = ABCMeta
 
-    def __init__(self, name, similarity_metric, is_multi_criteria):
+    def __init__(
+            self, name, similarity_metric, is_multi_criteria,
+            similarity_engine=None):
         self._name = name
         self._similarity_metric = similarity_metric
         self._is_multi_criteria = is_multi_criteria
         self._min_common_items = None
+        self._similarity_engine = similarity_engine
 
     def build_similarity_matrix(self, user_dictionary, user_ids):
         """
@@ -19,6 +22,27 @@ class BaseSimilarityMatrixBuilder:
         in the dataset of this recommender system. This is particularly useful
         to prevent repeating the same calculations in each cycle
 
+        If this builder has a similarity engine, the similarities are calculated
+        for all the pairs of users at once with the engine and a
+        SimilarityMatrix is returned, which can be indexed in the same way as
+        the dictionary of dictionaries returned by
+        build_dense_similarity_matrix
+
+        """
+        if self._similarity_engine is not None:
+            return self.build_sparse_similarity_matrix(
+                user_dictionary, user_ids)
+
+        return self.build_dense_similarity_matrix(user_dictionary, user_ids)
+
+    def build_dense_similarity_matrix(self, user_dictionary, user_ids):
+        """
+        Builds the similarity matrix as a dictionary of dictionaries, by
+        calculating the similarity between every pair of users one at a time
+
+        :param user_dictionary: a dictionary of users
+        :param user_ids: the IDs of the users
+        :return: a dictionary of dictionaries with the similarities
         """
         user_similarity_matrix = {}
 
@@ -32,6 +56,19 @@ class BaseSimilarityMatrixBuilder:
 
         return user_similarity_matrix
 
+    def build_sparse_similarity_matrix(self, user_dictionary, user_ids):
+        """
+        Builds the similarity matrix using this builder's similarity engine.
+        The builders that can't use the engine calculate the similarities one
+        pair at a time, in the same way as when there is no engine
+
+        :param user_dictionary: a dictionary of users
+        :param user_ids: the IDs of the users
+        :return: a SimilarityMatrix, or a dictionary of dictionaries if this
+        builder doesn't support the similarity engine
+        """
+        return self.build_dense_similarity_matrix(user_dictionary, user_ids)
+
     @abstractmethod
     def calculate_users_similarity(self, user_dictionary, user_id1, user_id2):
         pass
@@ -8,9 +8,15 @@ __author__ = 'fpena'
 
 class MultiSimilarityMatrixBuilder(BaseSimilarityMatrixBuilder):
 
-    def __init__(self, similarity_metric):
+    def __init__(self, similarity_metric, similarity_engine=None):
         super(MultiSimilarityMatrixBuilder, self).__init__(
-            'MultiStandardSimilarity', similarity_metric, True)
+            'MultiStandardSimilarity', similarity_metric, True,
+            similarity_engine)
+
+    def build_sparse_similarity_matrix(self, user_dictionary, user_ids):
+        return self._similarity_engine.build_item_vectors_similarity_matrix(
+            user_dictionary, user_ids, self._similarity_metric,
+            self._min_common_items)
 
     def calculate_users_similarity(self, user_dictionary, user1, user2):
 
@@ -26,7 +32,7 @@ class MultiSimilarityMatrixBuilder(BaseSimilarityMatrixBuilder):
         user1_overall_ratings = user_dictionary[user1].item_ratings
         user1_multi_ratings = user_dictionary[user1].item_multi_ratings
 
-        user2_overall_ratings = user_dictionary[user1].item_ratings
+        user2_overall_ratings = user_dictionary[user2].item_ratings
         user2_multi_ratings = user_dictionary[user2].item_multi_ratings
 
         similarity_sum = 0.
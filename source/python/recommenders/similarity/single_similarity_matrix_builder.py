@@ -7,25 +7,26 @@ __author__ = 'fpena'
 
 
 class SingleSimilarityMatrixBuilder(BaseSimilarityMatrixBuilder):
-    def __init__(self, similarity_metric):
+    def __init__(self, similarity_metric, similarity_engine=None):
         super(SingleSimilarityMatrixBuilder, self).__init__(
-            'SingleSimilarity', similarity_metric, False)
+            'SingleSimilarity', similarity_metric, False, similarity_engine)
+
+    def build_sparse_similarity_matrix(self, user_dictionary, user_ids):
+        return self._similarity_engine.build_similarity_matrix(
+            user_dictionary, user_ids, self._similarity_metric,
+            self._min_common_items)
 
     def calculate_users_similarity(self, user_dictionary, user1, user2):
-        common_items = extractor.get_common_items(user_dictionary, user1, user2)
+        user1_ratings, user2_ratings =\
+            extractor.get_common_item_ratings(user_dictionary, user1, user2)
 
-        if not common_items:
+        if not len(user1_ratings):
             return None
 
         if self._min_common_items is not None and len(
-                common_items) < self._min_common_items:
+                user1_ratings) < self._min_common_items:
             return None
 
-        user1_ratings =\
-            extractor.get_user_ratings(user_dictionary, user1, common_items)
-        user2_ratings =\
-            extractor.get_user_ratings(user_dictionary, user2, common_items)
-
         similarity_value = similarity_calculator.calculate_similarity(
             user1_ratings, user2_ratings, self._similarity_metric)
 
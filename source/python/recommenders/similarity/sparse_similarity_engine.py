@@ -0,0 +1,608 @@
+import collections
+
+import numpy
+from scipy import sparse
+from scipy.spatial import distance
+
+__author__ = 'fpena'
+
+
+SIMILARITY_METRICS = [
+    'chebyshev',
+    'cosine',
+    'euclidean',
+    'manhattan',
+    'pearson'
+]
+
+CDIST_METRICS = {
+    'chebyshev': 'chebyshev',
+    'cosine': 'cosine',
+    'euclidean': 'euclidean',
+    'manhattan': 'cityblock',
+    'pearson': 'correlation'
+}
+
+
+class SimilarityRow(collections.Mapping):
+    """
+    Read-only view over one row of a SimilarityMatrix. It behaves like the
+    dictionaries stored in the old dict-of-dicts similarity matrices, so code
+    such as matrix[user1][user2] or matrix[user1].copy() keeps working, but the
+    values are looked up with a binary search over the CSR row
+    """
+
+    def __init__(self, similarity_matrix, row_index):
+        self._similarity_matrix = similarity_matrix
+        csr_matrix = similarity_matrix.csr_matrix
+        start = csr_matrix.indptr[row_index]
+        end = csr_matrix.indptr[row_index + 1]
+        self._indices = csr_matrix.indices[start:end]
+        self._values = csr_matrix.data[start:end]
+
+    def __getitem__(self, user_id):
+        column = self._similarity_matrix.user_index.get(user_id)
+        if column is not None:
+            position = numpy.searchsorted(self._indices, column)
+            if position < len(self._indices) and \
+                    self._indices[position] == column:
+                return float(self._values[position])
+        raise KeyError(user_id)
+
+    def __iter__(self):
+        user_ids = self._similarity_matrix.user_ids
+        for column in self._indices:
+            yield user_ids[column]
+
+    def __len__(self):
+        return len(self._indices)
+
+    def copy(self):
+        return dict(self.items())
+
+
+class SimilarityMatrix(collections.Mapping):
+    """
+    Compact user-user similarity matrix backed by a scipy CSR matrix. It can be
+    used wherever a dict-of-dicts similarity matrix was used before, since
+    indexing it with a user ID returns a SimilarityRow
+    """
+
+    def __init__(self, csr_matrix, user_ids):
+        self.csr_matrix = csr_matrix
+        self.csr_matrix.sort_indices()
+        self.user_ids = list(user_ids)
+        self.user_index = {
+            user_id: index for index, user_id in enumerate(self.user_ids)}
+
+    def __getitem__(self, user_id):
+        return SimilarityRow(self, self.user_index[user_id])
+
+    def __iter__(self):
+        return iter(self.user_ids)
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def get_similarity(self, user1, user2):
+        return self[user1].get(user2)
+
+    def to_dict(self):
+        """
+        Returns the similarity matrix as a dictionary of dictionaries, in the
+        same format produced by
+        BaseSimilarityMatrixBuilder.build_similarity_matrix
+
+        :return: a dictionary of dictionaries with the similarities
+        """
+        return {user_id: self[user_id].copy() for user_id in self.user_ids}
+
+
+class SparseSimilarityEngine(object):
+    """
+    Calculates the similarity between every pair of users at once using sparse
+    matrix products over a user x item ratings matrix, instead of looping over
+    each pair of users in Python. The similarity is calculated only over the
+    items that both users have rated, exactly like the loop based builders do.
+
+    Only the upper triangle of the matrix is calculated, in blocks of
+    block_size rows, and then it is mirrored to obtain the symmetric matrix.
+    The ratings are expected to be strictly positive.
+    """
+
+    def __init__(self, block_size=1000, top_k=None):
+        self._block_size = block_size
+        self._top_k = top_k
+
+    @staticmethod
+    def build_ratings_matrix(user_dictionary, user_ids, item_ids=None):
+        """
+        Builds a CSR user x item matrix with the overall ratings the users have
+        given to the items
+
+        :param user_dictionary: a dictionary of users as returned by
+        extractor.initialize_users
+        :param user_ids: the IDs of the users, in the order in which they will
+        appear as rows of the matrix
+        :param item_ids: the IDs of the items, in the order in which they will
+        appear as columns of the matrix. If None then it is calculated from the
+        users' ratings
+        :return: a tuple (ratings_matrix, item_ids)
+        """
+        store = user_dictionary[user_ids[0]].store if user_ids else None
+        if item_ids is None and store is not None and all(
+                user_dictionary[user_id].store is store for user_id in user_ids):
+            # The users are views over a RatingsStore, which already has the
+            # ratings in CSR format
+            store_matrix = sparse.csr_matrix(
+                (store.user_ratings, store.user_items, store.user_indptr),
+                shape=(len(store.user_ids), len(store.item_ids)))
+            rows = [user_dictionary[user_id].row for user_id in user_ids]
+            ratings_matrix = store_matrix[rows]
+            validate_ratings(ratings_matrix.data)
+            return ratings_matrix, store.item_ids
+
+        if item_ids is None:
+            item_set = set()
+            for user_id in user_ids:
+                item_set.update(user_dictionary[user_id].item_ratings.keys())
+            item_ids = sorted(item_set)
+        item_index = {item_id: index for index, item_id in enumerate(item_ids)}
+
+        rows = []
+        columns = []
+        values = []
+        for row, user_id in enumerate(user_ids):
+            for item_id, rating in \
+                    user_dictionary[user_id].item_ratings.iteritems():
+                rows.append(row)
+                columns.append(item_index[item_id])
+                values.append(rating)
+
+        values = numpy.array(values, dtype=numpy.float64)
+        validate_ratings(values)
+
+        ratings_matrix = sparse.csr_matrix(
+            (values, (rows, columns)), shape=(len(user_ids), len(item_ids)))
+        ratings_matrix.sort_indices()
+
+        return ratings_matrix, item_ids
+
+    def build_similarity_matrix(
+            self, user_dictionary, user_ids, similarity_metric,
+            min_common_items=None):
+        """
+        Builds the similarity matrix between every pair of users using the
+        overall ratings that the users have given to the items they have rated
+        in common. This is equivalent to what SingleSimilarityMatrixBuilder
+        does
+
+        :param user_dictionary: a dictionary of users as returned by
+        extractor.initialize_users
+        :param user_ids: the IDs of the users
+        :param similarity_metric: the name of the similarity metric
+        :param min_common_items: the minimum number of items two users must have
+        rated in common in order to calculate their similarity
+        :return: a SimilarityMatrix
+        """
+        ratings_matrix, _ = self.build_ratings_matrix(user_dictionary, user_ids)
+        similarity_matrix = self.calculate_similarity_matrix(
+            ratings_matrix, similarity_metric, min_common_items)
+        return SimilarityMatrix(similarity_matrix, user_ids)
+
+    def calculate_similarity_matrix(
+            self, ratings_matrix, similarity_metric, min_common_items=None):
+        """
+        Calculates the similarity between every pair of rows of the given
+        ratings matrix considering only the columns in which both rows have a
+        value
+
+        :param ratings_matrix: a CSR user x item matrix with positive ratings
+        :param similarity_metric: the name of the similarity metric
+        :param min_common_items: the minimum number of items two users must have
+        rated in common in order to calculate their similarity
+        :return: a symmetric CSR user x user matrix with the similarities
+        """
+        validate_similarity_metric(similarity_metric)
+
+        ratings_matrix = sparse.csr_matrix(ratings_matrix, dtype=numpy.float64)
+        ratings_matrix.sort_indices()
+        binary_matrix = ratings_matrix.copy()
+        binary_matrix.data[:] = 1.
+        squares_matrix = ratings_matrix.copy()
+        squares_matrix.data **= 2
+
+        levels_matrices = None
+        if similarity_metric in ['chebyshev', 'manhattan']:
+            levels_matrices = self._build_levels_matrices(ratings_matrix)
+
+        num_users = ratings_matrix.shape[0]
+        block_rows = []
+        block_columns = []
+        block_values = []
+
+        for start in xrange(0, num_users, self._block_size):
+            end = min(start + self._block_size, num_users)
+
+            # We only calculate the upper triangle, starting at the diagonal
+            num_common = _product(binary_matrix[start:end], binary_matrix[start:])
+
+            if similarity_metric in ['chebyshev', 'manhattan']:
+                values = self._calculate_levels_block(
+                    num_common, levels_matrices, start, end,
+                    similarity_metric)
+            else:
+                values = self._calculate_products_block(
+                    ratings_matrix, binary_matrix, squares_matrix, start, end,
+                    num_common, similarity_metric)
+
+            coo_block = num_common.tocoo()
+            mask = numpy.isfinite(values)
+            if min_common_items is not None:
+                mask &= coo_block.data >= min_common_items
+            rows = coo_block.row + start
+            columns = coo_block.col + start
+            mask &= columns >= rows
+
+            block_rows.append(rows[mask])
+            block_columns.append(columns[mask])
+            block_values.append(values[mask])
+
+        similarity_matrix = self._build_symmetric_matrix(
+            block_rows, block_columns, block_values, num_users)
+
+        if self._top_k is not None:
+            similarity_matrix = keep_top_k(similarity_matrix, self._top_k)
+
+        return similarity_matrix
+
+    def build_item_vectors_similarity_matrix(
+            self, user_dictionary, user_ids, similarity_metric,
+            min_common_items=None):
+        """
+        Builds the similarity matrix between every pair of users as the average,
+        over the items both users have rated, of the similarity between the
+        multi-criteria rating vectors (overall rating first) they have given to
+        each item. This is equivalent to what MultiSimilarityMatrixBuilder
+        does.
+
+        The calculation is done item by item, computing the similarity between
+        all the users that have rated the item at once, so the work done is
+        proportional to the number of co-rated (user, user, item) triples.
+        Pearson similarities that are not valid (non positive or NaN) are
+        counted as 0
+
+        :param user_dictionary: a dictionary of users as returned by
+        extractor.initialize_users with the multi-criteria ratings
+        :param user_ids: the IDs of the users
+        :param similarity_metric: the name of the similarity metric
+        :param min_common_items: the minimum number of items two users must have
+        rated in common in order to calculate their similarity
+        :return: a SimilarityMatrix
+        """
+        validate_similarity_metric(similarity_metric)
+
+        item_raters = {}
+        item_vectors = {}
+        for row, user_id in enumerate(user_ids):
+            user = user_dictionary[user_id]
+            for item_id, rating in user.item_ratings.iteritems():
+                vector = [rating]
+                vector.extend(user.item_multi_ratings[item_id])
+                item_raters.setdefault(item_id, []).append(row)
+                item_vectors.setdefault(item_id, []).append(vector)
+
+        num_users = len(user_ids)
+        shape = (num_users, num_users)
+        sums_matrix = sparse.csr_matrix(shape, dtype=numpy.float64)
+        counts_matrix = sparse.csr_matrix(shape, dtype=numpy.float64)
+        chunk_rows = []
+        chunk_columns = []
+        chunk_values = []
+        chunk_size = 0
+
+        for item_id, raters in item_raters.iteritems():
+            raters = numpy.array(raters)
+            vectors = numpy.array(item_vectors[item_id], dtype=numpy.float64)
+
+            # The pairs of the upper triangle are generated one block of rows
+            # at a time, so the memory used by a popular item is bounded by
+            # block_size * raters instead of raters ** 2
+            for start in xrange(0, len(raters), self._block_size):
+                end = min(start + self._block_size, len(raters))
+                block_rows, block_columns = numpy.triu_indices(
+                    end - start, start, len(raters))
+                distances = distance.cdist(
+                    vectors[start:end], vectors,
+                    CDIST_METRICS[similarity_metric])
+                values = _distance_to_similarity(
+                    distances[block_rows, block_columns], similarity_metric)
+                block_rows += start
+                if similarity_metric == 'pearson':
+                    values[~(values > 0)] = 0.
+
+                rows = raters[block_rows]
+                columns = raters[block_columns]
+                chunk_rows.append(numpy.minimum(rows, columns))
+                chunk_columns.append(numpy.maximum(rows, columns))
+                chunk_values.append(values)
+                chunk_size += len(values)
+
+                # We periodically fold the partial results into the sparse
+                # matrices to keep the memory bounded
+                if chunk_size > self._block_size ** 2:
+                    sums_matrix, counts_matrix = _fold_chunks(
+                        sums_matrix, counts_matrix, chunk_rows,
+                        chunk_columns, chunk_values, shape)
+                    chunk_rows, chunk_columns, chunk_values = [], [], []
+                    chunk_size = 0
+
+        sums_matrix, counts_matrix = _fold_chunks(
+            sums_matrix, counts_matrix, chunk_rows, chunk_columns, chunk_values,
+            shape)
+
+        coo_sums = sums_matrix.tocoo()
+        counts = counts_matrix.tocoo().data
+        values = coo_sums.data / counts
+        mask = numpy.isfinite(values)
+        if min_common_items is not None:
+            mask &= counts >= min_common_items
+
+        similarity_matrix = self._build_symmetric_matrix(
+            [coo_sums.row[mask]], [coo_sums.col[mask]], [values[mask]],
+            num_users)
+
+        if self._top_k is not None:
+            similarity_matrix = keep_top_k(similarity_matrix, self._top_k)
+
+        return SimilarityMatrix(similarity_matrix, user_ids)
+
+    def build_vectors_similarity_matrix(
+            self, vectors, user_ids, similarity_metric):
+        """
+        Builds the similarity matrix between every pair of dense vectors, for
+        instance the criteria weights of the users. This is equivalent to what
+        WeightsSimilarityMatrixBuilder does
+
+        :param vectors: a list or an array with one vector per user
+        :param user_ids: the IDs of the users, in the same order as the vectors
+        :param similarity_metric: the name of the similarity metric
+        :return: a SimilarityMatrix
+        """
+        validate_similarity_metric(similarity_metric)
+
+        vectors = numpy.array(vectors, dtype=numpy.float64)
+        num_users = len(user_ids)
+        block_rows = []
+        block_columns = []
+        block_values = []
+
+        for start in xrange(0, num_users, self._block_size):
+            end = min(start + self._block_size, num_users)
+            distances = distance.cdist(
+                vectors[start:end], vectors[start:],
+                CDIST_METRICS[similarity_metric])
+            values = _distance_to_similarity(distances, similarity_metric)
+            if similarity_metric == 'pearson':
+                values[values <= 0] = numpy.nan
+
+            rows, columns = numpy.triu_indices(end - start, 0, num_users - start)
+            values = values[rows, columns]
+            mask = numpy.isfinite(values)
+            block_rows.append(rows[mask] + start)
+            block_columns.append(columns[mask] + start)
+            block_values.append(values[mask])
+
+        similarity_matrix = self._build_symmetric_matrix(
+            block_rows, block_columns, block_values, num_users)
+
+        if self._top_k is not None:
+            similarity_matrix = keep_top_k(similarity_matrix, self._top_k)
+
+        return SimilarityMatrix(similarity_matrix, user_ids)
+
+    @staticmethod
+    def _calculate_products_block(
+            ratings_matrix, binary_matrix, squares_matrix, start, end,
+            num_common, similarity_metric):
+        """
+        Calculates the cosine, euclidean or pearson similarities for the rows
+        between start and end. Since all the ratings are positive, every
+        product has the same sparsity pattern as num_common, which means that
+        their data arrays are aligned
+        """
+        counts = num_common.data
+        cross = _product(ratings_matrix[start:end], ratings_matrix[start:]).data
+        squares1 = _product(squares_matrix[start:end], binary_matrix[start:]).data
+        squares2 = _product(binary_matrix[start:end], squares_matrix[start:]).data
+
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            if similarity_metric == 'cosine':
+                return cross / numpy.sqrt(squares1 * squares2)
+
+            if similarity_metric == 'euclidean':
+                squared_distance = squares1 + squares2 - 2 * cross
+                tolerance = 1e-12 * (squares1 + squares2)
+                squared_distance[squared_distance <= tolerance] = 0.
+                return 1. / (1 + numpy.sqrt(squared_distance))
+
+            # Pearson correlation
+            sums1 = _product(ratings_matrix[start:end], binary_matrix[start:]).data
+            sums2 = _product(binary_matrix[start:end], ratings_matrix[start:]).data
+            covariance = cross - sums1 * sums2 / counts
+            variance1 = squares1 - sums1 ** 2 / counts
+            variance2 = squares2 - sums2 ** 2 / counts
+            # Constant vectors have an undefined correlation
+            variance1[variance1 <= 1e-12 * squares1] = numpy.nan
+            variance2[variance2 <= 1e-12 * squares2] = numpy.nan
+            correlation = covariance / numpy.sqrt(variance1 * variance2)
+            correlation[~(correlation > 0)] = numpy.nan
+            return numpy.minimum(correlation, 1.)
+
+    @staticmethod
+    def _build_levels_matrices(ratings_matrix):
+        """
+        Splits the ratings matrix into one binary matrix per distinct rating
+        value, so that the number of common items in which one user has given
+        rating a and the other user rating b can be calculated with a product
+        """
+        levels = numpy.unique(ratings_matrix.data)
+        levels_matrices = []
+        for level in levels:
+            level_matrix = ratings_matrix.copy()
+            level_matrix.data = (level_matrix.data == level).astype(
+                numpy.float64)
+            level_matrix.eliminate_zeros()
+            levels_matrices.append((level, level_matrix))
+        return levels_matrices
+
+    @staticmethod
+    def _calculate_levels_block(
+            num_common, levels_matrices, start, end, similarity_metric):
+        """
+        Calculates the chebyshev or manhattan similarities for the rows between
+        start and end. For every pair of distinct rating values (a, b) we count
+        the common items in which the users gave a and b, then the manhattan
+        distance is sum(|a - b| * count) and the chebyshev distance is the
+        largest |a - b| with a non-zero count
+        """
+        pattern = num_common.copy()
+        pattern.data[:] = 1.
+        distances = numpy.zeros(len(num_common.data))
+
+        for index1, (level1, matrix1) in enumerate(levels_matrices):
+            for level2, matrix2 in levels_matrices[index1 + 1:]:
+                counts = _product(matrix1[start:end], matrix2[start:]) +\
+                    _product(matrix2[start:end], matrix1[start:])
+                # Adding the pattern makes the counts aligned with num_common
+                counts = _product_align(pattern, counts)
+                gap = abs(level2 - level1)
+                if similarity_metric == 'manhattan':
+                    distances += gap * counts
+                else:
+                    distances[counts > 0] = numpy.maximum(
+                        distances[counts > 0], gap)
+
+        return 1. / (1 + distances)
+
+    @staticmethod
+    def _build_symmetric_matrix(block_rows, block_columns, block_values, size):
+        """
+        Builds a symmetric CSR matrix out of the entries of its upper triangle
+        (including the diagonal)
+        """
+        rows = numpy.concatenate(block_rows) if block_rows else numpy.array([])
+        columns = \
+            numpy.concatenate(block_columns) if block_columns else numpy.array([])
+        values = \
+            numpy.concatenate(block_values) if block_values else numpy.array([])
+
+        off_diagonal = rows != columns
+        all_rows = numpy.concatenate([rows, columns[off_diagonal]])
+        all_columns = numpy.concatenate([columns, rows[off_diagonal]])
+        all_values = numpy.concatenate([values, values[off_diagonal]])
+
+        similarity_matrix = sparse.coo_matrix(
+            (all_values, (all_rows, all_columns)), shape=(size, size)).tocsr()
+        similarity_matrix.sort_indices()
+        return similarity_matrix
+
+
+def validate_similarity_metric(similarity_metric):
+    if similarity_metric not in SIMILARITY_METRICS:
+        msg = 'Unrecognized similarity metric \'' + similarity_metric + '\''
+        raise ValueError(msg)
+
+
+def validate_ratings(ratings):
+    if (ratings <= 0).any():
+        raise ValueError(
+            'The sparse similarity engine requires positive ratings')
+
+
+def keep_top_k(similarity_matrix, top_k):
+    """
+    Keeps only the top_k most similar users in each row of the given CSR
+    similarity matrix. Note that the resulting matrix is no longer symmetric
+
+    :param similarity_matrix: a CSR user x user similarity matrix
+    :param top_k: the number of entries to keep in each row
+    :return: a CSR matrix with at most top_k entries per row
+    """
+    indptr = similarity_matrix.indptr
+    keep = numpy.zeros(len(similarity_matrix.data), dtype=bool)
+
+    for row in xrange(similarity_matrix.shape[0]):
+        start, end = indptr[row], indptr[row + 1]
+        if end - start <= top_k:
+            keep[start:end] = True
+            continue
+        row_values = similarity_matrix.data[start:end]
+        top_positions = numpy.argpartition(-row_values, top_k - 1)[:top_k]
+        keep[start + top_positions] = True
+
+    coo_matrix = similarity_matrix.tocoo()
+    top_k_matrix = sparse.coo_matrix(
+        (coo_matrix.data[keep], (coo_matrix.row[keep], coo_matrix.col[keep])),
+        shape=similarity_matrix.shape).tocsr()
+    top_k_matrix.sort_indices()
+    return top_k_matrix
+
+
+def _product(matrix1, matrix2):
+    """
+    Returns matrix1 * matrix2.T as a CSR matrix with sorted indices
+    """
+    result = (matrix1 * matrix2.T).tocsr()
+    result.sort_indices()
+    return result
+
+
+def _product_align(pattern, matrix):
+    """
+    Returns the values of matrix at the positions of the non-zero entries of
+    pattern, which must be a binary matrix whose non-zero entries are a
+    superset of the ones of matrix. The values of matrix must be non-negative
+    """
+    aligned = (pattern + matrix).tocsr()
+    aligned.sort_indices()
+    return aligned.data - 1
+
+
+def _distance_to_similarity(distances, similarity_metric):
+    with numpy.errstate(invalid='ignore'):
+        if similarity_metric in ['cosine', 'pearson']:
+            return 1 - distances
+        return 1. / (1 + distances)
+
+
+def _fold_chunks(
+        sums_matrix, counts_matrix, chunk_rows, chunk_columns, chunk_values,
+        shape):
+    """
+    Adds the given (row, column, value) chunks to the sums and counts matrices.
+    The COO to CSR conversion sums the duplicates but, unlike the sparse
+    addition, it does not drop the entries that sum to zero
+    """
+    if not chunk_rows:
+        return sums_matrix, counts_matrix
+
+    sums_coo = sums_matrix.tocoo()
+    counts_coo = counts_matrix.tocoo()
+    values = numpy.concatenate(chunk_values)
+    values[~numpy.isfinite(values)] = 0.
+    rows = numpy.concatenate([sums_coo.row] + chunk_rows)
+    columns = numpy.concatenate([sums_coo.col] + chunk_columns)
+
+    sums_matrix = sparse.coo_matrix(
+        (numpy.concatenate([sums_coo.data, values]), (rows, columns)),
+        shape=shape).tocsr()
+    counts_matrix = sparse.coo_matrix(
+        (numpy.concatenate([counts_coo.data, numpy.ones(len(values))]),
+         (rows, columns)), shape=shape).tocsr()
+    sums_matrix.sum_duplicates()
+    counts_matrix.sum_duplicates()
+    sums_matrix.sort_indices()
+    counts_matrix.sort_indices()
+
+    return sums_matrix, counts_matrix
@@ -0,0 +1,124 @@
+from unittest import TestCase
+
+import numpy
+
+from recommenders.similarity.average_similarity_matrix_builder import \
+    AverageSimilarityMatrixBuilder
+from recommenders.similarity.multi_similarity_matrix_builder import \
+    MultiSimilarityMatrixBuilder
+from recommenders.similarity.single_similarity_matrix_builder import \
+    SingleSimilarityMatrixBuilder
+from recommenders.similarity.sparse_similarity_engine import \
+    SparseSimilarityEngine
+from tripadvisor.fourcity import extractor
+
+__author__ = 'fpena'
+
+
+reviews_matrix_5 = [
+    {'user_id': 'U1', 'business_id': 2, 'overall_rating': 4.0, 'multi_ratings': [5.0, 5.0, 4.0, 3.0, 4.0]},
+    {'user_id': 'U1', 'business_id': 3, 'overall_rating': 2.0, 'multi_ratings': [2.0, 2.0, 1.0, 3.0, 2.0]},
+    {'user_id': 'U1', 'business_id': 4, 'overall_rating': 5.0, 'multi_ratings': [5.0, 4.0, 5.0, 5.0, 4.0]},
+    {'user_id': 'U2', 'business_id': 1, 'overall_rating': 3.0, 'multi_ratings': [3.0, 2.0, 2.0, 4.0, 3.0]},
+    {'user_id': 'U2', 'business_id': 2, 'overall_rating': 5.0, 'multi_ratings': [4.0, 5.0, 5.0, 5.0, 4.0]},
+    {'user_id': 'U2', 'business_id': 3, 'overall_rating': 1.0, 'multi_ratings': [1.0, 2.0, 1.0, 1.0, 2.0]},
+    {'user_id': 'U2', 'business_id': 4, 'overall_rating': 4.0, 'multi_ratings': [4.0, 4.0, 3.0, 5.0, 4.0]},
+    {'user_id': 'U2', 'business_id': 5, 'overall_rating': 5.0, 'multi_ratings': [5.0, 5.0, 5.0, 4.0, 5.0]},
+    {'user_id': 'U3', 'business_id': 1, 'overall_rating': 4.0, 'multi_ratings': [4.0, 3.0, 4.0, 4.0, 5.0]},
+    {'user_id': 'U3', 'business_id': 2, 'overall_rating': 3.0, 'multi_ratings': [3.0, 3.0, 2.0, 3.0, 3.0]},
+    {'user_id': 'U3', 'business_id': 5, 'overall_rating': 3.0, 'multi_ratings': [2.0, 3.0, 4.0, 3.0, 3.0]},
+    {'user_id': 'U4', 'business_id': 1, 'overall_rating': 2.0, 'multi_ratings': [2.0, 3.0, 1.0, 2.0, 2.0]},
+    {'user_id': 'U4', 'business_id': 3, 'overall_rating': 2.0, 'multi_ratings': [2.0, 2.0, 3.0, 2.0, 1.0]},
+    {'user_id': 'U4', 'business_id': 4, 'overall_rating': 2.0, 'multi_ratings': [1.0, 2.0, 2.0, 3.0, 2.0]},
+    {'user_id': 'U4', 'business_id': 5, 'overall_rating': 1.0, 'multi_ratings': [1.0, 1.0, 2.0, 1.0, 1.0]},
+    {'user_id': 'U5', 'business_id': 1, 'overall_rating': 5.0, 'multi_ratings': [5.0, 5.0, 4.0, 5.0, 5.0]},
+    {'user_id': 'U5', 'business_id': 5, 'overall_rating': 4.0, 'multi_ratings': [4.0, 3.0, 4.0, 4.0, 5.0]},
+]
+
+similarity_metrics = ['chebyshev', 'cosine', 'euclidean', 'manhattan', 'pearson']
+
+
+class TestSparseSimilarityEngine(TestCase):
+
+    def assert_matrices_almost_equal(self, expected_matrix, actual_matrix):
+        self.assertItemsEqual(expected_matrix.keys(), actual_matrix.keys())
+        for user1 in expected_matrix:
+            self.assertItemsEqual(
+                expected_matrix[user1].keys(), actual_matrix[user1].keys())
+            for user2, similarity in expected_matrix[user1].items():
+                self.assertAlmostEqual(similarity, actual_matrix[user1][user2])
+
+    def test_build_similarity_matrix(self):
+
+        user_dictionary = extractor.initialize_users(reviews_matrix_5, False)
+        user_ids = extractor.get_groupby_list(reviews_matrix_5, 'user_id')
+
+        for similarity_metric in similarity_metrics:
+            for min_common_items in [None, 3]:
+                loop_builder = SingleSimilarityMatrixBuilder(similarity_metric)
+                loop_builder._min_common_items = min_common_items
+                sparse_builder = SingleSimilarityMatrixBuilder(
+                    similarity_metric, SparseSimilarityEngine(block_size=2))
+                sparse_builder._min_common_items = min_common_items
+
+                self.assert_matrices_almost_equal(
+                    loop_builder.build_similarity_matrix(
+                        user_dictionary, user_ids),
+                    sparse_builder.build_similarity_matrix(
+                        user_dictionary, user_ids))
+
+    def test_build_item_vectors_similarity_matrix(self):
+
+        user_dictionary = extractor.initialize_users(reviews_matrix_5, True)
+        user_ids = extractor.get_groupby_list(reviews_matrix_5, 'user_id')
+
+        for similarity_metric in ['chebyshev', 'euclidean', 'manhattan']:
+            loop_builder = MultiSimilarityMatrixBuilder(similarity_metric)
+            sparse_builder = MultiSimilarityMatrixBuilder(
+                similarity_metric, SparseSimilarityEngine(block_size=2))
+
+            self.assert_matrices_almost_equal(
+                loop_builder.build_similarity_matrix(user_dictionary, user_ids),
+                sparse_builder.build_similarity_matrix(
+                    user_dictionary, user_ids).to_dict())
+
+    def test_build_similarity_matrix_fallback(self):
+
+        user_dictionary = extractor.initialize_users(reviews_matrix_5, True)
+        user_ids = extractor.get_groupby_list(reviews_matrix_5, 'user_id')
+
+        # A builder without a sparse implementation falls back to calculating
+        # the similarities one pair at a time
+        loop_builder = AverageSimilarityMatrixBuilder('euclidean')
+        engine_builder = AverageSimilarityMatrixBuilder('euclidean')
+        engine_builder._similarity_engine = SparseSimilarityEngine()
+
+        self.assert_matrices_almost_equal(
+            loop_builder.build_similarity_matrix(user_dictionary, user_ids),
+            engine_builder.build_similarity_matrix(user_dictionary, user_ids))
+
+    def test_build_vectors_similarity_matrix(self):
+
+        user_ids = ['U1', 'U2', 'U3']
+        vectors = [[1.0, 2.0, 3.0], [2.0, 4.0, 7.0], [3.0, 2.0, 1.0]]
+        engine = SparseSimilarityEngine()
+        similarity_matrix = engine.build_vectors_similarity_matrix(
+            vectors, user_ids, 'pearson')
+
+        self.assertAlmostEqual(
+            numpy.corrcoef(vectors[0], vectors[1])[0, 1],
+            similarity_matrix['U1']['U2'])
+        self.assertAlmostEqual(1.0, similarity_matrix['U3']['U3'])
+        self.assertNotIn('U3', similarity_matrix['U1'])
+
+    def test_top_k(self):
+
+        user_dictionary = extractor.initialize_users(reviews_matrix_5, False)
+        user_ids = extractor.get_groupby_list(reviews_matrix_5, 'user_id')
+        engine = SparseSimilarityEngine(top_k=2)
+        similarity_matrix = engine.build_similarity_matrix(
+            user_dictionary, user_ids, 'euclidean')
+
+        for user_id in user_ids:
+            self.assertEqual(2, len(similarity_matrix[user_id]))
+            self.assertAlmostEqual(1.0, similarity_matrix[user_id][user_id])
@@ -7,9 +7,16 @@ __author__ = 'fpena'
 
 class WeightsSimilarityMatrixBuilder(BaseSimilarityMatrixBuilder):
 
-    def __init__(self, similarity_metric):
+    def __init__(self, similarity_metric, similarity_engine=None):
         super(WeightsSimilarityMatrixBuilder, self).__init__(
-            'MultiWeightsSimilarity', similarity_metric, True)
+            'MultiWeightsSimilarity', similarity_metric, True,
+            similarity_engine)
+
+    def build_sparse_similarity_matrix(self, user_dictionary, user_ids):
+        vectors = [
+            user_dictionary[user_id].criteria_weights for user_id in user_ids]
+        return self._similarity_engine.build_vectors_similarity_matrix(
+            vectors, user_ids, self._similarity_metric)
 
     def calculate_users_similarity(self, user_dictionary, user_id1, user_id2):
         """
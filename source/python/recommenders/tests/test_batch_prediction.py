@@ -0,0 +1,37 @@
+from unittest import TestCase
+
+import numpy
+
+from recommenders import batch_prediction
+
+__author__ = 'fpena'
+
+
+class TestBatchPrediction(TestCase):
+
+    def test_group_by_user(self):
+        self.assertEqual(
+            {('U1', None): [0, 2], ('U2', None): [1]},
+            batch_prediction.group_by_user(['U1', 'U2', 'U1']))
+        self.assertEqual(
+            {('U1', 'a'): [0], ('U1', 'b'): [1], ('U2', 'a'): [2]},
+            batch_prediction.group_by_user(
+                ['U1', 'U1', 'U2'], ['a', 'b', 'a']))
+
+    def test_predict_many(self):
+        calls = []
+
+        def predict_user_ratings(user_id, item_ids, context):
+            calls.append((user_id, item_ids, context))
+            return [None if item_id == 3 else float(item_id)
+                    for item_id in item_ids]
+
+        predictions = batch_prediction.predict_many(
+            predict_user_ratings, ['U1', 'U2', 'U1', 'U1'], [1, 2, 3, 4])
+
+        self.assertEqual(2, len(calls))
+        self.assertEqual(
+            [('U1', [1, 3, 4], None), ('U2', [2], None)], sorted(calls))
+        self.assertEqual([1.0, 2.0, None, 4.0],
+                         batch_prediction.to_optional_list(predictions))
+        self.assertTrue(numpy.isnan(predictions[2]))
@@ -0,0 +1,119 @@
+from unittest import TestCase
+
+import numpy
+
+from etl import libfm_converter
+from recommenders import factorization_machine
+from recommenders.factorization_machine import FactorizationMachine
+
+__author__ = 'fpena'
+
+
+def generate_rows(random_state, user_factors, item_factors, num_rows):
+    rows = []
+    for _ in range(num_rows):
+        user = random_state.randint(len(user_factors))
+        item = random_state.randint(len(item_factors))
+        context = random_state.rand()
+        rating = 3. + numpy.dot(user_factors[user], item_factors[item]) + \
+            context + random_state.normal(0., 0.1)
+        rows.append([rating, 'U%d' % user, 'I%d' % item, context])
+    return rows
+
+
+def calculate_rmse(true_values, predictions):
+    return numpy.sqrt(numpy.mean((true_values - predictions) ** 2))
+
+
+class TestFactorizationMachine(TestCase):
+
+    def setUp(self):
+        random_state = numpy.random.RandomState(0)
+        user_factors = random_state.normal(0., 1., (30, 2))
+        item_factors = random_state.normal(0., 1., (20, 2))
+        train_rows = generate_rows(
+            random_state, user_factors, item_factors, 800)
+        test_rows = generate_rows(
+            random_state, user_factors, item_factors, 100)
+        matrices, self.num_variables, _ = \
+            libfm_converter.rows_to_csr_matrices(
+                [train_rows, test_rows], 0, [1, 2])
+        (self.x_train, self.y_train), (self.x_test, self.y_test) = matrices
+        self.baseline_rmse = calculate_rmse(
+            self.y_test, numpy.mean(self.y_train))
+
+    def test_predict(self):
+
+        fm = FactorizationMachine(
+            num_factors=2, method='als', num_iterations=1, seed=0,
+            regularization=(0., 0.1, 0.1))
+        fm.fit(self.x_train, self.y_train)
+
+        x_test = self.x_test.toarray()
+        expected_predictions = []
+        for x in x_test:
+            prediction = fm.w0 + numpy.dot(fm.w, x)
+            for i in range(self.num_variables):
+                for j in range(i + 1, self.num_variables):
+                    prediction += numpy.dot(fm.v[i], fm.v[j]) * x[i] * x[j]
+            expected_predictions.append(prediction)
+        expected_predictions = numpy.clip(
+            expected_predictions, fm.min_target, fm.max_target)
+
+        numpy.testing.assert_allclose(
+            expected_predictions, fm.predict(self.x_test))
+
+    def test_column_blocks(self):
+
+        blocks = list(factorization_machine._ColumnBlocks(self.x_train))
+
+        # The context column, the users and the items
+        self.assertEqual(3, len(blocks))
+        self.assertEqual([0], list(blocks[0].columns))
+        self.assertEqual(
+            range(self.num_variables),
+            [column for block in blocks for column in block.columns])
+
+    def test_fit_predict(self):
+
+        parameters = {
+            'sgd': {'learn_rate': 0.05, 'regularization': (0., 0.01, 0.01)},
+            'als': {'regularization': (0., 1., 1.)},
+            'mcmc': {},
+        }
+
+        for method, method_parameters in parameters.items():
+            fm = FactorizationMachine(
+                num_factors=2, method=method, num_iterations=50, seed=0,
+                **method_parameters)
+            predictions = fm.fit_predict(
+                self.x_train, self.y_train, self.x_test)
+            self.assertEqual(len(self.y_test), len(predictions))
+            self.assertLess(
+                calculate_rmse(self.y_test, predictions),
+                self.baseline_rmse / 2)
+
+    def test_warm_start(self):
+
+        fm = FactorizationMachine(
+            num_factors=2, method='als', num_iterations=20, seed=0,
+            regularization=(0., 1., 1.))
+        fm.fit(self.x_train, self.y_train)
+        rmse = calculate_rmse(self.y_test, fm.predict(self.x_test))
+
+        # A single iteration starting from the previous model keeps the fit
+        fm.num_iterations = 1
+        fm.fit(self.x_train, self.y_train, warm_start=True)
+        warm_rmse = calculate_rmse(self.y_test, fm.predict(self.x_test))
+        self.assertLess(warm_rmse, rmse * 1.1)
+
+        fm.fit(self.x_train, self.y_train)
+        cold_rmse = calculate_rmse(self.y_test, fm.predict(self.x_test))
+        self.assertLess(warm_rmse, cold_rmse)
+
+        # The design matrix must have the same variables
+        self.assertRaises(
+            ValueError, fm.fit, self.x_train[:, :-1], self.y_train, True)
+
+    def test_invalid_method(self):
+        self.assertRaises(ValueError, FactorizationMachine, method='adam')
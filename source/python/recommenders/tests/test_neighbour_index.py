@@ -0,0 +1,74 @@
+from unittest import TestCase
+
+from recommenders.neighbour_index import NeighbourIndex
+from tripadvisor.fourcity import extractor
+
+__author__ = 'fpena'
+
+
+reviews = [
+    {'user_id': 'U1', 'offering_id': 1, 'overall_rating': 5.0},
+    {'user_id': 'U1', 'offering_id': 2, 'overall_rating': 3.0},
+    {'user_id': 'U2', 'offering_id': 1, 'overall_rating': 4.0},
+    {'user_id': 'U2', 'offering_id': 3, 'overall_rating': 2.0},
+    {'user_id': 'U3', 'offering_id': 1, 'overall_rating': 3.0},
+    {'user_id': 'U3', 'offering_id': 3, 'overall_rating': 5.0},
+    {'user_id': 'U4', 'offering_id': 1, 'overall_rating': 1.0},
+    {'user_id': 'U4', 'offering_id': 3, 'overall_rating': 4.0},
+    {'user_id': 'U5', 'offering_id': 3, 'overall_rating': 4.0},
+]
+
+similarity_matrix = {
+    'U1': {'U1': 1.0, 'U2': 0.5, 'U3': 0.9, 'U4': 0.0, 'U5': None},
+    'U2': {'U1': 0.5, 'U2': 1.0, 'U3': 0.2, 'U4': 0.7, 'U5': 0.1},
+    'U3': {'U1': 0.9, 'U2': 0.2, 'U3': 1.0, 'U4': 0.3, 'U5': 0.4},
+    'U4': {'U1': 0.0, 'U2': 0.7, 'U3': 0.3, 'U4': 1.0, 'U5': 0.6},
+    'U5': {'U1': None, 'U2': 0.1, 'U3': 0.4, 'U4': 0.6, 'U5': 1.0},
+}
+
+
+class TestNeighbourIndex(TestCase):
+
+    def setUp(self):
+        self.user_dictionary = extractor.initialize_users(reviews, False)
+
+    def test_get_neighbourhood(self):
+        index = NeighbourIndex(similarity_matrix, self.user_dictionary)
+
+        self.assertEqual(
+            ('U3', 'U2', 'U4'), index.get_neighbourhood('U1', 1))
+        self.assertEqual(('U3', 'U2'), index.get_neighbourhood('U1', 1, 2))
+        self.assertEqual(
+            ('U4', 'U3', 'U2'), index.get_neighbourhood('U5', 3))
+        self.assertEqual(('U4',), index.get_neighbourhood('U5', 3, 1))
+        self.assertEqual(
+            ('U4', 'U3', 'U5'), index.get_neighbourhood('U2', 3))
+        self.assertEqual(
+            ('U5', 'U4', 'U2'), index.get_neighbourhood('U3', 3))
+
+    def test_get_neighbourhood_unknown(self):
+        index = NeighbourIndex(similarity_matrix, self.user_dictionary)
+
+        self.assertEqual((), index.get_neighbourhood('U1', 4))
+        self.assertEqual((), index.get_neighbourhood('U6', 1))
+        self.assertEqual((), index.get_neighbourhood('U1', 2))
+
+    def test_skip_dissimilar(self):
+        index = NeighbourIndex(
+            similarity_matrix, self.user_dictionary, skip_dissimilar=True)
+
+        self.assertEqual(('U3', 'U2'), index.get_neighbourhood('U1', 1))
+        self.assertEqual(('U2', 'U3'), index.get_neighbourhood('U4', 1))
+
+    def test_cache(self):
+        index = NeighbourIndex(
+            similarity_matrix, self.user_dictionary, cache_size=2)
+
+        neighbourhood = index.get_neighbourhood('U1', 1)
+        self.assertIs(neighbourhood, index.get_neighbourhood('U1', 1))
+        index.get_neighbourhood('U2', 1)
+        index.get_neighbourhood('U1', 1)
+        index.get_neighbourhood('U3', 1)
+        # ('U2', 1) was the least recently used one
+        self.assertEqual(
+            [('U1', 1, None), ('U3', 1, None)], list(index._cache.keys()))
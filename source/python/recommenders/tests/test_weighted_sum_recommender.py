@@ -1,5 +1,7 @@
 from unittest import TestCase
 
+import numpy
+
 from recommenders.similarity.single_similarity_matrix_builder import \
     SingleSimilarityMatrixBuilder
 from recommenders.weighted_sum_recommender import WeightedSumRecommender
@@ -83,3 +85,22 @@ class TestWeightedSumRecommender(TestCase):
         self.assertEqual(actual_rating_1, recommender.predict_rating('A1', 1))
         actual_rating_2 = 2.0
         self.assertEqual(actual_rating_2, recommender.predict_rating('A1', 3))
+
+    def test_predict_many(self):
+
+        recommender = WeightedSumRecommender(SingleSimilarityMatrixBuilder('cosine'))
+        recommender.load(reviews_matrix_5)
+
+        # U1 is repeated and interleaved with other users, so the predictions
+        # must come back in the order of the requests after being grouped
+        predictions = recommender.predict_many(
+            ['U1', 'U4', 'U1', 'U4', 'U6', 'U1'], [5, 5, 2, 6, 5, 1])
+
+        self.assertEqual(6, len(predictions))
+        self.assertAlmostEqual(7.0109592331638115, predictions[0])
+        self.assertAlmostEqual(7.6308202451312980, predictions[1])
+        self.assertAlmostEqual(6.5027398082909520, predictions[2])
+        # Unknown users and items can't be predicted
+        self.assertTrue(numpy.isnan(predictions[3]))
+        self.assertTrue(numpy.isnan(predictions[4]))
+        self.assertAlmostEqual(5.4972601917090460, predictions[5])
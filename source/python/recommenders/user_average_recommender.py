@@ -10,9 +10,10 @@ class UserAverageRecommender(BaseRecommender):
         super(UserAverageRecommender, self).__init__('AverageRecommender', None)
         self._rating = None
 
-    def load(self, reviews):
+    def load(self, reviews, ratings_store=None):
         self.reviews = reviews
-        self.user_dictionary = extractor.initialize_users(self.reviews, False)
+        self.user_dictionary =\
+            extractor.initialize_users(self.reviews, False, ratings_store)
         self.user_ids = extractor.get_groupby_list(self.reviews, 'user_id')
 
     def predict_rating(self, user_id, item_id):
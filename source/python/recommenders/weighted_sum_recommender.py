@@ -12,13 +12,17 @@ class WeightedSumRecommender(BaseRecommender):
 
     def predict_rating(self, user_id, item_id):
 
-        if user_id not in self.user_ids:
+        if user_id not in self.user_dictionary:
             return None
 
         neighbourhood = self.get_neighbourhood(user_id, item_id)
         # item_neighbourhood =\
         #     [neighbour for neighbour in neighbourhood if item_id in self.user_dictionary[neighbour].item_ratings]
 
+        return self.calculate_rating(user_id, item_id, neighbourhood)
+
+    def calculate_rating(self, user_id, item_id, neighbourhood):
+
         weighted_sum = 0.
         z_denominator = 0.
         num_users = 0
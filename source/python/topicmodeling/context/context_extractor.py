@@ -3,9 +3,8 @@ import time
 
 import operator
 
-import math
-
 from etl import ETLUtils
+from topicmodeling.context import lda_context_utils
 from utils.constants import Constants
 
 
@@ -88,46 +87,17 @@ class ContextExtractor:
             print('context topics: %d' % len(self.context_rich_topics))
             return sorted_topics
 
-        topic_ratio_map = {}
-        self.topic_weighted_frequency_map = {}
-        lower_than_alpha_count = 0.0
-        lower_than_beta_count = 0.0
-        non_contextual_topics = set()
-        for topic in range(self.num_topics):
-            # print('topic: %d' % topic)
-            weighted_frq = self.calculate_topic_weighted_frequency(
-                topic, self.records)
-            target_weighted_frq = \
-                self.calculate_topic_weighted_frequency(
-                    topic, self.target_reviews)
-            non_target_weighted_frq = \
-                self.calculate_topic_weighted_frequency(
-                    topic, self.non_target_reviews)
-
-            if weighted_frq < Constants.CONTEXT_EXTRACTOR_ALPHA:
-                non_contextual_topics.add(topic)
-                # print('non-contextual_topic: %d' % topic)
-                lower_than_alpha_count += 1.0
-
-            if non_target_weighted_frq == 0:
-                # We can't know if the topic is good or not
-                non_contextual_topics.add(topic)
-                ratio = 'N/A'
-                # non_contextual_topics.add(topic)
-            else:
-                ratio = target_weighted_frq / non_target_weighted_frq
-                print('topic: %d, specific_frq: %f, generic_frq: %f' % (topic, target_weighted_frq, non_target_weighted_frq))
-
-            # print('topic: %d --> ratio: %f\tspecific: %f\tgeneric: %f' %
-            #       (topic, ratio, target_weighted_frq, non_target_weighted_frq))
-
-            if self.lda_beta_comparison_operator(
-                    ratio, Constants.CONTEXT_EXTRACTOR_BETA):
-                non_contextual_topics.add(topic)
-                lower_than_beta_count += 1.0
-
-            topic_ratio_map[topic] = ratio
-            self.topic_weighted_frequency_map[topic] = weighted_frq
+        # All the weighted frequencies and ratios are calculated at once from
+        # the topic weight matrices of the target and non-target reviews
+        target_matrix = lda_context_utils.build_topic_weight_matrix(
+            self.target_reviews, self.num_topics)
+        non_target_matrix = lda_context_utils.build_topic_weight_matrix(
+            self.non_target_reviews, self.num_topics)
+        topic_ratio_map, self.topic_weighted_frequency_map,\
+            non_contextual_topics, lower_than_alpha_count,\
+            lower_than_beta_count = lda_context_utils.find_context_rich_topics(
+                target_matrix, non_target_matrix,
+                self.lda_beta_comparison_operator)
 
         self.topic_ratio_map = copy.deepcopy(topic_ratio_map)
 
@@ -145,35 +115,6 @@ class ContextExtractor:
 
         return sorted_topics
 
-    @staticmethod
-    def calculate_topic_weighted_frequency(topic, reviews):
-        """
-
-        :type topic: int
-        :param topic:
-        :type reviews: list[dict]
-        :param reviews:
-        :return:
-        """
-        num_reviews = 0.0
-
-        for review in reviews:
-            for review_topic in review[Constants.TOPICS_FIELD]:
-                if topic == review_topic[0]:
-                    if Constants.TOPIC_WEIGHTING_METHOD == 'binary':
-                        num_reviews += 1
-                    elif Constants.TOPIC_WEIGHTING_METHOD == 'probability':
-                        num_reviews += review_topic[1]
-                        if math.isnan(review_topic[1]):
-                            print(topic, review)
-                    else:
-                        raise ValueError(
-                            'Topic weighting method not recognized')
-
-        print('num_reviews: %f, len(reviews): %f' % (num_reviews, len(reviews)))
-
-        return num_reviews / len(reviews)
-
     def clear_reviews(self):
         self.records = None
         self.target_reviews = None
@@ -5,6 +5,7 @@ import operator
 from gensim import corpora
 
 from topicmodeling.context import lda_context_utils
+from topicmodeling.context import online_topic_model
 from utils.constants import Constants
 
 __author__ = 'fpena'
@@ -75,6 +76,35 @@ class LdaBasedContext:
         print('%s: topic model built' %
               time.strftime("%Y/%m/%d-%H:%M:%S"))
 
+    def build_streaming_topic_model(
+            self, file_path,
+            chunk_size=lda_context_utils.TOPIC_MODEL_CHUNK_SIZE):
+        """
+        Builds the topic model with the target reviews of the given records
+        file, which are streamed from disk in chunks and used in online LDA
+        updates, instead of using the corpus of the records of this object
+
+        :param file_path: the path of the JSON records file
+        :param chunk_size: the number of documents of each update
+        """
+        if self.dictionary is None:
+            self.dictionary = corpora.Dictionary.load(Constants.DICTIONARY_FILE)
+        self.topic_model = online_topic_model.train_lda_model(
+            file_path, self.dictionary, chunk_size)
+
+    def update_topic_model(self, records):
+        """
+        Updates the topic model with the target reviews of the given records,
+        instead of training it again from scratch
+
+        :param records: the new records
+        """
+        corpus = [
+            record[Constants.CORPUS_FIELD] for record in
+            online_topic_model.get_target_reviews(records)
+        ]
+        online_topic_model.update_lda_model(self.topic_model, corpus)
+
     def update_reviews_with_topics(self):
         lda_context_utils.update_reviews_with_topics(
             self.topic_model, self.target_corpus, self.target_reviews)
@@ -114,47 +144,17 @@ class LdaBasedContext:
             print('context topics: %d' % len(self.context_rich_topics))
             return sorted_topics
 
-        # numpy.random.seed(0)
-        topic_ratio_map = {}
-        self.topic_weighted_frequency_map = {}
-        lower_than_alpha_count = 0.0
-        lower_than_beta_count = 0.0
-        non_contextual_topics = set()
-        for topic in range(self.num_topics):
-            # print('topic: %d' % topic)
-            weighted_frq = lda_context_utils.calculate_topic_weighted_frequency(
-                topic, self.records)
-            target_weighted_frq = \
-                lda_context_utils.calculate_topic_weighted_frequency(
-                    topic, self.target_reviews)
-            non_target_weighted_frq = \
-                lda_context_utils.calculate_topic_weighted_frequency(
-                    topic, self.non_target_reviews)
-
-            if weighted_frq < Constants.CONTEXT_EXTRACTOR_ALPHA:
-                non_contextual_topics.add(topic)
-                # print('non-contextual_topic: %d' % topic)
-                lower_than_alpha_count += 1.0
-
-            if non_target_weighted_frq == 0:
-                # We can't know if the topic is good or not
-                non_contextual_topics.add(topic)
-                ratio = 'N/A'
-                # non_contextual_topics.add(topic)
-            else:
-                ratio = target_weighted_frq / non_target_weighted_frq
-
-            # print('topic: %d --> ratio: %f\tspecific: %f\tgeneric: %f' %
-            #       (topic, ratio, target_weighted_frq, non_target_weighted_frq))
-
-            if self.lda_beta_comparison_operator(
-                    ratio, Constants.CONTEXT_EXTRACTOR_BETA):
-                non_contextual_topics.add(topic)
-                lower_than_beta_count += 1.0
-                # print('non-contextual_topic: %d' % topic)
-
-            topic_ratio_map[topic] = ratio
-            self.topic_weighted_frequency_map[topic] = weighted_frq
+        # All the weighted frequencies and ratios are calculated at once from
+        # the topic weight matrices of the target and non-target reviews
+        target_matrix = lda_context_utils.build_topic_weight_matrix(
+            self.target_reviews, self.num_topics)
+        non_target_matrix = lda_context_utils.build_topic_weight_matrix(
+            self.non_target_reviews, self.num_topics)
+        topic_ratio_map, self.topic_weighted_frequency_map,\
+            non_contextual_topics, lower_than_alpha_count,\
+            lower_than_beta_count = lda_context_utils.find_context_rich_topics(
+                target_matrix, non_target_matrix,
+                self.lda_beta_comparison_operator)
 
         self.topic_ratio_map = copy.deepcopy(topic_ratio_map)
 
@@ -189,36 +189,28 @@ class LdaBasedContext:
 
         return sorted_topics
 
-    def find_contextual_topics(self, records, text_sampling_proportion=None):
-        for record in records:
-            # numpy.random.seed(0)
-            topic_distribution = lda_context_utils.get_topic_distribution(
-                record, self.topic_model, self.dictionary,
-                Constants.CONTEXT_EXTRACTOR_EPSILON, text_sampling_proportion,
-                self.max_words
-            )
-
-            # We calculate the sum of the probabilities of the contextual topics
-            # to then normalize the contextual vector
-            context_topics_sum = 0.0
-            for i in self.context_rich_topics:
-                context_topics_sum += topic_distribution[i[0]]
-
-            topics_map = {}
-            for i in self.context_rich_topics:
-                topic_id = 'topic' + str(i[0])
-                if context_topics_sum > 0:
-                    topics_map[topic_id] =\
-                        topic_distribution[i[0]] / 1.0
-                else:
-                    topics_map[topic_id] = 0.0
-
-            topics_map['nocontexttopics'] = 1 - context_topics_sum
-
-            record[Constants.CONTEXT_TOPICS_FIELD] = topics_map
-
-        # print(self.context_rich_topics)
-        # print('total_topics', len(self.context_rich_topics))
+    def find_contextual_topics(
+            self, records, text_sampling_proportion=None,
+            chunk_size=lda_context_utils.TOPIC_INFERENCE_CHUNK_SIZE):
+        """
+        Finds the context topics of the given records. The topics of the
+        records are inferred in chunks, with a single call to the topic model
+        per chunk
+
+        :param records: the records
+        :param text_sampling_proportion: not used, the whole text of the
+        records is always taken
+        :param chunk_size: the number of records whose topics are inferred at
+        once, or None to infer the topics of all the records at once
+        :return: the records, with the context topics field
+        """
+        for chunk in lda_context_utils.iterate_chunks(records, chunk_size):
+            topic_distributions = lda_context_utils.get_topic_distributions(
+                chunk, self.topic_model, Constants.CONTEXT_EXTRACTOR_EPSILON)
+            topics_maps = lda_context_utils.build_context_topics_maps(
+                topic_distributions, self.context_rich_topics)
+            for record, topics_map in zip(chunk, topics_maps):
+                record[Constants.CONTEXT_TOPICS_FIELD] = topics_map
 
         return records
 
@@ -1,29 +1,39 @@
 import time
 
-import nltk
 from gensim import corpora
 from gensim.models import ldamodel, LdaMulticore
-from nltk import RegexpTokenizer
-from nltk.corpus import stopwords
 import numpy
 from etl import ETLUtils
+from nlp import nlp_resources
 from utils.constants import Constants
 
 __author__ = 'fpena'
 
 
-def build_topic_model_from_corpus(corpus, dictionary):
+# The default number of records whose topics are inferred at once
+TOPIC_INFERENCE_CHUNK_SIZE = 10000
+
+# The number of documents used in each update of the topic models, the same
+# default used by gensim
+TOPIC_MODEL_CHUNK_SIZE = 2000
+
+
+def build_topic_model_from_corpus(
+        corpus, dictionary, chunk_size=TOPIC_MODEL_CHUNK_SIZE):
     """
     Builds a topic model with the given corpus and dictionary.
     The model is built using Latent Dirichlet Allocation
 
     :type corpus list
     :parameter corpus: a list of bag of words, each bag of words represents a
-    document
+    document. It can also be any re-iterable sequence, such as a corpus that
+    is streamed from disk
     :type dictionary: gensim.corpora.Dictionary
     :parameter dictionary: a Dictionary object that contains the words that are
     permitted to belong to the document, words that are not in this dictionary
     will be ignored
+    :param chunk_size: the number of documents used in each update of the
+    model
     :rtype: gensim.models.ldamodel.LdaModel
     :return: an LdaModel built using the reviews contained in the records
     parameter
@@ -37,14 +47,14 @@ def build_topic_model_from_corpus(corpus, dictionary):
             num_topics=Constants.TOPIC_MODEL_NUM_TOPICS,
             passes=Constants.TOPIC_MODEL_PASSES,
             iterations=Constants.TOPIC_MODEL_ITERATIONS,
-            workers=Constants.NUM_CORES - 1)
+            chunksize=chunk_size, workers=Constants.NUM_CORES - 1)
     else:
         print('%s: lda monocore' % time.strftime("%Y/%m/%d-%H:%M:%S"))
         topic_model = ldamodel.LdaModel(
             corpus, id2word=dictionary,
             num_topics=Constants.TOPIC_MODEL_NUM_TOPICS,
             passes=Constants.TOPIC_MODEL_PASSES,
-            iterations=Constants.TOPIC_MODEL_ITERATIONS)
+            iterations=Constants.TOPIC_MODEL_ITERATIONS, chunksize=chunk_size)
 
     return topic_model
 
@@ -131,6 +141,104 @@ def calculate_topic_weighted_frequency_complete(topic, reviews):
     return results
 
 
+def build_topic_weight_matrix(reviews, num_topics):
+    """
+    Builds a dense matrix with the weight of each topic in each review. With
+    the 'binary' weighting method the weight is the number of times the topic
+    appears in the topics list of the review (even with a probability of 0),
+    and with the 'probability' weighting method it is the sum of its
+    probabilities, so the sum of a column divided by the number of reviews is
+    the same value calculate_topic_weighted_frequency returns for that topic
+
+    :type reviews: list[dict]
+    :param reviews: the reviews, with their topics lists
+    :param num_topics: the number of topics
+    :rtype: numpy.ndarray
+    :return: a (reviews x topics) matrix
+    """
+    if Constants.TOPIC_WEIGHTING_METHOD not in ['binary', 'probability']:
+        raise ValueError('Topic weighting method not recognized')
+
+    review_topics = [review[Constants.TOPICS_FIELD] for review in reviews]
+    topic_matrix = numpy.zeros((len(reviews), num_topics))
+    num_review_topics = [len(topics) for topics in review_topics]
+    if sum(num_review_topics) == 0:
+        return topic_matrix
+
+    topic_pairs = numpy.array(
+        [review_topic for topics in review_topics for review_topic in topics],
+        dtype=numpy.float64)
+    rows = numpy.repeat(numpy.arange(len(reviews)), num_review_topics)
+    columns = topic_pairs[:, 0].astype(int)
+    if Constants.TOPIC_WEIGHTING_METHOD == 'binary':
+        weights = 1.
+    else:
+        weights = topic_pairs[:, 1]
+    numpy.add.at(topic_matrix, (rows, columns), weights)
+
+    return topic_matrix
+
+
+def find_context_rich_topics(
+        target_matrix, non_target_matrix, beta_comparison_operator):
+    """
+    Calculates the weighted frequency of every topic and its target/non-target
+    frequency ratio, and finds the topics that are not context-rich because
+    their weighted frequency is lower than Constants.CONTEXT_EXTRACTOR_ALPHA,
+    because their ratio compared with Constants.CONTEXT_EXTRACTOR_BETA using
+    beta_comparison_operator is True, or because they don't appear in the
+    non-target reviews
+
+    :type target_matrix: numpy.ndarray
+    :param target_matrix: the topic weight matrix of the target reviews
+    :type non_target_matrix: numpy.ndarray
+    :param non_target_matrix: the topic weight matrix of the non-target
+    reviews
+    :param beta_comparison_operator: the operator used to compare the ratios
+    with beta
+    :return: a tuple with a dictionary with the ratio of each topic ('N/A'
+    when the topic doesn't appear in the non-target reviews), a dictionary
+    with the weighted frequency of each topic, the set of non context-rich
+    topics, and the number of topics lower than alpha and beta
+    """
+    num_target_reviews = len(target_matrix)
+    num_non_target_reviews = len(non_target_matrix)
+    target_sums = target_matrix.sum(axis=0)
+    non_target_sums = non_target_matrix.sum(axis=0)
+
+    weighted_frequencies = (target_sums + non_target_sums) / \
+        (num_target_reviews + num_non_target_reviews)
+    target_frequencies = target_sums / num_target_reviews
+    non_target_frequencies = non_target_sums / num_non_target_reviews
+
+    lower_than_alpha = \
+        weighted_frequencies < Constants.CONTEXT_EXTRACTOR_ALPHA
+    # We can't know if the topics that don't appear in the non-target reviews
+    # are good or not
+    unknown_ratio = non_target_frequencies == 0
+    ratios = target_frequencies / numpy.where(
+        unknown_ratio, 1., non_target_frequencies)
+    lower_than_beta = numpy.asarray(beta_comparison_operator(
+        ratios, Constants.CONTEXT_EXTRACTOR_BETA))
+    lower_than_beta[unknown_ratio] = bool(
+        beta_comparison_operator('N/A', Constants.CONTEXT_EXTRACTOR_BETA))
+
+    topic_ratio_map = {}
+    topic_weighted_frequency_map = {}
+    for topic in range(len(ratios)):
+        topic_ratio_map[topic] = \
+            'N/A' if unknown_ratio[topic] else float(ratios[topic])
+        topic_weighted_frequency_map[topic] = \
+            float(weighted_frequencies[topic])
+
+    non_contextual_topics = set(numpy.flatnonzero(
+        lower_than_alpha | unknown_ratio | lower_than_beta).tolist())
+
+    return topic_ratio_map, topic_weighted_frequency_map,\
+        non_contextual_topics, float(lower_than_alpha.sum()),\
+        float(lower_than_beta.sum())
+
+
 def create_bag_of_words(document_list):
     """
     Creates a bag of words representation of the document list given. It removes
@@ -141,13 +249,9 @@ def create_bag_of_words(document_list):
     :rtype: list[list[str]]
     :return:
     """
-    tokenizer = RegexpTokenizer(r'\w+')
-    tagger = nltk.PerceptronTagger()
-    cached_stop_words = set(stopwords.words("english"))
-    cached_stop_words |= {
-        't', 'didn', 'doesn', 'haven', 'don', 'aren', 'isn', 've', 'll',
-        'couldn', 'm', 'hasn', 'hadn', 'won', 'shouldn', 's', 'wasn',
-        'wouldn'}
+    tokenizer = nlp_resources.get_word_tokenizer()
+    tagger = nlp_resources.get_tagger()
+    cached_stop_words = nlp_resources.get_stop_words()
     body = []
     processed = []
 
@@ -241,6 +345,80 @@ def get_topic_distribution(record, lda_model, dictionary, minimum_probability,
     return topic_distribution
 
 
+def get_topic_distributions(records, lda_model, minimum_probability):
+    """
+    Batched version of get_topic_distribution, which infers the topics of all
+    the given records with a single call to the topic model
+
+    :type records: list[dict]
+    :param records: the records, with their corpus
+    :type lda_model: LdaModel
+    :param minimum_probability: the topics with a lower probability are set
+    to 0
+    :rtype: numpy.ndarray
+    :return: a (records x topics) matrix with the topic distribution of each
+    record
+    """
+    if minimum_probability is None:
+        minimum_probability = lda_model.minimum_probability
+    # The same lower bound used by LdaModel.get_document_topics
+    minimum_probability = max(minimum_probability, 1e-8)
+
+    corpus = [record[Constants.CORPUS_FIELD] for record in records]
+    gamma, _ = lda_model.inference(corpus)
+    topic_distributions = gamma / gamma.sum(axis=1)[:, numpy.newaxis]
+    topic_distributions[topic_distributions < minimum_probability] = 0.
+
+    return topic_distributions
+
+
+def build_context_topics_maps(topic_distributions, context_rich_topics):
+    """
+    Builds the context topics map of each row of the given topic
+    distributions, which contains the probability of each context-rich topic
+    (with the key 'topic' + topic index) and the probability of not being
+    about any of them (with the key 'nocontexttopics')
+
+    :type topic_distributions: numpy.ndarray
+    :param topic_distributions: a (records x topics) matrix
+    :type context_rich_topics: list[(int, float)]
+    :param context_rich_topics: the context-rich topics and their ratios
+    :rtype: list[dict]
+    :return: a list with the context topics map of each record
+    """
+    topic_indices = [topic[0] for topic in context_rich_topics]
+    topic_ids = ['topic' + str(topic_index) for topic_index in topic_indices]
+
+    context_distributions = topic_distributions[:, topic_indices]
+    context_topics_sums = context_distributions.sum(axis=1)
+    context_distributions[context_topics_sums <= 0] = 0.
+    no_context_topics = (1 - context_topics_sums).tolist()
+
+    topics_maps = []
+    for row, no_context_probability in zip(
+            context_distributions.tolist(), no_context_topics):
+        topics_map = dict(zip(topic_ids, row))
+        topics_map['nocontexttopics'] = no_context_probability
+        topics_maps.append(topics_map)
+
+    return topics_maps
+
+
+def iterate_chunks(records, chunk_size):
+    """
+    Splits the given records in consecutive chunks
+
+    :param records: a list of records
+    :param chunk_size: the number of records of each chunk. If None all the
+    records are returned in a single chunk
+    :return: a generator of lists of records
+    """
+    if chunk_size is None:
+        chunk_size = max(len(records), 1)
+    for start in xrange(0, len(records), chunk_size):
+        yield records[start:start + chunk_size]
+
+
 def sample_bag_of_words(review_bow, sampling_method, max_words=None):
     """
     Samples a list of strings containing a bag of words using the given
@@ -6,11 +6,11 @@ import operator
 import numpy
 from sklearn import decomposition
 
-from sklearn.feature_extraction.stop_words import ENGLISH_STOP_WORDS
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.preprocessing import normalize
 
 from etl import ETLUtils
+from topicmodeling import nmf_ensemble
+from topicmodeling.context import lda_context_utils
+from topicmodeling.context import online_topic_model
 from utils.constants import Constants
 
 
@@ -75,19 +75,10 @@ class NmfContextExtractor:
 
     def build_document_term_matrix(self):
 
-        self.tfidf_vectorizer = TfidfVectorizer(
-            stop_words=ENGLISH_STOP_WORDS, lowercase=True,
-            strip_accents="unicode",
-            use_idf=True, norm="l2", min_df=Constants.MIN_DICTIONARY_WORD_COUNT,
-            max_df=Constants.MAX_DICTIONARY_WORD_COUNT, ngram_range=(1, 1))
+        self.tfidf_vectorizer = online_topic_model.create_tfidf_vectorizer()
         self.document_term_matrix = \
             self.tfidf_vectorizer.fit_transform(self.target_bows)
-
-        vocabulary = self.tfidf_vectorizer.vocabulary_
-        num_terms = len(vocabulary)
-        self.terms = [""] * num_terms
-        for term in vocabulary.keys():
-            self.terms[vocabulary[term]] = term
+        self.terms = online_topic_model.get_terms(self.tfidf_vectorizer)
 
         print "Created document-term matrix of size %d x %d" % (
             self.document_term_matrix.shape[0],
@@ -108,43 +99,11 @@ class NmfContextExtractor:
         print('%s: topic model built' %
               time.strftime("%Y/%m/%d-%H:%M:%S"))
 
-    def build_single_topic_model(self):
-        # print('%s: building NMF topic model' %
-        #       time.strftime("%Y/%m/%d-%H:%M:%S"))
-
-        topic_model = decomposition.NMF(
-            init="nndsvd", n_components=self.num_topics,
-            max_iter=Constants.TOPIC_MODEL_ITERATIONS,
-            alpha=Constants.NMF_REGULARIZATION,
-            l1_ratio=Constants.NMF_REGULARIZATION_RATIO
-        )
-        topic_model.fit_transform(self.document_term_matrix)
-        topic_term_matrix = topic_model.components_
-
-        return topic_term_matrix
-
     def build_stable_topic_model(self):
 
-        matrices = []
-        for i in range(Constants.TOPIC_MODEL_PASSES):
-            topic_term_matrix = self.build_single_topic_model().transpose()
-            matrices.append(topic_term_matrix)
-
-        stack_matrix = numpy.hstack(matrices)
-        stack_matrix = normalize(stack_matrix, axis=0)
-        stack_matrix = stack_matrix.transpose()
-
-        print "Stack matrix M of size %s" % str(stack_matrix.shape)
-
-        self.topic_model = decomposition.NMF(
-            init="nndsvd", n_components=self.num_topics,
-            max_iter=Constants.TOPIC_MODEL_ITERATIONS,
-            alpha=Constants.NMF_REGULARIZATION,
-            l1_ratio=Constants.NMF_REGULARIZATION_RATIO
-        )
-
-        self.document_topic_matrix = \
-            self.topic_model.fit_transform(stack_matrix)
+        self.topic_model, self.document_topic_matrix = \
+            nmf_ensemble.build_ensemble_topic_model(
+                self.document_term_matrix, self.num_topics)
         self.topic_term_matrix = self.topic_model.components_
 
         row_sums = self.topic_term_matrix.sum(axis=1)
@@ -157,6 +116,46 @@ class NmfContextExtractor:
 
         # return model
 
+    def build_streaming_topic_model(
+            self, file_path,
+            chunk_size=lda_context_utils.TOPIC_MODEL_CHUNK_SIZE):
+        """
+        Builds an online NMF topic model with the target reviews of the given
+        records file, which are streamed from disk in chunks, instead of
+        building the document-term matrix of the records of this object
+
+        :param file_path: the path of the JSON records file
+        :param chunk_size: the number of documents of each mini-batch
+        """
+        self.tfidf_vectorizer, self.topic_model = \
+            online_topic_model.train_nmf_model(file_path, chunk_size)
+        self.terms = online_topic_model.get_terms(self.tfidf_vectorizer)
+        # The components of the model are not normalized in place, since
+        # they are used by its transform method
+        topic_term_matrix = self.topic_model.components_
+        self.topic_term_matrix = \
+            topic_term_matrix / topic_term_matrix.sum(axis=1)[:, numpy.newaxis]
+
+    def update_topic_model(self, records):
+        """
+        Updates the online NMF topic model with the target reviews of the
+        given records, instead of training it again from scratch
+
+        :param records: the new records
+        """
+        if not isinstance(self.topic_model, online_topic_model.OnlineNmf):
+            raise ValueError('Only online NMF topic models can be updated')
+
+        documents = [
+            " ".join(record[Constants.BOW_FIELD]) for record in
+            online_topic_model.get_target_reviews(records)
+        ]
+        online_topic_model.update_nmf_model(
+            self.tfidf_vectorizer, self.topic_model, documents)
+        topic_term_matrix = self.topic_model.components_
+        self.topic_term_matrix = \
+            topic_term_matrix / topic_term_matrix.sum(axis=1)[:, numpy.newaxis]
+
     def update_reviews_with_topics(self):
 
         self.update_documents_with_topics(self.target_reviews, self.target_bows)
@@ -207,47 +206,17 @@ class NmfContextExtractor:
             print('context topics: %d' % len(self.context_rich_topics))
             return sorted_topics
 
-        # numpy.random.seed(0)
-        topic_ratio_map = {}
-        self.topic_weighted_frequency_map = {}
-        lower_than_alpha_count = 0.0
-        lower_than_beta_count = 0.0
-        non_contextual_topics = set()
-        for topic in range(self.num_topics):
-            # print('topic: %d' % topic)
-            weighted_frq = self.calculate_topic_weighted_frequency(
-                topic, self.records)
-            target_weighted_frq = \
-                self.calculate_topic_weighted_frequency(
-                    topic, self.target_reviews)
-            non_target_weighted_frq = \
-                self.calculate_topic_weighted_frequency(
-                    topic, self.non_target_reviews)
-
-            if weighted_frq < Constants.CONTEXT_EXTRACTOR_ALPHA:
-                non_contextual_topics.add(topic)
-                # print('non-contextual_topic: %d' % topic)
-                lower_than_alpha_count += 1.0
-
-            if non_target_weighted_frq == 0:
-                # We can't know if the topic is good or not
-                non_contextual_topics.add(topic)
-                ratio = 'N/A'
-                # non_contextual_topics.add(topic)
-            else:
-                ratio = target_weighted_frq / non_target_weighted_frq
-
-            # print('topic: %d --> ratio: %f\tspecific: %f\tgeneric: %f' %
-            #       (topic, ratio, target_weighted_frq, non_target_weighted_frq))
-
-            if self.lda_beta_comparison_operator(
-                    ratio, Constants.CONTEXT_EXTRACTOR_BETA):
-                non_contextual_topics.add(topic)
-                lower_than_beta_count += 1.0
-                # print('non-contextual_topic: %d' % topic)
-
-            topic_ratio_map[topic] = ratio
-            self.topic_weighted_frequency_map[topic] = weighted_frq
+        # All the weighted frequencies and ratios are calculated at once from
+        # the topic weight matrices of the target and non-target reviews
+        target_matrix = lda_context_utils.build_topic_weight_matrix(
+            self.target_reviews, self.num_topics)
+        non_target_matrix = lda_context_utils.build_topic_weight_matrix(
+            self.non_target_reviews, self.num_topics)
+        topic_ratio_map, self.topic_weighted_frequency_map,\
+            non_contextual_topics, lower_than_alpha_count,\
+            lower_than_beta_count = lda_context_utils.find_context_rich_topics(
+                target_matrix, non_target_matrix,
+                self.lda_beta_comparison_operator)
 
         self.topic_ratio_map = copy.deepcopy(topic_ratio_map)
 
@@ -278,59 +247,27 @@ class NmfContextExtractor:
 
         return sorted_topics
 
-    @staticmethod
-    def calculate_topic_weighted_frequency(topic, reviews):
+    def find_contextual_topics(
+            self, records, text_sampling_proportion=None,
+            chunk_size=lda_context_utils.TOPIC_INFERENCE_CHUNK_SIZE):
         """
-
-        :type topic: int
-        :param topic:
-        :type reviews: list[dict]
-        :param reviews:
-        :return:
+        Finds the context topics of the given records. The records are
+        vectorized and their topics are inferred in chunks, with a single call
+        to the vectorizer and the topic model per chunk
+
+        :param records: the records
+        :param text_sampling_proportion: not used, the whole text of the
+        records is always taken
+        :param chunk_size: the number of records whose topics are inferred at
+        once, or None to infer the topics of all the records at once
+        :return: the records, with the context topics field
         """
-        num_reviews = 0.0
-
-        for review in reviews:
-            for review_topic in review[Constants.TOPICS_FIELD]:
-                if topic == review_topic[0]:
-                    if Constants.TOPIC_WEIGHTING_METHOD == 'binary':
-                        num_reviews += 1
-                    elif Constants.TOPIC_WEIGHTING_METHOD == 'probability':
-                        num_reviews += review_topic[1]
-                    else:
-                        raise ValueError(
-                            'Topic weighting method not recognized')
-
-        return num_reviews / len(reviews)
-
-    def find_contextual_topics(self, records, text_sampling_proportion=None):
-        for record in records:
-            # numpy.random.seed(0)
-            topic_distribution =\
-                self.get_topic_distribution(record)
-
-            # We calculate the sum of the probabilities of the contextual topics
-            # to then normalize the contextual vector
-            context_topics_sum = 0.0
-            # print('context rich topics', self.context_rich_topics)
-            for i in self.context_rich_topics:
-                context_topics_sum += topic_distribution[i[0]]
-
-            topics_map = {}
-            for i in self.context_rich_topics:
-                topic_id = 'topic' + str(i[0])
-                if context_topics_sum > 0:
-                    topics_map[topic_id] = \
-                        topic_distribution[i[0]] / 1.0
-                else:
-                    topics_map[topic_id] = 0.0
-
-            topics_map['nocontexttopics'] = 1 - context_topics_sum
-
-            record[Constants.CONTEXT_TOPICS_FIELD] = topics_map
-
-        # print(self.context_rich_topics)
-        # print('total_topics', len(self.context_rich_topics))
+        for chunk in lda_context_utils.iterate_chunks(records, chunk_size):
+            topic_distributions = self.get_topic_distributions(chunk)
+            topics_maps = lda_context_utils.build_context_topics_maps(
+                topic_distributions, self.context_rich_topics)
+            for record, topics_map in zip(chunk, topics_maps):
+                record[Constants.CONTEXT_TOPICS_FIELD] = topics_map
 
         return records
 
@@ -367,6 +304,12 @@ class NmfContextExtractor:
 
         return document_topic_matrix[0]
 
+    def get_topic_distributions(self, records):
+        corpus = [" ".join(record[Constants.BOW_FIELD]) for record in records]
+        document_term_matrix = self.tfidf_vectorizer.transform(corpus)
+
+        return self.topic_model.transform(document_term_matrix)
+
     def clear_reviews(self):
         self.records = None
         self.target_reviews = None
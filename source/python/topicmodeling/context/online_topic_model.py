@@ -0,0 +1,395 @@
+import collections
+import numbers
+import time
+
+import numpy
+from scipy import sparse
+from sklearn.feature_extraction.stop_words import ENGLISH_STOP_WORDS
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from etl import record_store
+from topicmodeling.context import lda_context_utils
+from utils.constants import Constants
+
+__author__ = 'fpena'
+
+
+# The number of multiplicative updates used to fit the topic weights of the
+# documents and the topics of the online NMF model
+NMF_DOCUMENT_ITERATIONS = 50
+NMF_TOPIC_ITERATIONS = 10
+
+EPSILON = 1e-10
+
+
+class StreamingCorpus(object):
+    """
+    Re-iterable sequence with one field of the target reviews of a records
+    file, which is read from the columnar store of the file in chunks. It can
+    be given to gensim, which goes through it once per pass, and only one
+    chunk of records is decoded in memory at a time
+    """
+
+    def __init__(
+            self, file_path, field=Constants.CORPUS_FIELD,
+            chunk_size=lda_context_utils.TOPIC_MODEL_CHUNK_SIZE):
+        """
+        :param file_path: the path of the JSON records file
+        :param field: the field of the records that is returned
+        :param chunk_size: the number of records that are read at once
+        """
+        self.file_path = file_path
+        self.field = field
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        for documents in self.iterate_chunks():
+            for document in documents:
+                yield document
+
+    def iterate_chunks(self):
+        """
+        :return: a generator with the list of documents of each chunk
+        """
+        fields = [self.field, Constants.TOPIC_MODEL_TARGET_FIELD]
+        for records in record_store.iterate_records(
+                self.file_path, fields, self.chunk_size):
+            yield [
+                record[self.field] for record in get_target_reviews(records)]
+
+
+class OnlineNmf(object):
+    """
+    Non-negative matrix factorization that is learned from mini-batches of
+    documents, so the whole document-term matrix never has to be in memory.
+    It uses the online algorithm of Mairal et al. (2010) with multiplicative
+    updates: the sufficient statistics A = sum(W^T X) and B = sum(W^T W) of
+    the batches are accumulated and the topics H are updated to minimize
+    ||X - WH|| given them. A model that has already been trained can be
+    updated with new documents by calling partial_fit again, but documents
+    can't be removed from it.
+
+    It exposes the components_ and transform of sklearn's NMF, so it can be
+    used as the topic model of NmfContextExtractor. The NMF regularization is
+    not supported
+    """
+
+    def __init__(self, num_topics, forget_factor=1., seed=None):
+        """
+        :param num_topics: the number of topics
+        :param forget_factor: the weight of the statistics of the previous
+        batches when a new batch is added, 1 to weight all the documents
+        equally
+        :param seed: the seed used to initialize the topics. By default
+        Constants.NUMPY_RANDOM_SEED is used
+        """
+        self.num_topics = num_topics
+        self.forget_factor = forget_factor
+        self.random_state = numpy.random.RandomState(
+            Constants.NUMPY_RANDOM_SEED if seed is None else seed)
+        self.components_ = None
+        self.num_documents = 0
+        self._a = None
+        self._b = None
+
+    def fit(self, document_term_chunks, passes=1):
+        """
+        Trains the model with the given chunks of documents. Every pass
+        replaces the statistics of the documents that were added in the
+        previous pass, so the documents are not counted once per pass
+
+        :param document_term_chunks: a re-iterable sequence of document-term
+        matrices
+        :param passes: the number of times the chunks are read
+        :return: this model
+        """
+        statistics = self._get_statistics()
+        for pass_index in range(passes):
+            if pass_index > 0:
+                self._set_statistics(statistics)
+            for document_term_matrix in document_term_chunks:
+                self.partial_fit(document_term_matrix)
+        return self
+
+    def partial_fit(self, document_term_matrix):
+        """
+        Updates the topics with a batch of documents
+
+        :param document_term_matrix: the (documents x terms) matrix of the
+        batch
+        :return: this model
+        """
+        x = sparse.csr_matrix(document_term_matrix, dtype=numpy.float64)
+        if x.shape[0] == 0:
+            return self
+        if self.components_ is None:
+            self._initialize(x)
+
+        w = self.transform(x)
+        self._a = self.forget_factor * self._a + x.T.dot(w).T
+        self._b = self.forget_factor * self._b + w.T.dot(w)
+        self.num_documents += x.shape[0]
+
+        h = self.components_
+        for _ in range(NMF_TOPIC_ITERATIONS):
+            h *= self._a / (self._b.dot(h) + EPSILON)
+
+        return self
+
+    def transform(self, document_term_matrix):
+        """
+        Calculates the topic weights of the given documents with the current
+        topics
+
+        :param document_term_matrix: the (documents x terms) matrix
+        :rtype: numpy.ndarray
+        :return: the (documents x topics) matrix
+        """
+        x = sparse.csr_matrix(document_term_matrix, dtype=numpy.float64)
+        h = self.components_
+        xht = numpy.asarray(x.dot(h.T))
+        hht = h.dot(h.T)
+        w = numpy.full(
+            (x.shape[0], self.num_topics),
+            numpy.sqrt(max(x.mean(), EPSILON) / self.num_topics))
+        for _ in range(NMF_DOCUMENT_ITERATIONS):
+            w *= xht / (w.dot(hht) + EPSILON)
+        return w
+
+    def _get_statistics(self):
+        if self.components_ is None:
+            return None
+        return self._a.copy(), self._b.copy(), self.num_documents
+
+    def _set_statistics(self, statistics):
+        if statistics is None:
+            self._a[:] = 0.
+            self._b[:] = 0.
+            self.num_documents = 0
+        else:
+            a, b, self.num_documents = statistics
+            self._a = a.copy()
+            self._b = b.copy()
+
+    def _initialize(self, x):
+        scale = numpy.sqrt(max(x.mean(), EPSILON) / self.num_topics)
+        self.components_ = scale * self.random_state.rand(
+            self.num_topics, x.shape[1])
+        self._a = numpy.zeros((self.num_topics, x.shape[1]))
+        self._b = numpy.zeros((self.num_topics, self.num_topics))
+
+
+def get_target_reviews(records):
+    return [
+        record for record in records
+        if record[Constants.TOPIC_MODEL_TARGET_FIELD] ==
+        Constants.TOPIC_MODEL_TARGET_REVIEWS
+    ]
+
+
+def get_delta_records(records, new_records):
+    """
+    Returns the records that a topic model trained with the given records has
+    to be updated with to become a model of the new records. The topic models
+    can only be updated with new documents, so the new records must contain
+    all the given records, as the full train set contains the records of a
+    validation fold does
+
+    :param records: the records the topic model has been trained with
+    :param new_records: the records of the updated topic model
+    :return: the records of new_records that are not in records
+    :raises ValueError: if some of the records are not in new_records, since
+    they would have to be removed from the topic model
+    """
+    review_ids = set(
+        record[Constants.REVIEW_ID_FIELD] for record in records)
+    new_review_ids = set(
+        record[Constants.REVIEW_ID_FIELD] for record in new_records)
+    missing_review_ids = review_ids - new_review_ids
+    if missing_review_ids:
+        raise ValueError(
+            'The topic model can only be updated with new records, but %d of '
+            'its records would have to be removed' % len(missing_review_ids))
+
+    return [
+        record for record in new_records
+        if record[Constants.REVIEW_ID_FIELD] not in review_ids
+    ]
+
+
+def create_tfidf_vectorizer(vocabulary=None):
+    """
+    Creates the TF-IDF vectorizer used by the NMF topic models
+
+    :param vocabulary: a fixed vocabulary, or None to learn it from the
+    documents
+    :rtype: TfidfVectorizer
+    """
+    return TfidfVectorizer(
+        stop_words=ENGLISH_STOP_WORDS, lowercase=True,
+        strip_accents="unicode",
+        use_idf=True, norm="l2", min_df=Constants.MIN_DICTIONARY_WORD_COUNT,
+        max_df=Constants.MAX_DICTIONARY_WORD_COUNT, ngram_range=(1, 1),
+        vocabulary=vocabulary)
+
+
+def get_terms(tfidf_vectorizer):
+    """
+    :type tfidf_vectorizer: TfidfVectorizer
+    :return: a list with the terms of the vectorizer, in the order of their
+    columns
+    """
+    vocabulary = tfidf_vectorizer.vocabulary_
+    terms = [""] * len(vocabulary)
+    for term, term_index in vocabulary.items():
+        terms[term_index] = term
+    return terms
+
+
+def build_tfidf_vectorizer(document_chunks):
+    """
+    Builds the same TF-IDF vectorizer that create_tfidf_vectorizer would fit
+    with all the documents, reading the documents in chunks. Only the
+    document frequency of each term is kept in memory
+
+    :param document_chunks: a re-iterable sequence of lists of documents,
+    where each document is a string
+    :rtype: TfidfVectorizer
+    :return: the fitted vectorizer
+    """
+    analyzer = create_tfidf_vectorizer().build_analyzer()
+    document_frequencies = collections.Counter()
+    num_documents = 0
+    for documents in document_chunks:
+        for document in documents:
+            document_frequencies.update(set(analyzer(document)))
+        num_documents += len(documents)
+
+    min_df = Constants.MIN_DICTIONARY_WORD_COUNT
+    max_df = Constants.MAX_DICTIONARY_WORD_COUNT
+    if not isinstance(min_df, numbers.Integral):
+        min_df *= num_documents
+    if not isinstance(max_df, numbers.Integral):
+        max_df *= num_documents
+    terms = sorted(
+        term for term, frequency in document_frequencies.items()
+        if min_df <= frequency <= max_df)
+
+    vectorizer = create_tfidf_vectorizer(
+        {term: index for index, term in enumerate(terms)})
+    frequencies = numpy.array(
+        [document_frequencies[term] for term in terms], dtype=numpy.float64)
+    # The smoothed inverse document frequency used by sklearn
+    vectorizer.idf_ = numpy.log((1. + num_documents) / (1. + frequencies)) + 1.
+
+    return vectorizer
+
+
+class _DocumentTermChunks(object):
+    """
+    Re-iterable sequence with the TF-IDF document-term matrices of some
+    chunks of documents
+    """
+
+    def __init__(self, tfidf_vectorizer, document_chunks):
+        self.tfidf_vectorizer = tfidf_vectorizer
+        self.document_chunks = document_chunks
+
+    def __iter__(self):
+        for documents in self.document_chunks:
+            yield self.tfidf_vectorizer.transform(documents)
+
+
+class _BowChunks(object):
+    """
+    Re-iterable sequence with the chunks of a StreamingCorpus of bags of
+    words, joined into strings for the TF-IDF vectorizer
+    """
+
+    def __init__(self, corpus):
+        self.corpus = corpus
+
+    def __iter__(self):
+        for bows in self.corpus.iterate_chunks():
+            yield [" ".join(bow) for bow in bows]
+
+
+def train_lda_model(
+        file_path, dictionary,
+        chunk_size=lda_context_utils.TOPIC_MODEL_CHUNK_SIZE):
+    """
+    Trains an LDA topic model with the corpus of the target reviews of the
+    given records file, which is streamed from disk in chunks and used in
+    online LDA updates
+
+    :param file_path: the path of the JSON records file
+    :type dictionary: gensim.corpora.Dictionary
+    :param dictionary: the dictionary of the corpus
+    :param chunk_size: the number of documents of each update
+    :rtype: gensim.models.ldamodel.LdaModel
+    """
+    print('%s: training streaming LDA topic model' %
+          time.strftime("%Y/%m/%d-%H:%M:%S"))
+    corpus = StreamingCorpus(file_path, Constants.CORPUS_FIELD, chunk_size)
+    return lda_context_utils.build_topic_model_from_corpus(
+        corpus, dictionary, chunk_size)
+
+
+def update_lda_model(
+        topic_model, corpus,
+        chunk_size=lda_context_utils.TOPIC_MODEL_CHUNK_SIZE):
+    """
+    Updates a trained LDA topic model with new documents, instead of training
+    it again from scratch
+
+    :type topic_model: gensim.models.ldamodel.LdaModel
+    :param corpus: the corpus of the new documents
+    :param chunk_size: the number of documents of each update
+    """
+    if len(corpus) > 0:
+        topic_model.update(corpus, chunksize=chunk_size)
+
+
+def train_nmf_model(
+        file_path, chunk_size=lda_context_utils.TOPIC_MODEL_CHUNK_SIZE):
+    """
+    Trains an online NMF topic model with the bag of words of the target
+    reviews of the given records file, which is streamed from disk in chunks.
+    The corpus is read once to build the TF-IDF vectorizer and once per pass
+    to train the model, so the whole document-term matrix is never built
+
+    :param file_path: the path of the JSON records file
+    :param chunk_size: the number of documents of each mini-batch
+    :rtype: (TfidfVectorizer, OnlineNmf)
+    :return: the TF-IDF vectorizer and the topic model
+    """
+    print('%s: training streaming NMF topic model' %
+          time.strftime("%Y/%m/%d-%H:%M:%S"))
+    document_chunks = _BowChunks(
+        StreamingCorpus(file_path, Constants.BOW_FIELD, chunk_size))
+    tfidf_vectorizer = build_tfidf_vectorizer(document_chunks)
+    topic_model = OnlineNmf(Constants.TOPIC_MODEL_NUM_TOPICS)
+    topic_model.fit(
+        _DocumentTermChunks(tfidf_vectorizer, document_chunks),
+        Constants.TOPIC_MODEL_PASSES)
+
+    return tfidf_vectorizer, topic_model
+
+
+def update_nmf_model(
+        tfidf_vectorizer, topic_model, documents,
+        chunk_size=lda_context_utils.TOPIC_MODEL_CHUNK_SIZE):
+    """
+    Updates a trained online NMF topic model with new documents. The
+    vocabulary of the TF-IDF vectorizer is not changed, so the terms that
+    don't appear in it are ignored
+
+    :type tfidf_vectorizer: TfidfVectorizer
+    :type topic_model: OnlineNmf
+    :param documents: the new documents, as strings
+    :param chunk_size: the number of documents of each mini-batch
+    """
+    document_chunks = lda_context_utils.iterate_chunks(documents, chunk_size)
+    for document_term_matrix in _DocumentTermChunks(
+            tfidf_vectorizer, document_chunks):
+        topic_model.partial_fit(document_term_matrix)
@@ -21,8 +21,9 @@ def get_review_metrics(record):
     :rtype: list[float]
     :return: a list with numeric metrics
     """
-    review_text = record[Constants.TEXT_FIELD]
-    log_sentences = math.log(len(nlp_utils.get_sentences(review_text)) + 1)
+    # The number of sentences is not part of the metrics, so the text is not
+    # split into sentences
+    # log_sentences = math.log(len(nlp_utils.get_sentences(review_text)) + 1)
     # log_time_words = math.log(len(self.get_time_words(review.text)) + 1)
     tagged_words = record[Constants.POS_TAGS_FIELD]
     log_words = math.log(len(tagged_words) + 1)
@@ -73,6 +74,20 @@ def get_review_metrics(record):
     return numpy.array(result)
 
 
+def get_reviews_metrics(records):
+    """
+    Returns a matrix with the metrics of each of the given reviews, as
+    calculated by get_review_metrics
+
+    :type records: list[dict]
+    :param records: the reviews, with their part-of-speech tags
+    :rtype: numpy.ndarray
+    :return: a (reviews x metrics) matrix
+    """
+    return numpy.array(
+        [get_review_metrics(record) for record in records], dtype=float)
+
+
 def normalize_matrix_by_columns(matrix, min_values=None, max_values=None):
     """
 
@@ -25,13 +25,8 @@ class ReviewsClassifier:
         the dependent variables (y)
         """
 
-        self.num_features = \
-            len(review_metrics_extractor.get_review_metrics(records[0]))
-        metrics = numpy.zeros((len(records), self.num_features))
-
-        for index in range(len(records)):
-            metrics[index] = \
-                review_metrics_extractor.get_review_metrics(records[index])
+        metrics = review_metrics_extractor.get_reviews_metrics(records)
+        self.num_features = metrics.shape[1]
 
         self.min_values = metrics.min(axis=0)
         self.max_values = metrics.max(axis=0)
@@ -53,10 +48,7 @@ class ReviewsClassifier:
         self.classifier.fit(metrics, labels)
 
     def predict(self, records):
-        metrics = numpy.zeros((len(records), self.num_features))
-        for index in range(len(records)):
-            metrics[index] =\
-                review_metrics_extractor.get_review_metrics(records[index])
+        metrics = review_metrics_extractor.get_reviews_metrics(records)
 
         review_metrics_extractor.normalize_matrix_by_columns(
             metrics, self.min_values, self.max_values)
@@ -75,10 +67,7 @@ class ReviewsClassifier:
             record[Constants.PREDICTED_CLASS_FIELD] = label
 
     def score(self, records):
-        metrics = numpy.zeros((len(records), self.num_features))
-        for index in range(len(records)):
-            metrics[index] = \
-                review_metrics_extractor.get_review_metrics(records[index])
+        metrics = review_metrics_extractor.get_reviews_metrics(records)
 
         review_metrics_extractor.normalize_matrix_by_columns(
             metrics, self.min_values, self.max_values)
@@ -0,0 +1,142 @@
+import operator
+from unittest import TestCase
+
+import numpy
+
+from topicmodeling.context import lda_context_utils
+from utils.constants import Constants
+
+__author__ = 'fpena'
+
+
+def generate_reviews(random_state, num_reviews, num_topics):
+    reviews = []
+    for _ in range(num_reviews):
+        topics = random_state.choice(
+            num_topics, random_state.randint(num_topics + 1), replace=False)
+        probabilities = random_state.rand(len(topics))
+        reviews.append({Constants.TOPICS_FIELD: [
+            (int(topic), float(probability))
+            for topic, probability in zip(topics, probabilities)]})
+    return reviews
+
+
+class TestLdaContextUtils(TestCase):
+
+    def setUp(self):
+        self.weighting_method = Constants.TOPIC_WEIGHTING_METHOD
+        self.alpha = Constants.CONTEXT_EXTRACTOR_ALPHA
+        self.beta = Constants.CONTEXT_EXTRACTOR_BETA
+        random_state = numpy.random.RandomState(0)
+        self.num_topics = 6
+        self.target_reviews = generate_reviews(
+            random_state, 20, self.num_topics)
+        self.non_target_reviews = generate_reviews(
+            random_state, 30, self.num_topics)
+        # Topic 5 never appears in the non-target reviews
+        for review in self.non_target_reviews:
+            review[Constants.TOPICS_FIELD] = [
+                review_topic for review_topic in review[Constants.TOPICS_FIELD]
+                if review_topic[0] != 5]
+
+    def tearDown(self):
+        Constants.TOPIC_WEIGHTING_METHOD = self.weighting_method
+        Constants.CONTEXT_EXTRACTOR_ALPHA = self.alpha
+        Constants.CONTEXT_EXTRACTOR_BETA = self.beta
+
+    def test_build_topic_weight_matrix(self):
+        for weighting_method in ['binary', 'probability']:
+            Constants.TOPIC_WEIGHTING_METHOD = weighting_method
+            topic_matrix = lda_context_utils.build_topic_weight_matrix(
+                self.target_reviews, self.num_topics)
+            self.assertEqual((20, self.num_topics), topic_matrix.shape)
+            for topic in range(self.num_topics):
+                self.assertAlmostEqual(
+                    lda_context_utils.calculate_topic_weighted_frequency(
+                        topic, self.target_reviews),
+                    topic_matrix[:, topic].sum() / 20)
+
+        Constants.TOPIC_WEIGHTING_METHOD = 'unknown'
+        self.assertRaises(
+            ValueError, lda_context_utils.build_topic_weight_matrix,
+            self.target_reviews, self.num_topics)
+
+    def test_find_context_rich_topics(self):
+        Constants.TOPIC_WEIGHTING_METHOD = 'probability'
+        Constants.CONTEXT_EXTRACTOR_ALPHA = 0.2
+        Constants.CONTEXT_EXTRACTOR_BETA = 1.0
+        records = self.target_reviews + self.non_target_reviews
+
+        topic_ratio_map, topic_weighted_frequency_map,\
+            non_contextual_topics, lower_than_alpha_count,\
+            lower_than_beta_count = lda_context_utils.find_context_rich_topics(
+                lda_context_utils.build_topic_weight_matrix(
+                    self.target_reviews, self.num_topics),
+                lda_context_utils.build_topic_weight_matrix(
+                    self.non_target_reviews, self.num_topics),
+                operator.lt)
+
+        # The same values calculated topic by topic
+        expected_non_contextual_topics = set()
+        expected_alpha_count = 0
+        expected_beta_count = 0
+        for topic in range(self.num_topics):
+            weighted_frq = lda_context_utils.calculate_topic_weighted_frequency(
+                topic, records)
+            target_frq = lda_context_utils.calculate_topic_weighted_frequency(
+                topic, self.target_reviews)
+            non_target_frq = \
+                lda_context_utils.calculate_topic_weighted_frequency(
+                    topic, self.non_target_reviews)
+            if weighted_frq < Constants.CONTEXT_EXTRACTOR_ALPHA:
+                expected_non_contextual_topics.add(topic)
+                expected_alpha_count += 1
+            if non_target_frq == 0:
+                expected_non_contextual_topics.add(topic)
+                ratio = 'N/A'
+                self.assertEqual(ratio, topic_ratio_map[topic])
+            else:
+                ratio = target_frq / non_target_frq
+                self.assertAlmostEqual(ratio, topic_ratio_map[topic])
+            if ratio < Constants.CONTEXT_EXTRACTOR_BETA:
+                expected_non_contextual_topics.add(topic)
+                expected_beta_count += 1
+            self.assertAlmostEqual(
+                weighted_frq, topic_weighted_frequency_map[topic])
+
+        self.assertEqual('N/A', topic_ratio_map[5])
+        self.assertEqual(expected_non_contextual_topics, non_contextual_topics)
+        self.assertEqual(expected_alpha_count, lower_than_alpha_count)
+        self.assertEqual(expected_beta_count, lower_than_beta_count)
+
+    def test_build_context_topics_maps(self):
+        random_state = numpy.random.RandomState(0)
+        topic_distributions = random_state.rand(10, self.num_topics) / 3
+        # A record without any of the context-rich topics
+        topic_distributions[3, [1, 4]] = 0.
+        context_rich_topics = [(4, 2.5), (1, 1.5)]
+
+        topics_maps = lda_context_utils.build_context_topics_maps(
+            topic_distributions.copy(), context_rich_topics)
+
+        self.assertEqual(10, len(topics_maps))
+        for topic_distribution, topics_map in zip(
+                topic_distributions, topics_maps):
+            context_topics_sum = \
+                topic_distribution[4] + topic_distribution[1]
+            self.assertEqual(
+                {'topic4', 'topic1', 'nocontexttopics'}, set(topics_map))
+            self.assertAlmostEqual(topic_distribution[4], topics_map['topic4'])
+            self.assertAlmostEqual(topic_distribution[1], topics_map['topic1'])
+            self.assertAlmostEqual(
+                1 - context_topics_sum, topics_map['nocontexttopics'])
+        self.assertEqual(1.0, topics_maps[3]['nocontexttopics'])
+
+    def test_iterate_chunks(self):
+        records = range(7)
+        self.assertEqual(
+            [[0, 1, 2], [3, 4, 5], [6]],
+            list(lda_context_utils.iterate_chunks(records, 3)))
+        self.assertEqual(
+            [records], list(lda_context_utils.iterate_chunks(records, None)))
+        self.assertEqual([], list(lda_context_utils.iterate_chunks([], None)))
@@ -0,0 +1,151 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy
+from scipy import sparse
+
+from etl import record_store
+from topicmodeling.context import online_topic_model
+from topicmodeling.context.online_topic_model import OnlineNmf
+from topicmodeling.context.online_topic_model import StreamingCorpus
+from utils.constants import Constants
+
+__author__ = 'fpena'
+
+
+def generate_records(random_state, num_records):
+    words = ['word%02d' % index for index in range(30)]
+    records = []
+    for index in range(num_records):
+        # The first half of the words and the second half are two topics
+        topic = index % 2
+        bow = list(random_state.choice(
+            words[topic * 15:(topic + 1) * 15], 10))
+        records.append({
+            Constants.REVIEW_ID_FIELD: 'r%d' % index,
+            Constants.BOW_FIELD: bow,
+            Constants.CORPUS_FIELD: [[index % 7, 1.0]],
+            Constants.TOPIC_MODEL_TARGET_FIELD:
+                Constants.TOPIC_MODEL_TARGET_REVIEWS if index % 3
+                else 'other'
+        })
+    return records
+
+
+def calculate_error(x, topic_model):
+    return numpy.linalg.norm(
+        x.toarray() - topic_model.transform(x).dot(topic_model.components_))
+
+
+class TestOnlineTopicModel(TestCase):
+
+    def setUp(self):
+        self.min_count = Constants.MIN_DICTIONARY_WORD_COUNT
+        self.max_count = Constants.MAX_DICTIONARY_WORD_COUNT
+        Constants.MIN_DICTIONARY_WORD_COUNT = 2
+        Constants.MAX_DICTIONARY_WORD_COUNT = 0.9
+        self.directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.directory, 'records.json')
+        self.records = generate_records(numpy.random.RandomState(0), 60)
+
+    def tearDown(self):
+        Constants.MIN_DICTIONARY_WORD_COUNT = self.min_count
+        Constants.MAX_DICTIONARY_WORD_COUNT = self.max_count
+        shutil.rmtree(self.directory)
+
+    def test_streaming_corpus(self):
+        record_store.save_records(
+            self.file_path, self.records, export_json=False)
+        corpus = StreamingCorpus(self.file_path, Constants.BOW_FIELD, 7)
+
+        expected_bows = [
+            record[Constants.BOW_FIELD] for record in
+            online_topic_model.get_target_reviews(self.records)]
+        self.assertEqual(expected_bows, list(corpus))
+        # The corpus can be read several times, like gensim does
+        self.assertEqual(expected_bows, list(corpus))
+        self.assertEqual(
+            9, len(list(corpus.iterate_chunks())))
+
+    def test_build_tfidf_vectorizer(self):
+        documents = [
+            " ".join(record[Constants.BOW_FIELD]) for record in self.records]
+        expected_vectorizer = online_topic_model.create_tfidf_vectorizer()
+        expected_matrix = expected_vectorizer.fit_transform(documents)
+
+        document_chunks = [documents[:25], documents[25:50], documents[50:]]
+        vectorizer = online_topic_model.build_tfidf_vectorizer(document_chunks)
+
+        self.assertEqual(
+            expected_vectorizer.vocabulary_, vectorizer.vocabulary_)
+        numpy.testing.assert_allclose(
+            expected_matrix.toarray(),
+            vectorizer.transform(documents).toarray())
+
+    def test_online_nmf(self):
+        random_state = numpy.random.RandomState(0)
+        x = sparse.csr_matrix(
+            random_state.rand(100, 3).dot(random_state.rand(3, 20)))
+        topic_model = OnlineNmf(3, seed=0)
+        topic_model.partial_fit(x[:50])
+        error = calculate_error(x, topic_model)
+
+        chunks = [x[start:start + 10] for start in range(0, 100, 10)]
+        topic_model.fit(chunks, 5)
+        self.assertEqual((3, 20), topic_model.components_.shape)
+        self.assertEqual((100, 3), topic_model.transform(x).shape)
+        # Every pass replaces the statistics of the previous one
+        self.assertEqual(150, topic_model.num_documents)
+        self.assertLess(calculate_error(x, topic_model), error)
+        self.assertLess(
+            calculate_error(x, topic_model), 0.05 * numpy.linalg.norm(
+                x.toarray()))
+
+    def test_online_nmf_passes(self):
+        random_state = numpy.random.RandomState(0)
+        x = sparse.csr_matrix(
+            random_state.rand(100, 3).dot(random_state.rand(3, 20)))
+        chunks = [x[start:start + 10] for start in range(0, 100, 10)]
+        topic_model = OnlineNmf(3, seed=0).fit(chunks, 5)
+        w = topic_model.transform(x)
+
+        self.assertEqual(100, topic_model.num_documents)
+        # The statistics only contain the documents once
+        self.assertLess(
+            numpy.trace(topic_model._b), 2 * numpy.trace(w.T.dot(w)))
+
+    def test_get_delta_records(self):
+        train_records = self.records[:40]
+        delta_records = online_topic_model.get_delta_records(
+            train_records, self.records)
+        self.assertEqual(self.records[40:], delta_records)
+        self.assertEqual(
+            [], online_topic_model.get_delta_records(
+                train_records, train_records))
+
+        # The records can't be removed from a topic model
+        self.assertRaises(
+            ValueError, online_topic_model.get_delta_records,
+            self.records, train_records)
+
+    def test_update_nmf_model(self):
+        documents = [
+            " ".join(record[Constants.BOW_FIELD]) for record in self.records]
+        vectorizer = online_topic_model.build_tfidf_vectorizer([documents])
+        topic_model = OnlineNmf(2, seed=0)
+        topic_model.fit([vectorizer.transform(documents[:40])], 3)
+
+        x = vectorizer.transform(documents[40:])
+        w = topic_model.transform(x)
+        expected_a = topic_model._a + x.T.dot(w).T
+        expected_b = topic_model._b + w.T.dot(w)
+        online_topic_model.update_nmf_model(
+            vectorizer, topic_model, documents[40:], None)
+
+        # The statistics of the delta documents are added to the ones of the
+        # documents the model was trained with
+        self.assertEqual(60, topic_model.num_documents)
+        numpy.testing.assert_allclose(expected_a, topic_model._a)
+        numpy.testing.assert_allclose(expected_b, topic_model._b)
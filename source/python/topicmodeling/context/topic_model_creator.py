@@ -2,6 +2,7 @@ import argparse
 import codecs
 import os
 import random
+import tempfile
 import time
 import cPickle as pickle
 
@@ -12,15 +13,103 @@ from gensim import corpora
 from gensim.models import ldamodel
 
 from etl import ETLUtils
+from etl import record_store
+from topicmodeling import nmf_ensemble
 from topicmodeling import topic_ensemble_caller
+from topicmodeling.context import online_topic_model
 from topicmodeling.context.lda_based_context import LdaBasedContext
 from topicmodeling.context.nmf_context_extractor import NmfContextExtractor
+from utils import artifact_cache
 from utils import constants
 from utils import utilities
 from utils.constants import Constants
 
 
-def create_topic_model(records, cycle_index, fold_index, check_exists=True):
+# The fields of the records that are used to train the topic models
+TOPIC_MODEL_FIELDS = [
+    Constants.REVIEW_ID_FIELD,
+    Constants.BOW_FIELD,
+    Constants.CORPUS_FIELD,
+    Constants.TOPIC_MODEL_TARGET_FIELD
+]
+
+# The properties that affect the topic models and their context-rich topics
+TOPIC_MODEL_PROPERTIES = [
+    'business_type',
+    'bow_type',
+    'context_extractor_alpha',
+    'context_extractor_beta',
+    'context_extractor_epsilon',
+    'document_level',
+    'language',
+    'lda_beta_comparison_operator',
+    'lda_multicore',
+    'lemmatize',
+    'max_dictionary_word_count',
+    'min_dictionary_word_count',
+    'min_reviews_per_item',
+    'min_reviews_per_user',
+    'nmf_base_model_init',
+    'nmf_regularization',
+    'nmf_regularization_ratio',
+    'numpy_random_seed',
+    'random_seed',
+    'topic_model_iterations',
+    'topic_model_num_topics',
+    'topic_model_passes',
+    'topic_model_streaming',
+    'topic_model_target_reviews',
+    'topic_model_target_type',
+    'topic_model_type',
+    'topic_weighting_method',
+]
+
+
+def get_topic_model_key(records):
+    """
+    Returns the key of the topic model trained with the given records in the
+    artifacts cache
+
+    :param records: the records used to train the topic model
+    :return: the key of the topic model
+    """
+    return artifact_cache.build_key(
+        'topic_model', TOPIC_MODEL_PROPERTIES,
+        Constants.PROCESSED_RECORDS_FILE, artifact_cache.hash_records(records))
+
+
+def get_updated_topic_model_key(parent_key, delta_records):
+    """
+    Returns the key of the topic model obtained by updating a cached topic
+    model with the given records in the artifacts cache
+
+    :param parent_key: the key of the topic model that is updated
+    :param delta_records: the records the topic model is updated with
+    :return: the key of the updated topic model
+    """
+    return artifact_cache.build_key(
+        'topic_model', TOPIC_MODEL_PROPERTIES,
+        parent_key, artifact_cache.hash_records(delta_records))
+
+
+def create_topic_model(
+        records, cycle_index, fold_index, check_exists=True,
+        parent_records=None):
+    """
+    Creates the context extractor of the given records, or loads it from the
+    artifacts cache
+
+    :param records: the records used to train the topic model
+    :param cycle_index: the index of the cross-validation cycle
+    :param fold_index: the index of the cross-validation fold
+    :param check_exists: a boolean that indicates if a cached topic model can
+    be used
+    :param parent_records: the records of a cached topic model that is
+    updated instead of training a new one. They must be a subset of the given
+    records, for instance the train records of the nested validation when the
+    topic model of the full train set is built
+    :return: the context extractor
+    """
 
     print('%s: Create topic model' % time.strftime("%Y/%m/%d-%H:%M:%S"))
 
@@ -31,14 +120,30 @@ def create_topic_model(records, cycle_index, fold_index, check_exists=True):
 
     print(topic_model_file_path)
 
-    if check_exists and os.path.exists(topic_model_file_path):
-        print('WARNING: Topic model already exists')
-        return load_topic_model(cycle_index, fold_index)
+    # The topic models are looked up by the content of the training records
+    # and the properties that affect them, and then published in their old
+    # file name for the scripts that load them with load_topic_model
+    cache = artifact_cache.get_cache()
+    topic_model_key = get_topic_model_key(records)
+
+    if check_exists:
+        topic_model = cache.load(topic_model_key)
+        if topic_model is not None:
+            print('WARNING: Topic model already exists')
+            cache.export(topic_model_key, topic_model_file_path)
+            return topic_model
+
+    if check_exists and parent_records is not None:
+        topic_model, updated_key = update_topic_model(
+            get_topic_model_key(parent_records), parent_records, records)
+        if topic_model is not None:
+            cache.export(updated_key, topic_model_file_path)
+            return topic_model
 
     topic_model = train_context_extractor(records)
 
-    with open(topic_model_file_path, 'wb') as write_file:
-        pickle.dump(topic_model, write_file, pickle.HIGHEST_PROTOCOL)
+    cache.store(topic_model_key, topic_model)
+    cache.export(topic_model_key, topic_model_file_path)
 
     return topic_model
 
@@ -75,6 +180,10 @@ def train_topic_model(records):
             print('Ensemble topic model already exists')
             return
 
+        if Constants.TOPIC_ENSEMBLE_IN_PROCESS:
+            nmf_ensemble.create_ensemble_topic_model(records)
+            return
+
         export_to_text(records)
         topic_ensemble_caller.run_local_parse_directory()
         topic_ensemble_caller.run_generate_kfold()
@@ -90,18 +199,24 @@ def train_context_extractor(records, stable=True):
     if Constants.TOPIC_MODEL_TYPE == 'lda':
         context_extractor = LdaBasedContext(records)
         context_extractor.generate_review_corpus()
-        context_extractor.build_topic_model()
+        if Constants.TOPIC_MODEL_STREAMING:
+            build_streaming_topic_model(context_extractor, records)
+        else:
+            context_extractor.build_topic_model()
         context_extractor.update_reviews_with_topics()
         context_extractor.get_context_rich_topics()
         context_extractor.clear_reviews()
     elif Constants.TOPIC_MODEL_TYPE == 'nmf':
         context_extractor = NmfContextExtractor(records)
         context_extractor.generate_review_bows()
-        context_extractor.build_document_term_matrix()
-        if stable:
-            context_extractor.build_stable_topic_model()
+        if Constants.TOPIC_MODEL_STREAMING:
+            build_streaming_topic_model(context_extractor, records)
         else:
-            context_extractor.build_topic_model()
+            context_extractor.build_document_term_matrix()
+            if stable:
+                context_extractor.build_stable_topic_model()
+            else:
+                context_extractor.build_topic_model()
         context_extractor.update_reviews_with_topics()
         context_extractor.get_context_rich_topics()
         context_extractor.clear_reviews()
@@ -114,6 +229,91 @@ def train_context_extractor(records, stable=True):
     return context_extractor
 
 
+def build_streaming_topic_model(context_extractor, records):
+    """
+    Builds the topic model of the given context extractor with the target
+    reviews of the given records, which are streamed in chunks from a
+    temporary columnar store. This way the TF-IDF matrix or the corpus of all
+    the target reviews is never built at once
+
+    :param context_extractor: a LdaBasedContext or a NmfContextExtractor
+    :param records: the records used to train the topic model
+    """
+    folder = tempfile.mkdtemp(dir=Constants.CACHE_FOLDER)
+    try:
+        file_path = os.path.join(folder, 'topic_model_records.json')
+        record_store.save_records(file_path, [
+            {field: record[field] for field in TOPIC_MODEL_FIELDS
+             if field in record}
+            for record in records
+        ], export_json=False)
+        context_extractor.build_streaming_topic_model(file_path)
+    finally:
+        shutil.rmtree(folder)
+
+
+def update_context_extractor(context_extractor, records, new_records):
+    """
+    Updates a trained context extractor with the records that it hasn't seen,
+    instead of training a new topic model from scratch. The context-rich
+    topics are then recalculated with all the new records
+
+    :param context_extractor: a LdaBasedContext, or a NmfContextExtractor
+    with an online NMF topic model
+    :param records: the records the context extractor was trained with
+    :param new_records: all the records of the new training set, which must
+    contain the given records
+    :return: the updated context extractor
+    :raises ValueError: if some of the records are not in new_records
+    """
+    print('%s: update context topics model' %
+          time.strftime("%Y/%m/%d-%H:%M:%S"))
+    delta_records = online_topic_model.get_delta_records(records, new_records)
+    context_extractor.update_topic_model(delta_records)
+    context_extractor.records = new_records
+    if isinstance(context_extractor, LdaBasedContext):
+        context_extractor.generate_review_corpus()
+    else:
+        context_extractor.generate_review_bows()
+    context_extractor.update_reviews_with_topics()
+    context_extractor.get_context_rich_topics()
+    context_extractor.clear_reviews()
+
+    return context_extractor
+
+
+def update_topic_model(parent_key, records, new_records):
+    """
+    Updates the cached topic model with the given key, which was trained
+    with the given records, with the records of new_records it hasn't seen.
+    The updated topic model is cached with a key made of the parent key and a
+    hash of those records
+
+    :param parent_key: the key of the cached topic model
+    :param records: the records the cached topic model was trained with
+    :param new_records: all the records of the new training set, which must
+    contain the given records
+    :return: a tuple with the updated context extractor and its key. The
+    context extractor is None if the topic model with the parent key is not
+    cached
+    :raises ValueError: if some of the records are not in new_records
+    """
+    delta_records = online_topic_model.get_delta_records(records, new_records)
+    topic_model_key = get_updated_topic_model_key(parent_key, delta_records)
+    cache = artifact_cache.get_cache()
+
+    topic_model = cache.load(topic_model_key)
+    if topic_model is None:
+        topic_model = cache.load(parent_key)
+        if topic_model is None:
+            return None, topic_model_key
+        topic_model = update_context_extractor(
+            topic_model, records, new_records)
+        cache.store(topic_model_key, topic_model)
+
+    return topic_model, topic_model_key
+
+
 def load_topic_model(cycle_index, fold_index):
     file_path = \
         Constants.generate_file_name(
@@ -135,7 +335,8 @@ def create_single_topic_model(cycle_index, fold_index, check_exists=True):
               'separate_topic_model_recsys_reviews property is set to True'
         raise ValueError(msg)
 
-    records = ETLUtils.load_json_file(Constants.PROCESSED_RECORDS_FILE)
+    records = record_store.load_records(
+        Constants.PROCESSED_RECORDS_FILE, TOPIC_MODEL_FIELDS)
 
     if Constants.CROSS_VALIDATION_STRATEGY == 'nested_test':
         pass
@@ -245,7 +446,8 @@ def main():
             {Constants.TOPIC_MODEL_NUM_TOPICS_FIELD: num_topics})
 
     if fold is None and cycle is None:
-        records = ETLUtils.load_json_file(Constants.PROCESSED_RECORDS_FILE)
+        records = record_store.load_records(
+            Constants.PROCESSED_RECORDS_FILE, TOPIC_MODEL_FIELDS)
 
         if Constants.SEPARATE_TOPIC_MODEL_RECSYS_REVIEWS:
             num_records = len(records)
@@ -1,165 +1,243 @@
-import re
+import array
+import cPickle as pickle
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
 from topicmodeling.hiddenfactortopics.vote import Vote
 
 __author__ = 'fpena'
 
 
+# The arrays of a parsed corpus that are stored in its cache folder
+CACHED_ARRAYS = [
+    'users', 'items', 'ratings', 'dates', 'word_offsets', 'words',
+    'word_counts'
+]
+CACHE_METADATA_FILE = 'metadata.pkl'
+
+
 class Corpus:
 
     WHITESPACE_SEPARATOR_REGEX = r"\S+"
 
+    MIN_USERS = 0
+    MIN_ITEMS = 0
+    MAX_WORDS = 5000
+
     def __init__(self):
 
         self._num_users = 0
         self._num_items = 0
         self._num_words = 0
 
-        self._user_count_map = {}
-        self._item_count_map = {}
         self._vote_list = []
-        self._user_id_map = {}
-        self._item_id_map = {}
-        self._word_count_map = {}
-        self._word_id_map = {}
-
-    def load_data(self, file_name, max_lines):
-        self.process_reviews(file_name, max_lines)
-        self.build_votes(file_name, max_lines)
 
-    # OK, returns the same results as the McAuley implementation
-    def process_reviews(self, file_name, max_lines):
+        # The votes stored in arrays: the user, item, rating and date of each
+        # vote, and the words of vote i in words[word_offsets[i]:word_offsets[i + 1]]
+        self.users = None
+        self.items = None
+        self.ratings = None
+        self.dates = None
+        self.word_offsets = None
+        self.words = None
+
+        self.user_names = None
+        self.item_names = None
+        # All the words that appear in the reviews, from the most frequent to
+        # the least frequent, and the number of times that each one appears
+        self.word_names = None
+        self.word_counts = None
+
+    def load_data(self, file_name, max_lines, cache_folder=None):
         """
-        Processes all the reviews contained in the given file and builds three
-        objects in this class: the number of reviews per user, the number of
-        reviews per item and the frequency of every word that appears in the
-        reviews
+        Loads the votes contained in the given file, which can be
+        gzip-compressed. The file is read once, assigning an integer id to
+        each user, item and word as soon as it appears, and only the
+        MAX_WORDS most frequent words are kept
 
         :param file_name: the file that contains the ratings and reviews
         :param max_lines: this indicates the maximum number of lines in the file
         to be processed by the method
+        :param cache_folder: a folder in which the parsed corpus is stored as
+        binary arrays, which are memory-mapped when the same file is loaded
+        again. If None the corpus is not cached
         """
+        if cache_folder is None:
+            self._read_votes(file_name, max_lines)
+            return
+
+        corpus_folder = os.path.join(
+            cache_folder, self._get_cache_key(file_name, max_lines))
+        if not os.path.isdir(corpus_folder):
+            self._read_votes(file_name, max_lines)
+            self._save(corpus_folder)
+        self._load(corpus_folder)
+
+    def _read_votes(self, file_name, max_lines):
+        user_ids = {}
+        item_ids = {}
+        word_ids = {}  # Temporary ids, in order of appearance
+        users = array.array('l')
+        items = array.array('l')
+        ratings = array.array('d')
+        dates = array.array('l')
+        word_offsets = array.array('l', [0])
+        tokens = array.array('l')
+
+        open_file = gzip.open if file_name.endswith('.gz') else open
         num_lines_read = 0
 
-        with open(file_name, 'r') as votes_file:
+        with open_file(file_name, 'r') as votes_file:
             for line in votes_file:
-                # print(line)
-                # We split the line by white spaces
-                iterator = re.finditer(self.WHITESPACE_SEPARATOR_REGEX, line)
-                user_name = next(iterator).group(0)
-                item_name = next(iterator).group(0)
-                rating = next(iterator).group(0)
-                vote_date = next(iterator).group(0)
-                num_words = next(iterator).group(0)
-
-                # print("user =", user_name,
-                #       "\titem =", item_name,
-                #       "\trating =", rating,
-                #       "\ttime =", vote_date,
-                #       "\twords =", num_words)
-
-                for token in iterator:
-                    word = token.group(0)
-                    if word not in self._word_count_map:
-                        self._word_count_map[word] = 0
-                    self._word_count_map[word] += 1
-                    # print(word)
-
-                if user_name not in self._user_count_map:
-                    self._user_count_map[user_name] = 0
-                if item_name not in self._item_count_map:
-                    self._item_count_map[item_name] = 0
-
-                self._user_count_map[user_name] += 1
-                self._item_count_map[item_name] += 1
+                fields = line.split()
+                users.append(user_ids.setdefault(fields[0], len(user_ids)))
+                items.append(item_ids.setdefault(fields[1], len(item_ids)))
+                ratings.append(float(fields[2]))
+                dates.append(int(fields[3]))
+                tokens.extend([
+                    word_ids.setdefault(word, len(word_ids))
+                    for word in fields[5:]
+                ])
+                word_offsets.append(len(tokens))
 
                 num_lines_read += 1
-
                 if 0 < max_lines <= num_lines_read:
                     break
 
-            print("\nnUsers =", len(self._user_count_map),
-                  "nItems =", len(self._item_count_map),
-                  "nRatings =", num_lines_read)
-
-    # Returns different results each time because elements are stored in a map,
-    # and when ordering the words by frequency, it is unpredictable which word
-    # is going to appear from a set of words that have the same frequency
-    def build_votes(self, file_name, max_lines):
-
-        # print("***************************")
-        # print("***************************")
-        # print("***************************")
-        # print("***************************\n")
-
-        self._num_users = 0
-        self._num_items = 0
-
-        min_users = 0
-        min_items = 0
-        max_words = 5000
-
-        word_id_map = Corpus.build_word_id_map(self._word_count_map, max_words)
-        self._num_words = len(word_id_map)
-        # print(word_id_map)
-
-        num_lines_read = 0
+        users = np.frombuffer(users, dtype=np.int64)
+        items = np.frombuffer(items, dtype=np.int64)
+        tokens = np.frombuffer(tokens, dtype=np.int64)
+        word_offsets = np.frombuffer(word_offsets, dtype=np.int64)
+
+        print("\nnUsers =", len(user_ids),
+              "nItems =", len(item_ids),
+              "nRatings =", num_lines_read)
+
+        # The words are ranked by frequency, breaking the ties by their order
+        # of appearance
+        word_counts = np.bincount(tokens, minlength=len(word_ids))
+        ranking = np.argsort(-word_counts, kind='mergesort')
+        word_ranks = np.empty(len(ranking), dtype=np.int64)
+        word_ranks[ranking] = np.arange(len(ranking))
+        word_names = [None] * len(word_ids)
+        for word, word_id in word_ids.iteritems():
+            word_names[word_ranks[word_id]] = word
+
+        tokens = word_ranks[tokens]
+        kept_tokens = tokens < self.MAX_WORDS
+        kept_offsets = np.concatenate([[0], np.cumsum(kept_tokens)])
+
+        self.users = self._filter_ids(users, self.MIN_USERS)
+        self.items = self._filter_ids(items, self.MIN_ITEMS)
+        self.ratings = np.frombuffer(ratings, dtype=np.float64)
+        self.dates = np.frombuffer(dates, dtype=np.int64)
+        self.word_offsets = kept_offsets[word_offsets]
+        self.words = tokens[kept_tokens]
+        self.user_names = sorted(user_ids, key=user_ids.get)
+        self.item_names = sorted(item_ids, key=item_ids.get)
+        self.word_names = word_names
+        self.word_counts = word_counts[ranking]
+        self._update_sizes()
 
-        with open(file_name, 'r') as votes_file:
-            for line in votes_file:
-                vote = Vote()
-
-                # We split the line by white spaces
-                iterator = re.finditer(self.WHITESPACE_SEPARATOR_REGEX, line)
-                user_name = next(iterator).group(0)
-                item_name = next(iterator).group(0)
-                rating = float(next(iterator).group(0))
-                vote_date = next(iterator).group(0)
-                num_words = next(iterator).group(0)
-
-                for token in iterator:
-                    word = token.group(0)
-                    if word in word_id_map:
-                        vote.word_list.append(word_id_map[word])
-
-                if self._user_count_map[user_name] >= min_users:
-                    if user_name not in self._user_id_map:
-                        self._user_id_map[user_name] = self.num_users
-                        self._num_users += 1
-                    vote.user = self._user_id_map[user_name]
-                else:
-                    vote.user = 0
-
-                if self._item_count_map[item_name] >= min_items:
-                    if item_name not in self._item_id_map:
-                        self._item_id_map[item_name] = self.num_items
-                        self._num_items += 1
-                    vote.item = self._item_id_map[item_name]
-                else:
-                    vote.item = 0
-
-                vote.rating = rating
-                vote.date = vote_date
-                self.vote_list.append(vote)
-
-                # print("\nvoteUser = %d, voteItem = %d, voteRating = %f, numWords = %d", vote.user, vote.item, vote.rating, len(vote.word_list))
-                # print("voteUser = ", vote.user,
-                #       "\tvoteItem = ", vote.item,
-                #       "\tvoteRating = ", vote.rating,
-                #       "\tnumWords = ", len(vote.word_list))
-                # print("voteUser =", vote.user,
-                #       "\tvoteItem =", vote.item,
-                #       "\tvoteRating =", vote.rating,
-                #       "\tnumWords =", len(vote.word_list),
-                #       "******",
-                #       "\tactualUser =", user_name,
-                #       "\tactualItem =", item_name,
-                #       "\tactualWords =", num_words)
-
-
-                num_lines_read += 1
-
-                if 0 < max_lines <= num_lines_read:
-                    break
+    @staticmethod
+    def _filter_ids(ids, min_count):
+        """
+        Maps the ids that appear less than min_count times to 0, and renumbers
+        the rest of the ids in their order of appearance starting from 0
+        """
+        if min_count <= 1:
+            return ids
+
+        counts = np.bincount(ids)
+        kept = counts[ids] >= min_count
+        _, first_indices = np.unique(ids[kept], return_index=True)
+        new_ids = np.zeros(len(counts), dtype=np.int64)
+        new_ids[ids[kept][np.sort(first_indices)]] = np.arange(
+            len(first_indices))
+        return new_ids[ids]
+
+    def _update_sizes(self):
+        self._num_users = int(self.users.max()) + 1 if len(self.users) else 0
+        self._num_items = int(self.items.max()) + 1 if len(self.items) else 0
+        self._num_words = min(self.MAX_WORDS, len(self.word_names))
+        self._vote_list = None
+
+    def _get_cache_key(self, file_name, max_lines):
+        file_stat = os.stat(file_name)
+        content = json.dumps([
+            os.path.abspath(file_name), file_stat.st_size, file_stat.st_mtime,
+            max_lines, self.MIN_USERS, self.MIN_ITEMS, self.MAX_WORDS
+        ])
+        return 'corpus_' + hashlib.sha1(content).hexdigest()
+
+    def _save(self, corpus_folder):
+        """
+        Stores the arrays of this corpus in the given folder. The arrays are
+        written into a temporary folder which is then renamed, so other
+        processes never load a partially written corpus
+        """
+        parent_folder = os.path.dirname(os.path.abspath(corpus_folder))
+        if not os.path.isdir(parent_folder):
+            os.makedirs(parent_folder)
+        temporary_folder = tempfile.mkdtemp(prefix='.tmp_', dir=parent_folder)
+        try:
+            for name in CACHED_ARRAYS:
+                np.save(os.path.join(temporary_folder, name + '.npy'),
+                        getattr(self, name))
+            metadata = {
+                'user_names': self.user_names,
+                'item_names': self.item_names,
+                'word_names': self.word_names
+            }
+            with open(os.path.join(
+                    temporary_folder, CACHE_METADATA_FILE), 'wb') as write_file:
+                pickle.dump(metadata, write_file, pickle.HIGHEST_PROTOCOL)
+            os.rename(temporary_folder, corpus_folder)
+        except OSError:
+            # Another process has already cached the same corpus
+            shutil.rmtree(temporary_folder, ignore_errors=True)
+            if not os.path.isdir(corpus_folder):
+                raise
+        except:
+            shutil.rmtree(temporary_folder, ignore_errors=True)
+            raise
+
+    def _load(self, corpus_folder):
+        for name in CACHED_ARRAYS:
+            setattr(self, name, np.load(
+                os.path.join(corpus_folder, name + '.npy'), mmap_mode='r'))
+        with open(os.path.join(corpus_folder, CACHE_METADATA_FILE), 'rb') as \
+                read_file:
+            metadata = pickle.load(read_file)
+        self.user_names = metadata['user_names']
+        self.item_names = metadata['item_names']
+        self.word_names = metadata['word_names']
+        self._update_sizes()
+
+    def get_word_list(self, index):
+        """
+        :param index: the position of the vote
+        :return: an array with the ids of the words of the vote
+        """
+        return self.words[self.word_offsets[index]:self.word_offsets[index + 1]]
+
+    def _build_vote_list(self):
+        vote_list = []
+        for index in range(len(self.users)):
+            vote = Vote()
+            vote.user = int(self.users[index])
+            vote.item = int(self.items[index])
+            vote.rating = float(self.ratings[index])
+            vote.date = int(self.dates[index])
+            vote.word_list = self.get_word_list(index).tolist()
+            vote_list.append(vote)
+        return vote_list
 
     @staticmethod
     def build_word_id_map(word_count, max_words):
@@ -195,8 +273,13 @@ class Corpus:
     @property
     def vote_list(self):
         """
+        The votes as Vote objects, which are built from the arrays the first
+        time they are requested
+
         :rtype: list[Vote]
         """
+        if self._vote_list is None:
+            self._vote_list = self._build_vote_list()
         return self._vote_list
 
     @vote_list.setter
@@ -204,7 +287,7 @@ class Corpus:
         """
         :type value: list[Vote]
         """
-        self.vote_list = value
+        self._vote_list = value
 
     @property
     def num_users(self):
@@ -1,5 +1,7 @@
 import math
-import sys
+import os
+from scipy import optimize
+from scipy import sparse
 from etl import ETLUtils
 from topicmodeling.hiddenfactortopics.corpus import Corpus
 # import sys; print('Python %s on %s' % (sys.version, sys.platform))
@@ -10,7 +12,52 @@ __author__ = 'fpena'
 
 import numpy as np
 
-class TopicCorpus:
+
+# The step of the plain gradient descent, as in the McAuley implementation
+LEARNING_RATE = 0.00001
+
+# The number of words whose topics are sampled at once, to bound the memory
+# used by the (words x topics) matrix of topic scores
+TOPIC_SAMPLING_CHUNK_SIZE = 100000
+
+
+def get_vote_arrays(votes):
+    """
+    Turns a list of votes into index arrays
+
+    :type votes: list[Vote]
+    :return: a tuple with the user, the item and the rating of each vote
+    """
+    users = np.array([vote.user for vote in votes], dtype=np.int64)
+    items = np.array([vote.item for vote in votes], dtype=np.int64)
+    ratings = np.array([vote.rating for vote in votes], dtype=np.float64)
+    return users, items, ratings
+
+
+def build_scatter_matrix(indices, size):
+    """
+    Builds a sparse (size x len(indices)) matrix that sums the rows of a
+    matrix with one row per element into the row of the index of each
+    element, so a scatter-add can be computed with a single product
+
+    :param indices: the index of each element
+    :param size: the number of different indices
+    :rtype: sparse.csr_matrix
+    """
+    return sparse.csr_matrix(
+        (np.ones(len(indices)), (indices, np.arange(len(indices)))),
+        shape=(size, len(indices)))
+
+
+def softmax(scores):
+    """
+    Normalizes the exponential of each row of the given matrix
+    """
+    scores = np.exp(scores - scores.max(axis=1)[:, np.newaxis])
+    return scores / scores.sum(axis=1)[:, np.newaxis]
+
+
+class TopicCorpus(object):
 
     # TODO: Create a list with all the users and all the items as strings
 
@@ -35,30 +82,36 @@ class TopicCorpus:
         self.valid_votes = None
         self.test_votes = None
 
+        # The (users, items, ratings) arrays of each set of votes
+        self.train_arrays = None
+        self.valid_arrays = None
+        self.test_arrays = None
+
         self.best_valid_predictions = {}
 
-        self.votes_per_item = []  # Vector of votes for each item
-        self.votes_per_user = []  # Vector of votes for each user
-        self.train_votes_per_item = []  # Same as above, but only votes from the training set
-        self.train_votes_per_user = []
+        # Sparse matrices that add the values of the training votes into
+        # their users and items
+        self.user_scatter = None
+        self.item_scatter = None
+
+        # Contiguous version of all parameters, i.e., a flat vector containing
+        # all parameters in order (useful for lbfgs). The model parameters
+        # below are views of this vector
+        self.w = None
 
         # Model parameters
-        self.alpha = None  # Offset parameter
-        self.kappa = 1.0  # "peakiness" parameter
         self.beta_user = None  # User offset parameters
         self.beta_item = None  # Item offset parameters
         self.gamma_user = None  # User latent factors
         self.gamma_item = None  # Item latent factors
 
-        # Contiguous version of all parameters, i.e., a flat vector containing
-        # all parameters in order (useful for lbfgs)
-        self.w = None
-
         self.topic_words = None  # Weights each word in each topic
         self.background_words = None  # "background" weight, so that each word has average weight zero across all topics
 
-        # Latent variables
-        self.word_topics = {}
+        # Latent variables, with one entry per word of each training vote
+        self.token_items = None  # The item of the vote of the word
+        self.token_words = None  # The word
+        self.token_topics = None  # The topic assigned to the word
 
         # Counters
         self.item_topic_counts = None  # How many times does each topic occur for each product?
@@ -73,8 +126,8 @@ class TopicCorpus:
         self.latent_reg = latent_reg  # Regularization parameter
         self.lambda_param = lambda_param  # Learning rate
 
-        self.n_training_per_user = {}  # Number of training items for each user
-        self.n_training_per_item = {}  # Number of training items for each item
+        self.n_training_per_user = None  # Number of training items for each user
+        self.n_training_per_item = None  # Number of training items for each item
 
         self.n_users = None  # Number of users
         self.n_items = None  # Number of items
@@ -82,6 +135,7 @@ class TopicCorpus:
         self.user_list = None
         self.item_list = None
 
+        self.gradient = None
         self.d_alpha = None
         self.d_kappa = None
         self.d_beta_user = None
@@ -92,6 +146,48 @@ class TopicCorpus:
 
         self._initialize()
 
+    @property
+    def alpha(self):
+        """
+        Offset parameter
+        """
+        return self.w[0]
+
+    @alpha.setter
+    def alpha(self, value):
+        self.w[0] = value
+
+    @property
+    def kappa(self):
+        """
+        "peakiness" parameter
+        """
+        return self.w[1]
+
+    @kappa.setter
+    def kappa(self, value):
+        self.w[1] = value
+
+    def get_parameter_views(self, vector):
+        """
+        Recovers all the parameters from a flat vector, as views of the vector
+
+        :param vector: a vector with nw elements
+        :return: a tuple with the alpha and kappa (as arrays of one element),
+        beta_user, beta_item, gamma_user, gamma_item and topic_words views
+        """
+        sizes = [
+            1, 1, self.n_users, self.n_items, self.n_users * self.num_topics,
+            self.n_items * self.num_topics, self.n_words * self.num_topics]
+        alpha, kappa, beta_user, beta_item, gamma_user, gamma_item,\
+            topic_words = np.split(vector, np.cumsum(sizes)[:-1])
+        return (
+            alpha, kappa, beta_user, beta_item,
+            gamma_user.reshape(self.n_users, self.num_topics),
+            gamma_item.reshape(self.n_items, self.num_topics),
+            topic_words.reshape(self.n_words, self.num_topics)
+        )
+
     def _initialize(self):
         self.n_users = self.corpus.num_users
         self.n_items = self.corpus.num_items
@@ -101,31 +197,18 @@ class TopicCorpus:
         print('n_items', self.n_items)
         print('n_words', self.n_words)
 
-        self.beta_user = np.zeros(self.n_users)
-        self.beta_item = np.zeros(self.n_items)
-        self.votes_per_user = [[] for _ in range(self.n_users)]
-        self.votes_per_item = [[] for _ in range(self.n_items)]
-        self.train_votes_per_user = [[] for _ in range(self.n_users)]
-        self.train_votes_per_item = [[] for _ in range(self.n_items)]
-        self.gamma_user = np.zeros((self.n_users, self.num_topics))
-        self.gamma_item = np.zeros((self.n_items, self.num_topics))
-
-        for vote in self.corpus.vote_list:
-            self.votes_per_user[vote.user].append(vote)
-
-        for user in range(self.n_users):
-            for vote in self.votes_per_user[user]:
-                # print_vote(vote)
-                # print('item', vote.item)
-                self.votes_per_item[vote.item].append(vote)
-
-        self.split_data()
-
         # total number of parameters
         self.nw = 1 + 1 + (self.num_topics + 1) * \
                           (self.n_users + self.n_items) + \
                   self.num_topics * self.n_words
 
+        self.w = np.zeros(self.nw)
+        _, _, self.beta_user, self.beta_item, self.gamma_user,\
+            self.gamma_item, self.topic_words = self.get_parameter_views(self.w)
+        self.kappa = 1.0
+
+        self.split_data()
+
         self.alpha = self._calculate_average_rating(self.train_votes)
 
         print('init alpha', self.alpha)
@@ -142,10 +225,8 @@ class TopicCorpus:
         # Actually the model works better if we initialize none of these terms
         if self.lambda_param > 0:
             self.alpha = 0
-            self.beta_user = np.zeros(self.n_users)
-            self.beta_item = np.zeros(self.n_items)
-
-        self.word_topic_counts = np.zeros((self.n_words, self.num_topics))
+            self.beta_user[:] = 0
+            self.beta_item[:] = 0
 
         self.generate_random_topic_assignments()
         self.init_background_word_frequency()
@@ -168,79 +249,63 @@ class TopicCorpus:
         self.valid_votes, self.test_votes = ETLUtils.split_train_test(
             validation_test_votes, split=0.5)
 
-        for vote in self.train_votes:
-            user = vote.user
-            item = vote.item
-            if user not in self.n_training_per_user:
-                self.n_training_per_user[user] = 0
-            if item not in self.n_training_per_item:
-                self.n_training_per_item[item] = 0
-            self.n_training_per_user[user] += 1
-            self.n_training_per_item[item] += 1
-            self.train_votes_per_user[user].append(vote)
-            self.train_votes_per_item[item].append(vote)
+        self.train_arrays = get_vote_arrays(self.train_votes)
+        self.valid_arrays = get_vote_arrays(self.valid_votes)
+        self.test_arrays = get_vote_arrays(self.test_votes)
+
+        users, items, _ = self.train_arrays
+        self.n_training_per_user = np.bincount(users, minlength=self.n_users)
+        self.n_training_per_item = np.bincount(items, minlength=self.n_items)
+        self.user_scatter = build_scatter_matrix(users, self.n_users)
+        self.item_scatter = build_scatter_matrix(items, self.n_items)
 
     def init_gamma_matrices(self):
         if self.lambda_param == 0:
-            for user in range(self.n_users):
-                if user not in self.n_training_per_user:
-                    continue
-                for k in range(self.num_topics):
-                    self.gamma_user[user][k] = np.random.rand()
-            for item in range(self.n_items):
-                if item not in self.n_training_per_item:
-                    continue
-                for k in range(self.num_topics):
-                    self.gamma_user[item][k] = np.random.rand()
+            users = self.n_training_per_user > 0
+            self.gamma_user[users] = np.random.rand(
+                np.count_nonzero(users), self.num_topics)
+            items = self.n_training_per_item > 0
+            self.gamma_item[items] = np.random.rand(
+                np.count_nonzero(items), self.num_topics)
         else:
-            self.topic_words = np.zeros((self.n_words, self.num_topics))
+            self.topic_words[:] = 0
 
     def init_background_word_frequency(self):
         # Initialize the background word frequency
-        self.total_words = 0
-        self.background_words = np.zeros(self.n_words)
-
-        for vote in self.train_votes:
-            for word in vote.word_list:
-                self.total_words += 1
-                self.background_words[word] += 1
-
+        self.total_words = len(self.token_words)
+        self.background_words = np.bincount(
+            self.token_words, minlength=self.n_words).astype(np.float64)
         self.background_words /= self.total_words
 
-        # for word in range(self.n_words):
-        #     print("background_words[%d]\t= %f" % (word, self.background_words[word]))
-
-        # print("total words = %d" % self.total_words)
-        # print("background words = %d" % self.background_words)
-
     def generate_random_topic_assignments(self):
         # Generate random topic assignments
-        self.topic_counts = np.zeros(self.num_topics)
-        self.item_topic_counts = np.zeros((self.n_items, self.num_topics))
-        self.item_words = np.zeros(self.n_items)
-
-        for vote in self.train_votes:
-            self.word_topics[vote] = np.zeros(self.n_words)
-            self.item_words[vote.item] += len(vote.word_list)
-
-            print_vote(vote)
-
-            # print("item_words[%d]\t = %d" % (vote.item, self.item_words[vote.item]))
-
-            for wp in range(len(vote.word_list)):
-                wi = vote.word_list[wp]
-                t = np.random.random() * self.num_topics
-
-                # print("wi = %d\tt = %d" % (wi, t))
-
-                self.word_topics[vote][wp] = t
-                self.item_topic_counts[vote.item][t] += 1
-                self.word_topic_counts[wi][t] += 1
-                self.topic_counts[t] += 1
-
-        for item in range(self.n_items):
-            for k in range(self.num_topics):
-                print("item_topic_counts[%d][%d]\t = %d" % (item, k, self.item_topic_counts[item][k]))
+        word_lists = [vote.word_list for vote in self.train_votes]
+        words_per_vote = np.array(
+            [len(word_list) for word_list in word_lists], dtype=np.int64)
+        self.token_items = np.repeat(self.train_arrays[1], words_per_vote)
+        self.token_words = np.fromiter(
+            (word for word_list in word_lists for word in word_list),
+            dtype=np.int64, count=words_per_vote.sum())
+        self.token_topics = np.random.randint(
+            self.num_topics, size=len(self.token_words))
+        self.item_words = np.bincount(
+            self.token_items, minlength=self.n_items).astype(np.float64)
+        self.update_topic_counts()
+
+    def update_topic_counts(self):
+        """
+        Counts the topics assigned to the words of the training votes
+        """
+        num_topics = self.num_topics
+        self.item_topic_counts = np.bincount(
+            self.token_items * num_topics + self.token_topics,
+            minlength=self.n_items * num_topics
+        ).reshape(self.n_items, num_topics).astype(np.float64)
+        self.word_topic_counts = np.bincount(
+            self.token_words * num_topics + self.token_topics,
+            minlength=self.n_words * num_topics
+        ).reshape(self.n_words, num_topics).astype(np.float64)
+        self.topic_counts = self.word_topic_counts.sum(axis=0)
 
     def _split_data_set(self):
         pass
@@ -255,16 +320,14 @@ class TopicCorpus:
         return average_rating / len(vote_list)
 
     def _calculate_user_item_offsets(self):
-        for vote in self.train_votes:
-            self.beta_user[vote.user] += vote.rating - self.alpha
-            self.beta_item[vote.item] += vote.rating - self.alpha
-        for user in range(self.n_users):
-            self.beta_user[user] /= len(self.votes_per_user[user])
-            # print('user', user)
-            # print('beta user %d = %f' % (user, self.beta_user[user]))
-        for item in range(self.n_items):
-            self.beta_item[item] /= len(self.votes_per_item[item])
-            # print('beta item %d = %f\tsize = %d' % (item, self.beta_item[item], len(self.votes_per_item[item])))
+        users, items, ratings = self.train_arrays
+        all_users, all_items, _ = get_vote_arrays(self.corpus.vote_list)
+        self.beta_user[:] = np.bincount(
+            users, ratings - self.alpha, minlength=self.n_users) /\
+            np.bincount(all_users, minlength=self.n_users)
+        self.beta_item[:] = np.bincount(
+            items, ratings - self.alpha, minlength=self.n_items) /\
+            np.bincount(all_items, minlength=self.n_items)
 
     def prediction(self, vote):
         """
@@ -272,125 +335,102 @@ class TopicCorpus:
 
         :type vote: Vote
         """
-        user = vote.user
-        item = vote.item
-        res = self.alpha + self.beta_user[user] + self.beta_item[item]
+        return self.predict(
+            np.array([vote.user]), np.array([vote.item]))[0]
 
-        for k in range(self.num_topics):
-            res += self.gamma_user[user][k] * self.gamma_item[item][k]
+    def predict(self, users, items):
+        """
+        Predict the ratings of the given user-item pairs given the current
+        parameter values
 
-        return res
+        :param users: an array with the user of each pair
+        :param items: an array with the item of each pair
+        :rtype: np.ndarray
+        """
+        return self.alpha + self.beta_user[users] + self.beta_item[items] +\
+            np.einsum(
+                'ij,ij->i', self.gamma_user[users], self.gamma_item[items])
 
-    # TODO: Finish this method
     def dl(self):
         """
         Derivative of the energy function
 
+        :return: the gradient, as a flat vector in the same order as w
         """
-
-        self.d_alpha = 0
-        self.d_kappa = 0
-        self.d_beta_user = np.zeros(self.n_users)
-        self.d_beta_item = np.zeros(self.n_items)
-        self.d_gamma_user = np.zeros((self.n_users, self.num_topics))
-        self.d_gamma_item = np.zeros((self.n_items, self.num_topics))
-        self.d_topic_words = np.zeros((self.n_words, self.num_topics))
-
-        for user in range(self.n_users):
-            for vote in self.train_votes_per_user[user]:
-                p = self.prediction(vote)
-                pred_error = 2 * (p - vote.rating)
-
-                self.d_alpha += pred_error
-                self.d_beta_user[user] += pred_error
-
-                for k in range(self.num_topics):
-                    self.d_gamma_user[user][k] -=\
-                        pred_error * self.gamma_item[vote.item][k]
-
-        for item in range(self.n_items):
-            for vote in self.train_votes_per_item[item]:
-                p = self.prediction(vote)
-                pred_error = 2 * (p - vote.rating)
-
-                self.d_beta_item[item] += pred_error
-
-                for k in range(self.num_topics):
-                    self.d_gamma_item[item][k] +=\
-                        pred_error * self.gamma_user[vote.user][k]
-
-        # dk = 0
-        for item in range(self.n_items):
-            tZ = self.topic_z(item)
-
-            for k in range(self.num_topics):
-                # print("lambda = %f" % self.lambda_param)
-                # print("item_topic_counts[%d][%d] = %d" % (item, k, self.item_topic_counts[item][k]))
-                # print('%f\t%d\t%d\t%f\t%f\t%f' %
-                #       (self.lambda_param, self.item_topic_counts[item][k],
-                #        self.item_words[item], self.kappa,
-                #        self.gamma_item[item][k], tZ))
-                q = - self.lambda_param * (self.item_topic_counts[item][k] - self.item_words[item] * math.exp(self.kappa * self.gamma_item[item][k]) / tZ)
-                print('q = %f' % q)
-                # print('kappa', self.kappa)
-                self.d_gamma_item[item][k] += self.kappa * q
-                self.d_kappa += self.gamma_item[item][k] * q
+        self.gradient = np.zeros(self.nw)
+        self.d_alpha, self.d_kappa, self.d_beta_user, self.d_beta_item,\
+            self.d_gamma_user, self.d_gamma_item, self.d_topic_words =\
+            self.get_parameter_views(self.gradient)
+
+        users, items, ratings = self.train_arrays
+        pred_errors = 2 * (self.predict(users, items) - ratings)
+
+        self.d_alpha[0] = pred_errors.sum()
+        self.d_beta_user[:] = self.user_scatter.dot(pred_errors)
+        self.d_beta_item[:] = self.item_scatter.dot(pred_errors)
+        self.d_gamma_user[:] = self.user_scatter.dot(
+            pred_errors[:, np.newaxis] * self.gamma_item[items])
+        self.d_gamma_item[:] = self.item_scatter.dot(
+            pred_errors[:, np.newaxis] * self.gamma_user[users])
+
+        item_topics = softmax(self.kappa * self.gamma_item)
+        q = -self.lambda_param * (
+            self.item_topic_counts -
+            self.item_words[:, np.newaxis] * item_topics)
+        self.d_gamma_item += self.kappa * q
+        self.d_kappa[0] = np.sum(self.gamma_item * q)
 
         # Add the derivative of the regularizer
         if self.latent_reg > 0:
-            for user in range(self.n_users):
-                for k in range(self.num_topics):
-                    self.d_gamma_user[user][k] +=\
-                        self.latent_reg * 2 * self.d_gamma_user[user][k]
-            for item in range(self.n_items):
-                for k in range(self.num_topics):
-                    self.d_gamma_item[item][k] +=\
-                        self.latent_reg * 2 * self.d_gamma_item[item][k]
-
-        wZ = self.word_z()
-
-        for word in range(self.n_words):
-            for k in range(self.num_topics):
-                twC = self.word_topic_counts[word][k]
-                ex = math.exp(self.background_words[word] +
-                              self.topic_words[word][k])
-                self.d_topic_words[word][k] +=\
-                    -self.lambda_param *\
-                    (twC - self.topic_counts[k] * ex / wZ[k])
-
-        print("d_alpha = %f" % self.d_alpha)
-        print("d_kappa = %f" % self.d_kappa)
-
-        for item in range(self.n_items):
-            for k in range(self.num_topics):
-                print("item_topic_counts[%d][%d]\t = %d" % (item, k, self.item_topic_counts[item][k]))
+            self.d_gamma_user += self.latent_reg * 2 * self.gamma_user
+            self.d_gamma_item += self.latent_reg * 2 * self.gamma_item
+
+        word_weights = np.exp(
+            self.background_words[:, np.newaxis] + self.topic_words)
+        self.d_topic_words[:] = -self.lambda_param * (
+            self.word_topic_counts -
+            self.topic_counts * word_weights / word_weights.sum(axis=0))
+
+        return self.gradient
 
     def update_gradient(self):
 
-        learning_rate = 0.00001
+        self.w -= LEARNING_RATE * self.gradient
+
+    def evaluate(self, w):
+        """
+        Computes the energy and its gradient at the given parameters, as
+        required by scipy's L-BFGS
 
-        self.alpha -= learning_rate * self.d_alpha
-        self.kappa -= learning_rate * self.d_kappa
-        self.beta_user -= learning_rate * self.d_beta_user
-        self.beta_item -= learning_rate * self.d_beta_item
-        self.gamma_user -= learning_rate * self.d_gamma_user
-        self.gamma_item -= learning_rate * self.d_gamma_item
-        self.topic_words -= learning_rate * self.d_topic_words
+        :param w: the flat vector of parameters
+        :return: a tuple with the energy and the gradient
+        """
+        self.w[:] = w
+        gradient = self.dl()
+        return self.lsq(), gradient
 
-    def train(self, em_iterations, grad_iterations):
+    def train(self, em_iterations, grad_iterations, use_lbfgs=False):
         """
 
         :type em_iterations: int
         :type grad_iterations: int
+        :param use_lbfgs: if True, the parameters are optimized with L-BFGS
+        in each EM iteration, instead of with plain gradient descent
         """
         best_valid = float("inf")
 
         for emi in range(em_iterations):
 
-            for gi in range(grad_iterations):
-                # evaluate
-                self.dl()
-                self.update_gradient()
+            if use_lbfgs:
+                w, energy, _ = optimize.fmin_l_bfgs_b(
+                    self.evaluate, self.w.copy(), maxiter=grad_iterations)
+                self.w[:] = w
+                print("energy after gradient step = %f" % energy)
+            else:
+                for gi in range(grad_iterations):
+                    # evaluate
+                    self.dl()
+                    self.update_gradient()
 
             if self.lambda_param > 0:
                 # print(self.gamma_user)
@@ -404,10 +444,10 @@ class TopicCorpus:
 
             if valid < best_valid:
                 best_valid = valid
-                for vote in self.corpus.vote_list:
-                    self.best_valid_predictions[vote] = self.prediction(vote)
-
-
+                votes = self.corpus.vote_list
+                users, items, _ = get_vote_arrays(votes)
+                self.best_valid_predictions = dict(
+                    zip(votes, self.predict(users, items)))
 
     def lsq(self):
         """
@@ -415,36 +455,23 @@ class TopicCorpus:
 
         :return:
         """
-        res = 0
+        users, items, ratings = self.train_arrays
+        res = np.sum((self.predict(users, items) - ratings) ** 2)
 
-        for vote in self.train_votes:
-            res += (self.prediction(vote) - vote.rating) ** 2
-
-        for item in range(self.n_items):
-            tZ = self.topic_z(item)
-            lZ = math.log(tZ)
-
-            for k in range(self.num_topics):
-                res += -self.lambda_param * self.item_topic_counts[item][k] * \
-                       (self.kappa * self.gamma_item[item][k] - lZ)
+        lZ = np.log(self.topic_z())
+        res += -self.lambda_param * np.sum(
+            self.item_topic_counts *
+            (self.kappa * self.gamma_item - lZ[:, np.newaxis]))
 
         # Add the regularizer to the energy
         if self.latent_reg > 0:
-            for user in range(self.n_users):
-                for k in range(self.num_topics):
-                    res += self.latent_reg * self.gamma_user[user][k] ** 2
-            for item in range(self.n_items):
-                for k in range(self.num_topics):
-                    res += self.latent_reg * self.gamma_item[item][k] ** 2
-
-        wZ = self.word_z()
-
-        # TODO: Pythonize this, remove the for and put it in one line
-        for k in range(self.num_topics):
-            lZ = math.log(wZ[k])
-            for word in range(self.n_words):
-                res += -self.lambda_param * self.word_topic_counts[word][k] * \
-                       (self.background_words[word] + self.topic_words[word][k] - lZ)
+            res += self.latent_reg * np.sum(self.gamma_user ** 2)
+            res += self.latent_reg * np.sum(self.gamma_item ** 2)
+
+        lZ = np.log(self.word_z())
+        res += -self.lambda_param * np.sum(
+            self.word_topic_counts *
+            (self.background_words[:, np.newaxis] + self.topic_words - lZ))
 
         return res
 
@@ -457,45 +484,15 @@ class TopicCorpus:
         :type test: float
         :type test_ste: float
         """
-        train = 0
-        valid = 0
-        test = 0
-        test_ste = 0
-
-        error_vs_training_user = {}
-        error_vs_training_item = {}
-
-        for train_vote in self.train_votes:
-            train += (self.prediction(train_vote) - train_vote.rating) ** 2
-        for valid_vote in self.valid_votes:
-            valid += (self.prediction(valid_vote) - valid_vote.rating) ** 2
-        for test_vote in self.test_votes:
-            err = (self.prediction(test_vote) - test_vote.rating) ** 2
-            test += err
-            test_ste += err ** 2
-
-            if test_vote.user in self.n_training_per_user:
-                nu = self.n_training_per_user[test_vote.user]
-                if nu not in error_vs_training_user:
-                    error_vs_training_user[nu] = []
-                error_vs_training_user[nu].append(err)
-
-            if test_vote.item in self.n_training_per_item:
-                ni = self.n_training_per_item[test_vote.item]
-                if ni not in error_vs_training_item:
-                    error_vs_training_item[ni] = []
-                error_vs_training_item[ni].append(err)
-
-        # Standard error
-        for key, value in error_vs_training_item.iteritems():
-            if key > 100:
-                continue
-            av, var = self.average_var(value)
-
-        train /= len(self.train_votes)
-        valid /= len(self.valid_votes)
-        test /= len(self.test_votes)
-        test_ste /= len(self.test_votes)
+        def squared_errors(vote_arrays):
+            users, items, ratings = vote_arrays
+            return (self.predict(users, items) - ratings) ** 2
+
+        train = np.mean(squared_errors(self.train_arrays))
+        valid = np.mean(squared_errors(self.valid_arrays))
+        test_errors = squared_errors(self.test_arrays)
+        test = np.mean(test_errors)
+        test_ste = np.mean(test_errors ** 2)
         test_ste = math.sqrt((test_ste - test ** 2) / len(self.test_votes))
 
         return train, valid, test, test_ste
@@ -524,14 +521,9 @@ class TopicCorpus:
         "self.background_words")
 
         """
-        for w in range(self.n_words):
-            av = 0
-            for k in range(self.num_topics):
-                av += self.topic_words[w][k]
-            av /= self.num_topics
-            for k in range(self.num_topics):
-                self.topic_words[w][k] -= av
-            self.background_words[w] -= av
+        av = self.topic_words.mean(axis=1)
+        self.topic_words -= av[:, np.newaxis]
+        self.background_words += av
 
     def save(self, model_path, prediction_path):
         """
@@ -541,54 +533,22 @@ class TopicCorpus:
         """
         pass
 
-    def get_g(self, g, alpha, kappa, beta_user, beta_item, gamma_user,
-              gamma_item, topic_words, init):
-        """
-
-        :type g: float
-        :type alpha: float
-        :type kappa: float
-        :type beta_user: float
-        :type beta_item: float
-        :type gamma_user: float
-        :type gamma_item: float
-        :type topic_words: float
-        :type init: bool
-        """
-        pass
-
-    # def clear_g(self):
-    #     pass
-
     def word_z(self):
         """
         Compute normalization constants for all K topics
         Look at equation 9 in the paper
         """
+        return np.exp(
+            self.background_words[:, np.newaxis] + self.topic_words).sum(axis=0)
 
-        res = np.zeros(self.num_topics)
-
-        for k in range(self.num_topics):
-            for w in range(self.n_words):
-                res[k] += math.exp(self.background_words[w] + self.topic_words[w][k])
-
-        return res
-
-    def topic_z(self, item):
+    def topic_z(self):
         """
-        Compute normalization constant for a particular item
+        Compute the normalization constant of every item
         Look at equation 4 in the paper
 
-        :type item: int
-        :type res: float
+        :rtype: np.ndarray
         """
-        res = 0
-        # print('kappa', self.kappa)
-        for k in range(self.num_topics):
-            # print('gamma_item', self.gamma_item[item][k])
-            res += math.exp(self.kappa * self.gamma_item[item][k])
-
-        return res
+        return np.exp(self.kappa * self.gamma_item).sum(axis=1)
 
     # def gradient_descent(self):
     #
@@ -596,48 +556,26 @@ class TopicCorpus:
 
     def update_topics(self):
         """
-        Update topic assignments for each word, this is done by sampling
-
-        """
-        for vote in self.train_votes:
-            item = vote.item
-            topics = self.word_topics[vote]
-
-            for wp in range(len(vote.word_list)):
-                # For each word position
-                wi = vote.word_list[wp]
-                topic_scores = np.zeros(self.num_topics)
-                topic_total = 0
-
-                for k in range(self.num_topics):
-                    topic_scores[k] = math.exp(
-                        self.kappa * self.gamma_item[item][k] +
-                        self.background_words[wi] + self.topic_words[wi][k])
-                    topic_total += topic_scores[k]
-
-                # TODO: Pythonize
-                for k in range(self.num_topics):
-                    topic_scores[k] /= topic_total
-
-                new_topic = 0
-                x = np.random.random()
-                while True:
-                    x -= topic_scores[new_topic]
-                    if x < 0:
-                        break
-                    new_topic += 1
-
-                if new_topic != topics[wp]:
-                    # Update topic counts if the topic for this word position
-                    # changed
-                    t = topics[wp]
-                    self.word_topic_counts[wi][t] -= 1
-                    self.word_topic_counts[wi][new_topic] += 1
-                    self.topic_counts[t] -= 1
-                    self.topic_counts[new_topic] += 1
-                    self.item_topic_counts[item][t] -= 1
-                    self.item_topic_counts[item][new_topic] += 1
-                    topics[wp] = new_topic
+        Update topic assignments for each word, this is done by sampling. The
+        topic of a word only depends on the current parameters, so the words
+        are sampled in chunks
+
+        """
+        item_scores = self.kappa * self.gamma_item
+        word_scores = self.background_words[:, np.newaxis] + self.topic_words
+
+        for start in range(0, len(self.token_words), TOPIC_SAMPLING_CHUNK_SIZE):
+            end = start + TOPIC_SAMPLING_CHUNK_SIZE
+            topic_scores = softmax(
+                item_scores[self.token_items[start:end]] +
+                word_scores[self.token_words[start:end]])
+            cdf = np.cumsum(topic_scores, axis=1)
+            x = np.random.random(len(cdf))[:, np.newaxis] * cdf[:, -1:]
+            # The first topic whose cumulative probability is greater than x
+            self.token_topics[start:end] = np.minimum(
+                (cdf <= x).sum(axis=1), self.num_topics - 1)
+
+        self.update_topic_counts()
 
     def top_words(self):
         """
@@ -655,7 +593,8 @@ class TopicCorpus:
         file_name = '/Users/fpena/tmp/SharedFolder/code_RecSys13/Arts-shuffled.votes'
         # file_name = '/Users/fpena/tmp/SharedFolder/code_RecSys13/Arts-short-shuffled.votes'
         corpus = Corpus()
-        corpus.load_data(file_name, 0)
+        # The parsed corpus is cached next to the votes file
+        corpus.load_data(file_name, 0, os.path.dirname(file_name))
         topic_corpus = TopicCorpus(corpus, num_topics, latent_reg, lambda_param)
         topic_corpus.train(2, 50)
 
@@ -672,7 +611,9 @@ def print_vote(vote):
     # for word in vote.word_list:
     #     print(word)
 
-TopicCorpus.main()
+
+if __name__ == '__main__':
+    TopicCorpus.main()
 
 # np.random.seed(0)
 # random.seed(0)
@@ -1,3 +1,6 @@
+import multiprocessing
+
+from scipy import sparse
 from scipy.special import gammaln
 
 __author__ = 'fpena'
@@ -26,43 +29,133 @@ def log_multi_beta(alpha, K=None):
         return K * gammaln(alpha) - gammaln(K*alpha)
 
 
+def build_token_arrays(matrix):
+    """
+    Flattens a document-word count matrix into one entry per token, in the
+    same order as calling word_indices on every row of the matrix
+
+    :param matrix: a dense or sparse matrix with a count of the words in each
+    document
+    :return: a tuple with the document and the word of each token
+    """
+    matrix = sparse.csr_matrix(matrix)
+    matrix.sum_duplicates()
+    matrix.sort_indices()
+    counts = matrix.data.astype(np.int64)
+    rows = np.repeat(
+        np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    return np.repeat(rows, counts), np.repeat(matrix.indices, counts)
+
+
+def sample_tokens(
+        document_ids, word_ids, token_topics, documents_topics_count,
+        words_topics_count, topics_words_sum, alpha, beta, random_state):
+    """
+    Runs one sweep of collapsed Gibbs sampling over the given tokens,
+    updating the topic of each token and the counts in place. The new topics
+    are drawn by inverse-CDF sampling with uniforms that are drawn for all
+    the tokens at once
+
+    :param document_ids: the document of each token, as a list
+    :param word_ids: the word of each token, as a list
+    :param token_topics: the topic of each token, as a list
+    :param documents_topics_count: a (documents x topics) matrix
+    :param words_topics_count: a (words x topics) matrix
+    :param topics_words_sum: the number of tokens assigned to each topic
+    :param alpha: the document-topic prior
+    :param beta: the topic-word prior
+    :param random_state: the random number generator
+    """
+    words_beta = words_topics_count.shape[0] * beta
+    uniforms = random_state.random_sample(len(word_ids)).tolist()
+    cumsum = np.cumsum
+
+    for token, (document, word) in enumerate(zip(document_ids, word_ids)):
+        topic = token_topics[token]
+        document_topics = documents_topics_count[document]
+        word_topics = words_topics_count[word]
+        document_topics[topic] -= 1
+        word_topics[topic] -= 1
+        topics_words_sum[topic] -= 1
+
+        # The document denominator of p(z) is the same for all the topics, so
+        # it doesn't change the sampled topic
+        cdf = cumsum(
+            (word_topics + beta) * (document_topics + alpha) /
+            (topics_words_sum + words_beta))
+        topic = cdf.searchsorted(uniforms[token] * cdf[-1], 'right')
+
+        document_topics[topic] += 1
+        word_topics[topic] += 1
+        topics_words_sum[topic] += 1
+        token_topics[token] = topic
+
+
+def sample_partition(partition):
+    """
+    Runs one sweep of Gibbs sampling over the tokens of a group of documents
+    in a worker process, with its own copy of the topic-word counts (AD-LDA)
+
+    :return: the new topics of the tokens and the new document-topic counts
+    of the documents
+    """
+    document_ids, word_ids, token_topics, documents_topics_count,\
+        words_topics_count, topics_words_sum, alpha, beta, seed = partition
+    token_topics = token_topics.tolist()
+    sample_tokens(
+        document_ids.tolist(), word_ids.tolist(), token_topics,
+        documents_topics_count, words_topics_count, topics_words_sum, alpha,
+        beta, np.random.RandomState(seed))
+    return token_topics, documents_topics_count
+
+
 class LatentDirichletAllocation(object):
 
-    def __init__(self, num_topics, alpha=0.1, beta=0.1):
-        # self.documents_topics_count = None
-        # self.topics_words_count = None
-        # self.documents_topics_sum = None
-        # self.topics_words_sum = None
+    def __init__(self, num_topics, alpha=0.1, beta=0.1, num_processes=1):
+        """
+        :param num_topics: the number of topics
+        :param alpha: the document-topic prior
+        :param beta: the topic-word prior
+        :param num_processes: the number of processes in which the documents
+        are sampled. With more than one process the approximate distributed
+        sampler AD-LDA (Newman et al.) is used: each process samples a group
+        of documents with the topic-word counts of the previous sweep, and the
+        counts are merged at the end of every sweep
+        """
         self.alpha = alpha
         self.beta = beta
-        # self.num_words = None
-        # self.num_docs = None
         self.num_topics = num_topics
+        self.num_processes = num_processes
+
+    @property
+    def topics_words_count(self):
+        # The counts are stored with one row per word, so the counts of a word
+        # are contiguous in memory when sampling
+        return self.words_topics_count.T
 
     def _initialize(self, matrix):
 
         self.num_docs, self.num_words = matrix.shape
+        self.document_ids, self.word_ids = build_token_arrays(matrix)
+
+        # choose an arbitrary topic as first topic for each token
+        self.token_topics = np.random.randint(
+            self.num_topics, size=len(self.word_ids))
+        self._update_counts()
 
+    def _update_counts(self):
         # number of times document m and topic z co-occur
         self.documents_topics_count = np.zeros((self.num_docs, self.num_topics))
+        np.add.at(
+            self.documents_topics_count,
+            (self.document_ids, self.token_topics), 1)
         # number of times topic z and word w co-occur
-        self.topics_words_count = np.zeros((self.num_topics, self.num_words))
-
-        self.documents_topics_sum = np.zeros(self.num_docs)
-        self.topics_words_sum = np.zeros(self.num_topics)
-        self.topics = {}
-
-        for m in range(self.num_docs):
-            # i is a number between 0 and doc_length-1
-            # w is a number between 0 and vocab_size-1
-            for i, w in enumerate(word_indices(matrix[m, :])):
-                # choose an arbitrary topic as first topic for word i
-                z = np.random.randint(self.num_topics)
-                self.documents_topics_count[m,z] += 1
-                self.documents_topics_sum[m] += 1
-                self.topics_words_count[z,w] += 1
-                self.topics_words_sum[z] += 1
-                self.topics[(m,i)] = z
+        self.words_topics_count = np.zeros((self.num_words, self.num_topics))
+        np.add.at(
+            self.words_topics_count, (self.word_ids, self.token_topics), 1)
+
+        self.documents_topics_sum = self.documents_topics_count.sum(axis=1)
+        self.topics_words_sum = self.words_topics_count.sum(axis=0)
 
     def calculate_p_z(self, d_i, w_i):
         '''
@@ -81,17 +174,11 @@ class LatentDirichletAllocation(object):
 
         # We calculate the probability mass function of p(z)
         # This includes all the topics (all the values of k)
-        left = (self.topics_words_count[:, w_i] + self.beta) /\
+        left = (self.words_topics_count[w_i] + self.beta) /\
                (self.topics_words_sum + self.num_words * self.beta)
         right = (self.documents_topics_count[d_i, :] + self.alpha) /\
                 (self.documents_topics_sum[d_i] + self.num_topics * self.alpha)
 
-        # This was giving better results
-        # left = (self.topics_words_count[:, w_i] + self.beta) /\
-        #        (self.topics_words_sum + self.num_words * self.beta)
-        # right = (self.documents_topics_count[d_i, :]) /\
-        #         (self.documents_topics_sum[d_i])
-
         p_z = left * right
         # We normalize the values to obtain the probability
         p_z /= np.sum(p_z)
@@ -101,7 +188,6 @@ class LatentDirichletAllocation(object):
 
         return p_z
 
-
     def sample_topic(self, p_z):
         '''
         Sample a new topic from the multinomial distribution p_z and return
@@ -111,43 +197,76 @@ class LatentDirichletAllocation(object):
         :return:
         '''
 
-        return np.random.multinomial(1, p_z).argmax()
+        cdf = np.cumsum(p_z)
+        return cdf.searchsorted(np.random.random_sample() * cdf[-1], 'right')
 
     def run(self, matrix, num_cycles):
         """
         Perform inference of the topic model using Gibss Sampling
 
-        :param matrix: a matrix with a count of the words in each document
+        :param matrix: a matrix with a count of the words in each document. It
+        can be a dense or a sparse matrix
         :param num_cycles: the number of iterations for the Gibbs Sampling
         routine
         """
         self._initialize(matrix)
 
+        # Every process samples at least one document
+        num_partitions = min(self.num_processes, self.num_docs)
+        if num_partitions > 1:
+            pool = multiprocessing.Pool(num_partitions)
+            try:
+                for gibbs_cycle in range(num_cycles):
+                    self._run_distributed_cycle(pool, num_partitions)
+                    yield self.phi()
+            finally:
+                pool.close()
+                pool.join()
+            return
+
+        document_ids = self.document_ids.tolist()
+        word_ids = self.word_ids.tolist()
         for gibbs_cycle in range(num_cycles):
-            for document in range(self.num_docs):
-                for i, word in enumerate(word_indices(matrix[document, :])):
-                    topic = self.topics[(document, i)]
-                    self.documents_topics_count[document, topic] -= 1
-                    self.topics_words_count[topic, word] -= 1
-                    self.documents_topics_sum[document] -= 1
-                    self.topics_words_sum[topic] -= 1
-
-                    p_z = self.calculate_p_z(document, word)
-                    new_topic = self.sample_topic(p_z)
-
-                    self.documents_topics_count[document, new_topic] += 1
-                    self.topics_words_count[new_topic, word] += 1
-                    self.documents_topics_sum[document] += 1
-                    self.topics_words_sum[new_topic] += 1
-                    self.topics[(document, i)] = new_topic
+            token_topics = self.token_topics.tolist()
+            sample_tokens(
+                document_ids, word_ids, token_topics,
+                self.documents_topics_count, self.words_topics_count,
+                self.topics_words_sum, self.alpha, self.beta, np.random)
+            self.token_topics = np.array(token_topics)
 
             yield self.phi()
 
+    def _run_distributed_cycle(self, pool, num_partitions):
+        # The tokens are sorted by document, so every group of documents is a
+        # contiguous range of tokens. There are no more partitions than
+        # documents, so none of the groups is empty
+        document_groups = np.array_split(
+            np.arange(self.num_docs), num_partitions)
+        token_starts = np.searchsorted(
+            self.document_ids, [group[0] for group in document_groups] +
+            [self.num_docs])
+        seeds = np.random.randint(2 ** 31 - 1, size=len(document_groups))
+
+        partitions = []
+        for index, documents in enumerate(document_groups):
+            start, end = token_starts[index], token_starts[index + 1]
+            partitions.append((
+                self.document_ids[start:end] - documents[0],
+                self.word_ids[start:end], self.token_topics[start:end],
+                self.documents_topics_count[documents],
+                self.words_topics_count, self.topics_words_sum.copy(),
+                self.alpha, self.beta, seeds[index]))
+
+        results = pool.map(sample_partition, partitions)
+        self.token_topics = np.concatenate(
+            [np.array(token_topics, dtype=np.int64)
+             for token_topics, _ in results])
+        self._update_counts()
+
     def phi(self):
         """
         Compute phi = p(w|z).
         """
-        V = self.topics_words_count.shape[1]
         num = self.topics_words_count + self.beta
         num /= np.sum(num, axis=1)[:, np.newaxis]
         return num
@@ -163,14 +282,8 @@ class LatentDirichletAllocation(object):
 
         :return: a matrix with the words distributions in each topics.
         """
-        phi = np.zeros(self.num_topics, self.num_words)
-        for topic in range(self.num_topics):
-            for word in range(self.num_words):
-                phi[topic, word] = \
-                    (self.topics_words_count[topic, word] + self.beta) /\
-                    (self.topics_words_sum[word] + self.num_words * self.beta)
-
-        return phi
+        return (self.topics_words_count + self.beta) /\
+            (self.topics_words_sum + self.num_words * self.beta)[:, np.newaxis]
 
     def estimate_theta(self):
         """
@@ -184,14 +297,9 @@ class LatentDirichletAllocation(object):
 
         :return: a matrix with the topics distributions in each document.
         """
-        theta = np.zeros(self.num_docs, self.num_topics)
-        for document in range(self.num_docs):
-            for word in range(self.num_topics):
-                theta[document, word] = \
-                    (self.documents_topics_count[document, word] + self.alpha) /\
-                    (self.documents_topics_sum[word] + self.num_topics * self.alpha)
-
-        return theta
+        return (self.documents_topics_count + self.alpha) /\
+            (self.documents_topics_sum +
+             self.num_topics * self.alpha)[:, np.newaxis]
 
     def loglikelihood(self):
         return self.loglikelihood_franpena()
@@ -216,22 +324,21 @@ class LatentDirichletAllocation(object):
         likelihood += self.num_topics * gammaln(self.num_words * self.beta)
         likelihood -= self.num_topics * self.num_words * gammaln(self.beta)
 
-        for topic in range(self.num_topics):
-            likelihood += np.sum(gammaln(self.topics_words_count[topic] + self.beta))
-            likelihood -= gammaln(np.sum(self.topics_words_count[topic] + self.num_words * self.beta))
+        likelihood += np.sum(gammaln(self.topics_words_count + self.beta))
+        likelihood -= np.sum(gammaln(np.sum(
+            self.topics_words_count + self.num_words * self.beta, axis=1)))
 
         # log p(z|\alpha) --> equation 3
         likelihood += self.num_docs * gammaln(np.sum(self.alpha) * self.num_topics)
         likelihood -= self.num_docs * self.num_topics * np.sum(gammaln(self.alpha))
 
-        for doc in range(self.num_docs):
-            likelihood += np.sum(gammaln(self.documents_topics_count[doc] + self.alpha))
-            likelihood -= gammaln(np.sum(self.documents_topics_count[doc] + self.num_topics * self.alpha))
+        likelihood += np.sum(gammaln(self.documents_topics_count + self.alpha))
+        likelihood -= np.sum(gammaln(np.sum(
+            self.documents_topics_count + self.num_topics * self.alpha,
+            axis=1)))
 
         return likelihood
 
-
-
     def loglikelihood_mblondiel(self):
         """
         Compute the likelihood that the model generated the data.
@@ -240,37 +347,30 @@ class LatentDirichletAllocation(object):
         n_docs = self.documents_topics_count.shape[0]
         lik = 0
 
-        for z in range(self.num_topics):
-            lik += log_multi_beta(self.topics_words_count[z,:]+self.beta)
-            lik -= log_multi_beta(self.beta, vocab_size)
+        topics_words = self.topics_words_count + self.beta
+        lik += np.sum(gammaln(topics_words))
+        lik -= np.sum(gammaln(np.sum(topics_words, axis=1)))
+        lik -= self.num_topics * log_multi_beta(self.beta, vocab_size)
 
-        for m in range(n_docs):
-            lik += log_multi_beta(self.documents_topics_count[m,:]+self.alpha)
-            lik -= log_multi_beta(self.alpha, self.num_topics)
+        documents_topics = self.documents_topics_count + self.alpha
+        lik += np.sum(gammaln(documents_topics))
+        lik -= np.sum(gammaln(np.sum(documents_topics, axis=1)))
+        lik -= n_docs * log_multi_beta(self.alpha, self.num_topics)
 
         return lik
 
-
     def loglikelihood_park(self):                                        # FIND (JOINT) LOG-LIKELIHOOD VALUE
         l = 0
-        for z in range(self.num_topics):                                # log p(w|z,\beta)
-            l += gammaln(self.num_words * self.beta)
-            l -= self.num_words * gammaln(self.beta)
-            l += np.sum(gammaln(self.topics_words_count[z] + self.beta))
-            l -= gammaln(np.sum(self.topics_words_count + self.beta))
-        for d in range(self.num_docs):                                  # log p(z|\alpha)
-            # d = self.indD[doc]
-            l += gammaln(np.sum(self.alpha))
-            l -= np.sum(gammaln(self.alpha))
-            l += np.sum(gammaln(self.documents_topics_count[d] + self.alpha))
-            l -= gammaln(np.sum(self.documents_topics_count[d] + self.alpha))
+        # log p(w|z,\beta)
+        l += self.num_topics * gammaln(self.num_words * self.beta)
+        l -= self.num_topics * self.num_words * gammaln(self.beta)
+        l += np.sum(gammaln(self.topics_words_count + self.beta))
+        l -= self.num_topics * gammaln(
+            np.sum(self.topics_words_count + self.beta))
+        # log p(z|\alpha)
+        l += self.num_docs * gammaln(np.sum(self.alpha))
+        l -= self.num_docs * np.sum(gammaln(self.alpha))
+        l += np.sum(gammaln(self.documents_topics_count + self.alpha))
+        l -= np.sum(gammaln(
+            np.sum(self.documents_topics_count + self.alpha, axis=1)))
         return l
-
-
-
-
-
-
-
-
-
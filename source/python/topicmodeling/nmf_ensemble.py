@@ -0,0 +1,365 @@
+import multiprocessing
+import os
+import time
+from multiprocessing import sharedctypes
+
+import numpy
+from scipy import sparse
+from sklearn import decomposition
+from sklearn.externals import joblib
+
+from topicmodeling import belford_tfidf
+from topicmodeling import topic_ensemble_caller
+from utils import utilities
+from utils.constants import Constants
+
+__author__ = 'fpena'
+
+
+# The documents with less characters are not used to build the ensemble, the
+# same value that is passed to the belford_tfidf script
+MIN_DOCUMENT_LENGTH = 10
+
+# The initializations of the NMF models that don't depend on the random state
+DETERMINISTIC_INITIALIZATIONS = ('nndsvd', 'nndsvda')
+
+# The state of the worker processes, which is inherited when the pool is
+# created instead of being pickled for every task
+_shared_matrix = None
+_base_model_parameters = None
+
+
+def get_run_seeds(num_runs, seed=None):
+    """
+    Derives the seed of each base model from a single seed, so the ensemble
+    is reproducible regardless of the number of processes used to build it
+
+    :param num_runs: the number of base models
+    :param seed: the seed from which the seeds of the runs are derived. By
+    default Constants.NUMPY_RANDOM_SEED is used
+    :return: a list with the seed of each run
+    """
+    if seed is None:
+        seed = Constants.NUMPY_RANDOM_SEED
+    random_state = numpy.random.RandomState(seed)
+    return random_state.randint(1, 2 ** 31 - 1, num_runs).tolist()
+
+
+def share_matrix(matrix):
+    """
+    Copies the arrays of the given sparse matrix into shared memory, so they
+    can be read by the worker processes without pickling them
+
+    :type matrix: scipy.sparse.spmatrix
+    :param matrix: the matrix to share
+    :return: a tuple with the shape of the matrix and the shared data, indices
+    and indptr arrays of its CSR representation
+    """
+    matrix = sparse.csr_matrix(matrix, dtype=numpy.float64)
+    shared_arrays = []
+    for array in [matrix.data, matrix.indices, matrix.indptr]:
+        shared_array = sharedctypes.RawArray('b', array.nbytes)
+        numpy.frombuffer(shared_array, dtype=array.dtype)[:] = array
+        shared_arrays.append((shared_array, array.dtype))
+
+    return matrix.shape, shared_arrays
+
+
+def load_shared_matrix(shared_matrix):
+    """
+    Builds a CSR matrix on top of the shared arrays created by share_matrix,
+    without copying them
+
+    :param shared_matrix: the value returned by share_matrix
+    :rtype: scipy.sparse.csr_matrix
+    """
+    shape, shared_arrays = shared_matrix
+    data, indices, indptr = [
+        numpy.frombuffer(shared_array, dtype=dtype)
+        for shared_array, dtype in shared_arrays
+    ]
+    return sparse.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+
+
+def get_base_model_parameters(num_topics):
+    return {
+        'init': Constants.NMF_BASE_MODEL_INIT,
+        'n_components': num_topics,
+        'max_iter': Constants.TOPIC_MODEL_ITERATIONS,
+        'alpha': Constants.NMF_REGULARIZATION,
+        'l1_ratio': Constants.NMF_REGULARIZATION_RATIO
+    }
+
+
+def build_combining_model(num_topics):
+    """
+    Returns the NMF model that combines the topics of the base models
+    """
+    return decomposition.NMF(
+        init="nndsvd", n_components=num_topics,
+        max_iter=Constants.TOPIC_MODEL_ITERATIONS,
+        alpha=Constants.NMF_REGULARIZATION,
+        l1_ratio=Constants.NMF_REGULARIZATION_RATIO
+    )
+
+
+def get_fold_train_indices(num_documents, seed, fold_index, num_folds):
+    """
+    Returns the documents used to train a base model of a k-fold run, which
+    are all the documents except the ones of the given fold. All the folds of
+    a run share the same random partition of the documents
+
+    :param num_documents: the number of documents
+    :param seed: the seed of the run
+    :param fold_index: the fold that is left out
+    :param num_folds: the number of folds of the run
+    :rtype: numpy.ndarray
+    :return: the sorted indices of the training documents
+    """
+    permutation = numpy.random.RandomState(seed).permutation(num_documents)
+    folds = numpy.array_split(permutation, num_folds)
+    del folds[fold_index]
+    return numpy.sort(numpy.concatenate(folds))
+
+
+def fit_base_model(
+        document_term_matrix, parameters, seed, fold_index=None,
+        num_folds=None):
+    """
+    Fits a single NMF model and returns its topic-term matrix, with each
+    topic normalized to unit length
+
+    :param document_term_matrix: the document-term matrix
+    :param parameters: the parameters of the NMF model
+    :param seed: the seed used to initialize the model
+    :param fold_index: the fold of the documents that is left out, or None to
+    train the model with all the documents
+    :param num_folds: the number of folds in which the documents are split
+    :rtype: numpy.ndarray
+    :return: the (topics x terms) matrix of the model
+    """
+    random_state = seed
+    if fold_index is not None:
+        document_term_matrix = document_term_matrix[get_fold_train_indices(
+            document_term_matrix.shape[0], seed, fold_index, num_folds)]
+        random_state = numpy.random.RandomState([seed, fold_index])
+
+    topic_model = decomposition.NMF(random_state=random_state, **parameters)
+    topic_model.fit(document_term_matrix)
+    topic_term_matrix = topic_model.components_
+    norms = numpy.sqrt((topic_term_matrix ** 2).sum(axis=1))
+    norms[norms == 0] = 1.
+    return topic_term_matrix / norms[:, numpy.newaxis]
+
+
+def initialize_worker(shared_matrix, parameters):
+    global _shared_matrix
+    global _base_model_parameters
+    _shared_matrix = load_shared_matrix(shared_matrix)
+    _base_model_parameters = parameters
+
+
+def fit_base_model_wrapper(run):
+    run_index, seed, fold_index, num_folds = run
+    return run_index, fit_base_model(
+        _shared_matrix, _base_model_parameters, seed, fold_index, num_folds)
+
+
+def build_stack_matrix(
+        document_term_matrix, num_topics, seeds, num_folds=None):
+    """
+    Fits the base NMF models and stacks their normalized topics. There is one
+    base model per seed or, when num_folds is given, one base model per seed
+    and fold, trained without the documents of that fold. The models are
+    fitted in a process pool when Constants.NUM_CORES allows it, with the
+    document-term matrix in shared memory, and each topic-term matrix is
+    written into its rows of the stack matrix as soon as it is received.
+
+    The seeds only change the base models when Constants.NMF_BASE_MODEL_INIT
+    is 'random' or 'nndsvdar'. With a deterministic initialization and no
+    folds all the base models would be identical, so a single model is fitted
+    and its topics are repeated once per seed
+
+    :param document_term_matrix: the document-term matrix
+    :param num_topics: the number of topics of each base model
+    :param seeds: the seed of each run
+    :param num_folds: the number of folds of each run, or None to train each
+    base model with all the documents
+    :rtype: numpy.ndarray
+    :return: a (base models * topics x terms) matrix with the topics of all
+    the base models, in the order of the seeds and folds
+    """
+    parameters = get_base_model_parameters(num_topics)
+    if num_folds is None and \
+            parameters['init'] in DETERMINISTIC_INITIALIZATIONS:
+        topic_term_matrix = fit_base_model(
+            document_term_matrix, parameters, seeds[0])
+        return numpy.tile(topic_term_matrix, (len(seeds), 1))
+
+    if num_folds is None:
+        runs = [(seed, None) for seed in seeds]
+    else:
+        runs = [
+            (seed, fold_index)
+            for seed in seeds for fold_index in range(num_folds)
+        ]
+    runs = [
+        (run_index, seed, fold_index, num_folds)
+        for run_index, (seed, fold_index) in enumerate(runs)
+    ]
+    stack_matrix = numpy.empty(
+        (len(runs) * num_topics, document_term_matrix.shape[1]))
+
+    def add_topics(run_index, topic_term_matrix):
+        start = run_index * num_topics
+        stack_matrix[start:start + num_topics] = topic_term_matrix
+
+    num_processes = utilities.get_num_processes(len(runs))
+    if num_processes > 1:
+        pool = multiprocessing.Pool(
+            num_processes, initialize_worker,
+            (share_matrix(document_term_matrix), parameters))
+        try:
+            for run_index, topic_term_matrix in pool.imap_unordered(
+                    fit_base_model_wrapper, runs):
+                add_topics(run_index, topic_term_matrix)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for run_index, seed, fold_index, _ in runs:
+            add_topics(run_index, fit_base_model(
+                document_term_matrix, parameters, seed, fold_index,
+                num_folds))
+
+    return stack_matrix
+
+
+def build_ensemble_topic_model(
+        document_term_matrix, num_topics, num_runs=None, seed=None,
+        num_folds=None):
+    """
+    Builds a stable NMF topic model, by factorizing the stacked topics of
+    several base NMF models fitted with different seeds
+
+    :param document_term_matrix: the document-term matrix
+    :param num_topics: the number of topics
+    :param num_runs: the number of base models. By default
+    Constants.TOPIC_MODEL_PASSES is used
+    :param seed: the seed from which the seeds of the base models are derived.
+    By default Constants.NUMPY_RANDOM_SEED is used
+    :param num_folds: the number of folds of each run, or None to train each
+    base model with all the documents
+    :rtype: (decomposition.NMF, numpy.ndarray)
+    :return: the NMF model fitted on the stack matrix, whose components_ are
+    the topics of the ensemble, and the weight of these topics in each of the
+    topics of the base models
+    """
+    if num_runs is None:
+        num_runs = Constants.TOPIC_MODEL_PASSES
+
+    stack_matrix = build_stack_matrix(
+        document_term_matrix, num_topics, get_run_seeds(num_runs, seed),
+        num_folds)
+
+    print "Stack matrix M of size %s" % str(stack_matrix.shape)
+
+    topic_model = build_combining_model(num_topics)
+    stack_topic_matrix = topic_model.fit_transform(stack_matrix)
+
+    return topic_model, stack_topic_matrix
+
+
+def parse_documents(records):
+    """
+    Returns the text of the target reviews that are used to build the
+    ensemble topic model, skipping the ones that are too short, in the same
+    way as the belford_tfidf script does with the exported text files
+
+    :param records: the records, with their bag of words
+    :return: a tuple with the list of documents and the list of their ids
+    """
+    topic_model_target = Constants.TOPIC_MODEL_TARGET_REVIEWS
+    documents = []
+    doc_ids = []
+    for record in records:
+        if record[Constants.TOPIC_MODEL_TARGET_FIELD] != \
+                topic_model_target and topic_model_target is not None:
+            continue
+        document = " ".join(record[Constants.BOW_FIELD])
+        if len(document) < MIN_DOCUMENT_LENGTH:
+            continue
+        documents.append(document)
+        doc_ids.append('bow_' + str(record[Constants.REVIEW_ID_FIELD]))
+
+    return documents, doc_ids
+
+
+def combine_topic_models(document_term_matrix, stack_matrix, num_topics):
+    """
+    Factorizes the stacked topics of the base models to obtain the topics of
+    the ensemble, and weights the documents with these topics, in the same way
+    as the combine-nmf script of topic-ensemble
+
+    :param document_term_matrix: the document-term matrix
+    :param stack_matrix: the stacked topics of the base models
+    :param num_topics: the number of topics of the ensemble
+    :return: a tuple with the (documents x topics) and the (topics x terms)
+    factors of the ensemble
+    """
+    topic_model = build_combining_model(num_topics)
+    topic_model.fit(stack_matrix)
+    topic_term_matrix = topic_model.components_
+    document_topic_matrix = numpy.asarray(
+        document_term_matrix.dot(topic_term_matrix.T))
+
+    return document_topic_matrix, topic_term_matrix
+
+
+def create_ensemble_topic_model(records):
+    """
+    In-process replacement of the topic_ensemble_caller pipeline, which runs
+    the parse, TF-IDF, k-fold base NMF models and combine stages without
+    writing the intermediate results to disk or starting new interpreters.
+    Only the files read by NmfTopicExtractor.load_trained_data are written:
+    the final factors and the TF-IDF vectorizer
+
+    :param records: the records, with their bag of words
+    """
+    print('%s: building the ensemble topic model' %
+          time.strftime("%Y/%m/%d-%H:%M:%S"))
+
+    documents, doc_ids = parse_documents(records)
+    # The same stop words that the belford_tfidf script uses by default
+    stopwords = belford_tfidf.load_stopwords(
+        Constants.TOPIC_ENSEMBLE_FOLDER + 'text/stopwords.txt')
+    document_term_matrix, terms, tfidf_vectorizer = belford_tfidf.preprocess(
+        documents, stopwords, min_df=Constants.MIN_DICTIONARY_WORD_COUNT)
+
+    print "Created document-term matrix of size %d x %d" % (
+        document_term_matrix.shape[0], document_term_matrix.shape[1])
+
+    num_topics = Constants.TOPIC_MODEL_NUM_TOPICS
+    stack_matrix = build_stack_matrix(
+        document_term_matrix, num_topics,
+        get_run_seeds(Constants.TOPIC_MODEL_PASSES),
+        Constants.TOPIC_MODEL_FOLDS)
+
+    print "Stack matrix M of size %s" % str(stack_matrix.shape)
+
+    document_topic_matrix, topic_term_matrix = combine_topic_models(
+        document_term_matrix, stack_matrix, num_topics)
+
+    for folder in [topic_ensemble_caller.CORPUS_FOLDER,
+                   Constants.ENSEMBLED_RESULTS_FOLDER]:
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+    belford_tfidf.save_tfidf(
+        topic_ensemble_caller.get_dataset_file_name(), tfidf_vectorizer)
+    joblib.dump(
+        (document_topic_matrix, topic_term_matrix, doc_ids, terms),
+        Constants.ENSEMBLED_RESULTS_FOLDER +
+        "factors_final_k%02d.pkl" % num_topics)
+
+    print('%s: ensemble topic model built' %
+          time.strftime("%Y/%m/%d-%H:%M:%S"))
@@ -0,0 +1,84 @@
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy
+
+from topicmodeling.hiddenfactortopics.corpus import Corpus
+
+__author__ = 'fpena'
+
+
+VOTES_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'hiddenfactortopics', 'Arts-short.votes.gz')
+
+
+class TestCorpus(TestCase):
+
+    def setUp(self):
+        self.cache_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_folder)
+
+    def check_votes(self, corpus):
+        with gzip.open(VOTES_FILE) as votes_file:
+            lines = [line.split() for line in votes_file]
+
+        word_counts = {}
+        for fields in lines:
+            for word in fields[5:]:
+                word_counts[word] = word_counts.get(word, 0) + 1
+        vocabulary = set(corpus.word_names[:corpus.num_words])
+
+        self.assertEqual(len(lines), len(corpus.vote_list))
+        self.assertEqual(len(set(fields[0] for fields in lines)),
+                         corpus.num_users)
+        for fields, vote in zip(lines, corpus.vote_list):
+            self.assertEqual(fields[0], corpus.user_names[vote.user])
+            self.assertEqual(fields[1], corpus.item_names[vote.item])
+            self.assertEqual(float(fields[2]), vote.rating)
+            self.assertEqual(
+                [word for word in fields[5:] if word in vocabulary],
+                [corpus.word_names[word] for word in vote.word_list])
+
+        for word, count in zip(corpus.word_names, corpus.word_counts):
+            self.assertEqual(word_counts[word], count)
+        self.assertTrue(numpy.all(numpy.diff(corpus.word_counts) <= 0))
+
+    def test_load_data(self):
+        corpus = Corpus()
+        corpus.load_data(VOTES_FILE, 0)
+        self.check_votes(corpus)
+
+    def test_load_data_max_lines(self):
+        corpus = Corpus()
+        corpus.load_data(VOTES_FILE, 5)
+        self.assertEqual(5, len(corpus.vote_list))
+        self.assertEqual(6, len(corpus.word_offsets))
+
+    def test_load_data_cached(self):
+        corpus = Corpus()
+        corpus.load_data(VOTES_FILE, 0, self.cache_folder)
+        self.assertEqual(1, len(os.listdir(self.cache_folder)))
+        self.assertIsInstance(corpus.words, numpy.memmap)
+        self.check_votes(corpus)
+
+        cached_corpus = Corpus()
+        cached_corpus.load_data(VOTES_FILE, 0, self.cache_folder)
+        self.assertEqual(1, len(os.listdir(self.cache_folder)))
+        self.check_votes(cached_corpus)
+        numpy.testing.assert_array_equal(corpus.words, cached_corpus.words)
+
+    def test_load_data_max_words(self):
+        class SmallCorpus(Corpus):
+            MAX_WORDS = 50
+
+        corpus = SmallCorpus()
+        corpus.load_data(VOTES_FILE, 0)
+        self.assertEqual(50, corpus.num_words)
+        self.assertEqual(50, len(numpy.unique(corpus.words)))
+        self.check_votes(corpus)
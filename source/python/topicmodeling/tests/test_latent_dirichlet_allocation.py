@@ -0,0 +1,135 @@
+from unittest import TestCase
+
+import numpy
+from scipy import sparse
+from scipy.special import gammaln
+
+from topicmodeling import latent_dirichlet_allocation
+from topicmodeling.latent_dirichlet_allocation import LatentDirichletAllocation
+
+__author__ = 'fpena'
+
+
+def build_topics_matrix(num_documents=30, seed=0):
+    # Two topics that use disjoint halves of a vocabulary of 10 words
+    random_state = numpy.random.RandomState(seed)
+    matrix = numpy.zeros((num_documents, 10), dtype=numpy.int64)
+    for document in range(num_documents):
+        words = range(5) if document % 2 == 0 else range(5, 10)
+        for _ in range(20):
+            matrix[document, random_state.choice(words)] += 1
+    return matrix
+
+
+def loglikelihood_reference(lda):
+    # The loop-based likelihood of the previous implementation
+    likelihood = 0
+    likelihood += lda.num_topics * gammaln(lda.num_words * lda.beta)
+    likelihood -= lda.num_topics * lda.num_words * gammaln(lda.beta)
+    for topic in range(lda.num_topics):
+        likelihood += numpy.sum(gammaln(lda.topics_words_count[topic] + lda.beta))
+        likelihood -= gammaln(numpy.sum(
+            lda.topics_words_count[topic] + lda.num_words * lda.beta))
+    likelihood += lda.num_docs * gammaln(numpy.sum(lda.alpha) * lda.num_topics)
+    likelihood -= lda.num_docs * lda.num_topics * numpy.sum(gammaln(lda.alpha))
+    for document in range(lda.num_docs):
+        likelihood += numpy.sum(
+            gammaln(lda.documents_topics_count[document] + lda.alpha))
+        likelihood -= gammaln(numpy.sum(
+            lda.documents_topics_count[document] + lda.num_topics * lda.alpha))
+    return likelihood
+
+
+class TestLatentDirichletAllocation(TestCase):
+
+    def setUp(self):
+        numpy.random.seed(0)
+        self.matrix = build_topics_matrix()
+
+    def check_counts(self, lda):
+        documents_topics_count = numpy.zeros((lda.num_docs, lda.num_topics))
+        words_topics_count = numpy.zeros((lda.num_words, lda.num_topics))
+        for document, word, topic in zip(
+                lda.document_ids, lda.word_ids, lda.token_topics):
+            documents_topics_count[document, topic] += 1
+            words_topics_count[word, topic] += 1
+        numpy.testing.assert_array_equal(
+            documents_topics_count, lda.documents_topics_count)
+        numpy.testing.assert_array_equal(
+            words_topics_count, lda.words_topics_count)
+        numpy.testing.assert_array_equal(
+            words_topics_count.sum(axis=0), lda.topics_words_sum)
+
+    def test_build_token_arrays(self):
+        document_ids, word_ids = latent_dirichlet_allocation.build_token_arrays(
+            sparse.csr_matrix(self.matrix))
+
+        expected_documents = []
+        expected_words = []
+        for document, row in enumerate(self.matrix):
+            for word in latent_dirichlet_allocation.word_indices(row):
+                expected_documents.append(document)
+                expected_words.append(word)
+
+        self.assertEqual(expected_documents, document_ids.tolist())
+        self.assertEqual(expected_words, word_ids.tolist())
+
+    def test_run(self):
+        lda = LatentDirichletAllocation(2)
+        phis = list(lda.run(self.matrix, 20))
+
+        self.assertEqual(20, len(phis))
+        self.assertEqual(self.matrix.sum(), len(lda.token_topics))
+        self.check_counts(lda)
+
+        # Each topic ends up with one half of the vocabulary
+        phi = phis[-1]
+        numpy.testing.assert_allclose(numpy.ones(2), phi.sum(axis=1))
+        first_half = phi[:, :5].sum(axis=1)
+        self.assertGreater(max(first_half), 0.9)
+        self.assertLess(min(first_half), 0.1)
+
+    def test_run_distributed(self):
+        lda = LatentDirichletAllocation(2, num_processes=2)
+        initial_likelihood = None
+        for _ in lda.run(self.matrix, 10):
+            if initial_likelihood is None:
+                initial_likelihood = lda.loglikelihood()
+
+        self.check_counts(lda)
+        self.assertGreater(lda.loglikelihood(), initial_likelihood)
+
+    def test_run_more_processes_than_documents(self):
+        matrix = build_topics_matrix(3)
+        lda = LatentDirichletAllocation(2, num_processes=5)
+        phis = list(lda.run(matrix, 3))
+
+        self.assertEqual(3, len(phis))
+        self.assertEqual(matrix.sum(), len(lda.token_topics))
+        self.check_counts(lda)
+
+    def test_estimates(self):
+        lda = LatentDirichletAllocation(3)
+        list(lda.run(self.matrix, 2))
+
+        numpy.testing.assert_allclose(
+            numpy.ones(3), lda.estimate_phi().sum(axis=1))
+        numpy.testing.assert_allclose(
+            numpy.ones(lda.num_docs), lda.estimate_theta().sum(axis=1))
+        numpy.testing.assert_allclose(lda.phi(), lda.estimate_phi())
+
+    def test_calculate_p_z(self):
+        lda = LatentDirichletAllocation(3)
+        list(lda.run(self.matrix, 1))
+
+        p_z = lda.calculate_p_z(0, 1)
+        self.assertAlmostEqual(1., p_z.sum())
+        self.assertIn(lda.sample_topic(p_z), range(3))
+        self.assertEqual(1, lda.sample_topic(numpy.array([0., 1., 0.])))
+
+    def test_loglikelihood(self):
+        lda = LatentDirichletAllocation(3)
+        list(lda.run(self.matrix, 2))
+
+        self.assertAlmostEqual(
+            loglikelihood_reference(lda), lda.loglikelihood_franpena())
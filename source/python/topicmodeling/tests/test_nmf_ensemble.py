@@ -0,0 +1,125 @@
+from unittest import TestCase
+
+import numpy
+from scipy import sparse
+
+from topicmodeling import nmf_ensemble
+from utils.constants import Constants
+
+__author__ = 'fpena'
+
+
+class TestNmfEnsemble(TestCase):
+
+    def setUp(self):
+        self.num_cores = Constants.NUM_CORES
+        random_state = numpy.random.RandomState(0)
+        self.document_term_matrix = sparse.random(
+            60, 40, density=0.2, format='csr', random_state=random_state)
+
+    def tearDown(self):
+        Constants.NUM_CORES = self.num_cores
+
+    def test_get_run_seeds(self):
+        seeds = nmf_ensemble.get_run_seeds(5, 3)
+        self.assertEqual(5, len(seeds))
+        self.assertEqual(5, len(set(seeds)))
+        self.assertEqual(seeds, nmf_ensemble.get_run_seeds(5, 3))
+        self.assertEqual(seeds[:3], nmf_ensemble.get_run_seeds(3, 3))
+        self.assertNotEqual(seeds, nmf_ensemble.get_run_seeds(5, 4))
+
+    def test_share_matrix(self):
+        shared_matrix = nmf_ensemble.load_shared_matrix(
+            nmf_ensemble.share_matrix(self.document_term_matrix))
+        self.assertEqual(self.document_term_matrix.shape, shared_matrix.shape)
+        self.assertEqual(
+            0, abs(self.document_term_matrix - shared_matrix).sum())
+
+    def test_build_stack_matrix(self):
+        seeds = nmf_ensemble.get_run_seeds(3, 0)
+
+        Constants.NUM_CORES = None
+        stack_matrix = nmf_ensemble.build_stack_matrix(
+            self.document_term_matrix, 4, seeds)
+        self.assertEqual((12, 40), stack_matrix.shape)
+        numpy.testing.assert_allclose(
+            numpy.ones(12), numpy.sqrt((stack_matrix ** 2).sum(axis=1)))
+
+        # The parallel version gives the same topics, in the same order
+        Constants.NUM_CORES = 2
+        numpy.testing.assert_allclose(
+            stack_matrix, nmf_ensemble.build_stack_matrix(
+                self.document_term_matrix, 4, seeds))
+
+    def test_base_model_init(self):
+        seeds = nmf_ensemble.get_run_seeds(2, 0)
+        properties = Constants.get_properties_copy()
+        fit_base_model = nmf_ensemble.fit_base_model
+        fitted_seeds = []
+
+        def count_fits(document_term_matrix, parameters, seed, *args):
+            fitted_seeds.append(seed)
+            return fit_base_model(
+                document_term_matrix, parameters, seed, *args)
+
+        Constants.NUM_CORES = None
+        nmf_ensemble.fit_base_model = count_fits
+        try:
+            # The deterministic initialization ignores the seeds of the runs,
+            # so the base model is fitted only once
+            Constants.update_properties(
+                {Constants.NMF_BASE_MODEL_INIT_FIELD: 'nndsvd'})
+            stack_matrix = nmf_ensemble.build_stack_matrix(
+                self.document_term_matrix, 4, seeds)
+            self.assertEqual((8, 40), stack_matrix.shape)
+            self.assertEqual(seeds[:1], fitted_seeds)
+            numpy.testing.assert_allclose(stack_matrix[:4], stack_matrix[4:])
+            numpy.testing.assert_allclose(
+                fit_base_model(
+                    self.document_term_matrix,
+                    nmf_ensemble.get_base_model_parameters(4), seeds[0]),
+                stack_matrix[4:])
+
+            Constants.update_properties(
+                {Constants.NMF_BASE_MODEL_INIT_FIELD: 'random'})
+            stack_matrix = nmf_ensemble.build_stack_matrix(
+                self.document_term_matrix, 4, seeds)
+            self.assertFalse(
+                numpy.allclose(stack_matrix[:4], stack_matrix[4:]))
+            self.assertEqual(seeds[:1] + seeds, fitted_seeds)
+        finally:
+            nmf_ensemble.fit_base_model = fit_base_model
+            Constants.update_properties(properties)
+
+    def test_get_fold_train_indices(self):
+        test_indices = []
+        for fold_index in range(3):
+            train_indices = nmf_ensemble.get_fold_train_indices(
+                10, 5, fold_index, 3)
+            self.assertEqual(sorted(train_indices), list(train_indices))
+            test_indices.extend(set(range(10)) - set(train_indices))
+        # Every document is left out in exactly one fold
+        self.assertEqual(range(10), sorted(test_indices))
+
+    def test_build_stack_matrix_folds(self):
+        seeds = nmf_ensemble.get_run_seeds(2, 0)
+
+        Constants.NUM_CORES = None
+        stack_matrix = nmf_ensemble.build_stack_matrix(
+            self.document_term_matrix, 4, seeds, 3)
+        self.assertEqual((24, 40), stack_matrix.shape)
+
+        Constants.NUM_CORES = 2
+        numpy.testing.assert_allclose(
+            stack_matrix, nmf_ensemble.build_stack_matrix(
+                self.document_term_matrix, 4, seeds, 3))
+
+    def test_combine_topic_models(self):
+        stack_matrix = nmf_ensemble.build_stack_matrix(
+            self.document_term_matrix, 4, nmf_ensemble.get_run_seeds(3, 0))
+        document_topic_matrix, topic_term_matrix = \
+            nmf_ensemble.combine_topic_models(
+                self.document_term_matrix, stack_matrix, 4)
+        self.assertEqual((60, 4), document_topic_matrix.shape)
+        self.assertEqual((4, 40), topic_term_matrix.shape)
+        self.assertTrue((document_topic_matrix >= 0).all())
@@ -0,0 +1,86 @@
+from unittest import TestCase
+
+import numpy
+
+from topicmodeling.hiddenfactortopics.corpus import Corpus
+from topicmodeling.hiddenfactortopics.topic_corpus import TopicCorpus
+from topicmodeling.hiddenfactortopics.vote import Vote
+
+__author__ = 'fpena'
+
+
+def build_corpus(num_votes=60, num_users=6, num_items=4, num_words=12):
+    random_state = numpy.random.RandomState(1)
+    corpus = Corpus()
+    for index in range(num_votes):
+        vote = Vote()
+        vote.user = index % num_users
+        vote.item = index % num_items
+        vote.rating = float(random_state.randint(1, 6))
+        vote.word_list = random_state.randint(
+            num_words, size=random_state.randint(1, 8)).tolist()
+        corpus.vote_list.append(vote)
+    corpus._num_users = num_users
+    corpus._num_items = num_items
+    corpus._num_words = num_words
+    return corpus
+
+
+class TestTopicCorpus(TestCase):
+
+    def setUp(self):
+        self.topic_corpus = TopicCorpus(build_corpus(), 3, 0.1, 0.1)
+        random_state = numpy.random.RandomState(2)
+        self.topic_corpus.w[:] = random_state.normal(
+            0, 0.1, self.topic_corpus.nw)
+
+    def test_predict(self):
+        topic_corpus = self.topic_corpus
+        for vote in topic_corpus.train_votes[:5]:
+            expected = topic_corpus.alpha +\
+                topic_corpus.beta_user[vote.user] +\
+                topic_corpus.beta_item[vote.item] +\
+                numpy.dot(topic_corpus.gamma_user[vote.user],
+                          topic_corpus.gamma_item[vote.item])
+            self.assertAlmostEqual(expected, topic_corpus.prediction(vote))
+
+    def test_dl(self):
+        # The gradient is compared with the finite differences of the energy
+        topic_corpus = self.topic_corpus
+        gradient = topic_corpus.dl().copy()
+        w = topic_corpus.w.copy()
+        epsilon = 1e-6
+        for index in range(0, topic_corpus.nw, 3):
+            topic_corpus.w[:] = w
+            topic_corpus.w[index] += epsilon
+            energy_plus = topic_corpus.lsq()
+            topic_corpus.w[index] -= 2 * epsilon
+            energy_minus = topic_corpus.lsq()
+            self.assertAlmostEqual(
+                (energy_plus - energy_minus) / (2 * epsilon), gradient[index],
+                places=4)
+
+    def test_update_topics(self):
+        topic_corpus = self.topic_corpus
+        topic_corpus.update_topics()
+
+        num_words = sum(
+            len(vote.word_list) for vote in topic_corpus.train_votes)
+        self.assertEqual(num_words, topic_corpus.topic_counts.sum())
+        item_topic_counts = numpy.zeros((topic_corpus.n_items, 3))
+        for item, topic in zip(
+                topic_corpus.token_items, topic_corpus.token_topics):
+            item_topic_counts[item, topic] += 1
+        numpy.testing.assert_array_equal(
+            item_topic_counts, topic_corpus.item_topic_counts)
+        numpy.testing.assert_array_equal(
+            topic_corpus.item_words, item_topic_counts.sum(axis=1))
+
+    def test_train_lbfgs(self):
+        topic_corpus = self.topic_corpus
+        initial_error = topic_corpus.valid_test_error()[0]
+        topic_corpus.train(1, 20, use_lbfgs=True)
+
+        self.assertEqual(len(topic_corpus.corpus.vote_list),
+                         len(topic_corpus.best_valid_predictions))
+        self.assertLess(topic_corpus.valid_test_error()[0], initial_error)
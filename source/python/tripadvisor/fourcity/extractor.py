@@ -5,7 +5,7 @@ import numpy
 from pandas import DataFrame
 
 from etl import ETLUtils
-from tripadvisor.fourcity.user import User
+from tripadvisor.fourcity.ratings_store import RatingsStore
 from utils.constants import Constants
 
 __author__ = 'fpena'
@@ -381,33 +381,25 @@ def get_significant_criteria(criteria_weights, ranges=None):
     return significant_criteria, cluster_name
 
 
-def initialize_users(reviews, is_multi_criteria):
+def initialize_users(reviews, is_multi_criteria, ratings_store=None):
     """
     Builds a dictionary containing all the users in the reviews. Each user
     contains information about its average overall rating, the list of reviews
     that user has made, and the cluster the user belongs to
 
     :param reviews: the list of reviews
+    :param is_multi_criteria: a boolean that indicates if the multi-criteria
+    ratings have to be included in the users
+    :param ratings_store: an optional RatingsStore already built for the given
+    reviews, for instance by subtracting the test fold from the store of the
+    whole dataset. If None, the store is built from the reviews
     :return: a dictionary with the users initialized, the keys of the
-    dictionaries are the users' ID
+    dictionaries are the users' ID. The users are views over a RatingsStore
     """
-    user_ids = get_groupby_list(reviews, Constants.USER_ID_FIELD)
-    user_dictionary = {}
+    if ratings_store is None:
+        ratings_store = RatingsStore(reviews)
 
-    for user_id in user_ids:
-        user = User(user_id)
-        user_reviews = \
-            ETLUtils.filter_records(reviews, Constants.USER_ID_FIELD, [user_id])
-        user.average_overall_rating = get_user_average_overall_rating(
-            user_reviews, user_id, apply_filter=False)
-        user.item_ratings = get_user_item_ratings(user_reviews, user_id)
-        user_dictionary[user_id] = user
-
-        if is_multi_criteria:
-            user.item_multi_ratings =\
-                get_user_item_multi_ratings(user_reviews, user_id)
-
-    return user_dictionary
+    return ratings_store.build_user_dictionary(is_multi_criteria)
 
 
 def initialize_cluster_users(reviews, significant_criteria_ranges=None):
@@ -420,29 +412,37 @@ def initialize_cluster_users(reviews, significant_criteria_ranges=None):
     :return: a dictionary with the users initialized, the keys of the
     dictionaries are the users' ID
     """
-    user_ids = get_groupby_list(reviews, Constants.USER_ID_FIELD)
-    user_dictionary = {}
+    user_dictionary = RatingsStore(reviews).build_user_dictionary(True)
+    user_reviews_dictionary = group_reviews(reviews, Constants.USER_ID_FIELD)
 
-    for user_id in user_ids:
-        user = User(user_id)
-        user_reviews = \
-            ETLUtils.filter_records(reviews, Constants.USER_ID_FIELD, [user_id])
-        user.average_overall_rating = get_user_average_overall_rating(
-            user_reviews, user_id, apply_filter=False)
+    for user_id, user_reviews in user_reviews_dictionary.iteritems():
+        user = user_dictionary[user_id]
         user.criteria_weights = get_criteria_weights(
             user_reviews, user_id, apply_filter=False)
         _, user.cluster = get_significant_criteria(
             user.criteria_weights, significant_criteria_ranges)
-        user.item_ratings = get_user_item_ratings(user_reviews, user_id)
-        user.item_multi_ratings = \
-            get_user_item_multi_ratings(user_reviews, user_id)
-        user_dictionary[user_id] = user
 
     # print('Total users: %i' % len(user_ids))
 
     return user_dictionary
 
 
+def group_reviews(reviews, field):
+    """
+    Groups the reviews by the value they have in the given field in a single
+    pass, keeping the original order of the reviews inside each group
+
+    :param reviews: the list of reviews
+    :param field: the field which is going to be used to group the reviews
+    :return: a dictionary where the keys are the distinct values of the field
+    and the values are the lists of reviews that have that value
+    """
+    groups = {}
+    for review in reviews:
+        groups.setdefault(review[field], []).append(review)
+    return groups
+
+
 def get_user_item_ratings(reviews, user_id, apply_filter=False):
     """
     Returns a dictionary that contains the items that the given user has rated,
@@ -554,6 +554,12 @@ def get_common_items(user_dictionary, user1, user2):
     :param user2: the id of the second user
     """
 
+    store = user_dictionary[user1].store
+    if store is not None and store is user_dictionary[user2].store:
+        items, _, _ = store.get_common_item_ratings(
+            user_dictionary[user1].row, user_dictionary[user2].row)
+        return [store.item_ids[item] for item in items]
+
     items_user1 = set(user_dictionary[user1].item_ratings.keys())
     items_user2 = set(user_dictionary[user2].item_ratings.keys())
 
@@ -562,6 +568,30 @@ def get_common_items(user_dictionary, user1, user2):
     return common_items
 
 
+def get_common_item_ratings(user_dictionary, user1, user2):
+    """
+    Obtains the ratings that user1 and user2 have given to the items they have
+    rated in common. When both users belong to the same RatingsStore the
+    sorted item arrays of the users are merged
+
+    :param user1: the id of the first user
+    :param user2: the id of the second user
+    :return: a tuple (user1_ratings, user2_ratings) with two aligned numpy
+    arrays
+    """
+    store = user_dictionary[user1].store
+    if store is not None and store is user_dictionary[user2].store:
+        _, user1_ratings, user2_ratings = store.get_common_item_ratings(
+            user_dictionary[user1].row, user_dictionary[user2].row)
+        return user1_ratings, user2_ratings
+
+    common_items = list(get_common_items(user_dictionary, user1, user2))
+    user1_ratings = get_user_ratings(user_dictionary, user1, common_items)
+    user2_ratings = get_user_ratings(user_dictionary, user2, common_items)
+
+    return numpy.array(user1_ratings), numpy.array(user2_ratings)
+
+
 def get_user_ratings(user_dictionary, user, items):
 
     ratings = []
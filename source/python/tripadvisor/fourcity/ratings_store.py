@@ -0,0 +1,345 @@
+import collections
+
+import numpy
+
+from tripadvisor.fourcity.user import User
+from utils.constants import Constants
+
+__author__ = 'fpena'
+
+
+class ItemRatingsView(collections.Mapping):
+    """
+    Read-only dictionary-like view over the ratings a user has given to the
+    items, stored in the arrays of a RatingsStore
+    """
+
+    def __init__(self, store, row, values):
+        self._store = store
+        start = store.user_indptr[row]
+        end = store.user_indptr[row + 1]
+        self._items = store.user_items[start:end]
+        self._values = values[start:end]
+
+    def _find(self, item_id):
+        item = self._store.item_index.get(item_id)
+        if item is None:
+            return None
+        position = numpy.searchsorted(self._items, item)
+        if position < len(self._items) and self._items[position] == item:
+            return position
+        return None
+
+    def __contains__(self, item_id):
+        return self._find(item_id) is not None
+
+    def __getitem__(self, item_id):
+        position = self._find(item_id)
+        if position is None:
+            raise KeyError(item_id)
+        return self._convert(self._values[position])
+
+    def __iter__(self):
+        item_ids = self._store.item_ids
+        for item in self._items:
+            yield item_ids[item]
+
+    def __len__(self):
+        return len(self._items)
+
+    @staticmethod
+    def _convert(value):
+        return float(value)
+
+    def copy(self):
+        return dict(self.items())
+
+
+class ItemMultiRatingsView(ItemRatingsView):
+    """
+    Read-only dictionary-like view over the multi-criteria ratings a user has
+    given to the items, stored in the arrays of a RatingsStore
+    """
+
+    @staticmethod
+    def _convert(value):
+        return value.tolist()
+
+
+class RatingsStore(object):
+    """
+    Compact storage of the ratings the users have given to the items. The user
+    and item IDs are interned to integers and the ratings are kept in CSR-like
+    arrays: for every user the sorted integer IDs of the items the user has
+    rated and the ratings, plus a parallel item-major view with, for every
+    item, the sorted integer IDs of the users that have rated the item and
+    their ratings. When a user has rated an item several times the rating is
+    the average of them, so the sum and the count of the ratings of every
+    (user, item) pair are kept as well.
+
+    The store is built directly from the reviews, without intermediate
+    per-user dictionaries, and the store of a train split can be obtained by
+    subtracting the test fold from the store of the whole dataset, so the
+    store is the only copy of the ratings that is kept during the
+    cross-validation.
+
+    The User objects built by this store are thin views over these arrays, and
+    the items two users have rated in common are obtained by merging their
+    sorted arrays instead of building sets
+    """
+
+    def __init__(self, reviews=None):
+        """
+        Builds the store out of the given reviews. The multi-criteria ratings
+        are stored when all the reviews have them
+
+        :param reviews: a list of reviews
+        """
+        if reviews is None:
+            reviews = []
+
+        user_ids = sorted(
+            {review[Constants.USER_ID_FIELD] for review in reviews})
+        item_ids = sorted(
+            {review[Constants.ITEM_ID_FIELD] for review in reviews})
+        user_index = {user_id: row for row, user_id in enumerate(user_ids)}
+        item_index = {item_id: item for item, item_id in enumerate(item_ids)}
+
+        keys = numpy.array([
+            user_index[review[Constants.USER_ID_FIELD]] * len(item_ids) +
+            item_index[review[Constants.ITEM_ID_FIELD]]
+            for review in reviews], dtype=numpy.int64)
+        keys, inverse = numpy.unique(keys, return_inverse=True)
+        inverse = inverse.ravel()
+
+        rating_counts = numpy.bincount(inverse, minlength=len(keys))
+        rating_sums = _sum_by_entry(
+            inverse, get_review_ratings(reviews), len(keys))
+        multi_ratings = get_review_multi_ratings(reviews)
+        multi_rating_sums = None
+        if multi_ratings is not None:
+            multi_rating_sums = _sum_by_entry(
+                inverse, multi_ratings, len(keys))
+
+        num_items = max(len(item_ids), 1)
+        self._load_entries(
+            user_ids, item_ids, keys // num_items, keys % num_items,
+            rating_sums, rating_counts, multi_rating_sums)
+
+    def _load_entries(
+            self, user_ids, item_ids, entry_rows, entry_items, rating_sums,
+            rating_counts, multi_rating_sums):
+        """
+        Builds the arrays of this store out of the sum and the count of the
+        ratings of each (user, item) pair. The users and the items without
+        ratings are left out of the store
+
+        :param user_ids: the IDs of the users the entry_rows refer to
+        :param item_ids: the IDs of the items the entry_items refer to
+        :param entry_rows: the user of each pair
+        :param entry_items: the item of each pair
+        :param rating_sums: the sum of the overall ratings of each pair
+        :param rating_counts: the number of ratings of each pair
+        :param multi_rating_sums: a (pairs x criteria) array with the sum of
+        the multi-criteria ratings of each pair, or None
+        """
+        # The pairs are sorted by user and item, and so they remain after
+        # renumbering the users and the items that are left
+        used_rows = numpy.unique(entry_rows)
+        used_items = numpy.unique(entry_items)
+        self.user_ids = [user_ids[row] for row in used_rows]
+        self.user_index = {
+            user_id: row for row, user_id in enumerate(self.user_ids)}
+        self.item_ids = [item_ids[item] for item in used_items]
+        self.item_index = {
+            item_id: item for item, item_id in enumerate(self.item_ids)}
+        entry_rows = numpy.searchsorted(used_rows, entry_rows)
+
+        num_users = len(self.user_ids)
+        self.user_indptr = numpy.zeros(num_users + 1, dtype=numpy.int64)
+        numpy.cumsum(
+            numpy.bincount(entry_rows, minlength=num_users),
+            out=self.user_indptr[1:])
+        self.user_items = numpy.searchsorted(
+            used_items, entry_items).astype(numpy.int32)
+        self.user_rating_sums = numpy.asarray(rating_sums, dtype=numpy.float64)
+        self.user_rating_counts = numpy.asarray(
+            rating_counts, dtype=numpy.int32)
+        self.user_ratings = self.user_rating_sums / self.user_rating_counts
+        user_rating_sums = numpy.bincount(
+            entry_rows, weights=self.user_rating_sums, minlength=num_users)
+        user_rating_counts = numpy.bincount(
+            entry_rows, weights=self.user_rating_counts, minlength=num_users)
+        self.average_ratings = user_rating_sums / user_rating_counts
+
+        self.has_multi_ratings = multi_rating_sums is not None
+        self.user_multi_rating_sums = None
+        self.user_multi_ratings = None
+        if self.has_multi_ratings:
+            self.user_multi_rating_sums = multi_rating_sums
+            self.user_multi_ratings =\
+                multi_rating_sums / self.user_rating_counts[:, numpy.newaxis]
+
+        # The item-major view is obtained with a stable sort by item, which
+        # keeps the users of each item sorted
+        order = numpy.argsort(self.user_items, kind='mergesort')
+        self.item_users = entry_rows.astype(numpy.int32)[order]
+        self.item_ratings = self.user_ratings[order]
+        self.item_indptr = numpy.zeros(
+            len(self.item_ids) + 1, dtype=numpy.int64)
+        numpy.cumsum(
+            numpy.bincount(self.user_items, minlength=len(self.item_ids)),
+            out=self.item_indptr[1:])
+
+    def subtract(self, reviews):
+        """
+        Returns a new store that contains all the reviews of this store except
+        for the given ones, for instance the store of a train split can be
+        obtained by subtracting the test fold from the store of the whole
+        dataset. This store is not modified
+
+        :param reviews: a list of reviews that are in this store
+        :return: a new RatingsStore without the given reviews
+        """
+        num_items = len(self.item_ids)
+        entry_rows = numpy.repeat(
+            numpy.arange(len(self.user_ids), dtype=numpy.int64),
+            numpy.diff(self.user_indptr))
+        keys = entry_rows * num_items + self.user_items
+        positions = numpy.searchsorted(keys, numpy.array([
+            self.user_index[review[Constants.USER_ID_FIELD]] * num_items +
+            self.item_index[review[Constants.ITEM_ID_FIELD]]
+            for review in reviews], dtype=numpy.int64))
+
+        rating_counts = self.user_rating_counts - numpy.bincount(
+            positions, minlength=len(keys))
+        rating_sums = self.user_rating_sums - _sum_by_entry(
+            positions, get_review_ratings(reviews), len(keys))
+        multi_rating_sums = None
+        if self.has_multi_ratings:
+            multi_ratings = get_review_multi_ratings(reviews)
+            if not reviews:
+                multi_ratings = numpy.zeros(
+                    (0, self.user_multi_rating_sums.shape[1]))
+            multi_rating_sums = self.user_multi_rating_sums - _sum_by_entry(
+                positions, multi_ratings, len(keys))
+
+        mask = rating_counts > 0
+        ratings_store = RatingsStore()
+        ratings_store._load_entries(
+            self.user_ids, self.item_ids, entry_rows[mask],
+            self.user_items[mask], rating_sums[mask], rating_counts[mask],
+            None if multi_rating_sums is None else multi_rating_sums[mask])
+
+        return ratings_store
+
+    def get_item_ratings_view(self, row):
+        return ItemRatingsView(self, row, self.user_ratings)
+
+    def get_item_multi_ratings_view(self, row):
+        return ItemMultiRatingsView(self, row, self.user_multi_ratings)
+
+    def get_user_items(self, row):
+        """
+        Returns the sorted integer IDs of the items the given user has rated
+        and the ratings given to them
+
+        :param row: the integer ID of the user
+        :return: a tuple (items, ratings) of arrays
+        """
+        start, end = self.user_indptr[row], self.user_indptr[row + 1]
+        return self.user_items[start:end], self.user_ratings[start:end]
+
+    def get_item_users(self, item):
+        """
+        Returns the sorted integer IDs of the users that have rated the given
+        item and the ratings they have given to it
+
+        :param item: the integer ID of the item
+        :return: a tuple (users, ratings) of arrays
+        """
+        start, end = self.item_indptr[item], self.item_indptr[item + 1]
+        return self.item_users[start:end], self.item_ratings[start:end]
+
+    def get_common_item_ratings(self, row1, row2):
+        """
+        Merges the sorted item arrays of the two given users to obtain the
+        items both users have rated, and their ratings
+
+        :param row1: the integer ID of the first user
+        :param row2: the integer ID of the second user
+        :return: a tuple (items, ratings1, ratings2) of aligned arrays
+        """
+        items1, ratings1 = self.get_user_items(row1)
+        items2, ratings2 = self.get_user_items(row2)
+
+        # We search the items of the shortest array in the longest one
+        swap = len(items1) > len(items2)
+        if swap:
+            items1, ratings1, items2, ratings2 =\
+                items2, ratings2, items1, ratings1
+
+        positions = numpy.searchsorted(items2, items1)
+        positions[positions == len(items2)] = 0
+        mask = items2[positions] == items1 if len(items2) else\
+            numpy.zeros(len(items1), dtype=bool)
+        common_ratings1 = ratings1[mask]
+        common_ratings2 = ratings2[positions[mask]]
+
+        if swap:
+            common_ratings1, common_ratings2 = common_ratings2, common_ratings1
+
+        return items1[mask], common_ratings1, common_ratings2
+
+    def build_user(self, row, is_multi_criteria=False):
+        user = User(self.user_ids[row], self, row)
+        user.average_overall_rating = float(self.average_ratings[row])
+        if is_multi_criteria and self.has_multi_ratings:
+            user.item_multi_ratings = self.get_item_multi_ratings_view(row)
+        return user
+
+    def build_user_dictionary(self, is_multi_criteria=False):
+        """
+        Builds a dictionary containing all the users in this store, each one of
+        them being a view over the arrays of the store
+
+        :param is_multi_criteria: a boolean that indicates if the
+        multi-criteria ratings have to be included in the users
+        :return: a dictionary with the users initialized, the keys of the
+        dictionaries are the users' ID
+        """
+        return {
+            user_id: self.build_user(row, is_multi_criteria)
+            for row, user_id in enumerate(self.user_ids)
+        }
+
+
+def get_review_ratings(reviews):
+    return numpy.array(
+        [review['overall_rating'] for review in reviews], dtype=numpy.float64)
+
+
+def get_review_multi_ratings(reviews):
+    """
+    Returns a (reviews x criteria) array with the multi-criteria ratings of the
+    reviews, or None if any of the reviews doesn't have them
+    """
+    if not reviews or any(
+            review.get('multi_ratings') is None for review in reviews):
+        return None
+    return numpy.array(
+        [review['multi_ratings'] for review in reviews], dtype=numpy.float64)
+
+
+def _sum_by_entry(entries, values, num_entries):
+    """
+    Adds up the values (a 1-D or 2-D array) that belong to each entry
+    """
+    if values.ndim == 1:
+        return numpy.bincount(entries, weights=values, minlength=num_entries)
+
+    sums = numpy.zeros((num_entries, values.shape[1]))
+    for column in range(values.shape[1]):
+        sums[:, column] = numpy.bincount(
+            entries, weights=values[:, column], minlength=num_entries)
+    return sums
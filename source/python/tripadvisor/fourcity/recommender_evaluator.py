@@ -3,9 +3,11 @@ import time
 from etl import ETLUtils
 from evaluation.mean_absolute_error import MeanAbsoluteError
 from evaluation.root_mean_square_error import RootMeanSquareError
+from recommenders import batch_prediction
 from recommenders.similarity.single_similarity_matrix_builder import \
     SingleSimilarityMatrixBuilder
 from topicmodeling.context import reviews_clusterer
+from tripadvisor.fourcity.ratings_store import RatingsStore
 
 __author__ = 'fpena'
 
@@ -23,24 +25,23 @@ def predict_rating_list(predictor, reviews):
     :return: a tuple with a list of the predicted ratings and the list of
     errors for those predictions
     """
-    predicted_ratings = []
     errors = []
     num_unknown_ratings = 0.
 
-    for review in reviews:
+    user_ids = [review['user_id'] for review in reviews]
+    item_ids = [review['offering_id'] for review in reviews]
+    text_reviews = None
+    if predictor.has_context:
+        text_reviews = [review['text'] for review in reviews]
 
-        user_id = review['user_id']
-        item_id = review['offering_id']
+    # The ratings are predicted in a single batch, so the recommenders compute
+    # the neighbours and the baseline of each user only once
+    predicted_ratings = batch_prediction.to_optional_list(
+        predictor.predict_many(user_ids, item_ids, text_reviews))
 
-        if not predictor.has_context:
-            predicted_rating = predictor.predict_rating(user_id, item_id)
-        else:
-            text_review = review['text']
-            predicted_rating =\
-                predictor.predict_rating(user_id, item_id, text_review)
-        actual_rating = review['overall_rating']
+    for review, predicted_rating in zip(reviews, predicted_ratings):
 
-        # print(user_id, item_id, predicted_rating)
+        actual_rating = review['overall_rating']
 
         error = None
 
@@ -51,7 +52,6 @@ def predict_rating_list(predictor, reviews):
         else:
             num_unknown_ratings += 1
 
-        predicted_ratings.append(predicted_rating)
         errors.append(error)
 
     return predicted_ratings, errors, num_unknown_ratings
@@ -66,6 +66,7 @@ def perform_cross_validation(
     total_mean_square_error = 0.
     total_coverage = 0.
     num_cycles = 0
+    ratings_store = RatingsStore(records)
 
     for i in range(0, num_folds):
         print('Num cycles: %d' % i)
@@ -79,7 +80,8 @@ def perform_cross_validation(
             if reviews_type is not None:
                 cluster_labels = reviews_clusterer.cluster_reviews(test_reviews)
             recommender.reviews = train_reviews
-        recommender.load(train_records)
+        recommender.load(
+            train_records, ratings_store=ratings_store.subtract(test_records))
 
         if cluster_labels is not None:
             separated_records = reviews_clusterer.split_list_by_labels(
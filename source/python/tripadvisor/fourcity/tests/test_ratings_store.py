@@ -0,0 +1,104 @@
+from unittest import TestCase
+
+import numpy
+
+from tripadvisor.fourcity import extractor
+from tripadvisor.fourcity.ratings_store import RatingsStore
+
+__author__ = 'fpena'
+
+
+reviews = [
+    {'user_id': 'U1', 'business_id': 'I3', 'overall_rating': 4.0, 'multi_ratings': [3.0, 4.0]},
+    {'user_id': 'U1', 'business_id': 'I1', 'overall_rating': 2.0, 'multi_ratings': [2.0, 2.0]},
+    {'user_id': 'U2', 'business_id': 'I1', 'overall_rating': 5.0, 'multi_ratings': [4.0, 5.0]},
+    {'user_id': 'U1', 'business_id': 'I3', 'overall_rating': 5.0, 'multi_ratings': [2.0, 5.0]},
+    {'user_id': 'U3', 'business_id': 'I2', 'overall_rating': 1.0, 'multi_ratings': [1.0, 1.0]},
+    {'user_id': 'U2', 'business_id': 'I3', 'overall_rating': 3.0, 'multi_ratings': [2.0, 3.0]},
+    {'user_id': 'U2', 'business_id': 'I2', 'overall_rating': 2.0, 'multi_ratings': [1.0, 3.0]},
+]
+
+
+# The average overall rating, item ratings and item multi-criteria ratings of
+# each user in the reviews
+expected_users = {
+    'U1': (11. / 3, {'I1': 2.0, 'I3': 4.5},
+           {'I1': [2.0, 2.0], 'I3': [2.5, 4.5]}),
+    'U2': (10. / 3, {'I1': 5.0, 'I2': 2.0, 'I3': 3.0},
+           {'I1': [4.0, 5.0], 'I2': [1.0, 3.0], 'I3': [2.0, 3.0]}),
+    'U3': (1.0, {'I2': 1.0}, {'I2': [1.0, 1.0]}),
+}
+
+
+class TestRatingsStore(TestCase):
+
+    def assert_users_equal(self, expected_users, user_dictionary):
+        self.assertItemsEqual(expected_users.keys(), user_dictionary.keys())
+        for user_id, (average_rating, item_ratings, item_multi_ratings) in \
+                expected_users.items():
+            user = user_dictionary[user_id]
+            self.assertAlmostEqual(average_rating, user.average_overall_rating)
+            self.assertEqual(item_ratings, user.item_ratings.copy())
+            self.assertEqual(
+                item_multi_ratings, user.item_multi_ratings.copy())
+
+    def test_build_user_dictionary(self):
+
+        store = RatingsStore(reviews)
+        user_dictionary = store.build_user_dictionary(True)
+
+        self.assert_users_equal(expected_users, user_dictionary)
+
+        self.assertIn('I3', user_dictionary['U1'].item_ratings)
+        self.assertNotIn('I2', user_dictionary['U1'].item_ratings)
+        self.assertNotIn('I4', user_dictionary['U1'].item_ratings)
+        self.assertEqual(4.5, user_dictionary['U1'].item_ratings['I3'])
+
+    def test_get_item_users(self):
+
+        store = RatingsStore(reviews)
+        users, ratings = store.get_item_users(store.item_index['I3'])
+
+        self.assertEqual(
+            ['U1', 'U2'], [store.user_ids[user] for user in users])
+        self.assertEqual([4.5, 3.0], ratings.tolist())
+
+    def test_get_common_items(self):
+
+        user_dictionary = extractor.initialize_users(reviews, False)
+
+        self.assertEqual(
+            ['I1', 'I3'],
+            extractor.get_common_items(user_dictionary, 'U1', 'U2'))
+        self.assertEqual(
+            [], extractor.get_common_items(user_dictionary, 'U1', 'U3'))
+
+        user1_ratings, user2_ratings = extractor.get_common_item_ratings(
+            user_dictionary, 'U2', 'U1')
+        self.assertTrue(numpy.array_equal([5.0, 3.0], user1_ratings))
+        self.assertTrue(numpy.array_equal([2.0, 4.5], user2_ratings))
+
+    def test_subtract(self):
+
+        full_store = RatingsStore(reviews)
+        test_reviews = [reviews[0], reviews[4], reviews[6]]
+        train_store = full_store.subtract(test_reviews)
+
+        # U3 and I2 don't have any rating left
+        self.assertEqual(['U1', 'U2'], train_store.user_ids)
+        self.assertEqual(['I1', 'I3'], train_store.item_ids)
+        self.assert_users_equal({
+            'U1': (3.5, {'I1': 2.0, 'I3': 5.0},
+                   {'I1': [2.0, 2.0], 'I3': [2.0, 5.0]}),
+            'U2': (4.0, {'I1': 5.0, 'I3': 3.0},
+                   {'I1': [4.0, 5.0], 'I3': [2.0, 3.0]}),
+        }, train_store.build_user_dictionary(True))
+        users, ratings = train_store.get_item_users(train_store.item_index['I3'])
+        self.assertEqual([0, 1], users.tolist())
+        self.assertEqual([5.0, 3.0], ratings.tolist())
+
+        # The original store is not modified
+        self.assertEqual(
+            4.5, full_store.build_user_dictionary()['U1'].item_ratings['I3'])
+        self.assertIsNone(
+            full_store.build_user_dictionary()['U1'].item_multi_ratings)
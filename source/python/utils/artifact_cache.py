@@ -0,0 +1,337 @@
+import cPickle as pickle
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy
+
+from utils.constants import Constants
+
+__author__ = 'fpena'
+
+
+HASH_BLOCK_SIZE = 1024 * 1024
+PICKLE_EXTENSION = '.pkl'
+
+
+class ArtifactCache(object):
+    """
+    Content-addressed cache for the artifacts of the context pipeline (topic
+    models, dictionaries, context topics, predictions). Every artifact is
+    stored in a file named after a hash of all the inputs and properties that
+    were used to build it (see build_key), so changing anything that affects
+    an artifact produces a different key instead of silently reusing a stale
+    file, and the stages that didn't change are reused across the runs of a
+    parameter sweep.
+
+    Files are written atomically, by writing them to a temporary file in the
+    cache folder and then renaming them. When the total size of the cache
+    goes above max_size, the least recently used artifacts are removed
+    """
+
+    def __init__(self, folder, max_size=None):
+        """
+        :param folder: the folder in which the artifacts are stored
+        :param max_size: the maximum size of the cache in bytes, or None if the
+        size of the cache is not bounded
+        """
+        self.folder = folder
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def get_path(self, key, extension=PICKLE_EXTENSION):
+        return os.path.join(self.folder, key + extension)
+
+    def lookup(self, key, extension=PICKLE_EXTENSION):
+        """
+        Returns the path of the file of the given artifact, and marks it as
+        recently used
+
+        :param key: the key of the artifact
+        :param extension: the extension of the file of the artifact
+        :return: the path of the file, or None if the artifact is not cached
+        """
+        file_path = self.get_path(key, extension)
+        try:
+            os.utime(file_path, None)
+        except OSError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return file_path
+
+    def load(self, key):
+        """
+        Loads a pickled artifact
+
+        :param key: the key of the artifact
+        :return: the artifact, or None if it is not cached
+        """
+        def read(file_path):
+            with open(file_path, 'rb') as read_file:
+                return pickle.load(read_file)
+
+        return self.load_with(key, read)
+
+    def load_with(self, key, read_function, extension=PICKLE_EXTENSION):
+        """
+        Loads an artifact that is read by the given function. The file is read
+        without checking first if it exists, since another process can evict
+        it in between, so an artifact that can't be opened is a miss
+
+        :param key: the key of the artifact
+        :param read_function: a function that reads the artifact from the
+        file path it receives
+        :param extension: the extension of the file of the artifact
+        :return: the artifact, or None if it is not cached
+        """
+        file_path = self.get_path(key, extension)
+        try:
+            artifact = read_function(file_path)
+        except IOError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        try:
+            os.utime(file_path, None)
+        except OSError:
+            # The artifact was evicted after it was read
+            pass
+        return artifact
+
+    def store(self, key, artifact):
+        """
+        Pickles the given artifact into the cache
+
+        :param key: the key of the artifact
+        :param artifact: the object to store
+        :return: the path of the file of the artifact
+        """
+        def write(file_path):
+            with open(file_path, 'wb') as write_file:
+                pickle.dump(artifact, write_file, pickle.HIGHEST_PROTOCOL)
+
+        return self.store_with(key, write)
+
+    def store_file(self, key, source_path, extension=PICKLE_EXTENSION):
+        """
+        Copies the given file into the cache
+
+        :param key: the key of the artifact
+        :param source_path: the path of the file to copy
+        :param extension: the extension of the file of the artifact
+        :return: the path of the file of the artifact
+        """
+        return self.store_with(
+            key, lambda file_path: shutil.copyfile(source_path, file_path),
+            extension)
+
+    def store_with(self, key, write_function, extension=PICKLE_EXTENSION):
+        """
+        Stores an artifact that is written by the given function. The function
+        receives the path of a temporary file, which is renamed once the
+        function returns, so other processes never see a partially written
+        artifact
+
+        :param key: the key of the artifact
+        :param write_function: a function that writes the artifact into the
+        file path it receives
+        :param extension: the extension of the file of the artifact
+        :return: the path of the file of the artifact
+        """
+        file_path = self.get_path(key, extension)
+        file_descriptor, temporary_path = tempfile.mkstemp(
+            prefix='.tmp_', suffix=extension, dir=self.folder)
+        os.close(file_descriptor)
+        try:
+            write_function(temporary_path)
+            os.rename(temporary_path, file_path)
+        except:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+        # The artifact that has just been written is kept even if it doesn't
+        # fit in the cache on its own, since the caller is going to read it
+        self.evict(file_path)
+        return file_path
+
+    def export(self, key, destination_path, extension=PICKLE_EXTENSION):
+        """
+        Publishes a cached artifact in the given path, for the code that reads
+        the artifacts from their old file names. The file is hard linked when
+        possible, and copied otherwise, and it replaces the destination file
+        atomically
+
+        :param key: the key of the artifact
+        :param destination_path: the path in which the artifact is published
+        :param extension: the extension of the file of the artifact
+        """
+        file_path = self.get_path(key, extension)
+        destination_folder = os.path.dirname(os.path.abspath(destination_path))
+        file_descriptor, temporary_path = tempfile.mkstemp(
+            prefix='.tmp_', dir=destination_folder)
+        os.close(file_descriptor)
+        os.remove(temporary_path)
+        try:
+            try:
+                os.link(file_path, temporary_path)
+            except OSError:
+                shutil.copyfile(file_path, temporary_path)
+            os.rename(temporary_path, destination_path)
+        except:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+    def evict(self, keep_path=None):
+        """
+        Removes the least recently used artifacts until the size of the cache
+        is not greater than max_size
+
+        :param keep_path: the path of an artifact that must not be removed
+        """
+        if self.max_size is None:
+            return
+
+        entries = []
+        total_size = 0
+        for file_name in os.listdir(self.folder):
+            if file_name.startswith('.tmp_'):
+                continue
+            file_path = os.path.join(self.folder, file_name)
+            try:
+                file_stat = os.stat(file_path)
+            except OSError:
+                # The file was removed by another process
+                continue
+            total_size += file_stat.st_size
+            if file_path != keep_path:
+                entries.append(
+                    (file_stat.st_mtime, file_stat.st_size, file_path))
+
+        entries.sort()
+        for _, file_size, file_path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+            else:
+                self.evictions += 1
+            total_size -= file_size
+
+    def get_statistics(self):
+        """
+        :return: a dictionary with the number of hits, misses and evictions
+        and the hit ratio of this cache
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': float(self.hits) / lookups if lookups else 0.0
+        }
+
+    def print_statistics(self):
+        print('artifact cache: %d hits, %d misses, %d evictions' % (
+            self.hits, self.misses, self.evictions))
+
+
+_cache = None
+
+
+def get_cache():
+    """
+    Returns the artifact cache of the current properties, which is stored in
+    Constants.ARTIFACT_CACHE_FOLDER
+
+    :rtype: ArtifactCache
+    """
+    global _cache
+
+    max_size = Constants.ARTIFACT_CACHE_MAX_SIZE
+    if max_size is not None:
+        max_size = int(max_size * 1024 * 1024)
+
+    if _cache is None or _cache.folder != Constants.ARTIFACT_CACHE_FOLDER:
+        _cache = ArtifactCache(Constants.ARTIFACT_CACHE_FOLDER, max_size)
+    _cache.max_size = max_size
+    return _cache
+
+
+def build_key(name, property_names, *inputs):
+    """
+    Builds the key of an artifact from the values of the properties and the
+    inputs that are used to create it
+
+    :param name: the name of the artifact, which is used as a prefix of the
+    key to make the cache folder readable
+    :param property_names: the names of the properties that affect the
+    artifact
+    :param inputs: other values that affect the artifact, such as the hashes
+    of the records or of other artifacts. They must be serializable to JSON
+    :return: the key of the artifact
+    """
+    properties = Constants.get_properties_copy()
+    values = [
+        [property_name, properties.get(property_name)]
+        for property_name in sorted(property_names)
+    ]
+    content = json.dumps([name, values, list(inputs)], sort_keys=True)
+    return name + '_' + hashlib.sha1(content).hexdigest()
+
+
+def hash_records(records, field=Constants.REVIEW_ID_FIELD):
+    """
+    Hashes the identifiers of the given records, in order
+
+    :param records: a list of records
+    :param field: the field that identifies each record
+    :return: the hex digest of the hash
+    """
+    sha1 = hashlib.sha1()
+    for record in records:
+        sha1.update(unicode(record[field]).encode('utf-8'))
+        sha1.update('\n')
+    return sha1.hexdigest()
+
+
+def hash_file(file_path):
+    """
+    Hashes the content of the given file
+
+    :param file_path: the path of the file
+    :return: the hex digest of the hash
+    """
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as read_file:
+        for block in iter(lambda: read_file.read(HASH_BLOCK_SIZE), ''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def hash_arrays(*arrays):
+    """
+    Hashes the content, the shape and the type of the given numpy arrays
+
+    :param arrays: the arrays
+    :return: the hex digest of the hash
+    """
+    sha1 = hashlib.sha1()
+    for array in arrays:
+        array = numpy.ascontiguousarray(array)
+        sha1.update(str(array.dtype) + str(array.shape))
+        sha1.update(array.data)
+    return sha1.hexdigest()
@@ -26,6 +26,7 @@ class Constants(object):
     # Please keep the constants' names in alphabetical order to avoid problems
     # with the version control system (merging)
 
+    ARTIFACT_CACHE_MAX_SIZE_FIELD = 'artifact_cache_max_size'
     BOW_FIELD = 'bow'
     BOW_TYPE_FIELD = 'bow_type'
     BUSINESS_TYPE_FIELD = 'business_type'
@@ -66,6 +67,7 @@ class Constants(object):
     MAX_SAMPLE_TEST_SET_FIELD = 'max_sample_test_set'
     MIN_DICTIONARY_WORD_COUNT_FIELD = 'min_dictionary_word_count'
     NESTED_CROSS_VALIDATION_CYCLE_FIELD = 'nested_cross_validation_cycle'
+    NMF_BASE_MODEL_INIT_FIELD = 'nmf_base_model_init'
     NUM_CORES_FIELD = 'num_cores'
     NUM_CYCLES_FIELD = 'num_cycles'
     NUMPY_RANDOM_SEED_FIELD = 'numpy_random_seed'
@@ -81,11 +83,13 @@ class Constants(object):
     TEST_CONTEXT_REVIEWS_ONLY_FIELD = 'test_context_reviews_only'
     TEXT_FIELD = 'text'
     TEXT_SAMPLING_PROPORTION_FIELD = 'text_sampling_proportion'
+    TOPIC_ENSEMBLE_IN_PROCESS_FIELD = 'topic_ensemble_in_process'
     TOPIC_MODEL_ITERATIONS_FIELD = 'topic_model_iterations'
     TOPIC_MODEL_NUM_TOPICS_FIELD = 'topic_model_num_topics'
     TOPIC_MODEL_PASSES_FIELD = 'topic_model_passes'
     TOPIC_MODEL_STABILITY_SAMPLE_RATIO_FIELD =\
         'topic_model_stability_sample_ratio'
+    TOPIC_MODEL_STREAMING_FIELD = 'topic_model_streaming'
     TOPIC_MODEL_TARGET_FIELD = 'topic_model_target'
     TOPIC_MODEL_TARGET_REVIEWS_FIELD = 'topic_model_target_reviews'
     TOPIC_MODEL_TYPE_FIELD = 'topic_model_type'
@@ -109,6 +113,7 @@ class Constants(object):
     ALL_REVIEWS = 'all_reviews'
     LIBFM = 'libfm'
     FASTFM = 'fastfm'
+    NUMPYFM = 'numpyfm'
 
     # Folders
     DATASET_FOLDER = '/home/fpena/data/'
@@ -188,6 +193,7 @@ class Constants(object):
     TOPIC_MODEL_TARGET_TYPE = _properties['topic_model_target_type']
     TOPIC_MODEL_TARGET_REVIEWS = _properties['topic_model_target_reviews']
     NMF_REGULARIZATION = _properties['nmf_regularization']
+    NMF_BASE_MODEL_INIT = _properties['nmf_base_model_init']
     NMF_REGULARIZATION_RATIO = _properties['nmf_regularization_ratio']
     TOPIC_MODEL_FOLDS = _properties['topic_model_folds']
     CARSKIT_RECOMMENDERS = _properties['carskit_recommenders']
@@ -197,6 +203,9 @@ class Constants(object):
     CONTEXT_FORMAT = _properties['context_format']
     RIVAL_EVALUATION_STRATEGY = _properties['rival_evaluation_strategy']
     CARSKIT_PARAMETERS = _properties['carskit_parameters']
+    ARTIFACT_CACHE_MAX_SIZE = _properties['artifact_cache_max_size']
+    TOPIC_ENSEMBLE_IN_PROCESS = _properties['topic_ensemble_in_process']
+    TOPIC_MODEL_STREAMING = _properties['topic_model_streaming']
 
     # Main Files
     CACHE_FOLDER = DATASET_FOLDER + 'cache_context/'
@@ -205,6 +214,8 @@ class Constants(object):
     TOPIC_MODEL_FOLDER = CACHE_FOLDER + 'topic_models/'
     ENSEMBLE_FOLDER = TOPIC_MODEL_FOLDER + 'ensemble/'
     RIVAL_FOLDER = CACHE_FOLDER + 'rival/'
+    ARTIFACT_CACHE_FOLDER = CACHE_FOLDER + 'artifacts/'
+    NLP_CACHE_FOLDER = CACHE_FOLDER + 'nlp/'
     GENERATED_TEXT_FILES_FOLDER = None
     # RECORDS_FILE = DATASET_FOLDER + 'yelp_training_set_review_' +\
     #                ITEM_TYPE + 's_shuffled_tagged.json'
@@ -344,6 +355,8 @@ class Constants(object):
             Constants._properties['topic_model_target_reviews']
         Constants.NMF_REGULARIZATION = \
             Constants._properties['nmf_regularization']
+        Constants.NMF_BASE_MODEL_INIT = \
+            Constants._properties['nmf_base_model_init']
         Constants.NMF_REGULARIZATION_RATIO = \
             Constants._properties['nmf_regularization_ratio']
         Constants.TOPIC_MODEL_FOLDS = Constants._properties['topic_model_folds']
@@ -361,6 +374,12 @@ class Constants(object):
             Constants._properties['rival_evaluation_strategy']
         Constants.CARSKIT_PARAMETERS = \
             Constants._properties['carskit_parameters']
+        Constants.ARTIFACT_CACHE_MAX_SIZE = \
+            Constants._properties['artifact_cache_max_size']
+        Constants.TOPIC_ENSEMBLE_IN_PROCESS = \
+            Constants._properties['topic_ensemble_in_process']
+        Constants.TOPIC_MODEL_STREAMING = \
+            Constants._properties['topic_model_streaming']
 
         # Main Files
         Constants.CACHE_FOLDER = Constants.DATASET_FOLDER + 'cache_context/'
@@ -369,6 +388,8 @@ class Constants(object):
         Constants.TOPIC_MODEL_FOLDER = Constants.CACHE_FOLDER + 'topic_models/'
         Constants.ENSEMBLE_FOLDER = Constants.TOPIC_MODEL_FOLDER + 'ensemble/'
         Constants.RIVAL_FOLDER = Constants.CACHE_FOLDER + 'rival/'
+        Constants.ARTIFACT_CACHE_FOLDER = Constants.CACHE_FOLDER + 'artifacts/'
+        Constants.NLP_CACHE_FOLDER = Constants.CACHE_FOLDER + 'nlp/'
         Constants.GENERATED_TEXT_FILES_FOLDER = Constants.generate_file_name(
             'bow_files', '', Constants.TEXT_FILES_FOLDER, None, None, False,
             True)[:-1] + '/'
@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from utils import artifact_cache
+from utils.artifact_cache import ArtifactCache
+from utils.constants import Constants
+
+__author__ = 'fpena'
+
+
+class TestArtifactCache(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache = ArtifactCache(os.path.join(self.folder, 'artifacts'))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_store(self):
+        self.assertIsNone(self.cache.load('model'))
+        self.cache.store('model', {'topics': [1, 2, 3]})
+        self.assertEqual({'topics': [1, 2, 3]}, self.cache.load('model'))
+
+        statistics = self.cache.get_statistics()
+        self.assertEqual(1, statistics['hits'])
+        self.assertEqual(1, statistics['misses'])
+        self.assertEqual(0.5, statistics['hit_ratio'])
+        self.assertEqual(
+            ['model.pkl'], os.listdir(self.cache.folder))
+
+    def test_store_file(self):
+        source_path = os.path.join(self.folder, 'predictions.txt')
+        with open(source_path, 'w') as write_file:
+            write_file.write('4.5\n3.0\n')
+
+        self.cache.store_file('predictions', source_path, '.txt')
+        os.remove(source_path)
+
+        cached_path = self.cache.lookup('predictions', '.txt')
+        with open(cached_path) as read_file:
+            self.assertEqual('4.5\n3.0\n', read_file.read())
+
+        destination_path = os.path.join(self.folder, 'exported.txt')
+        self.cache.export('predictions', destination_path, '.txt')
+        with open(destination_path) as read_file:
+            self.assertEqual('4.5\n3.0\n', read_file.read())
+
+    def test_evict(self):
+        self.cache.max_size = 2500
+        for index in range(3):
+            self.cache.store('artifact%d' % index, 'x' * 1000)
+            # Makes sure the access times are different
+            os.utime(
+                self.cache.get_path('artifact%d' % index),
+                (time.time() + index, time.time() + index))
+        self.cache.evict()
+
+        self.assertEqual(1, self.cache.evictions)
+        self.assertIsNone(self.cache.lookup('artifact0'))
+        self.assertIsNotNone(self.cache.lookup('artifact2'))
+
+    def test_evict_stored_artifact(self):
+        # An artifact that doesn't fit in the cache on its own is kept when it
+        # is stored, and evicted when the next artifact is stored
+        self.cache.max_size = 500
+        self.cache.store('artifact0', 'x' * 1000)
+        self.assertEqual('x' * 1000, self.cache.load('artifact0'))
+        self.cache.store('artifact1', 'y' * 100)
+
+        self.assertIsNone(self.cache.load('artifact0'))
+        self.assertEqual('y' * 100, self.cache.load('artifact1'))
+        self.assertEqual(1, self.cache.evictions)
+
+    def test_load_evicted_artifact(self):
+        self.cache.store('model', [1, 2, 3])
+
+        # The file is removed by another process after the artifact is found
+        def read(file_path):
+            os.remove(file_path)
+            with open(file_path, 'rb') as read_file:
+                return read_file.read()
+
+        self.assertIsNone(self.cache.load_with('model', read))
+        self.assertIsNone(self.cache.load('model'))
+        self.assertEqual(2, self.cache.misses)
+
+    def test_build_key(self):
+        properties = Constants.get_properties_copy()
+        try:
+            Constants.update_properties({'topic_model_num_topics': 10})
+            key = artifact_cache.build_key(
+                'topic_model', ['topic_model_num_topics'], 'abc')
+            self.assertTrue(key.startswith('topic_model_'))
+            self.assertEqual(key, artifact_cache.build_key(
+                'topic_model', ['topic_model_num_topics'], 'abc'))
+            self.assertNotEqual(key, artifact_cache.build_key(
+                'topic_model', ['topic_model_num_topics'], 'abd'))
+
+            Constants.update_properties({'topic_model_num_topics': 20})
+            self.assertNotEqual(key, artifact_cache.build_key(
+                'topic_model', ['topic_model_num_topics'], 'abc'))
+        finally:
+            Constants.update_properties(properties)
+
+    def test_hash_records(self):
+        records = [{'review_id': 'r1'}, {'review_id': u'r2'}]
+        self.assertEqual(
+            artifact_cache.hash_records(records),
+            artifact_cache.hash_records([dict(record) for record in records]))
+        self.assertNotEqual(
+            artifact_cache.hash_records(records),
+            artifact_cache.hash_records(records[::-1]))
@@ -1,3 +1,4 @@
+import multiprocessing
 import random
 
 import numpy
@@ -127,3 +128,20 @@ def plant_seeds():
     if Constants.NUMPY_RANDOM_SEED is not None:
         print('numpy random seed: %d' % Constants.NUMPY_RANDOM_SEED)
         numpy.random.seed(Constants.NUMPY_RANDOM_SEED)
+
+
+def get_num_processes(num_tasks):
+    """
+    Returns the number of processes used to run the given number of tasks in
+    parallel, which is never greater than Constants.NUM_CORES. Worker
+    processes can't create their own pools, so inside a worker the tasks are
+    always run one after another
+
+    :param num_tasks: the number of tasks
+    :return: the number of processes
+    """
+    if multiprocessing.current_process().daemon:
+        return 1
+    if Constants.NUM_CORES is None:
+        return 1
+    return max(1, min(Constants.NUM_CORES, num_tasks))